@@ -14,6 +14,7 @@
 #  limitations under the License.
 #############################################################################
 
+import concurrent.futures
 import io
 import json
 import pickle
@@ -23,6 +24,7 @@ import pymongo
 from girder_jobs.constants import JobStatus
 from girder_jobs.models.job import Job
 
+import large_image
 from girder import logger
 from girder.constants import SortDir
 from girder.exceptions import FilePathException, GirderException, ValidationException
@@ -113,7 +115,10 @@ class ImageItem(Item):
         return job
 
     def _createLargeImageJob(
-            self, item, fileObj, user, token, toFolder=False, folderId=None, name=None, **kwargs):
+            self, item, fileObj, user, token, toFolder=False, folderId=None, name=None,
+            resumable=False, **kwargs):
+        # resumable is ignored, since remote workers don't have a persistent
+        # work directory
         import large_image_tasks.tasks
         from girder_worker_utils.transforms.common import TemporaryDirectory
         from girder_worker_utils.transforms.contrib.girder_io import GirderFileIdAllowDirect
@@ -183,10 +188,16 @@ class ImageItem(Item):
         return self._createLargeImageLocalJob(item, fileObj, user, toFolder=True, **kwargs)
 
     @classmethod
-    def _tileFromHash(cls, item, x, y, z, mayRedirect=False, **kwargs):
-        tileCache, tileCacheLock = getTileCache()
-        if tileCache is None:
-            return None
+    def _tileHashPrefix(cls, item, **kwargs):
+        """
+        Get the part of the tile cache key that is shared by all tiles of an
+        item with the same image parameters.
+
+        :param item: the item with the tiles.
+        :param kwargs: the image parameters.
+        :returns: the key prefix and the parameters that still need to be
+            hashed with each tile, or None if the item has no tile source.
+        """
         if 'largeImage' not in item:
             return None
         if item['largeImage'].get('expected'):
@@ -202,9 +213,20 @@ class ImageItem(Item):
         classHash = sourceClass.getLRUHash(item, **kwargs)
         # style isn't part of the tile hash strhash parameters
         kwargs.pop('style', None)
-        tileHash = sourceClass.__name__ + ' ' + classHash + ' ' + strhash(
-            sourceClass.__name__ + ' ' + classHash) + strhash(
-            *(x, y, z), mayRedirect=mayRedirect, **kwargs)
+        prefix = sourceClass.__name__ + ' ' + classHash + ' ' + strhash(
+            sourceClass.__name__ + ' ' + classHash)
+        return prefix, kwargs
+
+    @classmethod
+    def _tileFromHash(cls, item, x, y, z, mayRedirect=False, **kwargs):
+        tileCache, tileCacheLock = getTileCache()
+        if tileCache is None:
+            return None
+        hashPrefix = cls._tileHashPrefix(item, **kwargs)
+        if hashPrefix is None:
+            return None
+        prefix, kwargs = hashPrefix
+        tileHash = prefix + strhash(*(x, y, z), mayRedirect=mayRedirect, **kwargs)
         try:
             if tileCacheLock is None:
                 tileData = tileCache[tileHash]
@@ -218,6 +240,40 @@ class ImageItem(Item):
         except (KeyError, ValueError):
             return None
 
+    @classmethod
+    def _tilesFromHash(cls, item, tiles, **kwargs):
+        """
+        Look up a list of tiles in the tile cache.
+
+        :param item: the item with the tiles.
+        :param tiles: a list of (z, x, y, frame) tuples.  frame may be None.
+        :param kwargs: the image parameters used for all tiles.
+        :returns: a list with (tileData, tileMime, None) for each tile that
+            was in the cache and None for each tile that was not.
+        """
+        results = [None] * len(tiles)
+        tileCache, tileCacheLock = getTileCache()
+        if tileCache is None:
+            return results
+        hashPrefix = cls._tileHashPrefix(item, **kwargs)
+        if hashPrefix is None:
+            return results
+        prefix, kwargs = hashPrefix
+        tileMime = TileOutputMimeTypes.get(kwargs.get('encoding'), 'image/jpeg')
+        for idx, (z, x, y, frame) in enumerate(tiles):
+            frameKwargs = kwargs if frame is None else dict(kwargs, frame=frame)
+            tileHash = prefix + strhash(*(x, y, z), mayRedirect=False, **frameKwargs)
+            try:
+                if tileCacheLock is None:
+                    tileData = tileCache[tileHash]
+                else:
+                    with tileCacheLock:
+                        tileData = tileCache[tileHash]
+                results[idx] = (tileData, tileMime, None)
+            except (KeyError, ValueError):
+                pass
+        return results
+
     @classmethod
     def _loadTileSource(cls, item, **kwargs):
         if 'largeImage' not in item:
@@ -274,6 +330,61 @@ class ImageItem(Item):
         tileMimeType = tileSource.getTileMimeType()
         return tileData, tileMimeType
 
+    def getTiles(self, item, tiles, concurrency=None, **kwargs):
+        """
+        Get a list of tiles from an item.  The tile source and the tile cache
+        are resolved once for all of the tiles, and tiles that are not in the
+        cache are fetched concurrently.
+
+        :param item: the item with the tiles.
+        :param tiles: a list of (z, x, y, frame) tuples.  frame may be None.
+        :param concurrency: the maximum number of tiles to fetch at once.
+            None to use the number of cpus.
+        :param kwargs: the image parameters used for all tiles.
+        :returns: an iterator that yields (tileData, tileMime, error) for each
+            tile in order.  If a tile could not be fetched, tileData is None
+            and error is a message.
+        """
+        results = self._tilesFromHash(item, tiles, **kwargs)
+        misses = [idx for idx, result in enumerate(results) if result is None]
+        if not misses:
+            return iter(results)
+        kwargs = {k: v for k, v in kwargs.items() if k != 'frame'}
+        tileSource = self._loadTileSource(item, **kwargs)
+        tileMimeType = tileSource.getTileMimeType()
+
+        def fetch(idx):
+            z, x, y, frame = tiles[idx]
+            try:
+                imageParams = {} if frame is None else {'frame': int(frame)}
+                return (tileSource.getTile(x, y, z, mayRedirect=False, **imageParams),
+                        tileMimeType, None)
+            except TileGeneralError as exc:
+                return None, None, exc.args[0]
+            except Exception as exc:
+                # The response may already be streaming, so an error can't be
+                # raised; report it for this tile instead.
+                logger.exception('Failed to get tile %r of item %s', tiles[idx], item['_id'])
+                return None, None, 'Failed to get tile: %s' % exc
+
+        concurrency = min(len(misses), concurrency or large_image.config.cpu_count())
+        if concurrency <= 1:
+            for idx in misses:
+                results[idx] = fetch(idx)
+            return iter(results)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        futures = {idx: pool.submit(fetch, idx) for idx in misses}
+        pool.shutdown(wait=False)
+
+        def stream():
+            try:
+                for idx, result in enumerate(results):
+                    yield futures[idx].result() if result is None else result
+            finally:
+                for future in futures.values():
+                    future.cancel()
+        return stream()
+
     def delete(self, item, skipFileIds=None):
         deleted = False
         if 'largeImage' in item:
@@ -577,6 +688,21 @@ class ImageItem(Item):
         tileSource = self._loadTileSource(item, **kwargs)
         return tileSource.getPixel(**kwargs)
 
+    def getPixels(self, item, points, **kwargs):
+        """
+        Using a tile source, get the values of many pixels from the image.
+
+        :param item: the item with the tile source.
+        :param points: an Nx2 list or array of x, y coordinates in base
+            pixels.
+        :param kwargs: optional arguments.  Some options are frame, level,
+            and style.
+        :returns: an NxB masked numpy array of pixel values, where points
+            outside of the image are masked.
+        """
+        tileSource = self._loadTileSource(item, **kwargs)
+        return tileSource.getPixels(points, **kwargs)
+
     def histogram(self, item, checkAndCreate=False, **kwargs):
         """
         Using a tile source, get a histogram of the image.
@@ -35,9 +35,10 @@ from girder import logger
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute, describeRoute
 from girder.api.rest import Resource
-from girder.constants import SortDir, TokenScope
+from girder.constants import AccessType, SortDir, TokenScope
 from girder.exceptions import RestException
 from girder.models.file import File
+from girder.models.folder import Folder
 from girder.models.item import Item
 from girder.models.setting import Setting
 from large_image import cache_util
@@ -242,6 +243,7 @@ class LargeImageResource(Resource):
         self.resourceName = 'large_image'
         self.route('GET', ('cache', ), self.cacheInfo)
         self.route('PUT', ('cache', 'clear'), self.cacheClear)
+        self.route('PUT', ('cache', 'tiles'), self.cacheTiles)
         self.route('POST', ('config', 'format'), self.configFormat)
         self.route('POST', ('config', 'validate'), self.configValidate)
         self.route('POST', ('config', 'replace'), self.configReplace)
@@ -278,6 +280,117 @@ class LargeImageResource(Resource):
             'after': after,
         }
 
+    def _cacheTilesParams(self, params):
+        """
+        Parse the parameters of the cache tiles endpoint.
+
+        :param params: the request parameters.
+        :returns: a dictionary of job kwargs.
+        """
+        jobKwargs = {}
+        for key, check in [
+                ('levels', lambda v: isinstance(v, int)),
+                ('frames', lambda v: isinstance(v, int) and v >= 0),
+                ('styles', lambda v: v is None or isinstance(v, (str, dict)))]:
+            if params.get(key):
+                try:
+                    value = json.loads(params[key])
+                    if not isinstance(value, list) or not all(check(v) for v in value):
+                        raise ValueError
+                except ValueError:
+                    msg = 'The %s parameter must be a JSON list.' % key
+                    raise RestException(msg)
+                jobKwargs[key] = value
+        tileParams = {}
+        try:
+            for key, cast in [('encoding', str), ('jpegQuality', int),
+                              ('jpegSubsampling', int), ('tiffCompression', str)]:
+                if params.get(key) is not None:
+                    tileParams[key] = cast(params[key])
+            if params.get('maxTiles') is not None:
+                jobKwargs['maxTiles'] = int(params['maxTiles'])
+            if params.get('logInterval') is not None:
+                jobKwargs['logInterval'] = float(params['logInterval'])
+            if params.get('concurrent') is not None:
+                jobKwargs['concurrent'] = int(params['concurrent'])
+        except ValueError:
+            msg = 'Parameters have incorrect types.'
+            raise RestException(msg)
+        if tileParams:
+            jobKwargs['tileParams'] = tileParams
+        return jobKwargs
+
+    @describeRoute(
+        Description('Populate the tile cache for an item or for all large '
+                    'image items in a folder.')
+        .notes('This creates a local job that fetches the requested tiles so '
+               'that later tile requests are served from the cache.  Either '
+               'itemId or folderId must be specified.')
+        .param('itemId', 'The ID of an item.', required=False)
+        .param('folderId', 'The ID of a folder.', required=False)
+        .param('recurse', 'If true and a folder is specified, also include '
+               'items in subfolders.', required=False, dataType='boolean',
+               default=False)
+        .param('levels', 'A JSON list of levels to cache.  Negative values '
+               'are relative to the number of levels, so -1 is the maximum '
+               'resolution level.  If not specified, all levels with at most '
+               'maxTiles tiles are cached.', required=False)
+        .param('maxTiles', 'The maximum number of tiles in a level when levels '
+               'are not specified.', required=False, dataType='int', default=256)
+        .param('frames', 'A JSON list of frame numbers to cache.  If not '
+               'specified, the default frame is cached.', required=False)
+        .param('styles', 'A JSON list of styles to cache.  Use null for the '
+               'unstyled image.  If not specified, only the unstyled image is '
+               'cached.', required=False)
+        .param('encoding', 'Tile output encoding.', required=False,
+               enum=list(large_image.constants.TileOutputMimeTypes.keys()))
+        .param('jpegQuality', 'Quality used for generating JPEG images',
+               required=False, dataType='int')
+        .param('jpegSubsampling', 'Chroma subsampling used for generating '
+               'JPEG images.', required=False, dataType='int')
+        .param('tiffCompression', 'Compression method when storing a TIFF '
+               'image', required=False)
+        .param('logInterval', 'The number of seconds between log messages.  '
+               'This also determines how often the job is checked if it has '
+               'been canceled or deleted.', required=False, dataType='float')
+        .param('concurrent', 'The number of concurrent threads to use when '
+               'fetching tiles.  0 or unspecified to base this on the number '
+               'of reported cpus.', required=False, dataType='int'),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    def cacheTiles(self, params):
+        user = self.getCurrentUser()
+        jobKwargs = {'userId': str(user['_id'])}
+        if params.get('itemId'):
+            item = Item().load(params['itemId'], user=user, level=AccessType.WRITE, exc=True)
+            if 'largeImage' not in item:
+                msg = 'The item is not a large image item.'
+                raise RestException(msg)
+            jobKwargs['itemId'] = str(item['_id'])
+            title = 'Cache tiles for item %s' % item['name']
+        elif params.get('folderId'):
+            folder = Folder().load(
+                params['folderId'], user=user, level=AccessType.WRITE, exc=True)
+            jobKwargs['folderId'] = str(folder['_id'])
+            jobKwargs['recurse'] = str(params.get('recurse')).lower() == 'true'
+            title = 'Cache tiles for folder %s' % folder['name']
+        else:
+            msg = 'Either itemId or folderId must be specified.'
+            raise RestException(msg)
+        jobKwargs.update(self._cacheTilesParams(params))
+        job = Job().createLocalJob(
+            module='large_image_tasks.tasks',
+            function='cache_tiles_job',
+            kwargs=jobKwargs,
+            title=title,
+            type='large_image_cache_tiles',
+            user=user,
+            public=True,
+            asynchronous=True,
+        )
+        Job().scheduleJob(job)
+        return job
+
     @describeRoute(
         Description('Get information on caches.'),
     )
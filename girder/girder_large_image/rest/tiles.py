@@ -16,14 +16,18 @@
 
 import hashlib
 import io
+import json
 import math
 import os
 import pathlib
 import pickle
 import re
+import struct
 import urllib
+import uuid
 
 import cherrypy
+import numpy as np
 
 import large_image
 from girder.api import access, filter_logging
@@ -54,6 +58,10 @@ for key, value in TileOutputMimeTypes.items():
 ImageMimeTypes = list(MimeTypeExtensions)
 EncodingTypes = list(TileOutputMimeTypes.keys()) + [
     'pickle', 'pickle:3', 'pickle:4', 'pickle:5']
+# The maximum number of tiles that can be requested in one batch
+MaxBatchTiles = 1024
+# The maximum number of pixels that can be requested in one batch
+MaxBatchPixels = 100000
 
 
 def _adjustParams(params):
@@ -158,11 +166,15 @@ class TilesItemResource(ItemResource):
         apiRoot.item.route('GET', (':itemId', 'tiles', 'tile_frames', 'quad_info'),
                            self.tileFramesQuadInfo)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'pixel'), self.getTilesPixel)
+        apiRoot.item.route('GET', (':itemId', 'tiles', 'pixels'), self.getTilesPixels)
+        apiRoot.item.route('POST', (':itemId', 'tiles', 'pixels'), self.getTilesPixels)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'histogram'), self.getHistogram)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'bands'), self.getBandInformation)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'zxy', ':z', ':x', ':y'), self.getTile)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'fzxy', ':frame', ':z', ':x', ':y'),
                            self.getTileWithFrame)
+        apiRoot.item.route('GET', (':itemId', 'tiles', 'batch'), self.getTileBatch)
+        apiRoot.item.route('POST', (':itemId', 'tiles', 'batch'), self.getTileBatch)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'images'), self.getAssociatedImagesList)
         apiRoot.item.route('GET', (':itemId', 'tiles', 'images', ':image'),
                            self.getAssociatedImage)
@@ -290,7 +302,11 @@ class TilesItemResource(ItemResource):
         .param('concurrent', 'Suggested number of maximum concurrent '
                'processes to use during conversion.  Values less than or '
                'equal to 0 use the number of logical cpus less that value.  '
-               'Default is -2.', dataType='int', required=False),
+               'Default is -2.', dataType='int', required=False)
+        .param('resumable', 'If true, keep intermediate files so that the '
+               'same conversion can resume if it is interrupted.  This only '
+               'applies to local jobs.', dataType='boolean', default=False,
+               required=False),
     )
     @access.user(scope=TokenScope.DATA_WRITE)
     @loadmodel(model='item', map={'itemId': 'item'}, level=AccessType.READ)
@@ -298,6 +314,8 @@ class TilesItemResource(ItemResource):
     def convertImage(self, item, params):
         if 'concurrent' in params:
             params['_concurrency'] = params.pop('concurrent')
+        if 'resumable' in params:
+            params['resumable'] = self.boolParam('resumable', params)
         largeImageFileId = params.get('fileId')
         if largeImageFileId is None:
             files = list(Item().childFiles(item=item, limit=2))
@@ -612,6 +630,133 @@ class TilesItemResource(ItemResource):
         return self._getTile(item, z, x, y, params, mayRedirect=redirect)
     getTileWithFrame.accessLevel = 'public'
 
+    @classmethod
+    def _parseTileList(cls, tiles, frame=None):
+        """
+        Parse and validate a list of tiles.
+
+        :param tiles: a json-encoded list.  Each entry is either a list of
+            [z, x, y] or [z, x, y, frame] or an object with z, x, y, and,
+            optionally, frame.
+        :param frame: the frame to use for tiles that do not specify one.
+        :returns: a list of (z, x, y, frame) tuples where frame may be None.
+        """
+        try:
+            tiles = json.loads(tiles) if isinstance(tiles, str) else tiles
+        except ValueError:
+            msg = 'tiles must be a JSON list'
+            raise RestException(msg, code=400)
+        if not isinstance(tiles, list):
+            msg = 'tiles must be a JSON list'
+            raise RestException(msg, code=400)
+        if len(tiles) > MaxBatchTiles:
+            msg = 'At most %d tiles can be requested at once' % MaxBatchTiles
+            raise RestException(msg, code=400)
+        result = []
+        for entry in tiles:
+            try:
+                if isinstance(entry, dict):
+                    entry = [entry['z'], entry['x'], entry['y'], entry.get('frame')]
+                if len(entry) not in {3, 4}:
+                    raise ValueError
+                z, x, y = (int(val) for val in entry[:3])
+                tileFrame = entry[3] if len(entry) == 4 and entry[3] is not None else frame
+                tileFrame = int(tileFrame) if tileFrame is not None else None
+            except (KeyError, TypeError, ValueError):
+                msg = 'Each tile must have integer z, x, y, and optionally frame values'
+                raise RestException(msg, code=400)
+            if x < 0 or y < 0 or z < 0 or (tileFrame is not None and tileFrame < 0):
+                msg = 'x, y, z, and frame must be positive integers'
+                raise RestException(msg, code=400)
+            result.append((z, x, y, tileFrame))
+        return result
+
+    @describeRoute(
+        Description('Get multiple large image tiles in one response.')
+        .notes('All tiles use the same image parameters.  The tiles are '
+               'returned in the requested order.  With the multipart format, '
+               'the response is multipart/mixed; each part has an X-Tile '
+               'header of z/x/y or z/x/y/frame and tiles that could not be '
+               'fetched have an X-Tile-Error header and a text/plain body.  '
+               'With the binary format, each tile is a 4-byte little-endian '
+               'length, a JSON header of that length with z, x, y, frame, '
+               'mime, size, and, optionally, error, followed by size bytes '
+               'of tile data.  For long lists, POST with a form-encoded '
+               'body.')
+        .param('itemId', 'The ID of the item.', paramType='path')
+        .param('tiles', 'A JSON list of tiles.  Each tile is a list of '
+               '[z, x, y] or [z, x, y, frame] or an object with z, x, y, '
+               'and, optionally, frame keys.', required=True)
+        .param('frame', 'The frame number for tiles that do not specify one.',
+               required=False, dataType='int')
+        .param('format', 'The format of the response.', required=False,
+               enum=['multipart', 'binary'], default='multipart')
+        .param('encoding', 'Tile output encoding.', required=False,
+               enum=list(TileOutputMimeTypes.keys()))
+        .param('jpegQuality', 'Quality used for generating JPEG images',
+               required=False, dataType='int')
+        .param('jpegSubsampling', 'Chroma subsampling used for generating '
+               'JPEG images.  0, 1, and 2 are full, half, and quarter '
+               'resolution chroma respectively.', required=False,
+               enum=['0', '1', '2'], dataType='int')
+        .param('tiffCompression', 'Compression method when storing a TIFF '
+               'image', required=False)
+        .param('style', 'JSON-encoded style string', required=False)
+        .produces(['multipart/mixed', 'application/octet-stream'])
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the item.', 403),
+    )
+    @access.public(cookie=True, scope=TokenScope.DATA_READ)
+    @loadmodel(model='item', map={'itemId': 'item'}, level=AccessType.READ)
+    def getTileBatch(self, item, params):
+        _adjustParams(params)
+        params = params.copy()
+        tiles = self._parseTileList(params.pop('tiles', None) or '[]', params.pop('frame', None))
+        outputFormat = params.pop('format', None) or 'multipart'
+        if outputFormat not in {'multipart', 'binary'}:
+            msg = 'format must be either multipart or binary'
+            raise RestException(msg, code=400)
+        if _pickleParams(dict(params)) is not None:
+            msg = 'Pickled encodings are not supported for tile batches'
+            raise RestException(msg, code=400)
+        _handleETag('getTileBatch', item, tiles, outputFormat, params)
+        setResponseTimeLimit(86400)
+        try:
+            results = self.imageItemModel.getTiles(item, tiles, **params)
+        except TileGeneralError as e:
+            raise RestException(e.args[0], code=404)
+        boundary = uuid.uuid4().hex
+        if outputFormat == 'multipart':
+            setResponseHeader('Content-Type', 'multipart/mixed; boundary=%s' % boundary)
+        else:
+            setResponseHeader('Content-Type', 'application/octet-stream')
+
+        def stream():
+            for (z, x, y, frame), (tileData, tileMime, error) in zip(tiles, results):
+                if error is not None:
+                    tileData, tileMime = error.encode(), 'text/plain'
+                if outputFormat == 'binary':
+                    header = {'z': z, 'x': x, 'y': y, 'frame': frame,
+                              'mime': tileMime, 'size': len(tileData)}
+                    if error is not None:
+                        header['error'] = error
+                    header = json.dumps(header).encode()
+                    yield struct.pack('<I', len(header)) + header
+                else:
+                    tileKey = '/'.join(str(val) for val in (z, x, y, frame) if val is not None)
+                    part = ('--%s\r\nContent-Type: %s\r\nContent-Length: %d\r\n'
+                            'X-Tile: %s\r\n' % (boundary, tileMime, len(tileData), tileKey))
+                    if error is not None:
+                        part += 'X-Tile-Error: %s\r\n' % error.replace('\r', ' ').replace(
+                            '\n', ' ')
+                    yield (part + '\r\n').encode()
+                yield tileData
+                if outputFormat == 'multipart':
+                    yield b'\r\n'
+            if outputFormat == 'multipart':
+                yield ('--%s--\r\n' % boundary).encode()
+        return stream
+
     @describeRoute(
         Description('Get a test large image tile.')
         .param('z', 'The layer number of the tile (0 is the most zoomed-out '
@@ -973,6 +1118,59 @@ class TilesItemResource(ItemResource):
             raise RestException('Value Error: %s' % e.args[0])
         return pixel
 
+    @describeRoute(
+        Description('Get the values of many pixels of a large image item.')
+        .notes('Points are in base pixels.  Each point is sampled from the '
+               'pixel that contains it.  The response has a list of values '
+               'for each point in the requested order; the value of a point '
+               'outside of the image is null.  For long lists, POST with a '
+               'form-encoded body.')
+        .param('itemId', 'The ID of the item.', paramType='path')
+        .param('points', 'A JSON list of points.  Each point is a list of '
+               '[x, y] or an object with x and y keys.', required=True)
+        .param('frame', 'For multiframe images, the 0-based frame number.  '
+               'This is ignored on non-multiframe images.', required=False,
+               dataType='int')
+        .param('level', 'The level to sample.  The default is the maximum '
+               'level.', required=False, dataType='int')
+        .param('style', 'JSON-encoded style string', required=False)
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the item.', 403),
+    )
+    @access.public(cookie=True, scope=TokenScope.DATA_READ)
+    @loadmodel(model='item', map={'itemId': 'item'}, level=AccessType.READ)
+    def getTilesPixels(self, item, params):
+        params = self._parseParams(params, True, [
+            ('frame', int),
+            ('level', int),
+        ])
+        points = params.pop('points', None) or '[]'
+        try:
+            points = json.loads(points) if isinstance(points, str) else points
+            if not isinstance(points, list):
+                raise ValueError
+            if len(points) > MaxBatchPixels:
+                msg = 'At most %d pixels can be requested at once' % MaxBatchPixels
+                raise RestException(msg, code=400)
+            points = [[entry['x'], entry['y']] if isinstance(entry, dict) else entry
+                      for entry in points]
+            points = np.array(points, dtype=float)
+            if len(points) and (points.ndim != 2 or points.shape[1] != 2):
+                raise ValueError
+        except (ValueError, TypeError, KeyError):
+            msg = 'points must be a JSON list of [x, y] or {"x": x, "y": y}'
+            raise RestException(msg, code=400)
+        try:
+            values = self.imageItemModel.getPixels(item, points, **params)
+        except TileGeneralError as e:
+            raise RestException(e.args[0])
+        except ValueError as e:
+            raise RestException('Value Error: %s' % e.args[0])
+        outside = np.ma.getmaskarray(values).all(axis=1)
+        return {'values': [
+            None if isOutside else value
+            for isOutside, value in zip(outside.tolist(), values.tolist())]}
+
     def _cacheHistograms(self, item, histRange, cache, params):
         needed = []
         result = {'cached': []}
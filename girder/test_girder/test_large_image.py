@@ -308,6 +308,60 @@ def testCaches(server, admin):
     assert 'cacheCleared' in results
 
 
+@pytest.mark.usefixtures('unbindLargeImage')
+@pytest.mark.plugin('large_image')
+def testCacheTiles(server, admin, user, fsAssetstore):
+    file = utilities.uploadExternalFile('sample_image.ptif', admin, fsAssetstore)
+    itemId = str(file['itemId'])
+    item = Item().load(itemId, force=True)
+    # Bad parameters
+    for params, status in [
+            ({}, 400),
+            ({'itemId': itemId, 'levels': 'not a list'}, 400),
+            ({'itemId': itemId, 'frames': '[-1]'}, 400),
+            ({'itemId': itemId, 'concurrent': 'x'}, 400)]:
+        resp = server.request(
+            method='PUT', path='/large_image/cache/tiles', user=admin, params=params)
+        assert utilities.respStatus(resp) == status
+    resp = server.request(
+        method='PUT', path='/large_image/cache/tiles', user=user, params={'itemId': itemId})
+    assert utilities.respStatus(resp) == 403
+    # Cache the two lowest resolution levels of the item and of its folder
+    for params in [{'itemId': itemId}, {'folderId': str(item['folderId'])}]:
+        params['levels'] = '[0, 1]'
+        resp = server.request(
+            method='PUT', path='/large_image/cache/tiles', user=admin, params=params)
+        assert utilities.respStatus(resp) == 200
+        job = resp.json
+        starttime = time.time()
+        while True:
+            assert time.time() - starttime < 30
+            job = Job().load(id=job['_id'], force=True)
+            if job['status'] in (JobStatus.SUCCESS, JobStatus.ERROR):
+                break
+            time.sleep(0.1)
+        assert job['status'] == JobStatus.SUCCESS
+        assert 'cached 3 tiles, 0 failed' in job['log'][-1]
+    assert ImageItem()._tileFromHash(item, 0, 0, 0) is not None
+    # Unexpected errors on individual tiles are counted as failures
+    sourceClass = ImageItem().tileSource(item).__class__
+    with mock.patch.object(sourceClass, 'getTile', side_effect=OSError('bad tile')):
+        resp = server.request(
+            method='PUT', path='/large_image/cache/tiles', user=admin,
+            params={'itemId': itemId, 'levels': '[0, 1]'})
+        assert utilities.respStatus(resp) == 200
+        job = resp.json
+        starttime = time.time()
+        while True:
+            assert time.time() - starttime < 30
+            job = Job().load(id=job['_id'], force=True)
+            if job['status'] in (JobStatus.SUCCESS, JobStatus.ERROR):
+                break
+            time.sleep(0.1)
+    assert job['status'] == JobStatus.SUCCESS
+    assert 'cached 0 tiles, 3 failed' in job['log'][-1]
+
+
 @pytest.mark.usefixtures('unbindLargeImage')
 @pytest.mark.plugin('large_image')
 def testAssociateImageCaching(server, admin, user, fsAssetstore):
@@ -1,3 +1,4 @@
+import json
 import math
 import os
 import pickle
@@ -6,6 +7,7 @@ import struct
 import time
 from unittest import mock
 
+import large_image_source_ometiff
 import pytest
 import requests
 
@@ -904,6 +906,52 @@ def testPixel(server, admin, fsAssetstore):
     assert resp.json == {}
 
 
+@pytest.mark.usefixtures('unbindLargeImage')
+@pytest.mark.plugin('large_image')
+def testPixels(server, admin, fsAssetstore):
+    file = utilities.uploadExternalFile(
+        'sample_image.ptif', admin, fsAssetstore)
+    itemId = str(file['itemId'])
+
+    # Test bad parameters
+    badParams = [
+        ({'points': 'invalid'}, 400, 'points must be'),
+        ({'points': '[[1, 2, 3]]'}, 400, 'points must be'),
+        ({'points': '[{"x": 1}]'}, 400, 'points must be'),
+        ({'points': '[[1, 2]]', 'level': 'invalid'}, 400, 'incorrect type'),
+    ]
+    for entry in badParams:
+        resp = server.request(path='/item/%s/tiles/pixels' % itemId,
+                              user=admin,
+                              params=entry[0])
+        assert utilities.respStatus(resp) == entry[1]
+        assert entry[2] in resp.json['message']
+
+    # Test a good query; points outside of the image are null
+    resp = server.request(
+        path='/item/%s/tiles/pixels' % itemId, user=admin,
+        params={'points': json.dumps([[48000, 3000], {'x': 148000, 'y': 3000}])})
+    assert utilities.respStatus(resp) == 200
+    assert len(resp.json['values']) == 2
+    assert 235 < resp.json['values'][0][0] < 240
+    assert 246 < resp.json['values'][0][1] < 250
+    assert 241 < resp.json['values'][0][2] < 245
+    assert resp.json['values'][1] is None
+    # Points are null even if none are in the image
+    resp = server.request(
+        path='/item/%s/tiles/pixels' % itemId, user=admin,
+        params={'points': json.dumps([[-1, 3000], [148000, 3000]])})
+    assert utilities.respStatus(resp) == 200
+    assert resp.json['values'] == [None, None]
+
+    # POST works, too
+    resp = server.request(
+        path='/item/%s/tiles/pixels' % itemId, user=admin, method='POST',
+        params={'points': json.dumps([[48000, 3000]]), 'level': 5})
+    assert utilities.respStatus(resp) == 200
+    assert len(resp.json['values']) == 1
+
+
 @pytest.mark.usefixtures('unbindLargeImage')
 @pytest.mark.plugin('large_image')
 def testGetTileSource(server, admin, fsAssetstore):
@@ -1203,6 +1251,69 @@ def testTilesWithFrameNumbers(server, admin, fsAssetstore):
     assert utilities.getBody(resp, text=False) == image1
 
 
+@pytest.mark.usefixtures('unbindLargeImage')
+@pytest.mark.plugin('large_image')
+def testTileBatch(server, admin, fsAssetstore):
+    file = utilities.uploadExternalFile(
+        'sample.ome.tif', admin, fsAssetstore)
+    itemId = str(file['itemId'])
+    images = []
+    for frame in range(2):
+        resp = server.request(path='/item/%s/tiles/fzxy/%d/0/0/0' % (itemId, frame),
+                              user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        images.append(utilities.getBody(resp, text=False))
+    tiles = '[[0, 0, 0, 0], {"z": 0, "x": 0, "y": 0, "frame": 1}, [0, 0, 0], [0, 9, 9]]'
+    # Binary format
+    resp = server.request(path='/item/%s/tiles/batch' % itemId, user=admin,
+                          isJson=False, params={'tiles': tiles, 'format': 'binary'})
+    assert utilities.respStatus(resp) == 200
+    body = utilities.getBody(resp, text=False)
+    results = []
+    while body:
+        headerLen = struct.unpack('<I', body[:4])[0]
+        header = json.loads(body[4:4 + headerLen])
+        body = body[4 + headerLen:]
+        results.append((header, body[:header['size']]))
+        body = body[header['size']:]
+    assert len(results) == 4
+    assert results[0][1] == images[0]
+    assert results[1][1] == images[1]
+    assert results[1][0]['frame'] == 1
+    assert results[2][1] == images[0]
+    assert results[2][0]['frame'] is None
+    assert 'error' in results[3][0]
+    # Multipart format with a default frame
+    resp = server.request(path='/item/%s/tiles/batch' % itemId, user=admin,
+                          isJson=False, params={'tiles': tiles, 'frame': 1})
+    assert utilities.respStatus(resp) == 200
+    boundary = resp.headers['Content-Type'].split('boundary=')[1]
+    parts = utilities.getBody(resp, text=False).split(
+        b'--' + boundary.encode())[1:-1]
+    assert len(parts) == 4
+    assert parts[2].split(b'\r\n\r\n', 1)[1][:-2] == images[1]
+    assert b'X-Tile: 0/0/0/1' in parts[2]
+    assert b'X-Tile-Error' in parts[3]
+    # Unexpected errors are reported per tile
+    with mock.patch.object(
+            large_image_source_ometiff.OMETiffFileTileSource, 'getTile',
+            side_effect=ValueError('unexpected')):
+        resp = server.request(path='/item/%s/tiles/batch' % itemId, user=admin,
+                              isJson=False, params={'tiles': '[[1, 0, 0, 2], [1, 1, 0, 2]]'})
+    assert utilities.respStatus(resp) == 200
+    parts = utilities.getBody(resp, text=False).split(
+        b'--' + resp.headers['Content-Type'].split('boundary=')[1].encode())[1:-1]
+    assert len(parts) == 2
+    assert all(b'X-Tile-Error' in part and b'unexpected' in part for part in parts)
+    # Bad parameters
+    for params in [{'tiles': 'not json'}, {'tiles': '[[0, 0]]'}, {'tiles': '[[0, -1, 0]]'},
+                   {'tiles': '[[0, 0, 0]]', 'format': 'other'},
+                   {'tiles': '[[0, 0, 0]]', 'encoding': 'pickle'}]:
+        resp = server.request(path='/item/%s/tiles/batch' % itemId, user=admin,
+                              isJson=False, params=params)
+        assert utilities.respStatus(resp) == 400
+
+
 @pytest.mark.usefixtures('unbindLargeImage')
 @pytest.mark.plugin('large_image')
 def testTilesHistogram(server, admin, fsAssetstore):
@@ -1,3 +1,4 @@
+import itertools
 import json
 import time
 import uuid
@@ -13,7 +14,7 @@ from girder.models.item import Item
 from girder.models.user import User
 
 from .models.annotation import Annotation
-from .utils import isGeoJSON
+from .utils import isGeoJSON, streamAnnotations
 
 _recentIdentifiers = cachetools.TTLCache(maxsize=100, ttl=86400)
 
@@ -105,6 +106,42 @@ def resolveAnnotationGirderIds(event, results, data, possibleGirderIds):
     return True
 
 
+def _processAnnotationStream(event, results, file):
+    """
+    Add annotations from a file that is too large to read into memory.  The
+    elements are parsed, validated, and stored incrementally.
+
+    :param event: the data.process event.
+    :param results: the results from _itemFromEvent.
+    :param file: the annotation file.
+    :returns: True if the annotations were added.
+    """
+    item = results['item']
+    user = results['user']
+    created = False
+    with File().open(file) as fptr:
+        for annotation in streamAnnotations(fptr):
+            elements = annotation.get('elements')
+            # Check some of the early elements to see if there are any
+            # girderIds that need resolution.
+            if 'uuid' in results and elements is not None:
+                early = list(itertools.islice(elements, 100))
+                annotation['elements'] = itertools.chain(early, elements)
+                girderIds = [element for element in early if 'girderId' in element]
+                if len(girderIds):
+                    if not resolveAnnotationGirderIds(event, results, [annotation], girderIds):
+                        if not created:
+                            return False
+                        logger.warning('Could not resolve girderIds in a later annotation')
+            try:
+                Annotation().createAnnotation(item, user, annotation)
+            except Exception:
+                logger.error('Could not create annotation object from data')
+                raise
+            created = True
+    return True
+
+
 def process_annotations(event):  # noqa: C901
     """Add annotations to an image on a ``data.process`` event"""
     results = _itemFromEvent(event, 'LargeImageAnnotationUpload')
@@ -122,13 +159,17 @@ def process_annotations(event):  # noqa: C901
     if not file:
         logger.error('Could not load models from the database')
         return
+    if file['size'] > int(large_image.config.getConfig(
+            'max_annotation_input_file_length', 1024 ** 3)):
+        logger.info('Streaming annotation file %s (%d bytes)', file['_id'], file['size'])
+        if not _processAnnotationStream(event, results, file):
+            return
+        if str(file['itemId']) == str(item['_id']):
+            File().remove(file)
+        if time.time() - startTime > 10:
+            logger.info('Added streamed annotations in %5.3fs', time.time() - startTime)
+        return
     try:
-        if file['size'] > int(large_image.config.getConfig(
-                'max_annotation_input_file_length', 1024 ** 3)):
-            msg = ('File is larger than will be read into memory.  If your '
-                   'server will permit it, increase the '
-                   'max_annotation_input_file_length setting.')
-            raise Exception(msg)
         data = []
         with File().open(file) as fptr:
             while True:
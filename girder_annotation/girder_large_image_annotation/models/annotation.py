@@ -14,6 +14,8 @@
 #  limitations under the License.
 ##############################################################################
 
+import bisect
+import concurrent.futures
 import copy
 import datetime
 import enum
@@ -23,11 +25,11 @@ import time
 
 import cherrypy
 import jsonschema
-import numpy as np
 from bson import ObjectId
 from girder_large_image import constants
 from girder_large_image.models.image_item import ImageItem
 
+import large_image
 from girder import events, logger
 from girder.constants import AccessType, SortDir
 from girder.exceptions import AccessException, ValidationException
@@ -39,10 +41,13 @@ from girder.models.setting import Setting
 from girder.models.user import User
 
 from ..utils import AnnotationGeoJSON, GeoJSONAnnotation, isGeoJSON
+from ..utils.validation import ElementValidator
 from .annotationelement import Annotationelement
 
-# Some arrays longer than this are validated using numpy rather than jsonschema
-VALIDATE_ARRAY_LENGTH = 1000
+# Annotations with more elements than this are validated in parallel chunks
+VALIDATE_CHUNK_SIZE = 10000
+# Old annotation versions are removed this many at a time
+OLD_VERSION_BATCH_SIZE = 1000
 
 
 def extendSchema(base, add):
@@ -609,8 +614,7 @@ class Annotation(AccessControlledModel):
         AnnotationSchema.annotationSchema)
     validatorAnnotationElement = jsonschema.Draft6Validator(
         AnnotationSchema.annotationElementSchema)
-    idRegex = re.compile('^[0-9a-f]{24}$')
-    numberInstance = (int, float)
+    elementValidator = ElementValidator(AnnotationSchema.annotationElementSchema)
 
     class Skill(enum.Enum):
         NOVICE = 'novice'
@@ -896,6 +900,30 @@ class Annotation(AccessControlledModel):
             expires=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1))
         return result
 
+    def _storeElements(self, doc):
+        """
+        Store the elements of an annotation document that is being saved.
+
+        :param doc: the annotation document.  If its elements are an iterator
+            rather than a list, they are removed from the document once they
+            have been stored.
+        """
+        elements = doc['annotation'].get('elements')
+        if isinstance(elements, (list, tuple)):
+            Annotationelement().updateElements(doc)
+            return
+        # Elements from an iterator are stored as they are validated, so a
+        # failure part way through must remove those already stored.
+        startTime = time.time()
+        try:
+            count = Annotationelement().updateElements(doc)
+        except Exception:
+            Annotationelement().removeVersionElements(doc)
+            raise
+        doc['annotation'].pop('elements', None)
+        logger.info('Stored %d streamed element(s) for annotation %s in %5.3fs',
+                    count, doc['_id'], time.time() - startTime)
+
     def save(self, annotation, *args, **kwargs):
         """
         When saving an annotation, override the collection insert_one and
@@ -930,12 +958,14 @@ class Annotation(AccessControlledModel):
             oldversion = self.collection.find_one(
                 {'_id': annotation['_id']}).get('_version')
         annotation['_version'] = version
+        # A complete save stores all elements with the new version
+        annotation.pop('_versionBase', None)
         _elementQuery = annotation.pop('_elementQuery', None)
         annotation.pop('_active', None)
         annotation.pop('_annotationId', None)
 
         def replaceElements(query, doc, *args, **kwargs):
-            Annotationelement().updateElements(doc)
+            self._storeElements(doc)
             elements = doc['annotation'].pop('elements', None)
             if self._historyEnabled:
                 oldAnnotation = self.collection.find_one(query)
@@ -955,7 +985,7 @@ class Annotation(AccessControlledModel):
             # the annotation without elements, then restore the elements.
             doc.setdefault('_id', ObjectId())
             if doc['annotation'].get('elements') is not None:
-                Annotationelement().updateElements(doc)
+                self._storeElements(doc)
             # If we are inserting, we shouldn't have any old elements, so don't
             # bother removing them.
             elements = doc['annotation'].pop('elements', None)
@@ -1007,141 +1037,216 @@ class Annotation(AccessControlledModel):
             expires=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1))
         return annotation
 
-    def _similarElementStructure(self, a, b, parentKey=None):  # noqa
+    def patchAnnotation(self, annotation, add=None, modify=None, remove=None,
+                        updateUser=None):
         """
-        Compare two elements to determine if they are similar enough that if
-        one validates, the other should, too.  This is called recursively to
-        validate dictionaries.  In general, types must be the same,
-        dictionaries must contain the same keys, arrays must be the same
-        length.  The only differences that are allowed are numerical values may
-        be different, ids may be different, and point arrays may contain
-        different numbers of elements.
-
-        :param a: first element
-        :param b: second element
-        :param parentKey: if set, the key of the dictionary that used for this
-            part of the comparison.
-        :returns: True if the elements are similar.  False if they are not.
+        Add, modify, and remove elements of an annotation without rewriting
+        the elements that are unchanged.
+
+        New and modified elements are stored with a new version, and the
+        elements they replace or remove are marked as ending at that version.
+        The annotation record is switched to the new version only after all of
+        the elements are written, so readers of the previous version still get
+        a consistent set of elements.  If history is enabled, the previous
+        version is kept as an inactive record.
+
+        :param annotation: the annotation document.  This does not need to
+            have its elements loaded.
+        :param add: a list of new elements.
+        :param modify: a list of elements, each with the id of an existing
+            element that it replaces.
+        :param remove: a list of the ids of elements to remove.
+        :param updateUser: the user who is making the change.
+        :returns: the updated annotation document without elements.
+        """
+        add = list(add or [])
+        modify = list(modify or [])
+        remove = [str(id) for id in remove or []]
+        if '_annotationId' in annotation:
+            msg = 'Only the current version of an annotation can be patched.'
+            raise ValidationException(msg)
+        current = self.collection.find_one({'_id': annotation['_id']})
+        if current is None or current.get('_active') is False:
+            msg = 'The annotation does not exist.'
+            raise ValidationException(msg)
+        if any('id' not in element for element in modify):
+            msg = 'Modified elements must have an id.'
+            raise ValidationException(msg)
+        changedIds = [str(element['id']) for element in modify] + remove
+        if len(set(changedIds)) != len(changedIds):
+            msg = 'An element can only be modified or removed once in a patch.'
+            raise ValidationException(msg)
+        self.validate({'annotation': dict(current['annotation'], elements=add + modify)})
+        elementModel = Annotationelement()
+        addedIds = [str(element['id']) for element in add if 'id' in element]
+        found = elementModel.getElementDocumentIds(current, addedIds + changedIds)
+        if any(id in found for id in addedIds):
+            msg = 'Added elements cannot use the id of an existing element.'
+            raise ValidationException(msg)
+        missing = [id for id in changedIds if id not in found]
+        if missing:
+            msg = 'Element ids are not in the annotation: %s' % ', '.join(missing[:10])
+            raise ValidationException(msg)
+
+        starttime = time.time()
+        version = elementModel.getNextVersionValue()
+        elementModel.updateElements({
+            '_id': current['_id'],
+            'itemId': current['itemId'],
+            '_version': version,
+            'annotation': {'elements': add + modify},
+        })
+        ended = [found[id] for id in changedIds]
+        historyId = None
+
+        def rollback():
+            # Only undo what this patch did; elements ended by another patch
+            # have a different _versionEnd
+            elementModel.removeWithQuery({'annotationId': current['_id'], '_version': version})
+            elementModel.collection.update_many(
+                {'_id': {'$in': ended}, '_versionEnd': version},
+                {'$unset': {'_versionEnd': True}})
+            if historyId is not None:
+                self.collection.delete_one({'_id': historyId})
+            msg = 'The annotation was changed while it was being patched.'
+            raise ValidationException(msg)
+
+        # If another patch has already ended any of the elements, this patch
+        # would conflict with it.
+        if elementModel.endElements(ended, version) != len(ended):
+            rollback()
+        if self._historyEnabled:
+            oldAnnotation = current.copy()
+            oldAnnotation['_annotationId'] = oldAnnotation.pop('_id')
+            oldAnnotation['_active'] = False
+            historyId = self.collection.insert_one(oldAnnotation).inserted_id
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # Only switch versions if no one else has saved the annotation since
+        # we read it.
+        result = self.collection.update_one({
+            '_id': current['_id'],
+            '_version': current['_version'],
+        }, {
+            '$set': {
+                '_version': version,
+                '_versionBase': current.get('_versionBase', current['_version']),
+                'updated': now,
+                'updatedId': updateUser['_id'] if updateUser else None,
+            },
+            '$unset': {'groups': True},
+        })
+        if not result.modified_count:
+            rollback()
+        annotation = self.load(current['_id'], getElements=False, force=True)
+        if not self._historyEnabled:
+            elementModel.removeEndedElements(annotation)
+        logger.info(
+            'Patched annotation %s in %5.3fs, adding %d, modifying %d, and removing %d '
+            'element(s)', annotation['_id'], time.time() - starttime,
+            len(add), len(modify), len(remove))
+        events.trigger('large_image.annotations.save_history', {
+            'annotation': annotation,
+        }, asynchronous=True)
+        Notification().createNotification(
+            type='large_image_annotation.update',
+            data={'_id': annotation['_id'], 'itemId': annotation['itemId']},
+            user=User().load(annotation['creatorId'], force=True),
+            expires=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1))
+        return annotation
+
+    def _validateElement(self, element):
+        """
+        Validate a single annotation element.
+
+        :param element: the element to validate.  Modified to remove keys
+            starting with an underscore and to convert an ObjectId id to a
+            string.
+        """
+        # Discard element keys beginning with _
+        for key in list(element):
+            if key.startswith('_'):
+                del element[key]
+        if isinstance(element.get('id'), ObjectId):
+            element['id'] = str(element['id'])
+        self.elementValidator.validate(element)
+
+    def _validateElementChunk(self, elements, chunk, chunkSize):
+        """
+        Validate a chunk of annotation elements.  See validate.
+
+        :returns: a list of the element ids in the chunk.
+        """
+        elementIds = []
+        for element in elements[chunk:chunk + chunkSize]:
+            self._validateElement(element)
+            if 'id' in element:
+                elementIds.append(element['id'])
+        return elementIds
+
+    def _validateElementStream(self, annot, elements):
+        """
+        Validate elements from an iterator as they are consumed.  The rest of
+        the annotation is validated once the elements are exhausted, as a
+        streamed annotation may not be complete until then.
+
+        :param annot: the annotation dictionary.
+        :param elements: an iterator of elements.
+        :yields: validated elements.
         """
-        # This function exceeds the recommended complexity, but since it is
-        # needs to be relatively fast, breaking it into smaller functions is
-        # probably undesirable.
-        if not isinstance(a, type(b)):
-            return False
-        if isinstance(a, dict):
-            if len(a) != len(b):
-                return False
-            for k in a:
-                if k not in b:
-                    return False
-                if k == 'id':
-                    if not isinstance(b[k], str) or not self.idRegex.match(b[k]):
-                        return False
-                elif parentKey in {'user'} or k in {'fillColor', 'lineColor'}:
-                    continue
-                elif parentKey != 'label' or k != 'value':
-                    if not self._similarElementStructure(a[k], b[k], k):
-                        return False
-        elif isinstance(a, list):
-            if parentKey == 'holes':
-                return all(
-                    len(hole) == 3 and
-                    # this is faster than checking the instance type, and, if
-                    # it raises an exception, it would have failed validation
-                    # any way.
-                    1 + hole[0] + hole[1] + hole[2] is not None
-                    # isinstance(hole[0], self.numberInstance) and
-                    # isinstance(hole[1], self.numberInstance) and
-                    # isinstance(hole[2], self.numberInstance)
-                    for hlist in b
-                    for hole in hlist)
-            if len(a) != len(b):
-                if parentKey not in {'points', 'values'} or len(a) < 2 or len(b) < 2:
-                    return False
-                # If this is an array of points, let it pass
-                return all(
-                    len(elem) == 3 and
-                    # this is faster than checking the instance type, and, if
-                    # it raises an exception, it would have failed validation
-                    # any way.
-                    1 + elem[0] + elem[1] + elem[2] is not None
-                    # isinstance(elem[0], self.numberInstance) and
-                    # isinstance(elem[1], self.numberInstance) and
-                    # isinstance(elem[2], self.numberInstance)
-                    for elem in b)
-            for idx in range(len(a)):
-                if not self._similarElementStructure(a[idx], b[idx], parentKey):
-                    return False
-        elif not isinstance(a, self.numberInstance):
-            return a == b
-        # Either a number or the dictionary or list comparisons passed
-        return True
-
-    def validate(self, doc):  # noqa
         startTime = lastTime = time.time()
+        elementIds = set()
+        count = 0
+        try:
+            for element in elements:
+                self._validateElement(element)
+                if 'id' in element:
+                    if element['id'] in elementIds:
+                        msg = 'Annotation Element IDs are not unique'
+                        raise ValidationException(msg)
+                    elementIds.add(element['id'])
+                count += 1
+                yield element
+                if time.time() - lastTime > 10:
+                    logger.info('Validated %d elements in %5.3fs',
+                                count, time.time() - startTime)
+                    lastTime = time.time()
+            header = {k: v for k, v in annot.items() if k != 'elements'}
+            header['elements'] = []
+            self.validatorAnnotation.validate(header)
+        except jsonschema.ValidationError as exp:
+            raise ValidationException(exp)
+
+    def validate(self, doc):
+        startTime = time.time()
+        annot = doc.get('annotation')
+        elements = annot.get('elements', [])
+        if not isinstance(elements, (list, tuple)):
+            annot['elements'] = self._validateElementStream(annot, elements)
+            return doc
         try:
-            # This block could just use the json validator:
-            #   jsonschema.validate(doc.get('annotation'),
-            #                       AnnotationSchema.annotationSchema)
+            # This could just use the json validator on the whole annotation,
             # but this is very slow.  Instead, validate the main structure and
-            # then validate each element.  If sequential elements are similar
-            # in structure, skip validating them.
-            annot = doc.get('annotation')
-            elements = annot.get('elements', [])
+            # then validate chunks of elements in parallel with checks
+            # compiled from the element schema.
             annot['elements'] = []
             self.validatorAnnotation.validate(annot)
-            lastValidatedElement = None
-            lastValidatedElement2 = None
-            for idx, element in enumerate(elements):
-                # Discard element keys beginning with _
-                for key in list(element):
-                    if key.startswith('_'):
-                        del element[key]
-                if isinstance(element.get('id'), ObjectId):
-                    element['id'] = str(element['id'])
-                # Handle elements with large arrays by checking that a
-                # conversion to a numpy array works
-                keys = None
-                if len(element.get('points', element.get('values', []))) > VALIDATE_ARRAY_LENGTH:
-                    key = 'points' if 'points' in element else 'values'
-                    try:
-                        # Check if the entire array converts in an obvious
-                        # manner
-                        np.array(element[key], dtype=float)
-                        keys[key] = element[key]
-                        element[key] = element[key][:VALIDATE_ARRAY_LENGTH]
-                    except Exception:
-                        pass
-                if any(len(h) > VALIDATE_ARRAY_LENGTH for h in element.get('holes', [])):
-                    key = 'holes'
-                    try:
-                        for h in element['holes']:
-                            np.array(h, dtype=float)
-                        keys[key] = element[key]
-                        element[key] = []
-                    except Exception:
-                        pass
-                try:
-                    if (not self._similarElementStructure(element, lastValidatedElement) and
-                            not self._similarElementStructure(element, lastValidatedElement2)):
-                        self.validatorAnnotationElement.validate(element)
-                        lastValidatedElement2 = lastValidatedElement
-                        lastValidatedElement = element
-                except TypeError:
-                    self.validatorAnnotationElement.validate(element)
-                if keys:
-                    element.update(keys)
-                if time.time() - lastTime > 10:
-                    logger.info('Validated %s of %d elements in %5.3fs',
-                                idx + 1, len(elements), time.time() - startTime)
-                    lastTime = time.time()
             annot['elements'] = elements
+            threads = large_image.config.cpu_count()
+            if len(elements) <= VALIDATE_CHUNK_SIZE or threads == 1:
+                elementIds = self._validateElementChunk(elements, 0, len(elements))
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+                    futures = [
+                        pool.submit(self._validateElementChunk, elements, chunk,
+                                    VALIDATE_CHUNK_SIZE)
+                        for chunk in range(0, len(elements), VALIDATE_CHUNK_SIZE)]
+                    elementIds = [
+                        elementId for future in futures for elementId in future.result()]
         except jsonschema.ValidationError as exp:
             raise ValidationException(exp)
         if time.time() - startTime > 10:
-            logger.info('Validated in %5.3fs' % (time.time() - startTime))
-        elementIds = [entry['id'] for entry in
-                      doc['annotation'].get('elements', []) if 'id' in entry]
+            logger.info('Validated %d elements in %5.3fs' % (
+                len(elements), time.time() - startTime))
         if len(set(elementIds)) != len(elementIds):
             msg = 'Annotation Element IDs are not unique'
             raise ValidationException(msg)
@@ -1317,19 +1422,142 @@ class Annotation(AccessControlledModel):
             self.update({'_id': doc['_id']}, {'$set': {'access': doc['access']}})
         return doc
 
-    def removeOldAnnotations(self, remove=False, minAgeInDays=30, keepInactiveVersions=5):  # noqa
+    def _oldAnnotationPipeline(self, age, resumeAfter=None):
+        """
+        Get an aggregation pipeline that lists the versions of each annotation
+        for removeOldAnnotations.
+
+        :param age: a datetime; versions last modified before this are old.
+        :param resumeAfter: if not None, only list annotations whose ids are
+            greater than this.
+        :returns: a pipeline that yields one document per annotation in
+            ascending id order with the ``itemId``, a non-empty ``item`` list
+            if the item exists, and a list of ``versions``, most recent first,
+            each with the ``version``, the ``base`` version (the same as the
+            version for complete saves), whether any record of that version is
+            ``active``, and whether all of them are ``old``.
+        """
+        pipeline = [
+            {'$project': {
+                'root': {'$ifNull': ['$_annotationId', '$_id']},
+                'itemId': 1,
+                '_version': 1,
+                'base': {'$ifNull': ['$_versionBase', '$_version']},
+                'active': {'$ne': ['$_active', False]},
+                'old': {'$lt': [{'$max': ['$created', '$updated']}, age]},
+            }},
+        ]
+        if resumeAfter is not None:
+            pipeline.append({'$match': {'root': {'$gt': ObjectId(resumeAfter)}}})
+        pipeline += [
+            # Concurrent saves can produce multiple records with the same
+            # version
+            {'$group': {
+                '_id': {'root': '$root', 'version': '$_version'},
+                'itemId': {'$first': '$itemId'},
+                'base': {'$first': '$base'},
+                'active': {'$max': '$active'},
+                'old': {'$min': '$old'},
+            }},
+            {'$sort': {'_id.root': 1, '_id.version': -1}},
+            {'$group': {
+                '_id': '$_id.root',
+                'itemId': {'$first': '$itemId'},
+                'versions': {'$push': {
+                    'version': '$_id.version',
+                    'base': '$base',
+                    'active': '$active',
+                    'old': '$old',
+                }},
+            }},
+            {'$sort': {'_id': 1}},
+            {'$lookup': {
+                'from': 'item',
+                'let': {'itemId': '$itemId'},
+                'pipeline': [
+                    {'$match': {'$expr': {'$eq': ['$$itemId', '$_id']}}},
+                    {'$project': {'_id': 1}},
+                ],
+                'as': 'item',
+            }},
+        ]
+        return pipeline
+
+    def _removeOldVersions(self, versions, elementVersions, patched):
+        """
+        Remove a batch of old annotation versions.  The annotation records are
+        removed before their elements, so if this is interrupted, any
+        remaining elements are abandoned and will be removed by a later
+        cleanup.
+
+        :param versions: a list of annotation versions to remove.
+        :param elementVersions: a list of versions whose elements are not used
+            by any other version and can be removed.
+        :param patched: a list of tuples of (record, keptRecords) of versions
+            whose elements may be shared with kept versions.
+        """
+        self.collection.delete_many({'_version': {'$in': versions}})
+        if elementVersions:
+            Annotationelement().removeWithQuery({'_version': {'$in': elementVersions}})
+        for record, keptRecords in patched:
+            Annotationelement().removeVersionElements(record, keptRecords)
+
+    def _abandonedElementVersions(self, age):
+        """
+        Find element versions that are not used by any annotation record.
+
+        :param age: a datetime; only elements created before this are
+            considered.
+        :returns: a sorted list of versions.
+        """
+        annotVersions = {entry['_id'] for entry in self.collection.aggregate(
+            [{'$group': {'_id': '$_version'}}], allowDiskUse=True)}
+        # Patched annotations use elements from a range of versions; merge
+        # these ranges so that versions can be checked with a bisection
+        lows, highs = [], []
+        for entry in self.collection.find(
+                {'_versionBase': {'$ne': None}}, {'_version': 1, '_versionBase': 1},
+        ).sort([('_versionBase', SortDir.ASCENDING)]):
+            if highs and entry['_versionBase'] <= highs[-1]:
+                highs[-1] = max(highs[-1], entry['_version'])
+            else:
+                lows.append(entry['_versionBase'])
+                highs.append(entry['_version'])
+        abandoned = []
+        for entry in Annotationelement().collection.aggregate([
+                {'$match': {'created': {'$lt': age}}},
+                {'$group': {'_id': '$_version'}}], allowDiskUse=True):
+            version = entry['_id']
+            if version in annotVersions:
+                continue
+            idx = bisect.bisect_right(lows, version) - 1
+            if idx < 0 or version > highs[idx]:
+                abandoned.append(version)
+        return sorted(abandoned)
+
+    def removeOldAnnotations(  # noqa
+            self, remove=False, minAgeInDays=30, keepInactiveVersions=5, resumeAfter=None):
         """
         Remove annotations that (a) have no item or (b) are inactive and at
         least (1) a minimum age in days and (2) not the most recent inactive
         versions.  Also remove any annotation elements that don't have
         associated annotations and are a minimum age in days.
 
+        The versions of each annotation are computed with an aggregation
+        pipeline and removed in batches.  Progress is logged periodically with
+        the id of the last annotation whose old versions have been removed; if
+        the cleanup is interrupted, it can be resumed after that annotation.
+        The report only includes the annotations that were checked.
+
         :param remove: if False, just report on what would be done.  If true,
             actually remove the annotations and compact the collections.
         :param minAgeInDays: only work on annotations that are at least this
             old.  This must be greater than or equal to 7.
         :param keepInactiveVersions: keep at least this many inactive versions
             of any annotation, regardless of age.
+        :param resumeAfter: if not None, the id of an annotation.  Only
+            annotations with greater ids are checked for old versions.
+        :returns: a report dictionary.
         """
         if (remove and minAgeInDays < 7) or minAgeInDays < 0:
             msg = 'minAgeInDays must be >= 7'
@@ -1341,62 +1569,74 @@ class Annotation(AccessControlledModel):
         report = {'fromDeletedItems': 0, 'oldVersions': 0, 'active': 0, 'recentVersions': 0}
         if remove:
             report['removedVersions'] = 0
-        itemIds = {}
-        processedIds = set()
-        annotVersions = set()
+        checked = 0
+        lastId = resumeAfter
+        versions, elementVersions, patched = [], [], []
         logger.info('Checking old annotations')
         logtime = time.time()
-        for annot in self.collection.find().sort([('_id', SortDir.ASCENDING)]):
+        for annot in self.collection.aggregate(
+                self._oldAnnotationPipeline(age, resumeAfter), allowDiskUse=True):
             if time.time() - logtime > 10:
-                logger.info('Still checking old annotations, checked %d with %d versions, %r' % (
-                    len(processedIds), len(annotVersions), report))
+                logger.info(
+                    'Still checking old annotations, checked %d, processed through '
+                    'annotation %s, %r' % (checked, lastId, report))
                 logtime = time.time()
-            id = annot.get('_annotationId', annot['_id'])
-            version = annot.get('_version')
-            annotVersions.add(version)
-            if id in processedIds:
-                continue
-            itemId = annot.get('itemId')
-            if itemId not in itemIds:
-                if len(itemIds) > 10000:
-                    itemIds = {}
-                itemIds[itemId] = Item().findOne({'_id': itemId}) is not None
-            keep = keepInactiveVersions if itemIds[itemId] else 0
-            history = self.versionList(id, force=True)
-            for record in history:
-                if record.get('_active') is not False and itemIds[itemId]:
+            itemExists = len(annot['item']) > 0
+            keep = keepInactiveVersions if itemExists else 0
+            removeRecords, keptRecords = [], []
+            for record in annot['versions']:
+                if record['active'] and itemExists:
                     report['active'] += 1
-                    continue
-                if keep:
+                elif keep:
                     keep -= 1
                     report['recentVersions'] += 1
+                elif record['old']:
+                    removeRecords.append(record)
+                    report['oldVersions' if itemExists else 'fromDeletedItems'] += 1
                     continue
-                if max(record['created'], record['updated']).timestamp() < age.timestamp():
-                    if remove:
-                        self.collection.delete_one({'_id': record['_id']})
-                        Annotationelement().removeWithQuery({'_version': record['_version']})
-                        report['removedVersions'] += 1
-                    if not itemIds[itemId]:
-                        report['fromDeletedItems'] += 1
-                    else:
-                        report['oldVersions'] += 1
                 else:
                     report['recentVersions'] += 1
-            processedIds.add(id)
-        logger.info('Getting distinct element versions')
-        elemVersions = Annotationelement().collection.distinct(
-            '_version', filter={'created': {'$lt': age}})
-        logger.info('Got %d distinct element versions' % len(elemVersions))
-        logtime = time.time()
-        abandonedVersions = set(elemVersions) - set(annotVersions)
+                keptRecords.append(record)
+            if remove and removeRecords:
+                keptRanges = [
+                    (record['base'], record['version']) for record in keptRecords
+                    if record['base'] != record['version']]
+                keptRecords = [{
+                    '_id': annot['_id'], '_version': record['version'],
+                    '_versionBase': record['base'],
+                } for record in keptRecords]
+                for record in removeRecords:
+                    version = record['version']
+                    versions.append(version)
+                    if (record['base'] == version and
+                            not any(low <= version <= high for low, high in keptRanges)):
+                        elementVersions.append(version)
+                    else:
+                        patched.append(({
+                            '_id': annot['_id'], '_version': version,
+                            '_versionBase': record['base'],
+                        }, keptRecords))
+                if len(versions) >= OLD_VERSION_BATCH_SIZE:
+                    self._removeOldVersions(versions, elementVersions, patched)
+                    report['removedVersions'] += len(versions)
+                    versions, elementVersions, patched = [], [], []
+            checked += 1
+            if not versions:
+                lastId = annot['_id']
+        if versions:
+            self._removeOldVersions(versions, elementVersions, patched)
+            report['removedVersions'] += len(versions)
+        logger.info('Checked %d annotations; getting abandoned element versions' % checked)
+        abandonedVersions = self._abandonedElementVersions(age)
         report['abandonedVersions'] = len(abandonedVersions)
         if remove:
-            for version in abandonedVersions:
+            for idx in range(0, len(abandonedVersions), OLD_VERSION_BATCH_SIZE):
                 if time.time() - logtime > 10:
                     logger.info('Removing abandoned versions, %r' % report)
                     logtime = time.time()
-                Annotationelement().removeWithQuery({'_version': version})
-                report['removedVersions'] += 1
+                batch = abandonedVersions[idx:idx + OLD_VERSION_BATCH_SIZE]
+                Annotationelement().removeWithQuery({'_version': {'$in': batch}})
+                report['removedVersions'] += len(batch)
             logger.info('Compacting annotation collection')
             self.collection.database.command('compact', self.name)
             logger.info('Compacting annotationelement collection')
@@ -1465,12 +1705,17 @@ class Annotation(AccessControlledModel):
 
         return super().save(annotation)
 
-    def geojson(self, annotation):
+    def geojson(self, annotation, binary=False):
         """
         Yield an annotation as geojson generator.
 
         :param annotation: The annotation to delete metadata from.
+        :param binary: if True, yield large chunks of bytes that are converted
+            in parallel.  Otherwise, yield one string per feature.
         :yields: geojson.  General annotation properties are added to the first
             feature under the annotation tag.
         """
+        if binary:
+            yield from AnnotationGeoJSON(annotation['_id']).chunks()
+            return
         yield from AnnotationGeoJSON(annotation['_id'])
@@ -14,14 +14,21 @@
 #  limitations under the License.
 ##############################################################################
 
+import collections
 import concurrent.futures
 import datetime
 import io
+import itertools
 import math
 import pickle
+import sys
+import threading
 import time
 
+import cachetools
+import numpy as np
 import pymongo
+from bson import ObjectId
 from girder_large_image.models.image_item import ImageItem
 
 import large_image
@@ -38,6 +45,32 @@ from girder.models.upload import Upload
 MAX_ELEMENT_CHECK = 100
 MAX_ELEMENT_DOCUMENT = 10000
 MAX_ELEMENT_USER_DOCUMENT = 1000000
+# When elements are stored in files, read this many element documents ahead
+# so that the files can be loaded in parallel.
+MAX_DATAFILE_PREFETCH = 32
+# Bounding boxes of elements with points are computed in batches of about this
+# many points
+BBOX_BATCH_POINTS = 1000000
+
+# Elements are indexed in a loose quadtree of square cells.  Each element is
+# assigned to the cell containing the center of its bounding box at the finest
+# level where the cell is at least as large as the element.  Level 0 cells are
+# CELL_SIZE pixels on a side and each subsequent level doubles that.  The
+# level and cell coordinates are packed into a single integer so that a row of
+# cells is a contiguous range of keys.
+CELL_SIZE = 256
+CELL_BITS = 24
+# If a region spans more than this many rows of cells at a level, query a
+# single range of keys for that level rather than one range per row.
+CELL_MAX_ROWS = 64
+# Levels are capped at the largest cell size that is a finite float (CELL_SIZE
+# must be a power of two).  Elements whose bounding boxes are not finite are
+# all stored in a single overflow cell just past the last level.
+CELL_MAX_LEVEL = sys.float_info.max_exp - CELL_SIZE.bit_length()
+CELL_OVERFLOW = (CELL_MAX_LEVEL + 1) << (CELL_BITS * 2)
+
+_cellInfoCache = cachetools.LRUCache(maxsize=1000)
+_cellInfoLock = threading.Lock()
 
 
 class Annotationelement(Model):
@@ -84,6 +117,16 @@ class Annotationelement(Model):
                 ('_version', SortDir.ASCENDING),
             ], {}),
             'element.girderId',
+            ([
+                ('annotationId', SortDir.ASCENDING),
+                ('element.id', SortDir.ASCENDING),
+            ], {}),
+            ([
+                ('annotationId', SortDir.ASCENDING),
+                ('bbox.cell', SortDir.ASCENDING),
+            ], {
+                'name': 'annotationCellIdx',
+            }),
         ])
 
         self.exposeFields(AccessType.READ, (
@@ -118,6 +161,73 @@ class Annotationelement(Model):
                 {'$inc': {'_version': 1}})
         return version['_version']
 
+    def versionQuery(self, annotation):
+        """
+        Get a query that selects the elements of a specific version of an
+        annotation.
+
+        When an annotation is saved, all of its elements are stored with the
+        annotation's version.  When an annotation is patched, only the new and
+        modified elements are stored with the new version, the elements that
+        they replace are marked with that version as their _versionEnd, and
+        the annotation records the version of its last complete save as
+        _versionBase.  The elements of a version are those stored between the
+        base version and that version that have not ended by that version.
+
+        :param annotation: the annotation record.
+        :returns: a query dictionary.
+        """
+        version = annotation['_version']
+        base = annotation.get('_versionBase', version)
+        query = {'annotationId': annotation.get('_annotationId', annotation['_id'])}
+        if base == version:
+            query['_version'] = version
+        else:
+            query['_version'] = {'$gte': base, '$lte': version}
+            query['_versionEnd'] = {'$not': {'$lte': version}}
+        return query
+
+    def getElementDocumentIds(self, annotation, ids):
+        """
+        Find the database documents of elements of an annotation by element
+        id.
+
+        :param annotation: the annotation record.
+        :param ids: a list of element id strings.
+        :returns: a dictionary of element ids to document ids for the ids that
+            are elements of the annotation.
+        """
+        ids = [str(id) for id in ids]
+        if not ids:
+            return {}
+        objectIds = [ObjectId(id) for id in ids if ObjectId.is_valid(id)]
+        query = self.versionQuery(annotation)
+        query['$or'] = [{'element.id': {'$in': ids}}]
+        if objectIds:
+            query['$or'].append({'_id': {'$in': objectIds}, 'element.id': {'$exists': False}})
+        return {
+            str(entry['element'].get('id', entry['_id'])): entry['_id']
+            for entry in self.collection.find(query, {'_id': True, 'element.id': True})}
+
+    def endElements(self, documentIds, version):
+        """
+        Mark element documents as no longer part of an annotation as of a
+        version.
+
+        Elements that have already been ended, such as by a concurrent patch,
+        are not changed.
+
+        :param documentIds: a list of document ids.
+        :param version: the version where the elements were replaced or
+            removed.
+        :returns: the number of element documents that were marked.
+        """
+        if not documentIds:
+            return 0
+        return self.collection.update_many(
+            {'_id': {'$in': list(documentIds)}, '_versionEnd': {'$exists': False}},
+            {'$set': {'_versionEnd': version}}).modified_count
+
     def getElements(self, annotation, region=None):
         """
         Given an annotation, fetch the elements from the database and add them
@@ -131,6 +241,8 @@ class Annotationelement(Model):
                 box is at least partially within the requested area, that
                 element is included.
             :minimumSize: the minimum size of an element to return.
+            :includePoints: if specified and true, point elements are returned
+                regardless of minimumSize.
             :sort, sortdir: standard sort options.  The sort key can include
                 size and details.
             :limit: limit the total number of elements by this value.  Defaults
@@ -159,7 +271,7 @@ class Annotationelement(Model):
         annotation['annotation']['elements'] = list(self.yieldElements(
             annotation, region, annotation['_elementQuery']))
 
-    def yieldElements(self, annotation, region=None, info=None):  # noqa
+    def yieldElements(self, annotation, region=None, info=None, numpyArrays=False):  # noqa
         """
         Given an annotation, fetch the elements from the database.
 
@@ -171,6 +283,8 @@ class Annotationelement(Model):
                 box is at least partially within the requested area, that
                 element is included.
             :minimumSize: the minimum size of an element to return.
+            :includePoints: if specified and true, point elements are returned
+                regardless of minimumSize.
             :sort, sortdir: standard sort options.  The sort key can include
                 size and details.
             :limit: limit the total number of elements by this value.  Defaults
@@ -202,22 +316,30 @@ class Annotationelement(Model):
             maxDetails (as specified by the region dictionary), details (sum of
             details returned), limit (as specified by region), centroids (a
             boolean based on the region specification).
+        :param numpyArrays: if True, large points and values arrays that are
+            stored as typed arrays are returned as numpy arrays rather than
+            lists.
         :returns: a list of elements.  If centroids were requested, each entry
             is a list with str(id), x, y, size.  Otherwise, each entry is the
             element record.
         """
         info = info if info is not None else {}
         region = region or {}
-        query = {
-            'annotationId': annotation.get('_annotationId', annotation['_id']),
-            '_version': annotation['_version'],
-        }
+        query = self.versionQuery(annotation)
         for key in region:
             if key in self.bboxKeys and self.bboxKeys[key][1]:
                 if self.bboxKeys[key][1] == '$gte' and float(region[key]) <= 0:
                     continue
                 query[self.bboxKeys[key][0]] = {
                     self.bboxKeys[key][1]: float(region[key])}
+        if region.get('includePoints') and 'bbox.size' in query:
+            # Points have a small fixed size, so they would be omitted from
+            # zoomed out regions
+            query['$and'] = [{'$or': [
+                {'bbox.size': query.pop('bbox.size')}, {'element.type': 'point'}]}]
+        cellQuery = self._cellQuery(annotation, region)
+        if cellQuery:
+            query['$or'] = cellQuery
         if region.get('sort') in self.bboxKeys:
             sortkey = self.bboxKeys[region['sort']][0]
         else:
@@ -272,7 +394,7 @@ class Annotationelement(Model):
             info['minElements'] = minElements
         if limit:
             info['limit'] = limit
-        for entry in elementCursor:
+        for entry, datafileValues in self._prefetchDatafiles(elementCursor, numpyArrays):
             element = entry['element']
             element.setdefault('id', entry['_id'])
             if centroids:
@@ -294,29 +416,8 @@ class Annotationelement(Model):
                 ]
                 details += 1
             else:
-                if entry.get('datafile'):
-                    datafile = entry['datafile']
-                    data = io.BytesIO()
-                    chunksize = 1024 ** 2
-                    with File().open(File().load(datafile['fileId'], force=True)) as fptr:
-                        while True:
-                            chunk = fptr.read(chunksize)
-                            if not len(chunk):
-                                break
-                            data.write(chunk)
-                    data.seek(0)
-                    element[datafile['key']] = pickle.load(data)
-                    if 'userFileId' in datafile:
-                        data = io.BytesIO()
-                        chunksize = 1024 ** 2
-                        with File().open(File().load(datafile['userFileId'], force=True)) as fptr:
-                            while True:
-                                chunk = fptr.read(chunksize)
-                                if not len(chunk):
-                                    break
-                                data.write(chunk)
-                        data.seek(0)
-                        element['user'] = pickle.load(data)
+                if datafileValues:
+                    element.update(datafileValues)
                 if region.get('bbox') and 'bbox' in entry:
                     element['_bbox'] = entry['bbox']
                     if 'bbox' not in info:
@@ -336,6 +437,76 @@ class Annotationelement(Model):
         info['returned'] = count
         info['details'] = details
 
+    def _readDatafile(self, fileId):
+        """
+        Read the contents of a file that stores part of an element.
+
+        :param fileId: the id of the file.
+        :returns: a BytesIO object with the file contents.
+        """
+        data = io.BytesIO()
+        chunksize = 1024 ** 2
+        with File().open(File().load(fileId, force=True)) as fptr:
+            while True:
+                chunk = fptr.read(chunksize)
+                if not len(chunk):
+                    break
+                data.write(chunk)
+        data.seek(0)
+        return data
+
+    def _loadDatafile(self, datafile, numpyArrays=False):
+        """
+        Load the parts of an element that are stored in files.
+
+        :param datafile: the datafile record of the element document.
+        :param numpyArrays: if True, return typed arrays as numpy arrays.
+            Otherwise, they are converted to lists.
+        :returns: a dictionary of element keys and values.
+        """
+        result = {}
+        data = self._readDatafile(datafile['fileId'])
+        if datafile.get('format') == 'npy':
+            value = np.load(data, allow_pickle=False)
+            result[datafile['key']] = value if numpyArrays else value.tolist()
+        else:
+            result[datafile['key']] = pickle.load(data)
+        if 'userFileId' in datafile:
+            result['user'] = pickle.load(self._readDatafile(datafile['userFileId']))
+        return result
+
+    def _prefetchDatafiles(self, cursor, numpyArrays=False):
+        """
+        Iterate through element documents, loading the parts of elements that
+        are stored in files in parallel.
+
+        :param cursor: an iterator of element documents.
+        :param numpyArrays: passed to _loadDatafile.
+        :returns: an iterator of tuples of the element document and either
+            None or a dictionary of element values that were stored in files.
+        """
+        pending = collections.deque()
+        pool = None
+        try:
+            for entry in cursor:
+                future = None
+                if entry.get('datafile'):
+                    if pool is None:
+                        pool = concurrent.futures.ThreadPoolExecutor(
+                            max_workers=large_image.config.cpu_count())
+                    future = pool.submit(self._loadDatafile, entry['datafile'], numpyArrays)
+                pending.append((entry, future))
+                while pending and (pending[0][1] is None or pending[0][1].done() or
+                                   len(pending) > MAX_DATAFILE_PREFETCH):
+                    entry, future = pending.popleft()
+                    yield entry, future.result() if future else None
+            while pending:
+                entry, future = pending.popleft()
+                yield entry, future.result() if future else None
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False)
+
     def removeWithQuery(self, query):
         """
         Remove all documents matching a given query from the collection.
@@ -385,6 +556,37 @@ class Annotationelement(Model):
             query['_version'] = {'$lte': oldversion}
         self.removeWithQuery(query)
 
+    def removeVersionElements(self, annotation, keptAnnotations=None):
+        """
+        Remove the elements of a version of an annotation that are not used by
+        other versions of it.
+
+        :param annotation: the annotation record whose elements are removed.
+        :param keptAnnotations: a list of other records of the same annotation
+            whose elements must be kept.
+        """
+        query = self.versionQuery(annotation)
+        conditions = []
+        for kept in keptAnnotations or []:
+            keptQuery = self.versionQuery(kept)
+            keptQuery.pop('annotationId')
+            conditions.append(keptQuery)
+        if conditions:
+            query = {'$and': [query, {'$nor': conditions}]}
+        self.removeWithQuery(query)
+
+    def removeEndedElements(self, annotation):
+        """
+        Remove elements that were replaced or removed by a patch at or before
+        the version of the annotation.
+
+        :param annotation: the annotation to remove elements from.
+        """
+        self.removeWithQuery({
+            'annotationId': annotation['_id'],
+            '_versionEnd': {'$lte': annotation['_version']},
+        })
+
     def _overlayBounds(self, overlayElement):
         """
         Compute bounding box information in the X-Y plane for an
@@ -515,6 +717,315 @@ class Annotationelement(Model):
         # simplify to points
         return bbox
 
+    def _storeBoundingBoxes(self, bboxes, indices, low, high, details):
+        """
+        Store bounding boxes computed for a group of elements.  See
+        _boundingBoxes.
+
+        :param bboxes: a list of bounding boxes that is updated.
+        :param indices: the indices of the elements in the group.
+        :param low: an Nx3 numpy array of the low x, y, and z values.
+        :param high: an Nx3 numpy array of the high x, y, and z values.
+        :param details: a list of the details value of each element.
+        :returns: an Nx4 array of lowx, lowy, highx, highy.
+        """
+        size = ((high[:, 1] - low[:, 1]) ** 2 + (high[:, 0] - low[:, 0]) ** 2) ** 0.5
+        # Converting columns produces fewer python objects than converting
+        # rows
+        columns = [low[:, axis].tolist() for axis in range(3)] + [
+            high[:, axis].tolist() for axis in range(3)] + [details, size.tolist()]
+        for idx, lowx, lowy, lowz, highx, highy, highz, detail, bsize in zip(indices, *columns):
+            bboxes[idx] = {
+                'lowx': lowx, 'lowy': lowy, 'lowz': lowz,
+                'highx': highx, 'highy': highy, 'highz': highz,
+                'details': detail,
+                'size': bsize,
+            }
+        return np.stack((low[:, 0], low[:, 1], high[:, 0], high[:, 1]), axis=1)
+
+    def _pointBoundingBoxes(self, elements, indices, bboxes):
+        """
+        Compute bounding boxes for elements with points arrays that have the
+        same number of values per point.  See _boundingBoxes.
+
+        :param elements: a list of elements.
+        :param indices: the indices of the elements to compute.
+        :param bboxes: a list of bounding boxes that is updated.
+        :returns: an Nx4 array of lowx, lowy, highx, highy or None if the
+            bounding boxes were computed individually.
+        """
+        counts = [len(elements[idx]['points']) for idx in indices]
+        points = list(itertools.chain.from_iterable(elements[idx]['points'] for idx in indices))
+        width = len(points[0])
+        try:
+            if set(map(len, points)) != {width}:
+                raise ValueError
+            # This is faster than converting the nested lists via np.array
+            pts = np.fromiter(
+                itertools.chain.from_iterable(points), dtype=float,
+                count=len(points) * width).reshape(-1, width)[:, :3]
+        except (ValueError, TypeError):
+            for idx in indices:
+                bboxes[idx] = self._boundingBox(elements[idx])
+            return None
+        offsets = np.cumsum([0] + counts[:-1])
+        return self._storeBoundingBoxes(
+            bboxes, indices, np.minimum.reduceat(pts, offsets, axis=0),
+            np.maximum.reduceat(pts, offsets, axis=0), counts)
+
+    def _centerBoundingBoxes(self, elements, indices, bboxes, kind):
+        """
+        Compute bounding boxes for rectangles and ellipses, circles, or
+        points.  See _boundingBoxes.
+
+        :param elements: a list of elements.
+        :param indices: the indices of the elements to compute.
+        :param bboxes: a list of bounding boxes that is updated.
+        :param kind: one of 'width', 'radius', or 'point'.
+        :returns: an Nx4 array of lowx, lowy, highx, highy or None if the
+            bounding boxes were computed individually.
+        """
+        group = [elements[idx] for idx in indices]
+        count = len(group)
+        try:
+            center = np.array([element['center'] for element in group], dtype=float)
+            if center.ndim != 2 or center.shape[1] != 3:
+                raise ValueError
+            if kind == 'width':
+                w = np.fromiter((element['width'] for element in group), float, count) * 0.5
+                h = np.fromiter((element['height'] for element in group), float, count) * 0.5
+                rotation = np.fromiter(
+                    (element.get('rotation') or 0 for element in group), float, count)
+                absin = np.abs(np.sin(rotation))
+                abcos = np.abs(np.cos(rotation))
+                w, h = (np.maximum(abcos * w, absin * h),
+                        np.maximum(absin * w, abcos * h))
+            elif kind == 'radius':
+                w = h = np.fromiter((element['radius'] for element in group), float, count)
+            else:
+                # Points have a small non-zero extent
+                w = h = np.full(count, 0.5)
+        except (ValueError, TypeError, KeyError):
+            for idx in indices:
+                bboxes[idx] = self._boundingBox(elements[idx])
+            return None
+        half = np.stack((w, h, np.zeros(count)), axis=1)
+        return self._storeBoundingBoxes(
+            bboxes, indices, center - half, center + half,
+            [1 if kind == 'point' else 4] * count)
+
+    def _boundingBoxes(self, elements):
+        """
+        Compute bounding box information for a list of annotation elements.
+        This gives the same results as calling _boundingBox and
+        _boundingBoxCell for each element, but elements with points and
+        rectangles, ellipses, circles, and points are computed with numpy a
+        group at a time.
+
+        :param elements: a list of elements.
+        :returns: a list of bounding box dictionaries, each including the
+            spatial index cell.
+        """
+        bboxes = [None] * len(elements)
+        groups = {}
+        for idx, element in enumerate(elements):
+            if 'points' in element:
+                if len(element['points']) and len(element['points'][0]) >= 3:
+                    groups.setdefault(('points', len(element['points'][0])), []).append(idx)
+                    continue
+            elif 'center' in element and element.get('type') not in {
+                    'griddata', 'image', 'pixelmap'}:
+                kind = 'width' if 'width' in element else (
+                    'radius' if 'radius' in element else 'point')
+                groups.setdefault((kind, ), []).append(idx)
+                continue
+            bboxes[idx] = self._boundingBox(element)
+        indices = []
+        bounds = []
+        for key, group in groups.items():
+            if key[0] != 'points':
+                parts = [(group, self._centerBoundingBoxes(elements, group, bboxes, key[0]))]
+            else:
+                # Limit how many points are converted at once
+                parts = []
+                start = total = 0
+                for pos, idx in enumerate(group):
+                    total += len(elements[idx]['points'])
+                    if total >= BBOX_BATCH_POINTS or pos + 1 == len(group):
+                        part = group[start:pos + 1]
+                        parts.append((part, self._pointBoundingBoxes(elements, part, bboxes)))
+                        start = pos + 1
+                        total = 0
+            for part, partBounds in parts:
+                if partBounds is not None:
+                    indices.extend(part)
+                    bounds.append(partBounds)
+        grouped = set(indices)
+        others = [idx for idx in range(len(bboxes)) if idx not in grouped]
+        if others:
+            indices.extend(others)
+            bounds.append(np.array([(
+                bboxes[idx]['lowx'], bboxes[idx]['lowy'],
+                bboxes[idx]['highx'], bboxes[idx]['highy']) for idx in others], dtype=float))
+        if indices:
+            cells = self._boundingBoxCells(np.concatenate(bounds))
+            for idx, cell in zip(indices, cells):
+                bboxes[idx]['cell'] = cell
+        return bboxes
+
+    def _boundingBoxCells(self, bounds):
+        """
+        Determine the spatial index cells of a set of bounding boxes.  This
+        gives the same results as _boundingBoxCell.
+
+        :param bounds: an Nx4 numpy array of lowx, lowy, highx, highy.
+        :returns: a list of integer cell keys.  Bounding boxes that are not
+            finite are in the CELL_OVERFLOW cell.
+        """
+        finite = np.isfinite(bounds).all(axis=1)
+        bounds = np.where(finite[:, np.newaxis], bounds, 0)
+        with np.errstate(over='ignore', invalid='ignore'):
+            maxdim = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        finite &= np.isfinite(maxdim)
+        maxdim[~finite] = 0
+        level = np.zeros(len(bounds), dtype=np.int64)
+        larger = maxdim > CELL_SIZE
+        while larger.any():
+            level[larger] += 1
+            larger = (maxdim > CELL_SIZE * 2.0 ** level) & (level < CELL_MAX_LEVEL)
+        cellSize = CELL_SIZE * 2.0 ** level
+        offset = 1 << (CELL_BITS - 1)
+        tx = np.clip(np.floor((bounds[:, 0] + bounds[:, 2]) / 2 / cellSize),
+                     -offset, offset - 1).astype(np.int64) + offset
+        ty = np.clip(np.floor((bounds[:, 1] + bounds[:, 3]) / 2 / cellSize),
+                     -offset, offset - 1).astype(np.int64) + offset
+        cells = ((level << (CELL_BITS * 2)) | (ty << CELL_BITS) | tx).tolist()
+        if not finite.all():
+            cells = [cell if ok else CELL_OVERFLOW for cell, ok in zip(cells, finite.tolist())]
+        return cells
+
+    def _cellKey(self, level, tx, ty):
+        """
+        Pack a spatial index cell into an integer key.  Cell coordinates are
+        clamped to the range that can be represented.
+
+        :param level: the cell level.  Cells at this level are
+            CELL_SIZE * 2 ** level pixels on a side.
+        :param tx: the cell column.
+        :param ty: the cell row.
+        :returns: an integer key.
+        """
+        offset = 1 << (CELL_BITS - 1)
+        tx = min(max(int(tx), -offset), offset - 1) + offset
+        ty = min(max(int(ty), -offset), offset - 1) + offset
+        return (level << (CELL_BITS * 2)) | (ty << CELL_BITS) | tx
+
+    def _boundingBoxCell(self, bbox):
+        """
+        Determine the spatial index cell of an element.
+
+        :param bbox: the bounding box dictionary of the element.
+        :returns: an integer cell key.  Bounding boxes that are not finite are
+            in the CELL_OVERFLOW cell.
+        """
+        bounds = [bbox['lowx'], bbox['lowy'], bbox['highx'], bbox['highy']]
+        if not all(math.isfinite(value) for value in bounds):
+            return CELL_OVERFLOW
+        maxdim = max(bbox['highx'] - bbox['lowx'], bbox['highy'] - bbox['lowy'])
+        if not math.isfinite(maxdim):
+            return CELL_OVERFLOW
+        level = 0
+        while level < CELL_MAX_LEVEL and CELL_SIZE * 2 ** level < maxdim:
+            level += 1
+        cellSize = CELL_SIZE * 2 ** level
+        return self._cellKey(
+            level,
+            math.floor((bbox['lowx'] + bbox['highx']) / 2 / cellSize),
+            math.floor((bbox['lowy'] + bbox['highy']) / 2 / cellSize))
+
+    def _cellInfo(self, annotation):
+        """
+        Check if the elements of an annotation can be queried via the spatial
+        index cells.  Elements saved before the spatial index existed do not
+        have cells.
+
+        :param annotation: the annotation record.
+        :returns: a tuple of the maximum cell level used by the annotation's
+            elements with finite bounding boxes and a boolean that is True if
+            any elements are in the overflow cell, or None if the spatial index
+            cells cannot be used.
+        """
+        annotationId = annotation.get('_annotationId', annotation['_id'])
+        key = (str(annotationId), annotation['_version'],
+               annotation.get('_versionBase', annotation['_version']))
+        with _cellInfoLock:
+            if key in _cellInfoCache:
+                return _cellInfoCache[key]
+        query = self.versionQuery(annotation)
+        query['bbox.cell'] = None
+        info = None
+        if not self.collection.find_one(query, {'_id': True}):
+            last = self.collection.find_one(
+                {'annotationId': annotationId, 'bbox.cell': {'$lt': CELL_OVERFLOW}},
+                {'bbox.cell': True}, sort=[('bbox.cell', SortDir.DESCENDING)])
+            overflow = self.collection.find_one(
+                {'annotationId': annotationId, 'bbox.cell': CELL_OVERFLOW}, {'_id': True})
+            info = (last['bbox']['cell'] >> (CELL_BITS * 2) if last else 0,
+                    overflow is not None)
+        with _cellInfoLock:
+            _cellInfoCache[key] = info
+        return info
+
+    def _cellQuery(self, annotation, region):
+        """
+        Convert the spatial portion of a region to a list of ranges of spatial
+        index cells.  At each level, an element's bounding box can extend at
+        most half a cell beyond the cell that contains its center, so the
+        region is expanded by that much.  Levels whose elements are all smaller
+        than the minimum size of the region are skipped, except for level 0
+        when points are included regardless of size.  Elements in the overflow
+        cell are always included.
+
+        :param annotation: the annotation record.
+        :param region: a dictionary as passed to yieldElements.
+        :returns: a list of query clauses to combine with $or or None if the
+            query cannot be or does not need to be restricted by cell.
+        """
+        bounds = {}
+        for key in ('left', 'right', 'top', 'bottom'):
+            if key in region and not (key in {'left', 'top'} and float(region[key]) <= 0):
+                bounds[key] = float(region[key])
+        if not bounds:
+            return None
+        info = self._cellInfo(annotation)
+        if info is None:
+            return None
+        maxLevel, overflow = info
+        minimumSize = float(region.get('minimumSize') or 0)
+        limit = 1 << (CELL_BITS - 1)
+        clauses = []
+        if overflow:
+            clauses.append({'bbox.cell': CELL_OVERFLOW})
+        for level in range(maxLevel + 1):
+            cellSize = CELL_SIZE * 2 ** level
+            if minimumSize > cellSize * 2 ** 0.5 and (level or not region.get('includePoints')):
+                continue
+            txmin, tymin = (
+                math.floor((bounds[key] - cellSize / 2) / cellSize) if key in bounds else -limit
+                for key in ('left', 'top'))
+            txmax, tymax = (
+                math.floor((bounds[key] + cellSize / 2) / cellSize) if key in bounds else limit
+                for key in ('right', 'bottom'))
+            if tymax - tymin >= CELL_MAX_ROWS:
+                clauses.append({'bbox.cell': {
+                    '$gte': self._cellKey(level, txmin, tymin),
+                    '$lte': self._cellKey(level, txmax, tymax)}})
+                continue
+            clauses.extend({'bbox.cell': {
+                '$gte': self._cellKey(level, txmin, ty),
+                '$lte': self._cellKey(level, txmax, ty)}} for ty in range(tymin, tymax + 1))
+        return clauses or None
+
     def _entryIsLarge(self, entry):
         """
         Return True is an entry is alrge enough it might not fit in a mongo
@@ -531,10 +1042,36 @@ class Annotationelement(Model):
             return True
         return False
 
+    def _typedArray(self, value):
+        """
+        Convert a points or values array to a typed numpy array if that can
+        be done without losing information.
+
+        :param value: a list of numbers or of lists of numbers.
+        :returns: a numpy array or None if the value cannot be represented as
+            a numeric array.
+        """
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            return None
+        if array.dtype.kind not in 'biuf' or not array.size:
+            return None
+        if array.dtype.kind == 'f':
+            with np.errstate(over='ignore', invalid='ignore'):
+                if np.array_equal(array.astype(np.float32), array):
+                    array = array.astype(np.float32)
+        elif array.dtype.kind != 'b' and (
+                array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max):
+            array = array.astype(np.int32)
+        return array
+
     def saveElementAsFile(self, annotation, entries):
         """
         If an element has a large points or values array, save that array to an
-        attached file.
+        attached file.  Numeric arrays are stored as numpy .npy files with the
+        smallest data type that exactly represents the values; other arrays
+        are pickled.
 
         :param annotation: the parent annotation.
         :param entries: the database entries document.  Modified.
@@ -546,13 +1083,22 @@ class Annotationelement(Model):
             element = entry['element'].copy()
             entries[idx]['element'] = element
             key = 'points' if 'points' in element else 'values'
-            # Use the highest protocol support by all python versions we
-            # support
-            data = pickle.dumps(element.pop(key), protocol=4)
+            array = self._typedArray(element[key])
+            if array is not None:
+                data = io.BytesIO()
+                np.save(data, array, allow_pickle=False)
+                data = data.getvalue()
+                mimeType = 'application/x-npy'
+                element.pop(key)
+            else:
+                # Use the highest protocol support by all python versions we
+                # support
+                data = pickle.dumps(element.pop(key), protocol=4)
+                mimeType = 'application/json'
             elementFile = Upload().uploadFromFile(
                 io.BytesIO(data), size=len(data), name='_annotationElementData',
                 parentType='item', parent=item, user=None,
-                mimeType='application/json', attachParent=True)
+                mimeType=mimeType, attachParent=True)
             userdata = None
             if 'user' in element:
                 userdata = pickle.dumps(element.pop('user'), protocol=4)
@@ -564,6 +1110,8 @@ class Annotationelement(Model):
                 'key': key,
                 'fileId': elementFile['_id'],
             }
+            if array is not None:
+                entry['datafile']['format'] = 'npy'
             if userdata:
                 entry['datafile']['userFileId'] = userFile['_id']
             logger.debug('Storing element as file (%r)', entry)
@@ -575,13 +1123,14 @@ class Annotationelement(Model):
         """
         lastTime = time.time()
         chunkStartTime = time.time()
+        chunkElements = elements[chunk:chunk + chunkSize]
         entries = [{
             'annotationId': annotation['_id'],
             '_version': annotation['_version'],
             'created': now,
-            'bbox': self._boundingBox(element),
+            'bbox': bbox,
             'element': element,
-        } for element in elements[chunk:chunk + chunkSize]]
+        } for element, bbox in zip(chunkElements, self._boundingBoxes(chunkElements))]
         prepTime = time.time() - chunkStartTime
         if (len(entries) <= MAX_ELEMENT_CHECK and any(
                 self._entryIsLarge(entry) for entry in entries[:MAX_ELEMENT_CHECK])):
@@ -603,11 +1152,16 @@ class Annotationelement(Model):
         database of them.
 
         :param annotation: the annotation to save elements for.  Modified.
+            The elements may be an iterator rather than a list, in which case
+            they are consumed in bounded chunks.
+        :returns: the number of elements stored.
         """
         startTime = time.time()
         elements = annotation['annotation'].get('elements', [])
+        if not isinstance(elements, (list, tuple)):
+            return self._updateElementStream(annotation, elements, startTime)
         if not len(elements):
-            return
+            return 0
         now = datetime.datetime.now(datetime.timezone.utc)
         threads = large_image.config.cpu_count()
         chunkSize = int(max(100000 // threads, 10000))
@@ -617,12 +1171,52 @@ class Annotationelement(Model):
         if time.time() - startTime > 10:
             logger.info('inserted %d elements in %4.2fs' % (
                 len(elements), time.time() - startTime))
+        return len(elements)
+
+    def _updateElementStream(self, annotation, elements, startTime):
+        """
+        Store elements from an iterator.  Chunks of elements are read from the
+        iterator and inserted on a thread pool, with a limited number of
+        chunks in memory at once.  See updateElements.
+
+        :param annotation: the annotation to save elements for.
+        :param elements: an iterator of elements.
+        :param startTime: the time the update started.
+        :returns: the number of elements stored.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        threads = large_image.config.cpu_count()
+        chunkSize = int(max(100000 // threads, 10000))
+        count = 0
+        pending = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                while True:
+                    chunk = list(itertools.islice(elements, chunkSize))
+                    if not len(chunk):
+                        break
+                    count += len(chunk)
+                    if len(pending) >= threads * 2:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(pool.submit(
+                        self.updateElementChunk, chunk, 0, len(chunk), annotation, now))
+            except BaseException:
+                # Don't store queued chunks if reading elements failed
+                for future in pending:
+                    future.cancel()
+                raise
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        if time.time() - startTime > 10:
+            logger.info('inserted %d elements in %4.2fs' % (
+                count, time.time() - startTime))
+        return count
 
     def getElementGroupSet(self, annotation):
-        query = {
-            'annotationId': annotation.get('_annotationId', annotation['_id']),
-            '_version': annotation['_version'],
-        }
+        query = self.versionQuery(annotation)
         groups = sorted([
             group for group in self.collection.distinct('element.group', filter=query)
             if isinstance(group, str)
@@ -21,12 +21,13 @@ import time
 import cherrypy
 import orjson
 from bson.objectid import ObjectId
+from girder_large_image.models.image_item import ImageItem
 from girder_large_image.rest.tiles import _handleETag
 
 from girder import logger
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute, describeRoute
-from girder.api.rest import Resource, filtermodel, loadmodel, setResponseHeader
+from girder.api.rest import Resource, filtermodel, loadmodel, setRawResponse, setResponseHeader
 from girder.constants import AccessType, SortDir, TokenScope
 from girder.exceptions import AccessException, RestException, ValidationException
 from girder.models.folder import Folder
@@ -34,10 +35,13 @@ from girder.models.item import Item
 from girder.models.user import User
 from girder.utility import JsonEncoder
 from girder.utility.progress import setResponseTimeLimit
+from large_image.constants import TileOutputMimeTypes
+from large_image.exceptions import TileGeneralError
 
 from .. import constants
 from ..models.annotation import Annotation, AnnotationSchema
 from ..models.annotationelement import Annotationelement
+from ..utils import tiles as annotationTiles
 
 
 class AnnotationResource(Resource):
@@ -52,7 +56,11 @@ class AnnotationResource(Resource):
         self.route('GET', ('images',), self.findAnnotatedImages)
         self.route('GET', (':id',), self.getAnnotation)
         self.route('GET', (':id', ':format'), self.getAnnotationWithFormat)
+        self.route('GET', (':id', 'tiles', ':z', ':x', ':y'), self.getAnnotationVectorTile)
+        self.route('GET', (':id', 'tiles', 'raster', ':z', ':x', ':y'),
+                   self.getAnnotationRasterTile)
         self.route('PUT', (':id',), self.updateAnnotation)
+        self.route('PATCH', (':id',), self.patchAnnotation)
         self.route('DELETE', (':id',), self.deleteAnnotation)
         self.route('GET', (':id', 'access'), self.getAnnotationAccess)
         self.route('PUT', (':id', 'access'), self.updateAnnotationAccess)
@@ -200,12 +208,121 @@ class AnnotationResource(Resource):
             raise RestException(msg, 404)
 
         def generateResult():
-            for chunk in Annotation().geojson(annotation):
-                yield chunk.encode()
+            yield from Annotation().geojson(annotation, binary=True)
 
         setResponseHeader('Content-Type', 'application/json')
         return generateResult
 
+    @autoDescribeRoute(
+        Description('Get the elements of an annotation within a tile as a '
+                    'binary vector tile.')
+        .notes('Tiles use the tiling scheme of the annotated image.  Elements '
+               'are clipped to the tile, simplified based on the tile level, '
+               'and their coordinates are quantized to 16-bit integers.  The '
+               'response is a 4-byte little-endian length, a JSON header of '
+               'that length with the tile origin and unit, the tile extent, '
+               'and a table of element properties, followed by one record per '
+               'element: a 12-byte element id, a uint32 property index, a '
+               'uint8 geometry type (1 point, 2 line, 3 polygon), a uint16 '
+               'number of parts, and, for each part, a uint32 number of '
+               'points followed by int16 x, y pairs.')
+        .param('id', 'The ID of the annotation.', paramType='path')
+        .param('z', 'The layer number of the tile (0 is the most zoomed-out '
+               'layer).', paramType='path', dataType='int')
+        .param('x', 'The X coordinate of the tile (0 is the left side).',
+               paramType='path', dataType='int')
+        .param('y', 'The Y coordinate of the tile (0 is the top).',
+               paramType='path', dataType='int')
+        .param('minimumSize', 'Only elements larger than or equal to this '
+               'size in base image pixels are included.  By default, elements '
+               'smaller than one tile pixel are omitted.  Points are always '
+               'included.', required=False,
+               dataType='float')
+        .param('tolerance', 'The maximum distance in tile pixels that a '
+               'simplified outline may differ from the original.',
+               required=False, dataType='float', default=0.5)
+        .produces(['application/octet-stream'])
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the annotation.', 403),
+    )
+    @access.public(cookie=True, scope=TokenScope.DATA_READ)
+    @loadmodel(model='annotation', plugin='large_image', getElements=False, level=AccessType.READ)
+    def getAnnotationVectorTile(self, annotation, z, x, y, minimumSize, tolerance):
+        _handleETag('getAnnotationVectorTile', annotation, z, x, y, minimumSize,
+                    tolerance, max_age=86400 * 30)
+        item = Item().load(annotation['itemId'], force=True)
+        try:
+            metadata = ImageItem().getMetadata(item)
+        except TileGeneralError as e:
+            raise RestException(e.args[0], code=400)
+        try:
+            tileData = annotationTiles.vectorTile(
+                annotation, metadata, z, x, y, minimumSize=minimumSize, tolerance=tolerance)
+        except ValueError as e:
+            raise RestException(e.args[0], code=404)
+        setResponseHeader('Content-Type', 'application/octet-stream')
+        setRawResponse()
+        return tileData
+
+    @autoDescribeRoute(
+        Description('Render the elements of an annotation within a tile as an '
+                    'image.')
+        .notes('Tiles use the tiling scheme of the annotated image.  Shapes '
+               'are drawn with their fill and line colors, griddata elements '
+               'with their color ranges, and pixelmap elements with their '
+               'category colors.  Heatmap elements are not rendered.')
+        .param('id', 'The ID of the annotation.', paramType='path')
+        .param('z', 'The layer number of the tile (0 is the most zoomed-out '
+               'layer).', paramType='path', dataType='int')
+        .param('x', 'The X coordinate of the tile (0 is the left side).',
+               paramType='path', dataType='int')
+        .param('y', 'The Y coordinate of the tile (0 is the top).',
+               paramType='path', dataType='int')
+        .param('minimumSize', 'Only elements larger than or equal to this '
+               'size in base image pixels are drawn.  By default, elements '
+               'smaller than one tile pixel are omitted.  Points are always '
+               'drawn.', required=False,
+               dataType='float')
+        .param('encoding', 'Tile output encoding.  Use an encoding that '
+               'supports transparency, such as PNG, for overlays.',
+               required=False, enum=[key for key in TileOutputMimeTypes if key != 'TILED'],
+               default='PNG')
+        .param('jpegQuality', 'Quality used for generating JPEG images',
+               required=False, dataType='int', default=95)
+        .param('jpegSubsampling', 'Chroma subsampling used for generating '
+               'JPEG images.  0, 1, and 2 are full, half, and quarter '
+               'resolution chroma respectively.', required=False,
+               enum=[0, 1, 2], dataType='int', default=0)
+        .param('tiffCompression', 'Compression method when storing a TIFF '
+               'image', required=False, default='raw')
+        .produces(['image/png', 'image/jpeg', 'image/tiff', 'image/webp'])
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the annotation.', 403),
+    )
+    @access.public(cookie=True, scope=TokenScope.DATA_READ)
+    @loadmodel(model='annotation', plugin='large_image', getElements=False, level=AccessType.READ)
+    def getAnnotationRasterTile(self, annotation, z, x, y, minimumSize, encoding,
+                                jpegQuality, jpegSubsampling, tiffCompression):
+        user = self.getCurrentUser()
+        _handleETag('getAnnotationRasterTile', annotation, z, x, y, minimumSize, encoding,
+                    jpegQuality, jpegSubsampling, tiffCompression,
+                    str(user['_id']) if user else None, max_age=86400 * 30)
+        item = Item().load(annotation['itemId'], force=True)
+        try:
+            metadata = ImageItem().getMetadata(item)
+        except TileGeneralError as e:
+            raise RestException(e.args[0], code=400)
+        try:
+            tileData, tileMime = annotationTiles.rasterTile(
+                annotation, metadata, z, x, y, encoding=encoding, minimumSize=minimumSize,
+                user=user, jpegQuality=jpegQuality, jpegSubsampling=jpegSubsampling,
+                tiffCompression=tiffCompression)
+        except ValueError as e:
+            raise RestException(e.args[0], code=404)
+        setResponseHeader('Content-Type', tileMime)
+        setRawResponse()
+        return tileData
+
     def _getAnnotation(self, annotation, params):
         """
         Get a generator function that will yield the json of an annotation.
@@ -392,6 +509,46 @@ class AnnotationResource(Resource):
             del annotation['annotation']['elements']
         return annotation
 
+    @describeRoute(
+        Description('Add, modify, and remove elements of an annotation.')
+        .notes('Only the changed elements are written, which is much faster '
+               'than updating the whole annotation when a few elements of a '
+               'large annotation change.  The body is a JSON object with any '
+               'of "add" (a list of new elements), "modify" (a list of '
+               'elements, each with the id of an existing element that it '
+               'replaces), and "remove" (a list of element ids).  The '
+               'annotation does not include its elements in the response.')
+        .param('id', 'The ID of the annotation.', paramType='path')
+        .param('body', 'A JSON object with add, modify, and remove lists.',
+               paramType='body')
+        .errorResponse('Write access was denied for the item.', 403)
+        .errorResponse('Invalid JSON passed in request body.')
+        .errorResponse("Validation Error: JSON doesn't follow schema."),
+    )
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @loadmodel(model='annotation', plugin='large_image', getElements=False, level=AccessType.WRITE)
+    @filtermodel(model='annotation', plugin='large_image')
+    def patchAnnotation(self, annotation, params):
+        setResponseTimeLimit(86400)
+        user = self.getCurrentUser()
+        item = Item().load(annotation.get('itemId'), force=True)
+        if item is not None:
+            Item().hasAccessFlags(
+                item, user, constants.ANNOTATION_ACCESS_FLAG) or Item().requireAccess(
+                    item, user=user, level=AccessType.WRITE)
+        patch = self.getBodyJson()
+        if not isinstance(patch, dict) or any(
+                not isinstance(patch.get(key, []), list) for key in ('add', 'modify', 'remove')):
+            msg = 'The body must be a JSON object with add, modify, and remove lists.'
+            raise RestException(msg)
+        try:
+            return Annotation().patchAnnotation(
+                annotation, add=patch.get('add'), modify=patch.get('modify'),
+                remove=patch.get('remove'), updateUser=user)
+        except ValidationException as exc:
+            raise RestException(
+                "Validation Error: JSON doesn't follow schema (%r)." % (exc.args, ))
+
     @describeRoute(
         Description('Delete an annotation.')
         .param('id', 'The ID of the annotation.', paramType='path')
@@ -815,12 +972,15 @@ class AnnotationResource(Resource):
                dataType='int', default=30)
         .param('versions', 'Keep at least this many history entries for each '
                'annotation.', required=False, dataType='int', default=10)
+        .param('resume', 'Only check annotations with IDs after this one.  '
+               'Use this to continue an interrupted cleanup from the last '
+               'annotation ID that was logged.', required=False)
         .errorResponse(),
     )
     @access.admin(scope=TokenScope.DATA_READ)
-    def getOldAnnotations(self, age, versions):
+    def getOldAnnotations(self, age, versions, resume):
         setResponseTimeLimit(86400)
-        return Annotation().removeOldAnnotations(False, age, versions)
+        return Annotation().removeOldAnnotations(False, age, versions, resume)
 
     @autoDescribeRoute(
         Description('Delete old annotations.')
@@ -828,12 +988,15 @@ class AnnotationResource(Resource):
                dataType='int', default=30)
         .param('versions', 'Keep at least this many history entries for each '
                'annotation.', required=False, dataType='int', default=10)
+        .param('resume', 'Only check annotations with IDs after this one.  '
+               'Use this to continue an interrupted cleanup from the last '
+               'annotation ID that was logged.', required=False)
         .errorResponse(),
     )
     @access.admin(scope=TokenScope.DATA_WRITE)
-    def deleteOldAnnotations(self, age, versions):
+    def deleteOldAnnotations(self, age, versions, resume):
         setResponseTimeLimit(86400)
-        return Annotation().removeOldAnnotations(True, age, versions)
+        return Annotation().removeOldAnnotations(True, age, versions, resume)
 
     @access.public(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -1,5 +1,19 @@
+import codecs
+import collections
+import concurrent.futures
+import itertools
 import json
 import math
+import re
+
+import numpy as np
+import orjson
+
+import large_image.config
+
+# The number of elements converted to geojson at a time by
+# AnnotationGeoJSON.chunks
+GeoJSONBatchSize = 2000
 
 
 class AnnotationGeoJSON:
@@ -69,6 +83,84 @@ class AnnotationGeoJSON:
                 return ']}'
             raise
 
+    def _featureBatch(self, elements, header):
+        """
+        Convert a batch of elements to geojson features and serialize them.
+
+        :param elements: a list of elements.
+        :param header: if True, add the annotation properties to the first
+            feature.
+        :returns: a list of features and the serialized features as bytes
+            without enclosing brackets.
+        """
+        features = []
+        for element in elements:
+            result = self.elementToGeoJSON(element)
+            if result is None:
+                if self.mustConvert:
+                    msg = f'Element of type {element["type"]} cannot be represented as geojson'
+                    raise Exception(msg)
+                continue
+            features.append(result)
+        if header and features:
+            features[0]['properties']['annotation'] = self.first
+        return features, orjson.dumps(features, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1]
+
+    def chunks(self):
+        """
+        Yield the annotation as a geojson string in large chunks of bytes.
+        Elements are read in batches and each batch is converted and
+        serialized on a thread pool.  This is much faster than iterating
+        through the features one at a time.
+
+        :yields: bytes of geojson.
+        """
+        from ..models.annotationelement import Annotationelement
+
+        elements = Annotationelement().yieldElements(self.annotation, numpyArrays=True)
+        threads = large_image.config.cpu_count()
+        pending = collections.deque()
+        header = True
+        idx = 0
+        yield b'{"type":"FeatureCollection","features":['
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                while True:
+                    batch = list(itertools.islice(elements, GeoJSONBatchSize))
+                    if batch:
+                        pending.append(pool.submit(self._featureBatch, batch, not idx))
+                        idx += 1
+                    while pending and (not batch or pending[0].done() or
+                                       len(pending) > threads):
+                        features, data = pending.popleft().result()
+                        if not features:
+                            continue
+                        if header and 'annotation' not in features[0]['properties']:
+                            # The first batch had no features that could be
+                            # converted.
+                            features[0]['properties']['annotation'] = self.first
+                            data = orjson.dumps(
+                                features, option=orjson.OPT_SERIALIZE_NUMPY)[1:-1]
+                        yield (b'' if header else b',') + data
+                        header = False
+                    if not batch:
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+        yield b']}'
+
+    def _closedRing(self, points):
+        """
+        Return a copy of a list or array of points with the first point
+        repeated at the end.
+        """
+        if isinstance(points, np.ndarray):
+            return np.concatenate((points, points[:1]))
+        points = points[:]
+        points.append(points[0])
+        return points
+
     def rotate(self, r, cx, cy, x, y, z):
         if not r:
             return [x + cx, y + cy, z]
@@ -100,13 +192,10 @@ class AnnotationGeoJSON:
     def polylineType(self, element, geom, prop):
         if element['closed']:
             geom['type'] = 'Polygon'
-            geom['coordinates'] = [element['points'][:]]
-            geom['coordinates'][0].append(geom['coordinates'][0][0])
-            if element.get('holes'):
+            geom['coordinates'] = [self._closedRing(element['points'])]
+            if element.get('holes') is not None and len(element['holes']):
                 for hole in element['holes']:
-                    hole = hole[:]
-                    hole.append(hole[0])
-                    geom['coordinates'].append(hole)
+                    geom['coordinates'].append(self._closedRing(hole))
         else:
             geom['type'] = 'LineString'
             geom['coordinates'] = element['points']
@@ -160,6 +249,8 @@ class AnnotationGeoJSON:
 
     @property
     def geojson(self):
+        if not self.asFeatures:
+            return b''.join(self.chunks()).decode()
         return ''.join(self)
 
 
@@ -334,3 +425,265 @@ def isGeoJSON(annotation):
         'Feature', 'FeatureCollection', 'GeometryCollection', 'Point',
         'LineString', 'Polygon', 'MultiPoint', 'MultiLineString',
         'MultiPolygon'}
+
+
+class JSONStreamReader:
+    """
+    Incrementally decode json from a binary file-like object.  Values are
+    decoded one at a time, so arrays and objects can be walked without
+    holding the whole file in memory.
+    """
+
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, fptr, chunkSize=1024 ** 2):
+        """
+        :param fptr: a file-like object opened in binary mode.
+        :param chunkSize: the minimum number of bytes to read at a time.
+        """
+        self._fptr = fptr
+        self._chunkSize = chunkSize
+        self._textDecoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read(self):
+        """
+        Read more data into the buffer, discarding data that has already been
+        decoded.  Reads grow with the amount of undecoded data so that a
+        large value is not decoded repeatedly.
+
+        :returns: False if the end of the file was reached.
+        """
+        if self._eof:
+            return False
+        data = self._fptr.read(max(self._chunkSize, len(self._buffer) - self._pos))
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        if not len(data):
+            self._eof = True
+            self._buffer += self._textDecoder.decode(b'', final=True)
+            return False
+        self._buffer += self._textDecoder.decode(data)
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :returns: the next character or None at the end of the file.
+        """
+        while True:
+            self._pos = self._whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                return None
+
+    def expect(self, chars):
+        """
+        Consume the next non-whitespace character, which must be one of a set
+        of characters.
+
+        :param chars: a string of allowed characters.
+        :returns: the character that was consumed.
+        """
+        char = self.peek()
+        if char is None or char not in chars:
+            msg = 'Expected one of %r, not %r' % (chars, char)
+            raise ValueError(msg)
+        self._pos += 1
+        return char
+
+    def atEnd(self):
+        """
+        :returns: True if only whitespace remains.
+        """
+        return self.peek() is None
+
+    def value(self):
+        """
+        Decode the next complete json value.
+
+        :returns: the decoded value.
+        """
+        if self.peek() is None:
+            msg = 'Unexpected end of json data'
+            raise ValueError(msg)
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number that ends with the buffer could still continue
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read()
+
+    def items(self):
+        """
+        Yield the entries of an array one at a time.  The next value must be
+        an array.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def keys(self):
+        """
+        Yield the keys of an object one at a time.  The next value must be an
+        object.  After each key is yielded, the caller must consume the
+        associated value, such as via value, items, or keys.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                msg = 'Expected an object key'
+                raise ValueError(msg)
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def _geojsonElements(feature, annotation):
+    """
+    Convert a single GeoJSON feature to annotation elements.
+
+    :param feature: a GeoJSON feature or geometry.
+    :param annotation: a dictionary that is updated with any annotation
+        properties stored in the feature.
+    :returns: a list of elements.
+    """
+    geojson = GeoJSONAnnotation(feature)
+    annotation.update({k: v for k, v in geojson.annotation.items() if k != 'elements'})
+    return geojson.elements
+
+
+def _streamAnnotationObject(reader, annotation, containers):
+    """
+    Yield the elements of an annotation object from a json stream.  The keys
+    of the annotation other than the elements are added to the annotation
+    dictionary when the object has been read.
+
+    :param reader: a JSONStreamReader whose next value is an object.
+    :param annotation: a dictionary that receives the annotation keys.
+    :param containers: a set that receives the keys that hold an annotation
+        or its elements (annotation, elements, or features).  If this is
+        empty after the object is read, the object isn't an annotation.
+    """
+    header = {}
+    nested = geojson = False
+    for key in reader.keys():
+        if key == 'annotation' and not nested and reader.peek() == '{':
+            # An annotation exported with its model information
+            nested = True
+            containers.add(key)
+            yield from _streamAnnotationObject(reader, annotation, containers)
+        elif key in {'elements', 'features'} and not nested and reader.peek() == '[':
+            geojson = key == 'features'
+            containers.add(key)
+            for entry in reader.items():
+                if geojson:
+                    yield from _geojsonElements(entry, annotation)
+                else:
+                    yield entry
+        else:
+            header[key] = reader.value()
+    if not nested and not geojson:
+        annotation.update(header)
+
+
+def _streamValues(reader, first, geojson, annotation):
+    """
+    Yield elements from a sequence of json values, such as the lines of an
+    ndjson file.
+
+    :param reader: a JSONStreamReader positioned after the first value.
+    :param first: the first value, which has already been decoded.
+    :param geojson: True if the values are GeoJSON features.
+    :param annotation: a dictionary that is updated with any annotation
+        properties stored in GeoJSON features.
+    """
+    entry = first
+    while True:
+        if geojson:
+            yield from _geojsonElements(entry, annotation)
+        else:
+            yield entry
+        char = reader.peek()
+        if char is None or char == ']':
+            return
+        if char == ',':
+            reader.expect(',')
+        entry = reader.value()
+
+
+def streamAnnotations(fptr):
+    """
+    Read annotations from a json file without loading the whole file.  The
+    file may contain an annotation (optionally as exported with its model
+    information), a GeoJSON feature collection, a list of annotations or
+    GeoJSON features, or newline-delimited json where each line is an
+    annotation element, a GeoJSON feature, or an annotation.  An ndjson
+    record is an annotation if it has an annotation, elements, or features
+    key or has no type; otherwise, it starts a sequence of elements.
+
+    Each annotation is yielded as a dictionary whose elements are a generator.
+    The elements must be consumed before the next annotation is requested.
+    Annotation keys that follow the elements in the file are added to the
+    dictionary when the elements are exhausted.  Entries of a list of
+    annotations are each decoded in full.
+
+    :param fptr: a file-like object opened in binary mode.
+    :yields: annotation dictionaries.
+    """
+    reader = JSONStreamReader(fptr)
+    if reader.peek() == '[':
+        entries = reader.items()
+        first = next(entries, None)
+        if isGeoJSON(first):
+            annotation = {}
+            annotation['elements'] = itertools.chain.from_iterable(
+                _geojsonElements(entry, annotation)
+                for entry in itertools.chain([first], entries))
+            yield annotation
+            return
+        for entry in itertools.chain([first] if first is not None else [], entries):
+            yield entry['annotation'] if 'annotation' in entry else entry
+        return
+    while not reader.atEnd():
+        annotation = {}
+        containers = set()
+        elements = _streamAnnotationObject(reader, annotation, containers)
+        first = next(elements, None)
+        if first is not None:
+            annotation['elements'] = itertools.chain([first], elements)
+            yield annotation
+            collections.deque(elements, maxlen=0)
+            continue
+        # Elements and GeoJSON features have a type; annotations have either
+        # a list of elements or no type.
+        if containers or 'type' not in annotation:
+            if containers:
+                annotation['elements'] = []
+            yield annotation
+            continue
+        # Newline-delimited elements or features
+        header = {}
+        header['elements'] = _streamValues(reader, annotation, isGeoJSON(annotation), header)
+        yield header
+        collections.deque(header['elements'], maxlen=0)
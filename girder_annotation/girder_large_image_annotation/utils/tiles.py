@@ -0,0 +1,732 @@
+"""
+Render annotation elements into tiles that share the tiling scheme of the
+annotated image.
+"""
+
+import json
+import math
+import struct
+
+import numpy as np
+import PIL.Image
+import PIL.ImageColor
+import PIL.ImageDraw
+
+from large_image.cache_util import getTileCache, strhash
+from large_image.constants import TILE_FORMAT_NUMPY, TileOutputMimeTypes
+from large_image.exceptions import TileGeneralError
+from large_image.tilesource.utilities import _encodeImage
+
+# The number of integer units across the larger dimension of a vector tile
+VectorTileExtent = 4096
+# Geometry is clipped this many units beyond the edges of a vector tile so
+# that lines and outlines that straddle tile edges render without seams.
+VectorTileBuffer = 64
+
+GeometryPoint = 1
+GeometryLine = 2
+GeometryPolygon = 3
+
+TilePropertyKeys = ['type', 'fillColor', 'lineColor', 'lineWidth', 'closed', 'group']
+# This should match the javascript
+TilePropertyDefaults = {
+    'fillColor': 'rgba(0,0,0,0)',
+    'lineColor': 'rgb(0,0,0)',
+    'lineWidth': 2,
+}
+
+
+def tileRegion(metadata, z, x, y):
+    """
+    Get the area of the base image covered by a tile.
+
+    :param metadata: the large image metadata of the annotated image.
+    :param z: the tile level, where 0 is the lowest resolution.
+    :param x: the tile column.
+    :param y: the tile row.
+    :returns: a dictionary with left, top, right, and bottom in base image
+        pixels, scale in base image pixels per tile pixel, and tileWidth and
+        tileHeight.
+    """
+    if not 0 <= z < metadata['levels'] or x < 0 or y < 0:
+        msg = 'z, x, and y must be within the tile range of the image.'
+        raise ValueError(msg)
+    scale = 2 ** (metadata['levels'] - 1 - z)
+    tileWidth, tileHeight = metadata['tileWidth'], metadata['tileHeight']
+    if x * tileWidth * scale >= metadata['sizeX'] or y * tileHeight * scale >= metadata['sizeY']:
+        msg = 'z, x, and y must be within the tile range of the image.'
+        raise ValueError(msg)
+    return {
+        'left': x * tileWidth * scale,
+        'top': y * tileHeight * scale,
+        'right': (x + 1) * tileWidth * scale,
+        'bottom': (y + 1) * tileHeight * scale,
+        'scale': scale,
+        'tileWidth': tileWidth,
+        'tileHeight': tileHeight,
+    }
+
+
+def _cacheGet(tileHash):
+    """
+    Get a value from the large_image tile cache.
+
+    :param tileHash: the cache key.
+    :returns: the cached value or None.
+    """
+    tileCache, tileCacheLock = getTileCache()
+    try:
+        if tileCacheLock is None:
+            return tileCache[tileHash]
+        with tileCacheLock:
+            return tileCache[tileHash]
+    except (KeyError, ValueError):
+        return None
+
+
+def _cacheSet(tileHash, value):
+    """
+    Store a value in the large_image tile cache.
+
+    :param tileHash: the cache key.
+    :param value: the value to store.
+    """
+    tileCache, tileCacheLock = getTileCache()
+    if tileCacheLock is None:
+        tileCache[tileHash] = value
+    else:
+        with tileCacheLock:
+            tileCache[tileHash] = value
+
+
+def _rotate(points, rotation, center):
+    if not rotation:
+        return points + center
+    cosr, sinr = math.cos(rotation), math.sin(rotation)
+    return np.column_stack((
+        points[:, 0] * cosr - points[:, 1] * sinr,
+        points[:, 0] * sinr + points[:, 1] * cosr)) + center
+
+
+def elementGeometry(element, scale=1):
+    """
+    Convert an annotation element to geometry.
+
+    :param element: the annotation element.
+    :param scale: the size of an output pixel in base image pixels.  Circles
+        and ellipses are approximated by polygons with about one vertex per
+        four output pixels of perimeter.
+    :returns: a tuple of the geometry type and a list of parts, each of which
+        is an Nx2 numpy array of x, y coordinates.  For polygons, the first
+        part is the exterior and the remaining parts are holes.  None if the
+        element cannot be represented as geometry.
+    """
+    elemType = element.get('type')
+    if elemType == 'point':
+        return GeometryPoint, [np.array([element['center'][:2]], dtype=float)]
+    if elemType in {'polyline', 'arrow'}:
+        points = np.asarray(element['points'], dtype=float)[:, :2]
+        if elemType == 'polyline' and element.get('closed'):
+            return GeometryPolygon, [points] + [
+                np.asarray(hole, dtype=float)[:, :2] for hole in element.get('holes') or []]
+        return GeometryLine, [points]
+    if elemType not in {'rectangle', 'circle', 'ellipse'}:
+        return None
+    center = np.array(element['center'][:2], dtype=float)
+    if elemType == 'circle':
+        rx = ry = element['radius']
+    else:
+        rx, ry = element['width'] / 2, element['height'] / 2
+    if elemType == 'rectangle':
+        points = np.array([[-rx, -ry], [rx, -ry], [rx, ry], [-rx, ry]], dtype=float)
+    else:
+        segments = int(min(256, max(8, 2 * math.pi * max(rx, ry) / scale / 4)))
+        angles = np.linspace(0, 2 * math.pi, segments, endpoint=False)
+        points = np.column_stack((np.cos(angles) * rx, np.sin(angles) * ry))
+    return GeometryPolygon, [_rotate(points, element.get('rotation', 0), center)]
+
+
+def _clipPolygon(ring, low, high):
+    """
+    Clip a polygon ring to a rectangle using the Sutherland-Hodgman method.
+
+    :param ring: an Nx2 numpy array of the vertices of the ring.
+    :param low: the minimum x and y of the rectangle.
+    :param high: the maximum x and y of the rectangle.
+    :returns: an Mx2 numpy array of the clipped ring.  This may be empty.
+    """
+    for axis, bound, keepHigh in ((0, low[0], True), (0, high[0], False),
+                                  (1, low[1], True), (1, high[1], False)):
+        inside = ring[:, axis] >= bound if keepHigh else ring[:, axis] <= bound
+        if inside.all():
+            continue
+        if not inside.any():
+            return ring[:0]
+        prev = np.roll(ring, 1, axis=0)
+        crossing = inside != np.roll(inside, 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (bound - prev[:, axis]) / (ring[:, axis] - prev[:, axis])
+            intersect = prev + (ring - prev) * t[:, np.newaxis]
+        intersect[:, axis] = bound
+        # Each vertex contributes the intersection with the edge that ends at
+        # it (if that edge crosses the bound) followed by itself (if inside).
+        ring = np.stack((intersect, ring), axis=1)[np.column_stack((crossing, inside))]
+    return ring
+
+
+def _clipLine(line, low, high):
+    """
+    Clip a polyline to a rectangle.
+
+    :param line: an Nx2 numpy array of the vertices of the line.
+    :param low: the minimum x and y of the rectangle.
+    :param high: the maximum x and y of the rectangle.
+    :returns: a list of Mx2 numpy arrays, one for each part of the line
+        within the rectangle.
+    """
+    parts = [line]
+    for axis, bound, keepHigh in ((0, low[0], True), (0, high[0], False),
+                                  (1, low[1], True), (1, high[1], False)):
+        clipped = []
+        for part in parts:
+            inside = part[:, axis] >= bound if keepHigh else part[:, axis] <= bound
+            if inside.all():
+                clipped.append(part)
+                continue
+            start = 0 if inside[0] else None
+            entry = None
+            for idx in np.flatnonzero(inside[1:] != inside[:-1]):
+                p0, p1 = part[idx], part[idx + 1]
+                point = p0 + (p1 - p0) * (bound - p0[axis]) / (p1[axis] - p0[axis])
+                point[axis] = bound
+                if inside[idx]:
+                    pieces = [part[start:idx + 1], point[np.newaxis]]
+                    if entry is not None:
+                        pieces.insert(0, entry[np.newaxis])
+                    clipped.append(np.concatenate(pieces))
+                else:
+                    entry, start = point, idx + 1
+            if inside[-1]:
+                pieces = [part[start:]]
+                if entry is not None:
+                    pieces.insert(0, entry[np.newaxis])
+                clipped.append(np.concatenate(pieces))
+        parts = clipped
+    return [part for part in parts if len(part) >= 2]
+
+
+def _simplify(points, tolerance):
+    """
+    Simplify a list of points using the Ramer-Douglas-Peucker method.
+
+    :param points: an Nx2 numpy array of points.
+    :param tolerance: the maximum distance a removed point may be from the
+        simplified line.
+    :returns: an Mx2 numpy array of the points that are kept.
+    """
+    if len(points) <= 2 or tolerance <= 0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        delta = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = math.hypot(delta[0], delta[1])
+        if length:
+            dist = np.abs(offsets[:, 0] * delta[1] - offsets[:, 1] * delta[0]) / length
+        else:
+            dist = np.hypot(offsets[:, 0], offsets[:, 1])
+        idx = int(np.argmax(dist))
+        if dist[idx] > tolerance:
+            keep[start + 1 + idx] = True
+            stack.append((start, start + 1 + idx))
+            stack.append((start + 1 + idx, end))
+    return points[keep]
+
+
+def _quantize(points):
+    """
+    Round points to integers and remove consecutive duplicates.
+
+    :param points: an Nx2 numpy array of points.
+    :returns: an Mx2 int16 numpy array.
+    """
+    points = np.rint(points).astype('<i2')
+    if len(points) > 1:
+        points = points[np.concatenate(([True], np.any(points[1:] != points[:-1], axis=1)))]
+    return points
+
+
+def _tileParts(geomType, parts, low, high, tolerance):
+    """
+    Clip, simplify, and quantize the parts of a geometry in tile units.
+
+    :returns: a list of int16 numpy arrays or None if nothing of the geometry
+        is left.
+    """
+    if geomType == GeometryPoint:
+        if np.any(parts[0] < low) or np.any(parts[0] > high):
+            return None
+        return [_quantize(parts[0])]
+    result = []
+    for idx, part in enumerate(parts):
+        if geomType == GeometryPolygon:
+            clipped = [_clipPolygon(part, low, high)]
+            minLength = 3
+        else:
+            clipped = _clipLine(part, low, high)
+            minLength = 2
+        for piece in clipped:
+            piece = _quantize(_simplify(piece, tolerance))
+            if len(piece) >= minLength:
+                result.append(piece)
+            elif geomType == GeometryPolygon and not idx:
+                # the exterior of the polygon vanished
+                return None
+    return result or None
+
+
+def _elementIdBytes(element):
+    try:
+        return bytes.fromhex(str(element.get('id', ''))[:24]).ljust(12, b'\x00')
+    except ValueError:
+        return b'\x00' * 12
+
+
+def vectorTile(annotation, metadata, z, x, y, minimumSize=None, tolerance=0.5):
+    """
+    Get the elements of an annotation within a tile as a compact binary
+    vector tile.  Tiles use the tiling scheme of the annotated image.  Results
+    are stored in the large_image tile cache.
+
+    The result starts with a 4-byte little-endian unsigned integer with the
+    length of a json header, followed by the header.  The header contains z,
+    x, y, left and top (the base image pixel coordinate of the tile origin),
+    unit (the number of base image pixels per tile unit), extent (the size of
+    the tile in tile units), buffer, count (the number of elements), and
+    propskeys and props (a table of distinct element properties).  This is
+    followed by one record per element: 12 bytes of element id, a uint32
+    index into the props table, a uint8 geometry type (1 point, 2 line, 3
+    polygon), a uint16 number of parts, and, for each part, a uint32 number of
+    points followed by int16 x, y pairs in tile units.  All values are
+    little-endian.  For polygons, the first part is the exterior and the
+    remaining parts are holes.  Lines may be split into multiple parts by
+    clipping.
+
+    :param annotation: the annotation record, without elements.
+    :param metadata: the large image metadata of the annotated image.
+    :param z: the tile level, where 0 is the lowest resolution.
+    :param x: the tile column.
+    :param y: the tile row.
+    :param minimumSize: elements smaller than this size in base image pixels
+        are omitted.  None to omit elements that are smaller than one tile
+        pixel.  Points are always included.
+    :param tolerance: the amount of simplification in tile pixels.
+    :returns: the tile as bytes.
+    """
+    from ..models.annotationelement import Annotationelement
+
+    region = tileRegion(metadata, z, x, y)
+    if minimumSize is None:
+        minimumSize = region['scale'] if region['scale'] > 1 else 0
+    tileHash = 'annotationVectorTile ' + strhash(
+        str(annotation['_id']), annotation['_version'], z, x, y,
+        minimumSize=minimumSize, tolerance=tolerance, metadata=[
+            metadata[key] for key in ('levels', 'tileWidth', 'tileHeight')])
+    tileData = _cacheGet(tileHash)
+    if tileData is not None:
+        return tileData
+    unitsPerPixel = VectorTileExtent / max(region['tileWidth'], region['tileHeight'])
+    unit = region['scale'] / unitsPerPixel
+    origin = np.array([region['left'], region['top']], dtype=float)
+    low = np.array([-VectorTileBuffer, -VectorTileBuffer], dtype=float)
+    high = np.array([region['tileWidth'] * unitsPerPixel + VectorTileBuffer,
+                     region['tileHeight'] * unitsPerPixel + VectorTileBuffer])
+    query = {
+        'left': region['left'] - VectorTileBuffer * unit,
+        'top': region['top'] - VectorTileBuffer * unit,
+        'right': region['right'] + VectorTileBuffer * unit,
+        'bottom': region['bottom'] + VectorTileBuffer * unit,
+        'minimumSize': minimumSize,
+        'includePoints': True,
+    }
+    props = {}
+    records = []
+    count = 0
+    for element in Annotationelement().yieldElements(annotation, query, numpyArrays=True):
+        geometry = elementGeometry(element, region['scale'])
+        if geometry is None:
+            continue
+        geomType, parts = geometry
+        parts = _tileParts(
+            geomType, [(part - origin) / unit for part in parts], low, high,
+            tolerance * unitsPerPixel)
+        if not parts:
+            continue
+        prop = tuple(element.get(key, TilePropertyDefaults.get(key)) for key in TilePropertyKeys)
+        if prop not in props:
+            props[prop] = len(props)
+        count += 1
+        records.append(struct.pack(
+            '<12sIBH', _elementIdBytes(element), props[prop], geomType, len(parts)))
+        for part in parts:
+            records.append(struct.pack('<I', len(part)))
+            records.append(part.tobytes())
+    header = json.dumps({
+        'z': z, 'x': x, 'y': y,
+        'left': region['left'], 'top': region['top'],
+        'unit': unit,
+        'extent': [region['tileWidth'] * unitsPerPixel, region['tileHeight'] * unitsPerPixel],
+        'buffer': VectorTileBuffer,
+        'count': count,
+        'propskeys': TilePropertyKeys,
+        'props': [list(prop) for prop in props],
+    }, separators=(',', ':')).encode()
+    tileData = struct.pack('<I', len(header)) + header + b''.join(records)
+    _cacheSet(tileHash, tileData)
+    return tileData
+
+
+# Extra tile pixels around raster tiles in which elements are drawn so that
+# wide outlines and points that straddle tile edges are not cut off.
+RasterTileBuffer = 8
+# The radius of point elements in raster tiles in tile pixels
+RasterPointRadius = 5
+# Cached in place of a raster tile that depends on the user's access to
+# other items; the tile is then cached per user.
+RasterTilePerUser = b'annotationRasterTilePerUser'
+
+
+def parseColor(color):
+    """
+    Parse an annotation color.
+
+    :param color: a css-style color string, such as '#rrggbb', '#rgb',
+        '#rrggbbaa', 'rgb(r, g, b)', 'rgba(r, g, b, a)' where a is in the
+        range [0, 1], or a named color.
+    :returns: a tuple of red, green, blue, and alpha, each in the range
+        [0, 255].  None if the color cannot be parsed.
+    """
+    if not isinstance(color, str):
+        return None
+    color = color.strip().lower()
+    try:
+        if color.startswith('rgb'):
+            values = [float(val) for val in color.split('(', 1)[1].rstrip(')').split(',')]
+            alpha = values[3] if len(values) == 4 else 1
+            return (tuple(int(round(min(255, max(0, val)))) for val in values[:3]) +
+                    (int(round(min(1, max(0, alpha)) * 255)), ))
+        rgba = PIL.ImageColor.getrgb(color)
+    except (ValueError, IndexError):
+        return None
+    return tuple(rgba) + ((255, ) if len(rgba) == 3 else ())
+
+
+class _RasterLayers:
+    """
+    Collect elements into one coverage mask per style so that they can be
+    composited with transparency.  Elements of the same style do not blend
+    with each other where they overlap.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.layers = {}
+
+    def draw(self, color):
+        if color not in self.layers:
+            mask = PIL.Image.new('L', self.size, 0)
+            self.layers[color] = (mask, PIL.ImageDraw.Draw(mask))
+        return self.layers[color]
+
+    def composite(self, image):
+        for color, (mask, _) in self.layers.items():
+            if color[3] != 255:
+                mask = mask.point(lambda v, alpha=color[3]: v * alpha // 255)
+            layer = PIL.Image.new('RGBA', self.size, color[:3] + (0, ))
+            layer.putalpha(mask)
+            image = PIL.Image.alpha_composite(image, layer)
+        return image
+
+
+def _rasterGeometry(layers, element, geomType, parts, low, high):
+    """
+    Draw the geometry of an element into the raster layers.
+
+    :param layers: a _RasterLayers instance.
+    :param element: the annotation element with style properties.
+    :param geomType: the geometry type.
+    :param parts: a list of Nx2 numpy arrays in tile pixels.
+    :param low: the minimum x and y of the drawing area.
+    :param high: the maximum x and y of the drawing area.
+    """
+    fillColor = parseColor(element.get('fillColor', TilePropertyDefaults['fillColor']))
+    lineColor = parseColor(element.get('lineColor', TilePropertyDefaults['lineColor']))
+    lineWidth = max(1, int(round(float(element.get(
+        'lineWidth', TilePropertyDefaults['lineWidth'])))))
+    if geomType == GeometryPoint:
+        x, y = parts[0][0]
+        box = [x - RasterPointRadius, y - RasterPointRadius,
+               x + RasterPointRadius, y + RasterPointRadius]
+        if fillColor and fillColor[3]:
+            layers.draw(fillColor)[1].ellipse(box, fill=255)
+        if lineColor and lineColor[3]:
+            layers.draw(lineColor)[1].ellipse(box, outline=255, width=lineWidth)
+        return
+    if geomType == GeometryPolygon and fillColor and fillColor[3]:
+        rings = [_clipPolygon(part, low, high) for part in parts]
+        if len(rings[0]) >= 3:
+            mask, draw = layers.draw(fillColor)
+            if len(rings) == 1:
+                draw.polygon([tuple(pt) for pt in rings[0]], fill=255)
+            else:
+                shape = PIL.Image.new('L', layers.size, 0)
+                shapeDraw = PIL.ImageDraw.Draw(shape)
+                shapeDraw.polygon([tuple(pt) for pt in rings[0]], fill=255)
+                for ring in rings[1:]:
+                    if len(ring) >= 3:
+                        shapeDraw.polygon([tuple(pt) for pt in ring], fill=0)
+                mask.paste(255, mask=shape)
+    if lineColor and lineColor[3]:
+        draw = layers.draw(lineColor)[1]
+        for part in parts:
+            if geomType == GeometryPolygon:
+                part = np.concatenate((part, part[:1]))
+            for piece in _clipLine(part, low, high):
+                draw.line([tuple(pt) for pt in piece], fill=255, width=lineWidth,
+                          joint='curve' if lineWidth > 2 else None)
+
+
+def _colorMap(samples, values, element):
+    """
+    Map grid values to colors.
+
+    :param samples: a numpy array of values to color.  NaN values are
+        transparent.
+    :param values: all of the values of the element, used to normalize the
+        range.
+    :param element: a griddata element with colorRange, rangeValues,
+        normalizeRange, minColor, maxColor, and stepped properties.
+    :returns: a numpy uint8 array with an extra axis of red, green, blue, and
+        alpha.
+    """
+    colors = [parseColor(color) or (0, 0, 0, 0) for color in element.get(
+        'colorRange', ['rgba(0, 0, 0, 0)', 'rgba(255, 255, 0, 1)'])]
+    rangeValues = element.get('rangeValues') or list(np.linspace(0, 1, len(colors)))
+    rangeValues = np.array(rangeValues[:len(colors) + 1], dtype=float)
+    if element.get('normalizeRange', True):
+        low, high = np.nanmin(values), np.nanmax(values)
+        samples = (samples - low) / ((high - low) or 1)
+    colors = np.array(colors, dtype=float)
+    result = np.zeros(samples.shape + (4, ), dtype=np.uint8)
+    valid = ~np.isnan(samples)
+    if element.get('stepped') and element.get('interpretation') == 'contour':
+        idx = np.clip(np.searchsorted(rangeValues, samples[valid], 'right') - 1,
+                      0, len(colors) - 1)
+        result[valid] = colors[idx]
+    else:
+        for channel in range(4):
+            result[valid, channel] = np.interp(
+                samples[valid], rangeValues[:len(colors)], colors[:len(rangeValues), channel])
+    for key, outside in (('minColor', samples < rangeValues[0]),
+                         ('maxColor', samples > rangeValues[-1])):
+        if parseColor(element.get(key)):
+            result[valid & outside] = parseColor(element[key])
+    return result
+
+
+def _rasterGrid(element, region, size):
+    """
+    Render a griddata element.
+
+    :param element: the griddata element.
+    :param region: the tile region.
+    :param size: the width and height of the tile in pixels.
+    :returns: an RGBA PIL image.
+    """
+    values = np.array(element['values'], dtype=float)
+    gridWidth = element['gridWidth']
+    gridHeight = int(math.ceil(len(values) / gridWidth))
+    grid = np.full((gridHeight * gridWidth, ), np.nan)
+    grid[:len(values)] = values
+    grid = grid.reshape(gridHeight, gridWidth)
+    x0, y0 = (element.get('origin') or [0, 0, 0])[:2]
+    gx = (region['left'] + (np.arange(size[0]) + 0.5) * region['scale'] - x0) / element.get('dx', 1)
+    gy = (region['top'] + (np.arange(size[1]) + 0.5) * region['scale'] - y0) / element.get('dy', 1)
+    if element.get('interpretation') == 'choropleth':
+        ix, iy = np.floor(gx).astype(int), np.floor(gy).astype(int)
+        validx, validy = (ix >= 0) & (ix < gridWidth), (iy >= 0) & (iy < gridHeight)
+        samples = grid[np.clip(iy, 0, gridHeight - 1)][:, np.clip(ix, 0, gridWidth - 1)]
+    else:
+        # Values are at grid points; interpolate bilinearly between them
+        validx, validy = (gx >= 0) & (gx <= gridWidth - 1), (gy >= 0) & (gy <= gridHeight - 1)
+        ix = np.clip(np.floor(gx).astype(int), 0, max(0, gridWidth - 2))
+        iy = np.clip(np.floor(gy).astype(int), 0, max(0, gridHeight - 2))
+        fx = np.clip(gx - ix, 0, 1)[np.newaxis, :]
+        fy = np.clip(gy - iy, 0, 1)[:, np.newaxis]
+        ix1, iy1 = np.minimum(ix + 1, gridWidth - 1), np.minimum(iy + 1, gridHeight - 1)
+        samples = (
+            grid[iy][:, ix] * (1 - fx) * (1 - fy) + grid[iy][:, ix1] * fx * (1 - fy) +
+            grid[iy1][:, ix] * (1 - fx) * fy + grid[iy1][:, ix1] * fx * fy)
+    samples[~(validy[:, np.newaxis] & validx[np.newaxis, :])] = np.nan
+    return PIL.Image.fromarray(_colorMap(samples, values, element), 'RGBA')
+
+
+def _rasterPixelmap(element, region, size, user):
+    """
+    Render a pixelmap element.  The pixel values of the referenced image are
+    indices into the values array, which in turn are indices into the
+    categories array.
+
+    :param element: the pixelmap element.
+    :param region: the tile region.
+    :param size: the width and height of the tile in pixels.
+    :param user: the user used to check access to the referenced image.
+    :returns: an RGBA PIL image or None if nothing was rendered.
+    """
+    from girder_large_image.models.image_item import ImageItem
+
+    from girder.constants import AccessType
+    from girder.exceptions import AccessException, ValidationException
+
+    try:
+        item = ImageItem().load(element['girderId'], user=user, level=AccessType.READ)
+        if item is None:
+            return None
+        source = ImageItem()._loadTileSource(item)
+    except (AccessException, ValidationException, TileGeneralError):
+        return None
+    transform = element.get('transform') or {}
+    matrix = np.array(transform.get('matrix', [[1, 0], [0, 1]]), dtype=float)
+    offset = np.array([transform.get('xoffset', 0), transform.get('yoffset', 0)], dtype=float)
+    try:
+        inverse = np.linalg.inv(matrix)
+    except np.linalg.LinAlgError:
+        return None
+    # The center of each tile pixel in the coordinates of the pixelmap image
+    px, py = np.meshgrid(
+        region['left'] + (np.arange(size[0]) + 0.5) * region['scale'],
+        region['top'] + (np.arange(size[1]) + 0.5) * region['scale'])
+    coords = (np.stack((px, py), axis=-1) - offset) @ inverse
+    low = np.maximum(np.floor(coords.reshape(-1, 2).min(axis=0)), 0)
+    high = np.minimum(np.ceil(coords.reshape(-1, 2).max(axis=0)),
+                      [source.sizeX, source.sizeY])
+    if np.any(high <= low):
+        return None
+    pixelsPerTilePixel = max(1, region['scale'] / abs(np.linalg.det(matrix)) ** 0.5)
+    data, _ = source.getRegion(
+        region={'left': low[0], 'top': low[1], 'right': high[0], 'bottom': high[1]},
+        output={'maxWidth': int(math.ceil((high[0] - low[0]) / pixelsPerTilePixel)),
+                'maxHeight': int(math.ceil((high[1] - low[1]) / pixelsPerTilePixel))},
+        format=TILE_FORMAT_NUMPY, resample=None)
+    data = data.astype(np.int64)
+    if len(data.shape) == 2:
+        data = data[:, :, np.newaxis]
+    indices = data[:, :, 0]
+    if data.shape[2] >= 3:
+        indices = indices + data[:, :, 1] * 256 + data[:, :, 2] * 65536
+    ix = np.floor((coords[:, :, 0] - low[0]) * data.shape[1] / (high[0] - low[0])).astype(int)
+    iy = np.floor((coords[:, :, 1] - low[1]) * data.shape[0] / (high[1] - low[1])).astype(int)
+    valid = (ix >= 0) & (ix < data.shape[1]) & (iy >= 0) & (iy < data.shape[0])
+    pixels = indices[np.clip(iy, 0, data.shape[0] - 1), np.clip(ix, 0, data.shape[1] - 1)]
+    categories = [(parseColor(category.get('fillColor')) or (0, 0, 0, 0),
+                   parseColor(category.get('strokeColor')) or (0, 0, 0, 0))
+                  for category in element.get('categories', [])]
+    boundaries = bool(element.get('boundaries'))
+    lut = np.zeros((len(element['values']) * (2 if boundaries else 1) + 1, 4), dtype=np.uint8)
+    for idx in range(len(lut) - 1):
+        category = element['values'][idx // 2 if boundaries else idx]
+        if 0 <= category < len(categories):
+            lut[idx] = categories[category][1 if boundaries and idx % 2 else 0]
+    pixels[~valid | (pixels < 0) | (pixels >= len(lut) - 1)] = len(lut) - 1
+    colors = lut[pixels]
+    opacity = element.get('opacity', 1)
+    if opacity != 1:
+        colors[:, :, 3] = (colors[:, :, 3] * opacity).astype(np.uint8)
+    return PIL.Image.fromarray(colors, 'RGBA')
+
+
+def rasterTile(annotation, metadata, z, x, y, encoding='PNG', minimumSize=None,
+               user=None, **kwargs):
+    """
+    Render the elements of an annotation within a tile into an RGBA image.
+    Tiles use the tiling scheme of the annotated image.  Shapes are drawn
+    with their fillColor, lineColor, and lineWidth; griddata elements are
+    colored by their color ranges; pixelmap elements are colored by their
+    categories.  Heatmap elements are not rendered.  Results are stored in
+    the large_image tile cache.
+
+    :param annotation: the annotation record, without elements.
+    :param metadata: the large image metadata of the annotated image.
+    :param z: the tile level, where 0 is the lowest resolution.
+    :param x: the tile column.
+    :param y: the tile row.
+    :param encoding: the output encoding.  This must be a key of
+        TileOutputMimeTypes.
+    :param minimumSize: elements smaller than this size in base image pixels
+        are omitted.  None to omit elements that are smaller than one tile
+        pixel.  Points are always included.
+    :param user: the user used to check access to the images referenced by
+        pixelmap elements.
+    :param kwargs: additional encoding parameters, such as jpegQuality.
+    :returns: the tile data and its mime type.
+    """
+    from ..models.annotationelement import Annotationelement
+
+    region = tileRegion(metadata, z, x, y)
+    if minimumSize is None:
+        minimumSize = region['scale'] if region['scale'] > 1 else 0
+    tileHash = 'annotationRasterTile ' + strhash(
+        str(annotation['_id']), annotation['_version'], z, x, y,
+        encoding=encoding, minimumSize=minimumSize, metadata=[
+            metadata[key] for key in ('levels', 'tileWidth', 'tileHeight')], **kwargs)
+    userHash = tileHash + ' ' + str(user['_id'] if user else None)
+    tileData = _cacheGet(tileHash)
+    if tileData == RasterTilePerUser:
+        tileData = _cacheGet(userHash)
+    if tileData is not None:
+        return tileData, TileOutputMimeTypes[encoding]
+    size = (region['tileWidth'], region['tileHeight'])
+    image = PIL.Image.new('RGBA', size, (0, 0, 0, 0))
+    layers = _RasterLayers(size)
+    origin = np.array([region['left'], region['top']], dtype=float)
+    low = np.array([-RasterTileBuffer, -RasterTileBuffer], dtype=float)
+    high = np.array([size[0] + RasterTileBuffer, size[1] + RasterTileBuffer], dtype=float)
+    buffer = RasterTileBuffer * region['scale']
+    query = {
+        'left': region['left'] - buffer, 'top': region['top'] - buffer,
+        'right': region['right'] + buffer, 'bottom': region['bottom'] + buffer,
+        'minimumSize': minimumSize,
+        'includePoints': True,
+    }
+    perUser = False
+    for element in Annotationelement().yieldElements(annotation, query, numpyArrays=True):
+        overlay = None
+        if element.get('type') == 'griddata':
+            overlay = _rasterGrid(element, region, size)
+        elif element.get('type') == 'pixelmap':
+            perUser = True
+            overlay = _rasterPixelmap(element, region, size, user)
+        else:
+            geometry = elementGeometry(element, region['scale'])
+            if geometry is not None:
+                _rasterGeometry(
+                    layers, element, geometry[0],
+                    [(part - origin) / region['scale'] for part in geometry[1]], low, high)
+        if overlay is not None:
+            # Keep the drawing order of shapes and overlays
+            image = PIL.Image.alpha_composite(layers.composite(image), overlay)
+            layers = _RasterLayers(size)
+    image = layers.composite(image)
+    tileData, mimeType = _encodeImage(
+        image, encoding=encoding, **kwargs)
+    if perUser:
+        _cacheSet(tileHash, RasterTilePerUser)
+        _cacheSet(userHash, tileData)
+    else:
+        _cacheSet(tileHash, tileData)
+    return tileData, mimeType
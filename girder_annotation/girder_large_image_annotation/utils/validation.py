@@ -0,0 +1,238 @@
+"""
+Validate annotation elements with checks compiled from the json schema.
+"""
+
+import itertools
+import numbers
+import re
+
+import jsonschema
+import numpy as np
+
+# Numeric arrays at least this long are checked with numpy rather than per
+# entry
+VECTORIZE_ARRAY_LENGTH = 32
+
+# Schema keywords that don't affect validation
+_AnnotationKeywords = {'$schema', 'decription', 'description', 'name', 'title'}
+_NumberKeywords = {'minimum', 'maximum', 'exclusiveMinimum', 'exclusiveMaximum'}
+_SupportedKeywords = _AnnotationKeywords | _NumberKeywords | {
+    'type', 'enum', 'pattern', 'minLength', 'properties', 'required',
+    'additionalProperties', 'items', 'minItems', 'maxItems'}
+
+
+def _isNumber(value):
+    return type(value) in {int, float} or (
+        isinstance(value, numbers.Number) and not isinstance(value, bool))
+
+
+def _isInteger(value):
+    if type(value) is float:
+        return value.is_integer()
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+_typeChecks = {
+    'array': lambda value: isinstance(value, list),
+    'boolean': lambda value: isinstance(value, bool),
+    'integer': _isInteger,
+    'null': lambda value: value is None,
+    'number': _isNumber,
+    'object': lambda value: isinstance(value, dict),
+    'string': lambda value: isinstance(value, str),
+}
+
+
+def _compileType(schema):
+    types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+    funcs = [_typeChecks[t] for t in types]
+    if len(funcs) == 1:
+        return funcs[0]
+    return lambda value: any(func(value) for func in funcs)
+
+
+def _compileNumber(schema):
+    checks = []
+    for key, op in (
+            ('minimum', lambda v, limit: v >= limit),
+            ('maximum', lambda v, limit: v <= limit),
+            ('exclusiveMinimum', lambda v, limit: v > limit),
+            ('exclusiveMaximum', lambda v, limit: v < limit)):
+        if key in schema:
+            checks.append(lambda value, op=op, limit=schema[key]: (
+                not _isNumber(value) or op(value, limit)))
+    return checks
+
+
+def _numericArrayItems(items):
+    """
+    Determine if the items of an array schema are numbers or fixed-length
+    arrays of numbers, as these can be checked with numpy.
+
+    :param items: the schema of the array items.
+    :returns: None if the items cannot be checked with numpy, otherwise a
+        tuple of (integer, width), where integer is True if the numbers must
+        be integers and width is None for numbers or the length of each entry
+        for arrays of numbers.
+    """
+    if not isinstance(items, dict) or set(items) - _AnnotationKeywords - {
+            'type', 'items', 'minItems', 'maxItems'}:
+        return None
+    if items.get('type') in {'number', 'integer'} and set(items) - _AnnotationKeywords == {'type'}:
+        return (items['type'] == 'integer', None)
+    if (items.get('type') == 'array' and items.get('minItems') is not None and
+            items.get('minItems') == items.get('maxItems')):
+        sub = _numericArrayItems(items.get('items'))
+        if sub is not None and sub[1] is None:
+            return (sub[0], items['minItems'])
+    return None
+
+
+def _compileNumericArray(integer, width, itemCheck):
+    kinds = 'iu' if integer else 'iuf'
+    ndim = 1 if width is None else 2
+
+    def check(value):
+        if len(value) < VECTORIZE_ARRAY_LENGTH:
+            return all(itemCheck(item) for item in value)
+        try:
+            arr = np.asarray(value)
+        except (ValueError, TypeError):
+            return False
+        if (arr.dtype.kind not in kinds or arr.ndim != ndim or
+                (width is not None and arr.shape[1] != width)):
+            return False
+        # numpy converts booleans mixed with numbers to numbers, but the json
+        # schema rejects them
+        types = set(map(type, value if width is None else itertools.chain.from_iterable(value)))
+        return not any(issubclass(itemType, (bool, np.bool_)) for itemType in types)
+
+    return check
+
+
+def _compileArray(schema):
+    checks = []
+    if 'minItems' in schema:
+        checks.append(lambda value, limit=schema['minItems']: (
+            not isinstance(value, list) or len(value) >= limit))
+    if 'maxItems' in schema:
+        checks.append(lambda value, limit=schema['maxItems']: (
+            not isinstance(value, list) or len(value) <= limit))
+    if 'items' in schema:
+        itemCheck = compileSchema(schema['items'])
+        numeric = _numericArrayItems(schema['items'])
+        if numeric is not None:
+            arrayCheck = _compileNumericArray(numeric[0], numeric[1], itemCheck)
+        else:
+            def arrayCheck(value):
+                return all(itemCheck(item) for item in value)
+        checks.append(lambda value: not isinstance(value, list) or arrayCheck(value))
+    return checks
+
+
+def _compileObject(schema):
+    properties = {key: compileSchema(sub) for key, sub in schema.get('properties', {}).items()}
+    required = set(schema.get('required', []))
+    additional = schema.get('additionalProperties', True)
+    if not isinstance(additional, bool):
+        return None
+    allowed = set(properties)
+
+    def check(value):
+        if not isinstance(value, dict):
+            return True
+        if required and not required.issubset(value):
+            return False
+        if not additional and not allowed.issuperset(value):
+            return False
+        for key, item in value.items():
+            func = properties.get(key)
+            if func is not None and not func(item):
+                return False
+        return True
+
+    return [check]
+
+
+def compileSchema(schema):
+    """
+    Compile a json schema into a function that checks if a value is valid.
+    Only the keywords used by the annotation schema are compiled; any part of
+    the schema that uses other keywords is checked with jsonschema.  The
+    compiled check may reject some values that jsonschema would accept, so a
+    value that fails the check should be validated with jsonschema to confirm
+    the failure and get a useful error message.
+
+    :param schema: a json schema.
+    :returns: a function that takes a value and returns True if it is valid.
+    """
+    if not isinstance(schema, dict) or set(schema) - _SupportedKeywords or (
+            'enum' in schema and not all(isinstance(e, str) for e in schema['enum'])):
+        return jsonschema.Draft6Validator(schema).is_valid
+    checks = []
+    if 'type' in schema:
+        checks.append(_compileType(schema))
+    if 'enum' in schema:
+        checks.append(lambda value, enum=frozenset(schema['enum']): (
+            isinstance(value, str) and value in enum))
+    if 'pattern' in schema:
+        checks.append(lambda value, search=re.compile(schema['pattern']).search: (
+            not isinstance(value, str) or search(value) is not None))
+    if 'minLength' in schema:
+        checks.append(lambda value, limit=schema['minLength']: (
+            not isinstance(value, str) or len(value) >= limit))
+    checks.extend(_compileNumber(schema))
+    checks.extend(_compileArray(schema))
+    objectChecks = _compileObject(schema)
+    if objectChecks is None:
+        return jsonschema.Draft6Validator(schema).is_valid
+    if 'properties' in schema or 'required' in schema or 'additionalProperties' in schema:
+        checks.extend(objectChecks)
+    if len(checks) == 1:
+        return checks[0]
+    return lambda value: all(check(value) for check in checks)
+
+
+class ElementValidator:
+    """
+    Validate annotation elements.  The element schema is a list of schemas,
+    one per element type.  Each of these is compiled to a fast check, and an
+    element is checked against the schema for its type.  Only elements that
+    fail the fast check are validated with jsonschema.
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: the annotation element schema.  This is expected to
+            have an ``anyOf`` list of schemas, each of which restricts the
+            element type to a single value.
+        """
+        self.validator = jsonschema.Draft6Validator(schema)
+        self._types = {}
+        for sub in schema.get('anyOf', []):
+            enum = sub.get('properties', {}).get('type', {}).get('enum', [])
+            if len(enum) == 1 and isinstance(enum[0], str):
+                self._types[enum[0]] = compileSchema(sub)
+
+    def isValid(self, element):
+        """
+        Check if an element is valid.
+
+        :param element: the element to check.
+        :returns: True if the element is valid.
+        """
+        check = None
+        if isinstance(element, dict) and isinstance(element.get('type'), str):
+            check = self._types.get(element['type'])
+        if check is not None and check(element):
+            return True
+        return self.validator.is_valid(element)
+
+    def validate(self, element):
+        """
+        Validate an element, raising an exception if it is invalid.
+
+        :param element: the element to validate.
+        """
+        if not self.isValid(element):
+            self.validator.validate(element)
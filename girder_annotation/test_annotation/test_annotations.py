@@ -1,9 +1,13 @@
 import copy
+import datetime
+import io
+import json
 import math
 import random
 from unittest import mock
 
 import jsonschema
+import numpy as np
 import pytest
 
 from . import girder_utilities as utilities
@@ -13,9 +17,10 @@ pytestmark = pytest.mark.girder
 try:
     from bson import ObjectId
     from girder_large_image import constants
-    from girder_large_image_annotation.models import annotation
+    from girder_large_image_annotation.models import annotation, annotationelement
     from girder_large_image_annotation.models.annotation import Annotation
     from girder_large_image_annotation.models.annotationelement import Annotationelement
+    from girder_large_image_annotation.utils import streamAnnotations
 
     from girder.constants import AccessType
     from girder.exceptions import AccessException, ValidationException
@@ -105,51 +110,6 @@ class TestLargeImageAnnotation:
         result = Annotation().load(annotId, user=admin)
         assert len(result['annotation']['elements']) == 1
 
-    def testSimilarElementStructure(self, db):
-
-        def ses(a, b):
-            try:
-                return Annotation()._similarElementStructure(a, b)
-            except TypeError:
-                return False
-
-        assert ses('a', 'a')
-        assert not ses('a', 'b')
-        assert ses(10, 10)
-        assert ses(10, 11)
-        assert not ses(10, 10.0)
-        assert ses({'a': 10}, {'a': 12})
-        assert not ses({'a': 10}, {'a': 'b'})
-        assert not ses({'a': 10, 'b': 11}, {'a': 10})
-        assert not ses({'a': 10, 'b': 11}, {'a': 10, 'c': 11})
-        assert ses({'id': '012345678901234567890123'},
-                   {'id': '01234567890123456789ffff'})
-        assert not ses({'id': '012345678901234567890123'},
-                       {'id': '01234567890123456789----'})
-        assert ses([1, 2, 3, 4], [2, 3, 4, 5])
-        assert not ses([1, 2, 3, 4], [2, 3, 4, 5, 6])
-        assert not ses([1, 2, 3, 4], [2, 3, 4, 'a'])
-        assert ses({'points': [
-            [1, 2, 3],
-            [4, 5, 6],
-            [7, 8, 9],
-        ]}, {'points': [
-            [10, 11, 12],
-            [13, 14, 15],
-            [16, 17, 18],
-            [19, 20, 21.1],
-        ]})
-        assert not ses({'points': [
-            [1, 2, 3],
-            [4, 5, 6],
-            [7, 8, 9],
-        ]}, {'points': [
-            [10, 11, 12],
-            [13, 14, 15],
-            [16, 17, 18],
-            [19, 20, 'b'],
-        ]})
-
     def testLoad(self, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
 
@@ -260,6 +220,95 @@ class TestLargeImageAnnotation:
         annot['elements'][1]['id'] = ObjectId('012345678901234567890124')
         assert Annotation().validate(doc) is not None
 
+    def testElementValidator(self):
+        validator = Annotation().elementValidator
+        points = [[x, x * 0.5, 0] for x in range(2000)]
+        valid = [
+            {'type': 'polyline', 'points': points, 'closed': True, 'holes': [points[:50]]},
+            {'type': 'point', 'center': [1, 2, 0], 'label': {'value': 'a'}},
+            {'type': 'rectangle', 'center': [1, 2, 0], 'width': 1, 'height': 2.5},
+            {'type': 'griddata', 'gridWidth': 10, 'values': [x * 0.5 for x in range(100)]},
+        ]
+        for element in valid:
+            assert validator.isValid(element)
+            validator.validate(element)
+        invalid = [
+            {'type': 'polyline', 'points': points[:-1] + [[1, 2]]},
+            {'type': 'polyline', 'points': points[:-1] + [[1, 2, 'a']]},
+            {'type': 'polyline', 'points': [[True, 2, 0]] * 40},
+            {'type': 'polyline', 'points': points[:-1] + [[1.5, False, 0]]},
+            {'type': 'griddata', 'gridWidth': 10, 'values': [x * 0.5 for x in range(99)] + [True]},
+            {'type': 'polyline', 'points': points, 'holes': [points[:-1] + [[1, 2, 0, 0]]]},
+            {'type': 'point', 'center': [1, 2, 0], 'label': {'value': 1}},
+            {'type': 'point', 'center': [1, 2, 0], 'lineColor': 'blue'},
+            {'type': 'rectangle', 'center': [1, 2, 0], 'width': -1, 'height': 2.5},
+            {'type': 'rectangle', 'center': [1, 2, 0], 'width': 1, 'height': 2.5, 'extra': 1},
+            {'type': 'griddata', 'gridWidth': 10, 'values': [x * 0.5 for x in range(100)] + [None]},
+            {'type': 'unknown'},
+        ]
+        for element in invalid:
+            assert not validator.isValid(element)
+            with pytest.raises(jsonschema.ValidationError):
+                validator.validate(element)
+
+    @mock.patch.object(annotation, 'VALIDATE_CHUNK_SIZE', 10)
+    def testValidateChunks(self, db):
+        annot = {'name': 'chunks', 'elements': [
+            {'type': 'point', 'center': [x, x, 0], '_extra': 1} for x in range(95)]}
+        doc = {'annotation': annot}
+        assert Annotation().validate(doc) is not None
+        assert not any('_extra' in element for element in annot['elements'])
+        annot['elements'][90]['id'] = annot['elements'][3]['id'] = '0123456789abcdef01234567'
+        with pytest.raises(ValidationException, match='not unique'):
+            Annotation().validate(doc)
+        annot['elements'][3]['id'] = '0123456789abcdef01234568'
+        annot['elements'][77]['center'] = [1, 2]
+        with pytest.raises(ValidationException):
+            Annotation().validate(doc)
+
+    def testCreateAnnotationFromStream(self, admin):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        item = Item().createItem('sample', admin, publicFolder)
+        elements = [{'type': 'point', 'center': [x, x + 1, 0]} for x in range(25)]
+        # The name follows the elements, so it is only known once they are read
+        data = json.dumps({'elements': elements, 'name': 'streamed'}).encode()
+        annots = [Annotation().createAnnotation(item, admin, annot)
+                  for annot in streamAnnotations(io.BytesIO(data))]
+        assert len(annots) == 1
+        loaded = Annotation().load(annots[0]['_id'], user=admin)
+        assert loaded['annotation']['name'] == 'streamed'
+        assert len(loaded['annotation']['elements']) == 25
+        # ndjson elements
+        data = '\n'.join(json.dumps(element) for element in elements).encode()
+        annot = next(streamAnnotations(io.BytesIO(data)))
+        annot = Annotation().createAnnotation(item, admin, annot)
+        loaded = Annotation().load(annot['_id'], user=admin)
+        assert len(loaded['annotation']['elements']) == 25
+        # A single ndjson element is an element, not an annotation
+        annots = list(streamAnnotations(io.BytesIO(json.dumps(elements[0]).encode())))
+        assert len(annots) == 1
+        assert list(annots[0]['elements']) == [elements[0]]
+        # An ndjson annotation without elements is still an annotation
+        data = '\n'.join(json.dumps(annot) for annot in [
+            {'name': 'empty', 'elements': []},
+            {'name': 'second', 'elements': elements[:2]},
+        ]).encode()
+        annots = []
+        for annot in streamAnnotations(io.BytesIO(data)):
+            annot['elements'] = list(annot['elements'])
+            annots.append(annot)
+        assert [annot['name'] for annot in annots] == ['empty', 'second']
+        assert [len(annot['elements']) for annot in annots] == [0, 2]
+        # A failure part way through doesn't leave elements behind
+        elements[20]['id'] = elements[5]['id'] = '0123456789abcdef01234567'
+        data = json.dumps({'name': 'bad', 'elements': elements}).encode()
+        count = Annotationelement().collection.count_documents({})
+        with pytest.raises(ValidationException, match='not unique'):
+            Annotation().createAnnotation(
+                item, admin, next(streamAnnotations(io.BytesIO(data))))
+        assert Annotationelement().collection.count_documents({}) == count
+        assert Annotation().findOne({'annotation.name': 'bad'}) is None
+
     def testVersionList(self, db, user, admin):
         privateFolder = utilities.namedFolder(admin, 'Private')
         # Test without history
@@ -363,6 +412,160 @@ class TestLargeImageAnnotation:
         assert len(Annotation().revertVersion(
             annot['_id'], user=admin)['annotation']['elements']) == 1
 
+    @pytest.mark.parametrize('history', [False, True])
+    def testPatchAnnotation(self, admin, history):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        Setting().set(constants.PluginSettings.LARGE_IMAGE_ANNOTATION_HISTORY, history)
+        item = Item().createItem('sample', admin, publicFolder)
+        annot = Annotation().createAnnotation(item, admin, {
+            'name': 'sample',
+            'elements': [{
+                'type': 'point', 'center': [idx, idx, 0], 'group': 'a',
+            } for idx in range(10)],
+        })
+        origVersion = annot['_version']
+        elements = Annotation().load(annot['_id'], force=True)['annotation']['elements']
+        ids = [str(element['id']) for element in elements]
+        elementCount = Annotationelement().find().count()
+
+        result = Annotation().patchAnnotation(
+            annot,
+            add=[{'type': 'point', 'center': [100, 100, 0], 'group': 'b'}],
+            modify=[{'id': ids[1], 'type': 'point', 'center': [50, 50, 0]}],
+            remove=[ids[2], ids[3]],
+            updateUser=admin)
+        assert result['_version'] > origVersion
+        assert result['_versionBase'] == origVersion
+        assert result['groups'] == ['a', 'b', None]
+        elements = Annotation().load(annot['_id'], force=True)['annotation']['elements']
+        assert len(elements) == 9
+        byId = {str(element['id']): element for element in elements}
+        assert byId[ids[1]]['center'] == [50, 50, 0]
+        assert ids[2] not in byId
+        assert ids[3] not in byId
+        # Only the changed elements were written; replaced elements are kept
+        # only if there is history
+        assert Annotationelement().find().count() == elementCount + 2 - (0 if history else 3)
+        # Region queries see the patched elements
+        region = Annotation().load(annot['_id'], region={'left': 40}, force=True)
+        assert len(region['annotation']['elements']) == 2
+
+        versions = list(Annotation().versionList(annot['_id'], force=True))
+        if history:
+            old = Annotation().getVersion(annot['_id'], origVersion, force=True)
+            assert len(old['annotation']['elements']) == 10
+            assert {str(element['id']) for element in old['annotation']['elements']} == set(ids)
+            assert len(versions) == 2
+        else:
+            assert len(versions) == 1
+
+        # A second patch builds on the first; a full save starts a new base
+        result = Annotation().patchAnnotation(result, remove=[ids[0]])
+        assert result['_versionBase'] == origVersion
+        annot = Annotation().load(annot['_id'], force=True)
+        assert len(annot['annotation']['elements']) == 8
+        annot = Annotation().save(annot)
+        assert '_versionBase' not in Annotation().load(annot['_id'], getElements=False, force=True)
+        assert len(Annotation().load(annot['_id'], force=True)['annotation']['elements']) == 8
+
+        # Bad patches
+        with pytest.raises(ValidationException, match='must have an id'):
+            Annotation().patchAnnotation(annot, modify=[{'type': 'point', 'center': [1, 1, 0]}])
+        with pytest.raises(ValidationException, match='not in the annotation'):
+            Annotation().patchAnnotation(annot, remove=[ids[2]])
+        with pytest.raises(ValidationException, match='only be modified or removed once'):
+            Annotation().patchAnnotation(annot, remove=[ids[4], ids[4]])
+        with pytest.raises(ValidationException, match='existing element'):
+            Annotation().patchAnnotation(annot, add=[
+                {'id': ids[4], 'type': 'point', 'center': [1, 1, 0]}])
+        with pytest.raises(ValidationException):
+            Annotation().patchAnnotation(annot, add=[{'type': 'point'}])
+
+    @pytest.mark.parametrize('history', [False, True])
+    def testPatchAnnotationConcurrent(self, admin, history):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        Setting().set(constants.PluginSettings.LARGE_IMAGE_ANNOTATION_HISTORY, history)
+        item = Item().createItem('sample', admin, publicFolder)
+        annot = Annotation().createAnnotation(item, admin, {
+            'name': 'sample',
+            'elements': [{'type': 'point', 'center': [idx, idx, 0]} for idx in range(4)],
+        })
+        elements = Annotation().load(annot['_id'], force=True)['annotation']['elements']
+        ids = [str(element['id']) for element in elements]
+        origEndElements = Annotationelement.endElements
+        firstVersion = []
+
+        def interleave(self, documentIds, version):
+            # Another patch removes the same element and finishes while this
+            # patch is in progress
+            with mock.patch.object(Annotationelement, 'endElements', origEndElements):
+                firstVersion.append(Annotation().patchAnnotation(
+                    annot, remove=[ids[0]])['_version'])
+            return origEndElements(self, documentIds, version)
+
+        with mock.patch.object(Annotationelement, 'endElements', interleave):
+            with pytest.raises(ValidationException, match='changed while'):
+                Annotation().patchAnnotation(
+                    annot, add=[{'type': 'point', 'center': [9, 9, 0]}], remove=[ids[0]])
+        # The first patch is intact
+        annot = Annotation().load(annot['_id'], force=True)
+        assert annot['_version'] == firstVersion[0]
+        assert sorted(str(element['id']) for element in annot['annotation']['elements']) == \
+            sorted(ids[1:])
+        if history:
+            assert Annotationelement().collection.find_one(
+                {'_id': ObjectId(ids[0])})['_versionEnd'] == firstVersion[0]
+
+    def testRemoveOldAnnotations(self, admin):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        Setting().set(constants.PluginSettings.LARGE_IMAGE_ANNOTATION_HISTORY, True)
+        item = Item().createItem('sample', admin, publicFolder)
+        annot = Annotation().createAnnotation(item, admin, copy.deepcopy(sampleAnnotation))
+        for idx in range(4):
+            annot['annotation']['name'] = 'Change %d' % idx
+            annot = Annotation().save(annot)
+        # The patched version uses the elements of the version before it
+        annot = Annotation().patchAnnotation(
+            annot, add=[{'type': 'point', 'center': [1, 1, 0]}], updateUser=admin)
+        elementCount = len(sampleAnnotation['elements']) + 1
+        # Remove an item without removing its annotations
+        deletedItem = Item().createItem('deleted', admin, publicFolder)
+        other = Annotation().createAnnotation(
+            deletedItem, admin, copy.deepcopy(sampleAnnotation))
+        Item().collection.delete_one({'_id': deletedItem['_id']})
+        abandonedVersion = Annotationelement().getNextVersionValue()
+        Annotationelement().collection.insert_one({
+            'annotationId': annot['_id'],
+            '_version': abandonedVersion,
+            'element': {'type': 'point', 'center': [0, 0, 0]},
+        })
+        old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=60)
+        Annotation().collection.update_many({}, {'$set': {'created': old, 'updated': old}})
+        Annotationelement().collection.update_many({}, {'$set': {'created': old}})
+
+        report = Annotation().removeOldAnnotations(False, 30, 0)
+        assert report == {
+            'fromDeletedItems': 1, 'oldVersions': 5, 'active': 1,
+            'recentVersions': 0, 'abandonedVersions': 1}
+        assert Annotation().removeOldAnnotations(False, 30, 2)['oldVersions'] == 3
+        report = Annotation().removeOldAnnotations(False, 30, 0, resumeAfter=str(annot['_id']))
+        assert report['fromDeletedItems'] == 1
+        assert report['oldVersions'] == 0
+
+        with mock.patch.object(annotation, 'OLD_VERSION_BATCH_SIZE', 2):
+            report = Annotation().removeOldAnnotations(True, 30, 0)
+        assert report['removedVersions'] == 7
+        assert len(list(Annotation().versionList(annot['_id'], force=True))) == 1
+        loaded = Annotation().load(annot['_id'], force=True)
+        assert len(loaded['annotation']['elements']) == elementCount
+        assert Annotation().findOne({'_id': other['_id']}) is None
+        assert Annotationelement().collection.count_documents(
+            {'annotationId': other['_id']}) == 0
+        assert Annotationelement().collection.count_documents(
+            {'_version': abandonedVersion}) == 0
+        report = Annotation().removeOldAnnotations(True, 30, 0)
+        assert report['removedVersions'] == 0
+
     def testPermissions(self, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
         item = Item().createItem('sample', admin, publicFolder)
@@ -530,6 +733,57 @@ class TestLargeImageAnnotationElement:
             'rotation': math.pi * 0.25})
         assert bbox['size'] == pytest.approx(4, 1.0e-4)
 
+    @mock.patch.object(annotationelement, 'BBOX_BATCH_POINTS', 5)
+    def testBoundingBoxes(self):
+        model = Annotationelement()
+        elements = [
+            {'type': 'polyline', 'points': [[1, -2, 3], [-4, 5, -6], [7, -8, 9]]},
+            {'type': 'polyline', 'points': [[x * 100.5, x * x, 0] for x in range(20)]},
+            {'type': 'heatmap', 'points': [[1, 2, 0, 4], [3, 1, 0, 5]]},
+            {'type': 'point', 'center': [1, -2, 3]},
+            {'type': 'circle', 'center': [1, -2, 3], 'radius': 4},
+            {'type': 'rectangle', 'center': [1, -2, 3], 'width': 2, 'height': 4},
+            {'type': 'ellipse', 'center': [1000, -2, 3], 'width': 2000, 'height': 4,
+             'rotation': math.pi * 0.25},
+            {'type': 'griddata', 'origin': [0, 0, 0], 'dx': 2, 'dy': 3, 'gridWidth': 5,
+             'values': [1] * 20},
+            {'type': 'polyline', 'points': [[5, 6, 0], [7, 8, 0]]},
+        ]
+        bboxes = model._boundingBoxes(elements)
+        for element, bbox in zip(elements, bboxes):
+            expected = model._boundingBox(element)
+            expected['cell'] = model._boundingBoxCell(expected)
+            assert bbox == pytest.approx(expected)
+
+    def testBoundingBoxCell(self):
+        model = Annotationelement()
+        cell = model._boundingBoxCell({'lowx': 10, 'lowy': 300, 'highx': 20, 'highy': 310})
+        assert cell == model._cellKey(0, 0, 1)
+        cell = model._boundingBoxCell({'lowx': -310, 'lowy': 0, 'highx': 290, 'highy': 10})
+        assert cell == model._cellKey(2, -1, 0)
+        assert model._cellKey(1, 0, 0) > model._cellKey(0, 1000, 1000)
+        assert model._cellKey(0, 5, 2) < model._cellKey(0, 0, 3)
+        cell = model._boundingBoxCell({'lowx': 0, 'lowy': 0, 'highx': 1e308, 'highy': 10})
+        assert cell >> (annotationelement.CELL_BITS * 2) == annotationelement.CELL_MAX_LEVEL
+        for bbox in [
+            {'lowx': -1e308, 'lowy': 0, 'highx': 1e308, 'highy': 10},
+            {'lowx': 0, 'lowy': 0, 'highx': math.inf, 'highy': 10},
+            {'lowx': math.nan, 'lowy': 0, 'highx': math.nan, 'highy': 0},
+        ]:
+            assert model._boundingBoxCell(bbox) == annotationelement.CELL_OVERFLOW
+        bounds = [[10, 300, 20, 310], [-310, 0, 290, 10], [0, 0, 1e308, 10],
+                  [-1e308, 0, 1e308, 10], [0, 0, math.inf, 10], [math.nan, 0, math.nan, 0]]
+        assert model._boundingBoxCells(np.array(bounds)) == [
+            model._boundingBoxCell(dict(zip(('lowx', 'lowy', 'highx', 'highy'), bbox)))
+            for bbox in bounds]
+        bboxes = model._boundingBoxes([
+            {'type': 'rectangle', 'center': [0, 0, 0], 'width': math.inf, 'height': 1},
+            {'type': 'point', 'center': [math.nan, 0, 0]},
+            {'type': 'point', 'center': [10, 300, 0]}])
+        assert [bbox['cell'] for bbox in bboxes] == [
+            annotationelement.CELL_OVERFLOW, annotationelement.CELL_OVERFLOW,
+            model._cellKey(0, 0, 1)]
+
     def testGetElements(self, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
         item = Item().createItem('sample', admin, publicFolder)
@@ -555,6 +809,7 @@ class TestLargeImageAnnotationElement:
         Annotationelement().getElements(annot, {
             'left': 3000, 'right': 4000, 'top': 4500, 'bottom': 6500})
         assert len(annot['annotation']['elements']) == 157
+        assert '$or' in annot['_elementQuery']['filter']
         annot.pop('elements', None)
         annot.pop('_elementQuery', None)
         Annotationelement().getElements(annot, {
@@ -580,6 +835,21 @@ class TestLargeImageAnnotationElement:
         assert (elements[0]['width'] * elements[0]['height'] <
                 elements[-1]['width'] * elements[-1]['height'])
 
+    def testGetElementsWithoutCells(self, admin):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        item = Item().createItem('sample', admin, publicFolder)
+        largeSample = makeLargeSampleAnnotation()
+        annot = Annotation().createAnnotation(item, admin, largeSample.copy())
+        # Elements saved before the spatial index existed don't have cells
+        Annotationelement().collection.update_many(
+            {'annotationId': annot['_id']}, {'$unset': {'bbox.cell': True}})
+        annot.pop('elements', None)
+        annot.pop('_elementQuery', None)
+        Annotationelement().getElements(annot, {
+            'left': 3000, 'right': 4000, 'top': 4500, 'bottom': 6500})
+        assert len(annot['annotation']['elements']) == 157
+        assert '$or' not in annot['_elementQuery']['filter']
+
     def testGetElementsByCentroids(self, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
         item = Item().createItem('sample', admin, publicFolder)
@@ -597,6 +867,40 @@ class TestLargeImageAnnotationElement:
         elements = annot['annotation']['elements']
         assert isinstance(elements[0], list)
 
+    def testLargeElementsAsFiles(self, admin):
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        item = Item().createItem('sample', admin, publicFolder)
+        points = [[x, x * 0.5, 0] for x in range(20000)]
+        values = [x / 3 for x in range(20000)]
+        annot = Annotation().createAnnotation(item, admin, {'elements': [{
+            'type': 'polyline',
+            'points': points,
+            'closed': False,
+        }, {
+            'type': 'griddata',
+            'gridWidth': 200,
+            'values': values,
+        }]})
+        entries = list(Annotationelement().find({'annotationId': annot['_id']}))
+        assert all(entry['datafile']['format'] == 'npy' for entry in entries)
+        loaded = Annotation().load(annot['_id'], user=admin)
+        elements = loaded['annotation']['elements']
+        assert elements[0]['points'] == points
+        assert elements[1]['values'] == values
+        elements = list(Annotationelement().yieldElements(loaded, numpyArrays=True))
+        assert isinstance(elements[0]['points'], np.ndarray)
+        assert elements[0]['points'].dtype == np.float32
+        assert elements[1]['values'].dtype == np.float64
+
+    def testTypedArray(self):
+        model = Annotationelement()
+        assert model._typedArray([[1, 2, 0], [3, 4, 0]]).dtype == np.int32
+        assert model._typedArray([1, 2 ** 40]).dtype == np.int64
+        assert model._typedArray([0.5, 1.25]).dtype == np.float32
+        assert model._typedArray([0.1, 1.25]).dtype == np.float64
+        assert model._typedArray([[1, 2], [3]]) is None
+        assert model._typedArray(['a', 'b']) is None
+
     def testRemoveWithQuery(self, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
         item = Item().createItem('sample', admin, publicFolder)
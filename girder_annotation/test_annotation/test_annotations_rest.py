@@ -1,7 +1,10 @@
 import copy
+import io
 import json
 import struct
+from unittest import mock
 
+import PIL.Image
 import pytest
 
 from . import girder_utilities as utilities
@@ -150,6 +153,151 @@ class TestLargeImageAnnotationRest:
         assert 'bbox' in resp.json['_elementQuery']
         assert '_bbox' in resp.json['annotation']['elements'][0]
 
+    def testGetAnnotationVectorTile(self, server, admin, fsAssetstore):
+        file = utilities.uploadTestFile('grey10kx5k.tif', admin, fsAssetstore)
+        item = Item().load(file['itemId'], force=True)
+        annot = Annotation().createAnnotation(item, admin, makeLargeSampleAnnotation())
+        annotId = str(annot['_id'])
+
+        def parseTile(data):
+            headerLen = struct.unpack('<I', data[:4])[0]
+            header = json.loads(data[4:4 + headerLen])
+            pos = 4 + headerLen
+            records = []
+            while pos < len(data):
+                _, prop, geomType, numParts = struct.unpack('<12sIBH', data[pos:pos + 19])
+                pos += 19
+                parts = []
+                for _ in range(numParts):
+                    count = struct.unpack('<I', data[pos:pos + 4])[0]
+                    parts.append(struct.unpack(
+                        '<%dh' % (count * 2), data[pos + 4:pos + 4 + count * 4]))
+                    pos += 4 + count * 4
+                records.append((prop, geomType, parts))
+            return header, records
+
+        resp = server.request(
+            path='/annotation/%s/tiles/6/12/18' % annotId, user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        header, records = parseTile(utilities.getBody(resp, text=False))
+        assert header['count'] == len(records)
+        assert header['unit'] == 0.0625
+        assert header['left'] == 3072
+        assert len(records) > 100
+        assert all(geomType == 3 for _, geomType, _ in records)
+        assert all(len(parts[0]) >= 6 for _, _, parts in records)
+        assert all(-64 <= val <= 4096 + 64 for _, _, parts in records for val in parts[0])
+        assert header['props'][records[0][0]][0] == 'rectangle'
+        resp = server.request(
+            path='/annotation/%s/tiles/0/0/0' % annotId, user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        header0, records0 = parseTile(utilities.getBody(resp, text=False))
+        assert header0['unit'] == 4
+        assert 0 < len(records0) < 1000
+        resp = server.request(
+            path='/annotation/%s/tiles/7/0/0' % annotId, user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 404
+
+        publicFolder = utilities.namedFolder(admin, 'Public')
+        item = Item().createItem('sample', admin, publicFolder)
+        annot = Annotation().createAnnotation(item, admin, sampleAnnotation)
+        resp = server.request(
+            path='/annotation/%s/tiles/0/0/0' % annot['_id'], user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 400
+
+    def testGetAnnotationRasterTile(self, server, admin, fsAssetstore):
+        file = utilities.uploadTestFile('grey10kx5k.tif', admin, fsAssetstore)
+        item = Item().load(file['itemId'], force=True)
+        annot = Annotation().createAnnotation(item, admin, {'elements': [{
+            'type': 'rectangle',
+            'center': [100, 100, 0],
+            'width': 50,
+            'height': 50,
+            'rotation': 0,
+            'fillColor': 'rgba(255, 0, 0, 1)',
+            'lineColor': 'rgb(0, 0, 255)',
+            'lineWidth': 3,
+        }, {
+            'type': 'griddata',
+            'interpretation': 'choropleth',
+            'origin': [150, 150, 0],
+            'dx': 20,
+            'dy': 20,
+            'gridWidth': 2,
+            'values': [0, 1, 1, 0],
+        }]})
+        resp = server.request(
+            path='/annotation/%s/tiles/raster/6/0/0' % annot['_id'], user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        assert resp.headers['Content-Type'] == 'image/png'
+        image = PIL.Image.open(io.BytesIO(utilities.getBody(resp, text=False)))
+        assert image.mode == 'RGBA'
+        assert image.size == (256, 256)
+        assert image.getpixel((100, 100)) == (255, 0, 0, 255)
+        assert image.getpixel((75, 100)) == (0, 0, 255, 255)
+        assert image.getpixel((10, 10))[3] == 0
+        assert image.getpixel((155, 155))[3] == 0
+        assert image.getpixel((175, 155)) == (255, 255, 0, 255)
+        resp = server.request(
+            path='/annotation/%s/tiles/raster/6/0/0' % annot['_id'], user=admin,
+            params={'encoding': 'JPEG'}, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        assert resp.headers['Content-Type'] == 'image/jpeg'
+
+    def testGetAnnotationTilesPoints(self, server, admin, fsAssetstore):
+        file = utilities.uploadTestFile('grey10kx5k.tif', admin, fsAssetstore)
+        item = Item().load(file['itemId'], force=True)
+        annot = Annotation().createAnnotation(item, admin, {'elements': [{
+            'type': 'point',
+            'center': [640, 640, 0],
+            'lineColor': 'rgb(0, 0, 255)',
+        }, {
+            'type': 'rectangle',
+            'center': [3200, 640, 0],
+            'width': 2,
+            'height': 2,
+            'rotation': 0,
+        }]})
+        # Points are included at zoomed out levels where they are smaller
+        # than a tile pixel
+        resp = server.request(
+            path='/annotation/%s/tiles/0/0/0' % annot['_id'], user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        data = utilities.getBody(resp, text=False)
+        headerLen = struct.unpack('<I', data[:4])[0]
+        header = json.loads(data[4:4 + headerLen])
+        assert header['count'] == 1
+        assert struct.unpack('<B', data[4 + headerLen + 16:4 + headerLen + 17])[0] == 1
+        resp = server.request(
+            path='/annotation/%s/tiles/raster/0/0/0' % annot['_id'], user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        image = PIL.Image.open(io.BytesIO(utilities.getBody(resp, text=False)))
+        assert image.crop((0, 0, 20, 20)).getextrema()[3][1] == 255
+        assert image.crop((40, 0, 60, 20)).getextrema()[3][1] == 0
+
+    def testGetAnnotationRasterTileMissingPixelmap(self, server, admin, fsAssetstore):
+        from girder_large_image_annotation.utils.tiles import _rasterPixelmap
+
+        file = utilities.uploadTestFile('grey10kx5k.tif', admin, fsAssetstore)
+        item = Item().load(file['itemId'], force=True)
+        pixelmapFile = utilities.uploadTestFile('grey10kx5k.tif', admin, fsAssetstore)
+        annot = Annotation().createAnnotation(item, admin, {'elements': [{
+            'type': 'pixelmap',
+            'girderId': str(pixelmapFile['itemId']),
+            'values': [0, 1],
+            'categories': [{'fillColor': 'rgba(255, 0, 0, 1)'}],
+            'boundaries': False,
+        }]})
+        # Rendering skips a pixelmap whose image was deleted
+        Item().remove(Item().load(pixelmapFile['itemId'], force=True))
+        resp = server.request(
+            path='/annotation/%s/tiles/raster/6/0/0' % annot['_id'], user=admin, isJson=False)
+        assert utilities.respStatus(resp) == 200
+        image = PIL.Image.open(io.BytesIO(utilities.getBody(resp, text=False)))
+        assert image.getextrema()[3] == (0, 0)
+        region = {'left': 0, 'top': 0, 'scale': 1}
+        assert _rasterPixelmap({'girderId': 'not an id'}, region, (256, 256), admin) is None
+
     def testAnnotationCopy(self, server, admin):
         publicFolder = utilities.namedFolder(admin, 'Public')
         # create annotation on an item
@@ -851,6 +999,42 @@ class TestLargeImageAnnotationElementGroups:
         assert utilities.respStatus(resp) == 200
         assert resp.json == 1
 
+    def testGeoJSONChunks(self, server, admin):
+        import girder_large_image_annotation
+
+        elements = [{
+            'type': 'arrow',
+            'points': [[0, 0, 0], [10, 10, 0]],
+        }] + [{
+            'type': 'polyline',
+            'points': [[idx, 6, 0], [-17, idx, 0], [56, -45, 6]],
+            'closed': bool(idx % 2),
+            'holes': [[[10, 10, 0], [20, 30, 0], [10, 30, 0]]] if idx % 2 else [],
+            'label': {'value': 'polyline %d' % idx},
+        } for idx in range(7)] + [{
+            'type': 'point',
+            'center': [123.3, 144.6, -123],
+        }]
+        annot = Annotation().createAnnotation(
+            self.item, admin, {'name': 'sample', 'elements': elements})
+        geojson = girder_large_image_annotation.utils.AnnotationGeoJSON(annot['_id'])
+        expected = json.loads(''.join(geojson))
+        assert len(expected['features']) == 8
+        with mock.patch.object(girder_large_image_annotation.utils, 'GeoJSONBatchSize', 2):
+            chunks = list(geojson.chunks())
+        assert len(chunks) == 7
+        assert json.loads(b''.join(chunks)) == expected
+        assert json.loads(geojson.geojson) == expected
+
+        resp = server.request('/annotation/%s/geojson' % str(annot['_id']), user=admin)
+        assert utilities.respStatus(resp) == 200
+        assert resp.json == expected
+        assert resp.json['features'][0]['properties']['annotation']['name'] == 'sample'
+
+        with pytest.raises(Exception, match='cannot be represented'):
+            list(girder_large_image_annotation.utils.AnnotationGeoJSON(
+                annot['_id'], mustConvert=True).chunks())
+
 
 @pytest.mark.usefixtures('unbindLargeImage', 'unbindAnnotation')
 @pytest.mark.plugin('large_image_annotation')
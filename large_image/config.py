@@ -4,7 +4,7 @@ import logging
 import os
 import pathlib
 import re
-from typing import Any, Optional, Union, cast
+from typing import Any, Optional, Set, Union, cast
 
 from . import exceptions
 
@@ -61,11 +61,32 @@ ConfigValues = {
     'max_annotation_input_file_length': 1 * 1024 ** 3 if not HAS_PSUTIL else max(
         1 * 1024 ** 3, psutil.virtual_memory().total // 16),
 
+    # Asyncio methods run blocking tile source calls on a shared thread pool
+    # with this many workers; None uses the ThreadPoolExecutor default.
+    'async_max_workers': None,
+    # The maximum number of asyncio calls that run at once for any one tile
+    # source.
+    'async_source_concurrency': 4,
+
+    # Tile source classes are described in a manifest in this directory so
+    # that their modules are only imported when they are used.  None uses the
+    # user cache directory; False imports all sources when any is needed.
+    'source_manifest_directory': None,
+
+    # If set, remember which tile source reads each local file so that later
+    # opens skip trying other sources.  This is either True to use a file in
+    # the user cache directory or the path of a sqlite database.
+    'source_selection_cache_path': None,
+
     # Any path that matches here will only be opened by a source that matches
     # extension or mime type.
     'all_sources_ignored_names': r'(\.mrxs|\.vsi)$',
 }
 
+# The keys that have been set with setConfig, as opposed to defaults added to
+# ConfigValues by large_image and its sources.
+_explicitKeys: Set[str] = set()
+
 
 # Fix when we drop Python 3.8 to just be @functools.cache
 @functools.lru_cache(maxsize=None)
@@ -117,11 +138,42 @@ def setConfig(key: str, value: Optional[Union[str, bool, int, logging.Logger]])
     :param value: the value to store in the key.
     """
     curConfig = getConfig()
+    _explicitKeys.add(key)
     if curConfig.get(key) is not value:
         curConfig[key] = value
         getConfig.cache_clear()
 
 
+def explicitConfigKeys() -> Set[str]:
+    """
+    Get the config keys that have been set with setConfig or environment
+    variables rather than only having default values.  Sources add their
+    defaults when they are imported, so these are the keys whose values don't
+    depend on which sources have been imported.
+
+    :returns: a set of config keys.  Keys from environment variables are in
+        lower case.
+    """
+    keys = set(_explicitKeys)
+    keys.update(
+        envKey[len('LARGE_IMAGE_'):].lower() for envKey in os.environ
+        if envKey.startswith('LARGE_IMAGE_'))
+    return keys
+
+
+def userCachePath(*parts: str) -> str:
+    """
+    Get a path in the user cache directory used by large_image.  This is
+    based on the XDG_CACHE_HOME environment variable, defaulting to
+    ~/.cache/large_image.
+
+    :param parts: optional path components within the cache directory.
+    :returns: the path.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'large_image', *parts)
+
+
 def _ignoreSourceNames(
         configKey: str, path: Union[str, pathlib.Path], default: Optional[str] = None) -> None:
     """
@@ -51,6 +51,10 @@ TileOutputMimeTypes = {
     #   https://docs.oracle.com/javase/8/docs/api/javax/imageio/metadata/
     #                           doc-files/jpeg_metadata.html
     'JFIF': 'image/jpeg',
+    # NPY is a numpy .npy file.  It is lossless, preserves the data type, and
+    # is fast to encode and decode, but is only useful for internal pipelines
+    # since browsers can't display it.
+    'NPY': 'application/x-npy',
 }
 TileOutputPILFormat = {
     'JFIF': 'JPEG',
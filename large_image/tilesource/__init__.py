@@ -4,7 +4,7 @@ import sys
 import uuid
 from importlib.metadata import entry_points
 from pathlib import PosixPath
-from typing import Any, Dict, List, Optional, Tuple, Type, Union, cast
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union, cast
 
 from .. import config
 from ..constants import NEW_IMAGE_PATH_FLAG, SourcePriority
@@ -12,11 +12,28 @@ from ..exceptions import (TileGeneralError, TileGeneralException,
                           TileSourceAssetstoreError,
                           TileSourceAssetstoreException, TileSourceError,
                           TileSourceException, TileSourceFileNotFoundError)
+from . import selectioncache
 from .base import (TILE_FORMAT_IMAGE, TILE_FORMAT_NUMPY, TILE_FORMAT_PIL,
                    FileTileSource, TileOutputMimeTypes, TileSource,
                    dictToEtree, etreeToDict, nearPowerOfTwo)
+from .registry import LazySourceDict, loadEntryPoints
+from .sniff import sniffFormats
 
-AvailableTileSources: Dict[str, Type[FileTileSource]] = {}
+AvailableTileSources: Dict[str, Type[FileTileSource]] = LazySourceDict()
+
+
+def _peekSource(availableSources: Dict[str, Type[FileTileSource]], sourceName: str) -> Any:
+    """
+    Get a source class or, if the source has not been imported, a stand-in
+    with the class attributes used to select a source.
+
+    :param availableSources: an ordered dictionary of sources.
+    :param sourceName: a key in availableSources.
+    :returns: a tile source class or a stand-in.
+    """
+    if isinstance(availableSources, LazySourceDict):
+        return availableSources.peek(sourceName)
+    return availableSources[sourceName]
 
 
 def isGeospatial(path: Union[str, PosixPath]) -> bool:
@@ -29,11 +46,13 @@ def isGeospatial(path: Union[str, PosixPath]) -> bool:
     if not len(AvailableTileSources):
         loadTileSources()
     for sourceName in sorted(AvailableTileSources):
-        source = AvailableTileSources[sourceName]
+        if not getattr(_peekSource(AvailableTileSources, sourceName), 'hasIsGeospatial', True):
+            continue
+        source = AvailableTileSources.get(sourceName)
         if hasattr(source, 'isGeospatial'):
             result = None
             try:
-                result = source.isGeospatial(path)
+                result = source.isGeospatial(path)  # type: ignore[union-attr]
             except Exception:
                 pass
             if result in (True, False):
@@ -45,7 +64,9 @@ def loadTileSources(entryPointName: str = 'large_image.source',
                     sourceDict: Dict[str, Type[FileTileSource]] = AvailableTileSources) -> None:
     """
     Load all tilesources from entrypoints and add them to the
-    AvailableTileSources dictionary.
+    AvailableTileSources dictionary.  If the dictionary is a LazySourceDict,
+    sources that are described by the source manifest are added without
+    importing their modules; they are imported when they are first used.
 
     :param entryPointName: the name of the entry points to load.
     :param sourceDict: a dictionary to populate with the loaded sources.
@@ -54,15 +75,38 @@ def loadTileSources(entryPointName: str = 'large_image.source',
     # Python 3.10 uses select and deprecates dictionary interface
     epointList = epoints.select(group=entryPointName) if hasattr(
         epoints, 'select') else epoints.get(entryPointName, [])
-    for entryPoint in epointList:
-        try:
-            sourceClass = entryPoint.load()
-            if sourceClass.name and None in sourceClass.extensions:
-                sourceDict[entryPoint.name] = sourceClass
-                config.getLogger('logprint').debug('Loaded tile source %s' % entryPoint.name)
-        except Exception:
-            config.getLogger('logprint').exception(
-                'Failed to loaded tile source %s' % entryPoint.name)
+    loadEntryPoints(epointList, entryPointName, sourceDict)
+
+
+def _applySignatures(
+        signatures: Optional[Dict[Optional[str], SourcePriority]], formats: Set[str],
+        priority: SourcePriority, fallback: bool) -> Tuple[SourcePriority, bool]:
+    """
+    Adjust the priority of a source based on the formats identified from the
+    contents of a file.
+
+    :param signatures: the signatures dictionary of the source.
+    :param formats: a set of format names from sniffFormats.
+    :param priority: the priority of the source based on the file's name and
+        mime type.
+    :param fallback: True if the file's name and mime type did not match the
+        source.
+    :returns: the adjusted priority and fallback flag.
+    """
+    if not signatures or not formats:
+        return priority, fallback
+    matches = [signatures[key] for key in formats if key in signatures]
+    if not matches:
+        # The file is a known format that this source doesn't list.  An
+        # explicit match on the file's name or mime type still takes
+        # precedence.
+        if None in signatures and fallback:
+            priority = max(priority, signatures[None])
+        return priority, fallback
+    if fallback and min(matches) < SourcePriority.FALLBACK_HIGH:
+        priority = min(priority, min(matches))
+        fallback = False
+    return priority, fallback
 
 
 def getSortedSourceList(
@@ -71,52 +115,69 @@ def getSortedSourceList(
 ) -> List[Tuple[bool, bool, SourcePriority, str]]:
     """
     Get an ordered list of sources where earlier sources are more likely to
-    work for a specified path or uri.
+    work for a specified path or uri.  For local files, the start of the file
+    is checked for known formats, which are matched against the signatures
+    of each source.
 
     :param availableSources: an ordered dictionary of sources to try.
     :param pathOrUri: either a file path or a fixed source via
         large_image://<source>.
     :param mimeType: the mimetype of the file, if known.
     :returns: a list of (clash, fallback, priority, sourcename) for sources
-        where sourcename is a key in availableSources.
+        where sourcename is a key in availableSources.  clash is only set if
+        the sources differ in a property that the file can be checked for,
+        such as being geospatial.
     """
     uriWithoutProtocol = str(pathOrUri).split('://', 1)[-1]
     isLargeImageUri = str(pathOrUri).startswith('large_image://')
     baseName = os.path.basename(uriWithoutProtocol)
     extensions = [ext.lower() for ext in baseName.split('.')[1:]]
-    properties = {
-        '_geospatial_source': isGeospatial(pathOrUri),
-    }
     isNew = str(pathOrUri).startswith(NEW_IMAGE_PATH_FLAG)
     ignored_names = config.getConfig('all_sources_ignored_names')
     ignoreName = (ignored_names and re.search(
         ignored_names, os.path.basename(str(pathOrUri)), flags=re.IGNORECASE))
-    sourceList = []
+    formats = sniffFormats(pathOrUri) if any(
+        getattr(_peekSource(availableSources, sourceName), 'signatures', None)
+        for sourceName in availableSources) else set()
+    candidates = []
     for sourceName in availableSources:
-        sourceExtensions = availableSources[sourceName].extensions
+        source = _peekSource(availableSources, sourceName)
+        sourceExtensions = source.extensions
         priority = sourceExtensions.get(None, SourcePriority.MANUAL)
         fallback = True
-        if isNew and getattr(availableSources[sourceName], 'newPriority', None) is not None:
-            priority = min(priority, cast(SourcePriority, availableSources[sourceName].newPriority))
-        if (mimeType and getattr(availableSources[sourceName], 'mimeTypes', None) and
-                mimeType in availableSources[sourceName].mimeTypes):
-            priority = min(priority, availableSources[sourceName].mimeTypes[mimeType])
+        if isNew and getattr(source, 'newPriority', None) is not None:
+            priority = min(priority, cast(SourcePriority, source.newPriority))
+        if (mimeType and getattr(source, 'mimeTypes', None) and
+                mimeType in source.mimeTypes):
+            priority = min(priority, source.mimeTypes[mimeType])
             fallback = False
-        for regex in getattr(availableSources[sourceName], 'nameMatches', {}):
+        for regex in getattr(source, 'nameMatches', {}):
             if re.match(regex, baseName):
-                priority = min(priority, availableSources[sourceName].nameMatches[regex])
+                priority = min(priority, source.nameMatches[regex])
                 fallback = False
         for ext in extensions:
             if ext in sourceExtensions:
                 priority = min(priority, sourceExtensions[ext])
                 fallback = False
+        priority, fallback = _applySignatures(
+            getattr(source, 'signatures', None), formats, priority, fallback)
         if isLargeImageUri and sourceName == uriWithoutProtocol:
             priority = SourcePriority.NAMED
         if priority >= SourcePriority.MANUAL or (ignoreName and fallback):
             continue
+        candidates.append((source, fallback, priority, sourceName))
+    # Checking if a file is geospatial may import and use a geospatial source,
+    # so only do so if it would change the order of the candidates.
+    propertyGetters = {
+        '_geospatial_source': lambda: isGeospatial(pathOrUri),
+    }
+    properties = {
+        k: func() for k, func in propertyGetters.items()
+        if len({getattr(entry[0], k, False) for entry in candidates}) > 1}
+    sourceList = []
+    for source, fallback, priority, sourceName in candidates:
         propertiesClash = any(
-            getattr(availableSources[sourceName], k, False) != v
-            for k, v in properties.items())
+            getattr(source, k, False) != v for k, v in properties.items())
         sourceList.append((propertiesClash, fallback, priority, sourceName))
     return sourceList
 
@@ -136,12 +197,35 @@ def getSourceNameFromDict(
     :returns: the name of a tile source that can read the input, or None if
         there is no such source.
     """
+    return _getSourceNameAndOrigin(availableSources, pathOrUri, mimeType, *args, **kwargs)[0]
+
+
+def _getSourceNameAndOrigin(
+        availableSources: Dict[str, Type[FileTileSource]], pathOrUri: Union[str, PosixPath],
+        mimeType: Optional[str] = None, *args, **kwargs) -> Tuple[Optional[str], bool]:
+    """
+    Get a tile source name as in getSourceNameFromDict, consulting and
+    updating the source selection cache for local files.
+
+    :param availableSources: an ordered dictionary of sources to try.
+    :param pathOrUri: either a file path or a fixed source via
+        large_image://<source>.
+    :param mimeType: the mimetype of the file, if known.
+    :returns: the name of a tile source that can read the input or None, and
+        True if the name came from the source selection cache.
+    """
+    cacheKey = selectioncache.selectionKey(availableSources, pathOrUri, mimeType)
+    sourceName = selectioncache.lookup(cacheKey)
+    if sourceName is not None and sourceName in availableSources:
+        return sourceName, True
     sourceList = getSortedSourceList(availableSources, pathOrUri, mimeType, *args, **kwargs)
     for entry in sorted(sourceList):
         sourceName = entry[-1]
-        if availableSources[sourceName].canRead(pathOrUri, *args, **kwargs):
-            return sourceName
-    return None
+        sourceClass = availableSources.get(sourceName)
+        if sourceClass is not None and sourceClass.canRead(pathOrUri, *args, **kwargs):
+            selectioncache.store(cacheKey, sourceName)
+            return sourceName, False
+    return None, False
 
 
 def getTileSourceFromDict(
@@ -157,7 +241,14 @@ def getTileSourceFromDict(
         large_image://<source>.
     :returns: a tile source instance or and error.
     """
-    sourceName = getSourceNameFromDict(availableSources, pathOrUri, *args, **kwargs)
+    sourceName, cached = _getSourceNameAndOrigin(availableSources, pathOrUri, *args, **kwargs)
+    if sourceName and cached:
+        try:
+            return availableSources[sourceName](pathOrUri, *args, **kwargs)
+        except TileSourceError:
+            # The remembered source no longer reads the file, so choose again
+            selectioncache.forget(pathOrUri)
+        sourceName = getSourceNameFromDict(availableSources, pathOrUri, *args, **kwargs)
     if sourceName:
         return availableSources[sourceName](pathOrUri, *args, **kwargs)
     if not os.path.exists(pathOrUri) and '://' not in str(pathOrUri):
@@ -227,8 +318,9 @@ def canReadList(
     result = []
     for entry in sorted(sourceList):
         sourceName = entry[-1]
-        result.append((sourceName, AvailableTileSources[sourceName].canRead(
-            pathOrUri, *args, **kwargs)))
+        sourceClass = AvailableTileSources.get(sourceName)
+        if sourceClass is not None:
+            result.append((sourceName, sourceClass.canRead(pathOrUri, *args, **kwargs)))
     return result
 
 
@@ -0,0 +1,81 @@
+"""
+Asyncio support for tile sources.
+
+Tile sources are read with blocking calls.  The coroutines here run those
+calls on a shared thread pool so that they don't stall the event loop, and
+limit how many calls run at once for any single tile source so that one busy
+source doesn't monopolize the pool.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from .. import config
+
+if TYPE_CHECKING:
+    from .. import tilesource
+
+_asyncPool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_asyncPoolLock = threading.Lock()
+
+
+def getAsyncExecutor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Get the thread pool used to run blocking tile source calls for asyncio
+    methods.  This is created when first needed and is sized based on the
+    ``async_max_workers`` config value.  By default, this uses the
+    ThreadPoolExecutor default, which allows for tile reads that are bound by
+    file or network access rather than cpu.
+
+    :returns: the thread pool executor.
+    """
+    global _asyncPool
+
+    with _asyncPoolLock:
+        if _asyncPool is None:
+            _asyncPool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.getConfig('async_max_workers') or None,
+                thread_name_prefix='large_image_async')
+    return _asyncPool
+
+
+def _sourceSemaphore(
+        source: 'tilesource.TileSource',
+        loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+    """
+    Get the semaphore that limits concurrent calls on a tile source.
+    Semaphores are bound to an event loop, so there is one per loop.
+
+    :param source: the tile source.
+    :param loop: the running event loop.
+    :returns: a semaphore.
+    """
+    semaphores = source.__dict__.setdefault('_asyncSemaphores', weakref.WeakKeyDictionary())
+    semaphore = semaphores.get(loop)
+    if semaphore is None:
+        semaphore = semaphores.setdefault(loop, asyncio.Semaphore(
+            max(1, int(config.getConfig('async_source_concurrency', 4)))))
+    return semaphore
+
+
+async def runAsync(
+        source: 'tilesource.TileSource', func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking function on the asyncio thread pool, waiting if the tile
+    source already has as many calls in progress as the
+    ``async_source_concurrency`` config value allows.
+
+    :param source: the tile source whose concurrency limit applies.
+    :param func: the function to call.
+    :param args: positional arguments for the function.
+    :param kwargs: keyword arguments for the function.
+    :returns: the result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    async with _sourceSemaphore(source, loop):
+        return await loop.run_in_executor(
+            getAsyncExecutor(), functools.partial(func, *args, **kwargs))
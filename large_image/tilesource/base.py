@@ -57,6 +57,15 @@ class TileSource(IPyLeafletMixin):
     nameMatches: Dict[str, SourcePriority] = {
     }
 
+    # A dictionary of file formats identified from the contents of a file
+    # (see large_image.tilesource.sniff) and the ``SourcePriority`` given to
+    # each.  This is used when the file's name and mime type don't match the
+    # source.  If present, the None key is the priority when a file has a
+    # recognized format that isn't listed; SourcePriority.MANUAL means the
+    # source can't read such files.
+    signatures: Dict[Optional[str], SourcePriority] = {
+    }
+
     # If a source supports creating new tiled images, specify its basic
     # priority based on expected feature set
     newPriority: Optional[SourcePriority] = None
@@ -996,6 +1005,16 @@ class TileSource(IPyLeafletMixin):
                 (image.shape[0], image.shape[1], newwidth),
                 np.float32 if image.dtype != np.float64 else image.dtype)
         image = self._applyStyleFunction(image, sc, 'pre')
+        # Read all of the other frames that are needed at once
+        sc.frameTiles = {}
+        frames = sorted({
+            entry['frame'] if entry.get('frame') is not None else
+            sc.mainFrame + entry['framedelta']
+            for entry in sc.style['bands']
+            if ((entry.get('frame') is not None or entry.get('framedelta')) and
+                entry.get('frame') != sc.mainFrame)})
+        if len(frames) > 1:
+            sc.frameTiles = dict(zip(frames, self._getTileFrames(x, y, z, frames)))
         for eidx, entry in enumerate(sc.style['bands']):
             sc.styleIndex = eidx
             sc.dtype = sc.dtype if sc.dtype is not None else entry.get('dtype')
@@ -1014,8 +1033,10 @@ class TileSource(IPyLeafletMixin):
             else:
                 frame = entry['frame'] if entry.get('frame') is not None else (
                     sc.mainFrame + entry['framedelta'])
-                image = getattr(self, '_unstyledInstance', self).getTile(
-                    x, y, z, frame=frame, numpyAllowed=True)
+                image = sc.frameTiles.get(frame)
+                if image is None:
+                    image = getattr(self, '_unstyledInstance', self).getTile(
+                        x, y, z, frame=frame, numpyAllowed=True)
                 image = image[:sc.mainImage.shape[0],
                               :sc.mainImage.shape[1],
                               :sc.mainImage.shape[2]]
@@ -1219,6 +1240,11 @@ class TileSource(IPyLeafletMixin):
                 tile[contentHeight:] = color
         if isinstance(tile, np.ndarray) and numpyAllowed:
             return tile
+        if self.encoding == 'NPY' and not pilImageAllowed:
+            # Encode without converting to PIL to preserve the data type
+            return utilities._encodeImageBinary(
+                _imageToNumpy(tile)[0], self.encoding, self.jpegQuality,
+                self.jpegSubsampling, self.tiffCompression)
         tile = _imageToPIL(tile)
         if pilImageAllowed:
             return tile
@@ -1555,6 +1581,166 @@ class TileSource(IPyLeafletMixin):
         """
         raise NotImplementedError
 
+    async def agetTile(self, x: int, y: int, z: int, **kwargs) -> Any:
+        """
+        Get a tile from a tile source without blocking the asyncio event loop.
+        The tile is read by getTile on a thread pool shared by all tile
+        sources.  No more than the ``async_source_concurrency`` config value
+        of calls run at once for any one tile source; further calls wait
+        their turn without blocking the event loop.
+
+        :param x: the 0-based x position of the tile on the specified z level.
+        :param y: the 0-based y position of the tile on the specified z level.
+        :param z: the z level of the tile.
+        :param kwargs: optional arguments to pass to getTile, such as
+            pilImageAllowed, numpyAllowed, sparseFallback, or frame.
+        :returns: the value returned by getTile.
+        """
+        from .asynctiles import runAsync
+
+        return await runAsync(self, self.getTile, x, y, z, **kwargs)
+
+    def _getTileStack(
+            self, x: int, y: int, z: int, frames: List[int]) -> Optional[np.ndarray]:
+        """
+        Read the same tile from several frames in a single call.  Sources that
+        store frames contiguously can override this.
+
+        :param x: the 0-based x position of the tile on the specified z level.
+        :param y: the 0-based y position of the tile on the specified z level.
+        :param z: the z level of the tile.
+        :param frames: a list of frame numbers.
+        :returns: None if the frames cannot be read together.  Otherwise, a
+            numpy array of (frames, height, width, bands).  The height and
+            width may be smaller than the tile size on the edges of the image.
+        """
+        return None
+
+    def _getTileFrames(
+            self, x: int, y: int, z: int, frames: List[int],
+            max_workers: Optional[int] = -4, **kwargs) -> List[np.ndarray]:
+        """
+        Get the same unstyled tile from several frames.  If the source can
+        read the frames together, this is done in one call; otherwise, the
+        frames are read in parallel.
+
+        :param x: the 0-based x position of the tile on the specified z level.
+        :param y: the 0-based y position of the tile on the specified z level.
+        :param z: the z level of the tile.
+        :param frames: a list of frame numbers.
+        :param max_workers: maximum workers for parallelism.  If negative, use
+            the minimum of the absolute value of this number or
+            multiprocessing.cpu_count().
+        :param kwargs: optional arguments to pass to getTile.
+        :returns: a list of numpy arrays, one per frame.
+        """
+        import concurrent.futures
+
+        source = getattr(self, '_unstyledInstance', self)
+        stack = None
+        if not source.edge and not hasattr(source, '_iccprofiles'):
+            stack = source._getTileStack(x, y, z, frames)
+        if stack is not None:
+            if len(stack.shape) == 3:
+                stack = stack[:, :, :, np.newaxis]
+            if stack.shape[1] != self.tileHeight or stack.shape[2] != self.tileWidth:
+                extend = np.zeros(
+                    (stack.shape[0], self.tileHeight, self.tileWidth, stack.shape[3]),
+                    dtype=stack.dtype)
+                extend[:, :min(self.tileHeight, stack.shape[1]),
+                       :min(self.tileWidth, stack.shape[2])] = stack
+                stack = extend
+            return list(stack)
+
+        def read(frame: int) -> np.ndarray:
+            tile = source.getTile(x, y, z, frame=frame, numpyAllowed='always', **kwargs)
+            if not isinstance(tile, np.ndarray) or len(tile.shape) != 3:
+                tile, _ = _imageToNumpy(tile)
+            return tile
+
+        if max_workers is not None and max_workers < 0:
+            max_workers = min(-max_workers, config.cpu_count(False))
+        if len(frames) > 1 and max_workers != 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+                return list(pool.map(read, frames))
+        return [read(frame) for frame in frames]
+
+    def getTileStack(
+            self, x: int, y: int, z: int, frames: Optional[List[int]] = None,
+            max_workers: Optional[int] = -4, **kwargs) -> np.ndarray:
+        """
+        Get the same tile from several frames as a single numpy array.  The
+        style is not applied.  Sources that store frames contiguously read
+        the frames in one call; otherwise, the frames are read in parallel.
+
+        :param x: the 0-based x position of the tile on the specified z level.
+        :param y: the 0-based y position of the tile on the specified z level.
+        :param z: the z level of the tile.
+        :param frames: a list of frame numbers.  None for all frames.
+        :param max_workers: maximum workers for parallelism when reading
+            frames separately.  If negative, use the minimum of the absolute
+            value of this number or multiprocessing.cpu_count().
+        :param kwargs: optional arguments to pass to getTile, such as
+            sparseFallback.
+        :returns: a numpy array of (frames, height, width, bands).  If frames
+            have different numbers of bands, only the bands common to all
+            frames are included.
+        """
+        frames = list(range(self.frames)) if frames is None else [int(f) for f in frames]
+        if not frames:
+            msg = 'At least one frame must be specified.'
+            raise ValueError(msg)
+        tiles = self._getTileFrames(x, y, z, frames, max_workers, **kwargs)
+        shape = tuple(min(tile.shape[axis] for tile in tiles) for axis in range(3))
+        return np.stack([tile[:shape[0], :shape[1], :shape[2]] for tile in tiles])
+
+    def asDaskArray(
+            self, level: Optional[int] = None, frames: Optional[List[int]] = None,
+            chunks: Optional[Union[int, Tuple[int, ...]]] = None) -> Any:
+        """
+        Get a lazy dask array of the unstyled pixels of the image.  Each chunk
+        is read from the native tiles that it covers when it is computed.  The
+        tile source is pickled to send chunks to dask workers.  This requires
+        the dask package.
+
+        :param level: the level to read.  None for the maximum level.
+        :param frames: a list of frame numbers.  If None, all frames are
+            included, but the array only has a frame axis if there is more
+            than one frame.
+        :param chunks: the chunk size.  None for the native tile size, an
+            integer for square chunks, a tuple of (height, width), or a tuple
+            of (frames, height, width).  The height and width are rounded up
+            to a multiple of the native tile size.  By default, each chunk has
+            one frame.
+        :returns: a dask array of (frames, y, x, bands) or (y, x, bands).
+        """
+        from .daskarray import asDaskArray
+
+        return asDaskArray(self, level, frames, chunks)
+
+    def asXarray(
+            self, level: Optional[int] = None, frames: Optional[List[int]] = None,
+            chunks: Optional[Union[int, Tuple[int, ...]]] = None) -> Any:
+        """
+        Get a lazy xarray DataArray of the unstyled pixels of the image.  This
+        is the same as asDaskArray with labelled axes.  If all frames are
+        included and they form a complete grid of the axes in the metadata's
+        IndexRange, the frame axis is split into those axes (e.g., ``c``,
+        ``z``, ``t``, ``xy``), and channel names are used as the ``c``
+        coordinates.  Otherwise, there is a single ``frame`` axis.  The last
+        axes are ``y``, ``x``, and ``s`` (bands); ``y`` and ``x`` coordinates
+        are in base image pixels.  This requires the dask and xarray
+        packages.
+
+        :param level: the level to read.  None for the maximum level.
+        :param frames: a list of frame numbers.  None for all frames.
+        :param chunks: the chunk size.  See asDaskArray.
+        :returns: an xarray DataArray backed by a dask array.
+        """
+        from .daskarray import asXarray
+
+        return asXarray(self, level, frames, chunks)
+
     def getTileMimeType(self) -> str:
         """
         Return the default mimetype for image tiles.
@@ -1794,6 +1980,24 @@ class TileSource(IPyLeafletMixin):
                 _imageToPIL(cast(np.ndarray, image), mode), maxWidth, maxHeight, kwargs['fill'])
         return utilities._encodeImage(cast(np.ndarray, image), format=format, **kwargs)
 
+    async def agetRegion(
+            self, format: Union[str, Tuple[str]] = (TILE_FORMAT_IMAGE, ), **kwargs) -> Tuple[
+            Union[np.ndarray, PIL.Image.Image, ImageBytes, bytes, pathlib.Path], str]:
+        """
+        Get a rectangular region from the current tile source without blocking
+        the asyncio event loop.  This runs getRegion on the asyncio thread
+        pool; see agetTile for how concurrency is limited.
+
+        :param format: the desired format or a tuple of allowed formats.  See
+            getRegion.
+        :param kwargs: optional arguments.  See getRegion.
+        :returns: regionData, formatOrRegionMime: the image data and either
+            the mime type, if the format is TILE_FORMAT_IMAGE, or the format.
+        """
+        from .asynctiles import runAsync
+
+        return await runAsync(self, self.getRegion, format=format, **kwargs)
+
     def _encodeTiledImage(
             self, image: Dict[str, Any], outWidth: int, outHeight: int,
             iterInfo: Dict[str, Any], **kwargs) -> Tuple[pathlib.Path, str]:
@@ -2295,8 +2499,15 @@ class TileSource(IPyLeafletMixin):
             Some of these are aliased: 'none', 'lzw', 'deflate'.
         :param frame: the frame number within the tile source.  None is the
             same as 0 for multi-frame sources.
+        :param frames: if present, a list of frame numbers.  Each tile is a
+            numpy array of (frames, height, width, bands) with the unstyled
+            data of these frames (see getTileStack).  The format must allow
+            numpy arrays and tiles cannot be resampled.
         :param kwargs: optional arguments.
-        :yields: an iterator that returns a dictionary as listed above.
+        :yields: an iterator that returns a dictionary as listed above.  This
+            can also be used with ``async for``, in which case each tile is
+            read on the asyncio thread pool before it is yielded (see
+            agetTile).
         """
         return TileIterator(self, format=format, resample=resample, **kwargs)
 
@@ -2423,6 +2634,78 @@ class TileSource(IPyLeafletMixin):
                 pixel.update(dict(zip([img.mode.lower()], [img.load()[0, 0]])))
         return JSONDict(pixel)
 
+    def getPixels(
+            self, points: Any, frame: Optional[int] = None, level: Optional[int] = None,
+            max_workers: Optional[int] = -4, **kwargs) -> np.ma.MaskedArray:
+        """
+        Get the values of many pixels at once.  The points are grouped by the
+        tile that contains them so that each tile is read only once, and the
+        tiles are read in parallel.
+
+        :param points: an Nx2 array of x, y coordinates in base pixels.
+        :param frame: the frame to sample.  None for the default frame.
+        :param level: the level to sample.  None for the maximum level.  At
+            lower levels, each value is from the pixel that contains the
+            point.
+        :param max_workers: maximum workers for parallelism.  If negative, use
+            the minimum of the absolute value of this number or
+            multiprocessing.cpu_count().
+        :param kwargs: optional arguments.  These are ignored.
+        :returns: an NxB masked numpy array of the value of each point, where
+            B is the number of bands in the tiles.  Points outside of the
+            image are masked.
+        """
+        import concurrent.futures
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if level is None:
+            level = self.levels - 1
+        scale = 2 ** (self.levels - 1 - level)
+        # Comparisons with nan are False, so those points are outside
+        inside = ((points[:, 0] >= 0) & (points[:, 1] >= 0) &
+                  (points[:, 0] < self.sizeX) & (points[:, 1] < self.sizeY))
+        px = (np.where(inside, points[:, 0], 0) // scale).astype(int)
+        py = (np.where(inside, points[:, 1], 0) // scale).astype(int)
+        tx = px // self.tileWidth
+        ty = py // self.tileHeight
+        tilesAcross = (self.sizeX // scale) // self.tileWidth + 1
+        keys = ty * tilesAcross + tx
+        order = np.nonzero(inside)[0]
+        order = order[np.argsort(keys[order], kind='stable')]
+        _, starts = np.unique(keys[order], return_index=True)
+        groups = np.split(order, starts[1:]) if len(order) else []
+        imageParams = {} if frame is None else {'frame': frame}
+
+        def readTile(x: int, y: int) -> np.ndarray:
+            tile = self.getTile(
+                x, y, level, numpyAllowed='always', sparseFallback=True, **imageParams)
+            if not isinstance(tile, np.ndarray) or len(tile.shape) != 3:
+                tile, _ = _imageToNumpy(tile)
+            return tile
+
+        def sample(group: np.ndarray) -> np.ndarray:
+            x, y = int(tx[group[0]]), int(ty[group[0]])
+            tile = readTile(x, y)
+            return tile[py[group] - y * self.tileHeight, px[group] - x * self.tileWidth]
+
+        if max_workers is not None and max_workers < 0:
+            max_workers = min(-max_workers, config.cpu_count(False))
+        if len(groups) > 1 and max_workers != 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+                values = list(pool.map(sample, groups))
+        else:
+            values = [sample(group) for group in groups]
+        if not values:
+            # No points are in the image; read one tile so that the result
+            # has the same bands and data type as it otherwise would
+            values = [readTile(0, 0)[0, :0]]
+        result = np.ma.masked_all(
+            (len(points), max(value.shape[1] for value in values)),
+            dtype=np.result_type(*values))
+        for group, value in zip(groups, values):
+            result[group, :value.shape[1]] = value
+        return result
+
     @property
     def frames(self) -> int:
         """A property with the number of frames."""
@@ -0,0 +1,211 @@
+"""
+Lazy dask and xarray views of tile sources.
+"""
+
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .. import tilesource
+
+
+class TileSourceArray:
+    """
+    A numpy-like array of the unstyled pixels of a tile source at one level.
+    Indexing this reads only the tiles that are needed.  This is the backing
+    array of the dask arrays returned by asDaskArray; since it is pickled
+    with its tile source, it can be sent to dask workers.
+    """
+
+    def __init__(
+            self, source: 'tilesource.TileSource', level: int, frames: List[int],
+            frameAxis: bool) -> None:
+        """
+        :param source: the tile source.
+        :param level: the level of the tile source to read.
+        :param frames: a list of frame numbers.
+        :param frameAxis: if True, the first axis of the array is the frame.
+            Otherwise, there must be exactly one frame.
+        """
+        self.source = source
+        self.level = level
+        self.frames = frames
+        self.frameAxis = frameAxis
+        scale = 2 ** (level - (source.levels - 1))
+        sizeX = max(1, int(source.sizeX * scale))
+        sizeY = max(1, int(source.sizeY * scale))
+        sample = source.getTileStack(0, 0, level, frames=frames[:1], max_workers=1)
+        self.dtype = sample.dtype
+        self.shape: Tuple[int, ...] = ((len(frames), ) if frameAxis else ()) + (
+            sizeY, sizeX, sample.shape[-1])
+        self.ndim = len(self.shape)
+
+    def _read(self, frames: List[int], y0: int, y1: int, x0: int, x1: int) -> np.ndarray:
+        """
+        Read a region of the array from the tiles that cover it.
+
+        :param frames: a list of frame numbers.
+        :param y0, y1: the vertical range of the region.
+        :param x0, x1: the horizontal range of the region.
+        :returns: a numpy array of (frames, y1 - y0, x1 - x0, bands).
+        """
+        tw, th = self.source.tileWidth, self.source.tileHeight
+        bands = self.shape[-1]
+        out = np.empty((len(frames), y1 - y0, x1 - x0, bands), dtype=self.dtype)
+        for ty in range(y0 // th, (y1 - 1) // th + 1):
+            for tx in range(x0 // tw, (x1 - 1) // tw + 1):
+                tile = self.source.getTileStack(
+                    tx, ty, self.level, frames=frames, max_workers=1, sparseFallback=True)
+                ty0, ty1 = max(y0, ty * th), min(y1, (ty + 1) * th)
+                tx0, tx1 = max(x0, tx * tw), min(x1, (tx + 1) * tw)
+                out[:, ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0] = tile[
+                    :, ty0 - ty * th:ty1 - ty * th, tx0 - tx * tw:tx1 - tx * tw, :bands]
+        return out
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key, )
+        key = key + (slice(None), ) * (self.ndim - len(key))
+        ranges = []
+        squeeze = []
+        for axis, entry in enumerate(key):
+            span = range(self.shape[axis])[entry]
+            if isinstance(span, int):
+                span = range(span, span + 1)
+                squeeze.append(axis)
+            ranges.append(span)
+        frameRange = ranges.pop(0) if self.frameAxis else range(1)
+        yRange, xRange, bandRange = ranges
+        frames = [self.frames[idx] for idx in frameRange]
+        if not len(frames) or not len(yRange) or not len(xRange) or not len(bandRange):
+            result = np.empty(
+                (len(frames), len(yRange), len(xRange), len(bandRange)), dtype=self.dtype)
+        else:
+            y0, x0 = min(yRange), min(xRange)
+            result = self._read(frames, y0, max(yRange) + 1, x0, max(xRange) + 1)
+            if yRange.step != 1 or xRange.step != 1 or len(bandRange) != self.shape[-1]:
+                result = result[:, np.asarray(yRange) - y0][:, :, np.asarray(xRange) - x0][
+                    ..., np.asarray(bandRange)]
+        if not self.frameAxis:
+            result = result[0]
+        return result.squeeze(axis=tuple(squeeze)) if squeeze else result
+
+
+def _alignedChunks(size: int, chunk: int) -> Tuple[int, ...]:
+    """
+    Split a dimension into chunks of a fixed size.
+
+    :param size: the length of the dimension.
+    :param chunk: the size of each chunk.
+    :returns: a tuple of chunk sizes.
+    """
+    return (chunk, ) * (size // chunk) + ((size % chunk, ) if size % chunk else ())
+
+
+def asDaskArray(
+        source: 'tilesource.TileSource', level: Optional[int] = None,
+        frames: Optional[List[int]] = None,
+        chunks: Optional[Union[int, Tuple[int, ...]]] = None) -> Any:
+    """
+    Get a lazy dask array of the unstyled pixels of a tile source.  See
+    TileSource.asDaskArray.
+    """
+    import dask.array
+    import dask.base
+
+    if level is None:
+        level = source.levels - 1
+    if not 0 <= level < source.levels:
+        msg = 'level does not exist'
+        raise ValueError(msg)
+    frameAxis = frames is not None or source.frames > 1
+    frames = list(range(source.frames)) if frames is None else [int(f) for f in frames]
+    if not frames:
+        msg = 'At least one frame must be specified.'
+        raise ValueError(msg)
+    arr = TileSourceArray(source, level, frames, frameAxis)
+    if chunks is None:
+        chunks = ()
+    elif isinstance(chunks, int):
+        chunks = (chunks, chunks)
+    chunks = tuple(chunks)
+    frameChunk = chunks[0] if len(chunks) == 3 else 1
+    height, width = chunks[-2:] if len(chunks) >= 2 else (1, 1)
+    # Align chunks with the native tiles
+    height = max(1, math.ceil(height / source.tileHeight)) * source.tileHeight
+    width = max(1, math.ceil(width / source.tileWidth)) * source.tileWidth
+    arrayChunks: Tuple[Tuple[int, ...], ...] = (
+        _alignedChunks(arr.shape[-3], height),
+        _alignedChunks(arr.shape[-2], width),
+        (arr.shape[-1], ))
+    if frameAxis:
+        arrayChunks = (_alignedChunks(len(frames), max(1, frameChunk)), ) + arrayChunks
+    name = 'large-image-%s' % dask.base.tokenize(
+        source.getState(), level, frames, frameAxis, arrayChunks)
+    return dask.array.from_array(
+        arr, chunks=arrayChunks, name=name, asarray=False, fancy=False,
+        meta=np.empty((0, ) * arr.ndim, dtype=arr.dtype))
+
+
+def _frameAxes(metadata: Dict[str, Any]) -> Optional[List[Tuple[str, int]]]:
+    """
+    Check if the frames of a source form a complete grid of their index axes,
+    and, if so, list the axes.
+
+    :param metadata: the tile source metadata.
+    :returns: None if the frames are not a complete grid.  Otherwise, a list
+        of the axis name and length of each axis from the slowest varying to
+        the fastest.
+    """
+    indexRange = metadata.get('IndexRange')
+    indexStride = metadata.get('IndexStride')
+    frames = metadata.get('frames')
+    if not indexRange or not indexStride or not frames:
+        return None
+    keys = sorted(indexRange, key=lambda key: -indexStride[key])
+    if math.prod(indexRange[key] for key in keys) != len(frames):
+        return None
+    for idx, frame in enumerate(frames):
+        if any(frame.get(key, 0) != (idx // indexStride[key]) % indexRange[key]
+               for key in keys):
+            return None
+    return [(key[len('Index'):].lower(), indexRange[key]) for key in keys]
+
+
+def asXarray(
+        source: 'tilesource.TileSource', level: Optional[int] = None,
+        frames: Optional[List[int]] = None,
+        chunks: Optional[Union[int, Tuple[int, ...]]] = None) -> Any:
+    """
+    Get a lazy xarray DataArray of the unstyled pixels of a tile source.  See
+    TileSource.asXarray.
+    """
+    import xarray
+
+    data = asDaskArray(source, level, frames, chunks)
+    if level is None:
+        level = source.levels - 1
+    metadata = source.getMetadata()
+    dims: List[str] = []
+    coords: Dict[str, Any] = {}
+    if data.ndim == 4:
+        axes = _frameAxes(metadata) if frames is None else None
+        if axes:
+            data = data.reshape(tuple(length for _, length in axes) + data.shape[1:])
+            dims = [axis for axis, _ in axes]
+            if 'c' in dims and metadata.get('channels'):
+                coords['c'] = metadata['channels']
+        else:
+            dims = ['frame']
+            coords['frame'] = list(range(source.frames)) if frames is None else frames
+    dims += ['y', 'x', 's']
+    # Coordinates are in base image pixels
+    scale = 2 ** (source.levels - 1 - level)
+    coords['y'] = np.arange(data.shape[-3]) * scale
+    coords['x'] = np.arange(data.shape[-2]) * scale
+    attrs = {key: metadata[key] for key in ('mm_x', 'mm_y', 'magnification')
+             if metadata.get(key) is not None}
+    attrs['level'] = level
+    return xarray.DataArray(data, dims=dims, coords=coords, attrs=attrs).rename(None)
@@ -1,10 +1,12 @@
+import contextlib
 import pathlib
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union, cast
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union, cast
 from urllib.parse import urlencode, urlparse
 
 import numpy as np
 import PIL.Image
 
+from .. import config
 from ..cache_util import CacheProperties, methodcache
 from ..constants import SourcePriority, TileInputUnits
 from ..exceptions import TileSourceError
@@ -46,6 +48,205 @@ def make_vsi(url: Union[str, pathlib.Path, Dict[Any, Any]], **options) -> str:
     return vsi
 
 
+class WarpPlan:
+    """
+    A reusable plan for warping the tiles of one level of a geospatial source
+    into the output projection with nearest-neighbor sampling.  The source
+    pixel of each output pixel is located the same way the GDAL warper does
+    it: the centers of each row of output pixels are transformed exactly at
+    the ends and middle of the row and linearly interpolated between them,
+    with the row split in half until the interpolation error is small.  All
+    rows of a tile are handled at once, so a tile needs only a few calls to
+    the coordinate transform.
+    """
+
+    # Allowed error in source pixels of the linear interpolation; this is the
+    # GDAL warper's default
+    maxError = 0.125
+    # Row segments at most this long are transformed exactly
+    exactLength = 5
+
+    def __init__(
+            self, transform: Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]],
+            resolution: float, width: int, height: int) -> None:
+        """
+        :param transform: a function that takes arrays of x and y coordinates
+            in the output projection and returns arrays of x and y coordinates
+            in source pixels.
+        :param resolution: the size of an output pixel in projection units.
+        :param width: the width of an output tile in pixels.
+        :param height: the height of an output tile in pixels.
+        """
+        self.transform = transform
+        self.resolution = resolution
+        self.width = width
+        self.height = height
+
+    @staticmethod
+    def alphaValue(dtype: np.dtype) -> int:
+        """
+        Get the value used for opaque pixels in an alpha band added by the
+        warper.
+
+        :param dtype: the data type of the output.
+        :returns: the opaque alpha value.
+        """
+        dtype = np.dtype(dtype)
+        if dtype in {np.dtype(np.uint8), np.dtype(np.int16), np.dtype(np.uint16)}:
+            return int(np.iinfo(dtype).max)
+        return 255
+
+    def _transformPoints(
+            self, left: float, top: float, rows: np.ndarray,
+            columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Transform the centers of a set of output pixels to source pixels.
+
+        :param left: the left edge of the tile in projection units.
+        :param top: the top edge of the tile in projection units.
+        :param rows: a 1-d array of output rows.
+        :param columns: a 1-d array of output columns.
+        :returns: two arrays of source x and y coordinates, each of shape
+            (len(rows), len(columns)).
+        """
+        x, y = np.broadcast_arrays(
+            left + (columns[None, :] + 0.5) * self.resolution,
+            top - (rows[:, None] + 0.5) * self.resolution)
+        sx, sy = self.transform(x.ravel(), y.ravel())
+        return (np.asarray(sx, dtype=float).reshape(x.shape),
+                np.asarray(sy, dtype=float).reshape(x.shape))
+
+    def _interpolate(
+            self, out: np.ndarray, rows: np.ndarray, start: int, end: int,
+            values: np.ndarray) -> None:
+        """
+        Linearly interpolate a segment of some rows of output pixels.
+
+        :param out: the array to fill.
+        :param rows: a 1-d array of the rows to fill.
+        :param start: the first column of the segment.
+        :param end: the last column of the segment.
+        :param values: an array of (len(rows), 3) with the values at the
+            start, middle, and end of the segment.
+        """
+        steps = np.arange(end - start + 1) / (end - start)
+        if len(rows) == out.shape[0]:
+            # Filling whole columns can be done in place, which avoids
+            # allocating temporary arrays
+            target = out[:, start:end + 1]
+            np.multiply(values[:, 2:] - values[:, :1], steps, out=target)
+            target += values[:, :1]
+        else:
+            out[rows, start:end + 1] = values[:, :1] + (values[:, 2:] - values[:, :1]) * steps
+
+    def sourcePixels(self, left: float, top: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Locate the source pixel coordinates of the centers of the pixels of
+        an output tile.
+
+        :param left: the left edge of the tile in projection units.
+        :param top: the top edge of the tile in projection units.
+        :returns: two arrays of source x and y coordinates, each of shape
+            (height, width).
+        """
+        sx = np.empty((self.height, self.width))
+        sy = np.empty((self.height, self.width))
+        rows = np.arange(self.height)
+        last = self.width - 1
+        if last + 1 <= self.exactLength:
+            return self._transformPoints(left, top, rows, np.arange(self.width))
+        # Each entry is the first and last column of a segment, the rows that
+        # need it, and the source coordinates at the start, middle, and end
+        # of the segment for those rows.
+        ends = self._transformPoints(left, top, rows, np.array([0, last // 2, last]))
+        stack = [(0, last, rows, ends[0], ends[1])]
+        while len(stack):
+            start, end, rows, px, py = stack.pop()
+            mid = start + (end - start) // 2
+            frac = (mid - start) / (end - start)
+            error = (np.abs(px[:, 0] + (px[:, 2] - px[:, 0]) * frac - px[:, 1]) +
+                     np.abs(py[:, 0] + (py[:, 2] - py[:, 0]) * frac - py[:, 1]))
+            good = error <= self.maxError
+            if np.all(good):
+                self._interpolate(sx, rows, start, end, px)
+                self._interpolate(sy, rows, start, end, py)
+                continue
+            if np.any(good):
+                self._interpolate(sx, rows[good], start, end, px[good])
+                self._interpolate(sy, rows[good], start, end, py[good])
+            rows, px, py = rows[~good], px[~good], py[~good]
+            for first, final, idx in ((start, mid, 0), (mid, end, 1)):
+                if final - first + 1 <= self.exactLength:
+                    sx[rows, first:final + 1], sy[rows, first:final + 1] = self._transformPoints(
+                        left, top, rows, np.arange(first, final + 1))
+                    continue
+                center = self._transformPoints(
+                    left, top, rows, np.array([first + (final - first) // 2]))
+                stack.append((
+                    first, final, rows,
+                    np.hstack([px[:, idx:idx + 1], center[0], px[:, idx + 1:idx + 2]]),
+                    np.hstack([py[:, idx:idx + 1], center[1], py[:, idx + 1:idx + 2]])))
+        return sx, sy
+
+    def warp(
+            self, left: float, top: float,
+            read: Callable[[int, int, int, int, int, int], np.ndarray],
+            sourceWidth: int, sourceHeight: int, bands: int,
+            dtype: np.dtype) -> np.ndarray:
+        """
+        Warp an output tile.  Only the window of the source that is needed is
+        read.  When the output is much coarser than the source, the window is
+        read at a reduced resolution so that overviews can be used.
+
+        :param left: the left edge of the tile in projection units.
+        :param top: the top edge of the tile in projection units.
+        :param read: a function that takes (x, y, width, height, bufferWidth,
+            bufferHeight) of a source window and returns a numpy array of
+            (bands, bufferHeight, bufferWidth) with nearest-neighbor sampling.
+        :param sourceWidth: the width of the source in pixels.
+        :param sourceHeight: the height of the source in pixels.
+        :param bands: the number of bands in the source.
+        :param dtype: the data type of the source.
+        :returns: a numpy array of (bands + 1, height, width) where the last
+            band is an alpha band marking output pixels inside the source.
+        """
+        sx, sy = self.sourcePixels(left, top)
+        # Pixels are sampled at exactly their floor, allowing for rounding
+        # error in the transform; comparisons with nan are False
+        sx += 1e-10
+        sy += 1e-10
+        valid = (sx >= 0) & (sy >= 0) & (sx < sourceWidth) & (sy < sourceHeight)
+        tile = np.zeros((bands + 1, self.height * self.width), dtype=dtype)
+        if not np.any(valid):
+            return tile.reshape(bands + 1, self.height, self.width)
+        # The arrays are modified in place where possible, as allocating
+        # temporary arrays is a noticeable part of the cost of a tile
+        x0 = int(sx.min(where=valid, initial=sourceWidth))
+        y0 = int(sy.min(where=valid, initial=sourceHeight))
+        np.copyto(sx, x0, where=~valid)
+        np.copyto(sy, y0, where=~valid)
+        # Truncation is the floor for non-negative values
+        ix = sx.astype(np.intp)
+        iy = sy.astype(np.intp)
+        ix -= x0
+        iy -= y0
+        w, h = int(ix.max()) + 1, int(iy.max()) + 1
+        scale = (w * h / np.count_nonzero(valid)) ** 0.5
+        reduce = 2 ** int(np.log2(scale)) if scale >= 2 else 1
+        bw, bh = (w + reduce - 1) // reduce, (h + reduce - 1) // reduce
+        data = read(x0, y0, w, h, bw, bh)
+        if reduce != 1:
+            ix = np.minimum((ix * 2 + 1) * bw // (w * 2), bw - 1)
+            iy = np.minimum((iy * 2 + 1) * bh // (h * 2), bh - 1)
+        iy *= bw
+        iy += ix
+        np.take(data.reshape(bands, -1), iy.ravel(), axis=1, out=tile[:bands])
+        tile[:bands] *= valid.ravel()
+        tile[bands] = valid.ravel()
+        tile[bands] *= self.alphaValue(tile.dtype)
+        return tile.reshape(bands + 1, self.height, self.width)
+
+
 class GeoBaseFileTileSource(FileTileSource):
     """Abstract base class for geospatial tile sources."""
 
@@ -84,6 +285,83 @@ class GDALBaseFileTileSource(GeoBaseFileTileSource):
     sourceSizeX: int
     sourceSizeY: int
     unitsAcrossLevel0: float
+    dataset: Any
+    _getDatasetLock: Any
+
+    def _openDataset(self) -> Any:
+        """
+        Open an additional handle to the dataset for reading pixel data.
+
+        :returns: a dataset handle or None if the dataset cannot be reopened,
+            in which case the shared dataset is used.
+        """
+        return None
+
+    def _closeDataset(self, dataset: Any) -> None:
+        """
+        Close a dataset handle that was opened by _openDataset.
+
+        :param dataset: the dataset handle.
+        """
+        if hasattr(dataset, 'close'):
+            dataset.close()
+
+    @contextlib.contextmanager
+    def _readDataset(self) -> Iterator[Any]:
+        """
+        Get a dataset handle for reading pixel data.  Handles are opened as
+        needed and kept in a small pool so that reads and warps from different
+        threads can run concurrently.  Metadata is read from the shared
+        dataset while holding the dataset lock.
+
+        :yields: a dataset handle that is not used by any other thread until
+            the context exits.
+        """
+        pool = self.__dict__.setdefault('_datasetPool', [])
+        try:
+            dataset = pool.pop()
+        except IndexError:
+            dataset = self._openDataset()
+        if dataset is None:
+            with self._getDatasetLock:
+                yield self.dataset
+            return
+        try:
+            yield dataset
+        finally:
+            if len(pool) < config.cpu_count():
+                pool.append(dataset)
+            else:
+                self._closeDataset(dataset)
+
+    def _warpTransform(
+            self) -> Optional[Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]]:
+        """
+        Get a function that converts coordinates in the output projection to
+        source pixel coordinates for use in warp plans.
+
+        :returns: a function that takes arrays of x and y coordinates and
+            returns arrays of source x and y pixel coordinates, or None if
+            tiles can't be warped with a plan.
+        """
+        return None
+
+    def _getWarpPlan(self, z: int) -> Optional[WarpPlan]:
+        """
+        Get the warp plan for a level of output tiles.  Plans are created the
+        first time they are needed and reused for all tiles of the level.
+
+        :param z: the tile level.
+        :returns: a WarpPlan or None if tiles can't be warped with a plan.
+        """
+        plans = self.__dict__.setdefault('_warpPlans', {})
+        if z not in plans:
+            if '_warpTransformFunc' not in self.__dict__:
+                self._warpTransformFunc = self._warpTransform()
+            plans[z] = None if self._warpTransformFunc is None else WarpPlan(
+                self._warpTransformFunc, self.unitsAcrossLevel0 / self.tileWidth * 2 ** -z,
+                self.tileWidth, self.tileHeight)
+        return plans[z]
 
     def _getDriver(self) -> str:
         """
@@ -102,6 +380,115 @@ class GDALBaseFileTileSource(GeoBaseFileTileSource):
     def toNativePixelCoordinates(self, *args, **kwargs) -> Tuple[float, float]:
         raise NotImplementedError
 
+    def _getGeoTransform(self) -> Tuple[float, float, float, float, float, float]:
+        """
+        Get the GDAL-style geotransform from native pixel coordinates to the
+        native projection.
+
+        :returns: a six-component tuple with the transform.
+        """
+        raise NotImplementedError
+
+    def _makeCoordinateTransform(
+            self, srcProj: Any, dstProj: Any = None,
+    ) -> Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        """
+        Create a function to convert coordinates between projections.
+
+        :param srcProj: the projection of the input coordinates.
+        :param dstProj: the projection of the output coordinates.  None for
+            the native projection of the dataset.
+        :returns: a function that takes arrays of x and y coordinates and
+            returns the converted x and y coordinates.
+        """
+        raise NotImplementedError
+
+    def _coordinateTransform(
+            self, srcProj: Any, dstProj: Any = None,
+    ) -> Callable[[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        """
+        Get a function to convert coordinates between projections.  These are
+        cached, since creating a transform is much slower than using one.
+
+        :param srcProj: the projection of the input coordinates.
+        :param dstProj: the projection of the output coordinates.  None for
+            the native projection of the dataset.
+        :returns: a function that takes arrays of x and y coordinates and
+            returns the converted x and y coordinates.
+        """
+        transforms = self.__dict__.setdefault('_coordinateTransforms', {})
+        key = (str(srcProj), None if dstProj is None else str(dstProj))
+        if key not in transforms:
+            transforms[key] = self._makeCoordinateTransform(srcProj, dstProj)
+        return transforms[key]
+
+    def _projectionToNativePixels(
+            self, x: np.ndarray, y: np.ndarray, proj: Any = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Convert arrays of coordinates in a projection to native pixel
+        coordinates.
+
+        :param x: an array of x coordinates.
+        :param y: an array of y coordinates.
+        :param proj: the projection of the coordinates.  None to use the
+            source's projection.
+        :returns: arrays of native pixel x and y coordinates.
+        """
+        px, py = self._coordinateTransform(self.projection if proj is None else proj)(x, y)
+        px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+        gt = self._getGeoTransform()
+        d = gt[2] * gt[4] - gt[1] * gt[5]
+        return ((gt[0] * gt[5] - gt[2] * gt[3] - gt[5] * px + gt[2] * py) / d,
+                (gt[1] * gt[3] - gt[0] * gt[4] + gt[4] * px - gt[1] * py) / d)
+
+    def toNativePixelCoordinatesArray(
+            self, points: Any, proj: Any = None, roundResults: bool = True) -> np.ndarray:
+        """
+        Convert an array of coordinates in a projection to native pixel
+        coordinates.  This is the same as toNativePixelCoordinates, but
+        converts many points at once.
+
+        :param points: an Nx2 array of x, y coordinates.
+        :param proj: the projection of the coordinates.  None to use the
+            source's projection.
+        :param roundResults: if True, round the results to the nearest pixel.
+        :returns: an Nx2 numpy array of x, y pixel coordinates.  This is an
+            integer array if roundResults is True.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        x, y = self._projectionToNativePixels(points[:, 0], points[:, 1], proj)
+        result = np.column_stack((x, y))
+        if roundResults:
+            result = np.round(result).astype(int)
+        return result
+
+    def pixelToProjectionArray(self, points: Any, level: Optional[int] = None) -> np.ndarray:
+        """
+        Convert an array of pixel coordinates to projection coordinates.  This
+        is the same as pixelToProjection, but converts many points at once.
+
+        :param points: an Nx2 array of x, y base pixel coordinates.
+        :param level: the level of the pixels.  None for maximum level.
+        :returns: an Nx2 numpy array of x, y coordinates in the source's
+            projection, or in the native projection if the source doesn't
+            have a projection.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if level is None:
+            level = self.levels - 1
+        if not self.projection:
+            x = points[:, 0] * 2 ** (self.levels - 1 - level)
+            y = points[:, 1] * 2 ** (self.levels - 1 - level)
+            gt = self._getGeoTransform()
+            return np.column_stack((
+                gt[0] + gt[1] * x + gt[2] * y, gt[3] + gt[4] * x + gt[5] * y))
+        xScale = 2 ** level * self.tileWidth
+        yScale = 2 ** level * self.tileHeight
+        return np.column_stack((
+            (points[:, 0] / xScale - 0.5) * self.unitsAcrossLevel0 + self.projectionOrigin[0],
+            (0.5 - points[:, 1] / yScale) * self.unitsAcrossLevel0 + self.projectionOrigin[1]))
+
     def getBounds(self, *args, **kwargs) -> Dict[str, Any]:
         raise NotImplementedError
 
@@ -409,20 +409,25 @@ def launch_tile_server(tile_source: IPyLeafletMixin, port: int = 0) -> Any:
     class TileSourceMetadataHandler(tornado.web.RequestHandler):
         """REST endpoint to get image metadata."""
 
-        def get(self) -> None:
-            self.write(json.dumps(manager.tile_source.metadata))  # type: ignore[attr-defined]
+        async def get(self) -> None:
+            from .asynctiles import runAsync
+
+            source = manager.tile_source
+            metadata = await runAsync(
+                source, source.getMetadata)  # type: ignore[attr-defined,arg-type]
+            self.write(json.dumps(metadata))
             self.set_header('Content-Type', 'application/json')
 
     class TileSourceTileHandler(tornado.web.RequestHandler):
         """REST endpoint to serve tiles from image in slippy maps standard."""
 
-        def get(self) -> None:
+        async def get(self) -> None:
             x = int(self.get_argument('x'))
             y = int(self.get_argument('y'))
             z = int(self.get_argument('z'))
             encoding = self.get_argument('encoding', 'PNG')
             try:
-                tile_binary = manager.tile_source.getTile(  # type: ignore[attr-defined]
+                tile_binary = await manager.tile_source.agetTile(  # type: ignore[attr-defined]
                     x, y, z, encoding=encoding)
             except TileSourceXYZRangeError as e:
                 self.clear()
@@ -0,0 +1,324 @@
+"""
+Lazy loading of tile sources.
+
+Importing a tile source module can be slow, since many of them import large
+libraries such as GDAL or Java.  To select a source for a file, only some
+class attributes (extensions, mimeTypes, nameMatches, and so on) are needed.
+These attributes are recorded in a manifest file the first time each source is
+loaded; afterwards, the source module is only imported when the source is
+actually used.  Manifest entries are keyed by the entry point and the
+modification time of the module that declares it, so upgrading or editing a
+source refreshes its entry.
+"""
+
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from .. import config
+from ..constants import SourcePriority
+
+# The class attributes that are recorded in the manifest.  These are the
+# attributes used by getSortedSourceList.
+ManifestAttributes = ('name', 'extensions', 'mimeTypes', 'nameMatches', 'signatures',
+                      'newPriority', '_geospatial_source')
+
+
+def _asPriority(value: Any) -> Any:
+    try:
+        return SourcePriority(value)
+    except ValueError:
+        return value
+
+
+class SourceManifestEntry:
+    """
+    A stand-in for a tile source class that has not been imported.  This has
+    the class attributes needed to rank the source for a file.
+    """
+
+    def __init__(self, attributes: Dict[str, Any]) -> None:
+        """
+        :param attributes: a dictionary of class attributes as stored in the
+            manifest.
+        """
+        self.name = attributes.get('name')
+        self.extensions = {
+            None if k == 'default' else k: _asPriority(v)
+            for k, v in attributes.get('extensions', {}).items()}
+        self.mimeTypes = {
+            None if k == 'default' else k: _asPriority(v)
+            for k, v in attributes.get('mimeTypes', {}).items()}
+        self.nameMatches = {
+            k: _asPriority(v) for k, v in attributes.get('nameMatches', {}).items()}
+        self.signatures = {
+            None if k == 'default' else k: _asPriority(v)
+            for k, v in (attributes.get('signatures') or {}).items()}
+        self.newPriority = (None if attributes.get('newPriority') is None else
+                            _asPriority(attributes['newPriority']))
+        self._geospatial_source = bool(attributes.get('_geospatial_source'))
+        # True if the class has an isGeospatial method
+        self.hasIsGeospatial = attributes.get('isGeospatial', False)
+
+    @staticmethod
+    def describe(sourceClass: Any) -> Dict[str, Any]:
+        """
+        Get the manifest attributes of a tile source class.
+
+        :param sourceClass: a tile source class.
+        :returns: a json-serializable dictionary of attributes.
+        """
+        attributes: Dict[str, Any] = {}
+        for key in ManifestAttributes:
+            value = getattr(sourceClass, key, None)
+            if isinstance(value, dict):
+                value = {'default' if k is None else k: int(v) for k, v in value.items()}
+            elif key == 'newPriority' and value is not None:
+                value = int(value)
+            elif key == '_geospatial_source':
+                value = bool(value)
+            attributes[key] = value
+        attributes['isGeospatial'] = hasattr(sourceClass, 'isGeospatial')
+        return attributes
+
+
+class LazySourceDict(Dict[str, Any]):
+    """
+    An ordered dictionary of tile source classes where some classes have not
+    been imported yet.  Getting a value imports its module if needed; use
+    peek to inspect a source without importing it.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._entryPoints: Dict[str, Any] = {}
+        self._loadLock = threading.RLock()
+
+    def addLazy(self, name: str, entryPoint: Any, attributes: Dict[str, Any]) -> None:
+        """
+        Add a source that will be imported when it is first used.
+
+        :param name: the source name.
+        :param entryPoint: the entry point to load.
+        :param attributes: the manifest attributes of the source class.
+        """
+        with self._loadLock:
+            self._entryPoints[name] = entryPoint
+            super().__setitem__(name, SourceManifestEntry(attributes))
+
+    def isLoaded(self, name: str) -> bool:
+        """
+        Check if a source has been imported.
+
+        :param name: the source name.
+        :returns: True if the source class is available.
+        """
+        return name in self and name not in self._entryPoints
+
+    def peek(self, name: str) -> Any:
+        """
+        Get a source class or, if it has not been imported, a stand-in with
+        the class attributes needed to select a source.
+
+        :param name: the source name.
+        :returns: a tile source class or a SourceManifestEntry.
+        """
+        return super().__getitem__(name)
+
+    def _load(self, name: str) -> Any:
+        # The entry point is only removed once the class is stored, so other
+        # threads either wait for the load or get the class
+        with self._loadLock:
+            entryPoint = self._entryPoints.get(name)
+            if entryPoint is None:
+                return super().__getitem__(name)
+            try:
+                sourceClass = entryPoint.load()
+            except Exception:
+                config.getLogger('logprint').exception(
+                    'Failed to loaded tile source %s' % name)
+                super().__delitem__(name)
+                self._entryPoints.pop(name, None)
+                raise KeyError(name) from None
+            config.getLogger('logprint').debug('Loaded tile source %s' % name)
+            super().__setitem__(name, sourceClass)
+            self._entryPoints.pop(name, None)
+        return sourceClass
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self._entryPoints:
+            return self._load(name)
+        return super().__getitem__(name)
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        with self._loadLock:
+            self._entryPoints.pop(name, None)
+            super().__setitem__(name, value)
+
+    def __delitem__(self, name: str) -> None:
+        with self._loadLock:
+            self._entryPoints.pop(name, None)
+            super().__delitem__(name)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def pop(self, name: str, *args) -> Any:
+        if name in self._entryPoints:
+            try:
+                self._load(name)
+            except KeyError:
+                if args:
+                    return args[0]
+                raise
+        return super().pop(name, *args)
+
+    def clear(self) -> None:
+        with self._loadLock:
+            self._entryPoints.clear()
+            super().clear()
+
+    def values(self) -> List[Any]:  # type: ignore[override]
+        return [source for _, source in self.items()]
+
+    def items(self) -> List[Tuple[str, Any]]:  # type: ignore[override]
+        result = []
+        for name in list(self):
+            source = self.get(name)
+            if source is not None:
+                result.append((name, source))
+        return result
+
+
+def manifestPath(entryPointName: str) -> Optional[str]:
+    """
+    Get the path of the manifest file for a group of entry points.
+
+    :param entryPointName: the name of the entry point group.
+    :returns: the path or None if manifests are disabled.
+    """
+    directory = config.getConfig('source_manifest_directory')
+    if directory is False:
+        return None
+    if not directory:
+        directory = config.userCachePath()
+    return os.path.join(str(directory), 'source_manifest_%s.json' % entryPointName)
+
+
+def readManifest(path: Optional[str]) -> Dict[str, Any]:
+    """
+    Read a manifest file.
+
+    :param path: the path of the manifest or None.
+    :returns: the manifest dictionary.  This is empty if the file cannot be
+        read.
+    """
+    if not path:
+        return {}
+    try:
+        with open(path) as fptr:
+            manifest = json.load(fptr)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def writeManifest(path: Optional[str], manifest: Dict[str, Any]) -> None:
+    """
+    Write a manifest file.  Failures are logged but otherwise ignored, since
+    the manifest only speeds up loading.
+
+    :param path: the path of the manifest or None.
+    :param manifest: the manifest dictionary.
+    """
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as fptr:
+            json.dump(manifest, fptr, sort_keys=True)
+        os.replace(tempPath, path)
+    except OSError:
+        config.getLogger().debug('Failed to write source manifest %s', path)
+
+
+def entryPointStamp(entryPoint: Any) -> Optional[list]:
+    """
+    Get a value that changes when the module of an entry point changes,
+    without importing the module.
+
+    :param entryPoint: the entry point.
+    :returns: a json-serializable list or None if the module cannot be found.
+    """
+    module = entryPoint.value.split(':', 1)[0].strip()
+    parts = module.split('.')
+    try:
+        spec = importlib.util.find_spec(parts[0])
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    path = spec.origin
+    if len(parts) > 1:
+        if not spec.submodule_search_locations:
+            return None
+        base = os.path.join(list(spec.submodule_search_locations)[0], *parts[1:])
+        path = base + '.py' if os.path.isfile(base + '.py') else os.path.join(
+            base, '__init__.py')
+    try:
+        return [entryPoint.value, path, os.path.getmtime(path)]
+    except OSError:
+        return None
+
+
+def loadEntryPoints(
+        epointList: Any, entryPointName: str, sourceDict: Dict[str, Type[Any]]) -> None:
+    """
+    Add the tile sources of a group of entry points to a dictionary.  If the
+    dictionary is a LazySourceDict, sources that are described by the
+    manifest are added without importing them.  Other sources are imported
+    and the manifest is updated.
+
+    :param epointList: a list of entry points.
+    :param entryPointName: the name of the entry point group.
+    :param sourceDict: a dictionary to populate with the sources.
+    """
+    lazy = isinstance(sourceDict, LazySourceDict)
+    path = manifestPath(entryPointName) if lazy else None
+    manifest = readManifest(path)
+    changed = False
+    for entryPoint in epointList:
+        stamp = entryPointStamp(entryPoint) if path else None
+        entry = manifest.get(entryPoint.name)
+        if (lazy and stamp and entry and entry.get('stamp') == stamp and
+                set(ManifestAttributes) <= set(entry.get('attributes', {})) and
+                not sourceDict.isLoaded(entryPoint.name)):  # type: ignore[attr-defined]
+            sourceDict.addLazy(  # type: ignore[attr-defined]
+                entryPoint.name, entryPoint, entry['attributes'])
+            continue
+        try:
+            sourceClass = entryPoint.load()
+            if sourceClass.name and None in sourceClass.extensions:
+                sourceDict[entryPoint.name] = sourceClass
+                config.getLogger('logprint').debug('Loaded tile source %s' % entryPoint.name)
+                # Sources that have added extensions at runtime no longer
+                # have their declared attributes, so don't describe them
+                if stamp and not getattr(sourceClass, '_addedExtensions', False):
+                    entry = {
+                        'stamp': stamp,
+                        'attributes': SourceManifestEntry.describe(sourceClass)}
+                    if manifest.get(entryPoint.name) != entry:
+                        manifest[entryPoint.name] = entry
+                        changed = True
+        except Exception:
+            config.getLogger('logprint').exception(
+                'Failed to loaded tile source %s' % entryPoint.name)
+    if changed:
+        writeManifest(path, manifest)
@@ -0,0 +1,204 @@
+"""
+A persistent cache of which tile source reads a file.
+
+Finding a tile source for a file tries canRead on each candidate source in
+turn, and each failed attempt can mean opening the file with a heavyweight
+library.  The source that worked is recorded in a sqlite database keyed by
+the file's path, size, and modification time, along with the mime type, the
+set of available sources, and the explicitly set settings that affect which
+sources can read a file, so that later selections for an unchanged file skip
+the failed attempts.  Default settings are not part of the key, since sources
+add them as they are imported.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .. import config
+
+# Settings that change which sources can read a file, in addition to those
+# starting with "source_".
+SelectionSettings = {'all_sources_ignored_names', 'max_small_image_size'}
+# Settings starting with "source_" that don't change which sources can read a
+# file.
+NonSelectionSettings = {'source_manifest_directory', 'source_selection_cache_path'}
+# The maximum number of files that are remembered.  When this is exceeded,
+# the oldest entries are discarded.
+MaximumEntries = 250000
+# How often, in number of stored entries, the size of the cache is checked.
+PruneInterval = 1000
+
+_connections: Dict[Tuple[str, int], Optional[sqlite3.Connection]] = {}
+_lock = threading.RLock()
+_storeCount = 0
+
+
+def cachePath() -> Optional[str]:
+    """
+    Get the path of the source selection cache.
+
+    :returns: the path or None if the cache is disabled.
+    """
+    path = config.getConfig('source_selection_cache_path')
+    if not path:
+        return None
+    return config.userCachePath('source_selection.sqlite') if path is True else str(path)
+
+
+def _connection(path: str) -> Optional[sqlite3.Connection]:
+    """
+    Get a connection to the cache database, creating it if needed.
+
+    :param path: the path of the database.
+    :returns: a connection or None if the database cannot be used.
+    """
+    # Connections can't be shared with forked processes
+    connKey = (path, os.getpid())
+    if connKey not in _connections:
+        conn: Optional[sqlite3.Connection]
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS selection ('
+                'path TEXT, mime TEXT, sources TEXT, size INTEGER, mtime INTEGER, '
+                'source TEXT, PRIMARY KEY (path, mime, sources))')
+            conn.commit()
+        except (OSError, sqlite3.Error):
+            config.getLogger().debug('Cannot use source selection cache %s', path)
+            conn = None
+        _connections[connKey] = conn
+    return _connections[connKey]
+
+
+def selectionKey(
+        availableSources: Dict[str, Any], pathOrUri: Any,
+        mimeType: Optional[str] = None) -> Optional[Tuple[str, str, str, int, int]]:
+    """
+    Get the cache key for choosing a source for a local file.
+
+    :param availableSources: an ordered dictionary of sources.
+    :param pathOrUri: the path or uri being opened.
+    :param mimeType: the mimetype of the file, if known.
+    :returns: a tuple of (path, mime type, sources and settings signature,
+        size, mtime) or None if the path is not a local file or directory or
+        the cache is disabled.
+    """
+    if not cachePath():
+        return None
+    if not isinstance(pathOrUri, (str, os.PathLike)) or '://' in str(pathOrUri):
+        return None
+    try:
+        path = os.path.realpath(pathOrUri)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    settings = {key: config.getConfig(key) for key in config.explicitConfigKeys()
+                if (key.startswith('source_') or key in SelectionSettings) and
+                key not in NonSelectionSettings}
+    sources = hashlib.sha256(json.dumps(
+        [sorted(availableSources), settings], sort_keys=True, default=str).encode()).hexdigest()
+    return (path, mimeType or '', sources, stat.st_size, stat.st_mtime_ns)
+
+
+def lookup(key: Optional[Tuple[str, str, str, int, int]]) -> Optional[str]:
+    """
+    Get the remembered source name for a file.
+
+    :param key: a key from selectionKey.
+    :returns: the source name or None if it is not known or the file has
+        changed.
+    """
+    path = cachePath()
+    if not key or not path:
+        return None
+    with _lock:
+        conn = _connection(path)
+        if conn is None:
+            return None
+        try:
+            row = conn.execute(
+                'SELECT size, mtime, source FROM selection '
+                'WHERE path = ? AND mime = ? AND sources = ?', key[:3]).fetchone()
+        except sqlite3.Error:
+            return None
+    if not row or tuple(row[:2]) != key[3:]:
+        return None
+    return row[2]
+
+
+def store(key: Optional[Tuple[str, str, str, int, int]], sourceName: str) -> None:
+    """
+    Remember the source that reads a file.
+
+    :param key: a key from selectionKey.
+    :param sourceName: the name of the source.
+    """
+    global _storeCount
+
+    path = cachePath()
+    if not key or not path:
+        return
+    with _lock:
+        conn = _connection(path)
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO selection '
+                '(path, mime, sources, size, mtime, source) VALUES (?, ?, ?, ?, ?, ?)',
+                key + (sourceName, ))
+            _storeCount += 1
+            if not _storeCount % PruneInterval:
+                conn.execute(
+                    'DELETE FROM selection WHERE rowid <= ('
+                    'SELECT MAX(rowid) FROM selection) - ?', (MaximumEntries, ))
+            conn.commit()
+        except sqlite3.Error:
+            config.getLogger().debug('Failed to update source selection cache %s', path)
+
+
+def forget(pathOrUri: Any) -> bool:
+    """
+    Forget the remembered sources for a file.  This is used when a
+    remembered source fails to open the file.
+
+    :param pathOrUri: the path or uri of the file.
+    :returns: True if any entries were removed.
+    """
+    path = cachePath()
+    if not path or not isinstance(pathOrUri, (str, os.PathLike)):
+        return False
+    with _lock:
+        conn = _connection(path)
+        if conn is None:
+            return False
+        try:
+            cursor = conn.execute(
+                'DELETE FROM selection WHERE path = ?', (os.path.realpath(pathOrUri), ))
+            conn.commit()
+        except (sqlite3.Error, ValueError):
+            return False
+    return cursor.rowcount > 0
+
+
+def clear() -> None:
+    """
+    Remove all remembered source selections.
+    """
+    path = cachePath()
+    if not path:
+        return
+    with _lock:
+        conn = _connection(path)
+        if conn is None:
+            return
+        try:
+            conn.execute('DELETE FROM selection')
+            conn.commit()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,78 @@
+"""
+Identify file formats from their contents.
+
+Tile sources are ranked by file extension, mime type, and name, which are
+unreliable for files with missing or wrong extensions.  The start of a file is
+read once and compared against well known signatures (magic bytes); the
+resulting format names are matched against the ``signatures`` attribute of
+each tile source.
+"""
+
+import json
+import os
+from typing import Any, Callable, List, Set, Tuple
+
+# The number of bytes read from the start of a file
+SniffLength = 4096
+
+# A list of (format name, test function) for the start of a file
+FileSignatures: List[Tuple[str, Callable[[bytes], bool]]] = [
+    ('tiff', lambda head: head[:4] in {b'II*\x00', b'MM\x00*'}),
+    ('bigtiff', lambda head: head[:4] in {b'II+\x00', b'MM\x00+'}),
+    ('jp2', lambda head: head[:12] == b'\x00\x00\x00\x0cjP  \r\n\x87\n'),
+    ('j2k', lambda head: head[:4] == b'\xff\x4f\xff\x51'),
+    ('dicom', lambda head: head[128:132] == b'DICM'),
+    ('nd2', lambda head: head[:4] == b'\xda\xce\xbe\x0a'),
+    ('png', lambda head: head[:8] == b'\x89PNG\r\n\x1a\n'),
+    ('jpeg', lambda head: head[:3] == b'\xff\xd8\xff'),
+    ('gif', lambda head: head[:6] in {b'GIF87a', b'GIF89a'}),
+    ('webp', lambda head: head[:4] == b'RIFF' and head[8:12] == b'WEBP'),
+    ('sqlite', lambda head: head[:16] == b'SQLite format 3\x00'),
+    ('zip', lambda head: head[:4] in {b'PK\x03\x04', b'PK\x05\x06'}),
+]
+
+# Files that mark a directory as a zarr store
+ZarrMarkers = ('.zgroup', '.zarray', 'zarr.json')
+
+
+def _sniffDirectory(path: str) -> Set[str]:
+    """
+    Identify the format of a directory.
+
+    :param path: the path of the directory.
+    :returns: a set of format names.
+    """
+    formats: Set[str] = set()
+    if any(os.path.isfile(os.path.join(path, marker)) for marker in ZarrMarkers):
+        formats.add('zarr')
+        for attrsFile in ('.zattrs', 'zarr.json'):
+            try:
+                with open(os.path.join(path, attrsFile)) as fptr:
+                    attrs = json.loads(fptr.read(1024 ** 2))
+            except (OSError, ValueError):
+                continue
+            if isinstance(attrs, dict) and (
+                    'multiscales' in attrs or 'ome' in attrs.get('attributes', {})):
+                formats.add('ome-ngff')
+    return formats
+
+
+def sniffFormats(pathOrUri: Any) -> Set[str]:
+    """
+    Identify the format of a local file or directory from its contents.
+
+    :param pathOrUri: the path to check.  Anything that is not a local file
+        or directory is not checked.
+    :returns: a set of format names.  This is empty if the format is not
+        recognized.
+    """
+    if not isinstance(pathOrUri, (str, os.PathLike)) or '://' in str(pathOrUri):
+        return set()
+    try:
+        if os.path.isdir(pathOrUri):
+            return _sniffDirectory(str(pathOrUri))
+        with open(pathOrUri, 'rb') as fptr:
+            head = fptr.read(SniffLength)
+    except (OSError, ValueError):
+        return set()
+    return {name for name, test in FileSignatures if test(head)}
@@ -31,11 +31,13 @@ class LazyTileDict(dict):
         load the tile image.  ang and kwargs are as for the dict() class.
 
         :param tileInfo: a dictionary of x, y, level, format, encoding, crop,
-            and source, used for fetching the tile image.
+            and source, used for fetching the tile image.  If this has a list
+            of frames, the tile image is a stack of those frames.
         """
         self.x = tileInfo['x']
         self.y = tileInfo['y']
         self.frame = tileInfo.get('frame')
+        self.frames = tileInfo.get('frames')
         self.level = tileInfo['level']
         self.format = tileInfo['format']
         self.encoding = tileInfo['encoding']
@@ -115,6 +117,27 @@ class LazyTileDict(dict):
             self.imageKwargs = imageKwargs
             self.loaded = False
 
+    def _getTileData(self, x: int, y: int, level: int) -> np.ndarray:
+        """
+        Get a source tile as a numpy array.  If this has a list of frames, the
+        array is a stack of those frames.
+
+        :param x: the x position of the source tile.
+        :param y: the y position of the source tile.
+        :param level: the level of the source tile.
+        :returns: a numpy array of (height, width, bands) or (frames, height,
+            width, bands).
+        """
+        if self.frames is not None:
+            return self.source.getTileStack(
+                x, y, level, frames=self.frames, sparseFallback=True)
+        tileData = self.source.getTile(
+            x, y, level,
+            numpyAllowed='always', sparseFallback=True, frame=self.frame)
+        if not isinstance(tileData, np.ndarray) or len(tileData.shape) != 3:
+            tileData, _ = _imageToNumpy(tileData)
+        return tileData
+
     def _retileTile(self) -> np.ndarray:
         """
         Given the tile information, create a numpy array and merge multiple
@@ -123,7 +146,6 @@ class LazyTileDict(dict):
         tileWidth = self.metadata['tileWidth']
         tileHeight = self.metadata['tileHeight']
         level = self.level
-        frame = self.frame
         width = self.width
         height = self.height
         tx = self['x']
@@ -136,27 +158,25 @@ class LazyTileDict(dict):
         ymax = int((ty + height - 1) // tileHeight + 1)
         for y in range(ymin, ymax):
             for x in range(xmin, xmax):
-                tileData = self.source.getTile(
-                    x, y, level,
-                    numpyAllowed='always', sparseFallback=True, frame=frame)
-                if not isinstance(tileData, np.ndarray) or len(tileData.shape) != 3:
-                    tileData, _ = _imageToNumpy(tileData)
+                tileData = self._getTileData(x, y, level)
                 x0 = int(x * tileWidth - tx)
                 y0 = int(y * tileHeight - ty)
                 if x0 < 0:
-                    tileData = tileData[:, -x0:]
+                    tileData = tileData[..., -x0:, :]
                     x0 = 0
                 if y0 < 0:
-                    tileData = tileData[-y0:, :]
+                    tileData = tileData[..., -y0:, :, :]
                     y0 = 0
-                tw = min(tileData.shape[1], width - x0)
-                th = min(tileData.shape[0], height - y0)
+                tw = min(tileData.shape[-2], width - x0)
+                th = min(tileData.shape[-3], height - y0)
                 if retile is None:
-                    retile = np.empty((height, width, tileData.shape[2]), dtype=tileData.dtype)
-                elif tileData.shape[2] < retile.shape[2]:
-                    retile = retile[:, :, :tileData.shape[2]]
-                retile[y0:y0 + th, x0:x0 + tw] = tileData[
-                    :th, :tw, :retile.shape[2]]  # type: ignore[misc]
+                    retile = np.empty(
+                        tileData.shape[:-3] + (height, width, tileData.shape[-1]),
+                        dtype=tileData.dtype)
+                elif tileData.shape[-1] < retile.shape[-1]:
+                    retile = retile[..., :tileData.shape[-1]]
+                retile[..., y0:y0 + th, x0:x0 + tw, :] = tileData[
+                    ..., :th, :tw, :retile.shape[-1]]
         return cast(np.ndarray, retile)
 
     def __getitem__(self, key: str, *args, **kwargs) -> Any:
@@ -172,7 +192,8 @@ class LazyTileDict(dict):
             # tile's own values.
             self.loaded = True
 
-            if not self.retile:
+            # Stacked frames are always assembled as numpy arrays
+            if not self.retile and self.frames is None:
                 tileData = self.source.getTile(
                     self.x, self.y, self.level,
                     pilImageAllowed=True,
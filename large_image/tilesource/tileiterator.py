@@ -1,4 +1,5 @@
 import math
+import threading
 from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple, Union, cast
 
 from ..constants import TILE_FORMAT_IMAGE, TILE_FORMAT_NUMPY, TILE_FORMAT_PIL, TileOutputMimeTypes
@@ -21,12 +22,16 @@ class TileIterator:
             resample: Optional[bool] = True, **kwargs) -> None:
         self.source = source
         self._kwargs = kwargs
+        self._nextLock = threading.Lock()
         if not isinstance(format, tuple):
             format = (format, )
         if TILE_FORMAT_IMAGE in format:
             encoding = kwargs.get('encoding')
             if encoding not in TileOutputMimeTypes:
                 raise ValueError('Invalid encoding "%s"' % encoding)
+        if kwargs.get('frames') is not None and TILE_FORMAT_NUMPY not in format:
+            msg = 'Stacked frames can only be returned as numpy arrays.'
+            raise ValueError(msg)
         self.format = format
         self.resample = resample
         iterFormat = format if resample in (False, None) else (TILE_FORMAT_PIL, )
@@ -36,6 +41,9 @@ class TileIterator:
             return
         if resample in (False, None) or round(self.info['requestedScale'], 2) == 1.0:
             self.resample = False
+        if self.info.get('frames') is not None and self.resample:
+            msg = 'Stacked frames cannot be resampled.'
+            raise ValueError(msg)
         self._iter = self._tileIterator(self.info)
 
     def __iter__(self) -> Iterator[LazyTileDict]:
@@ -51,6 +59,31 @@ class TileIterator:
         except StopIteration:
             raise
 
+    def __aiter__(self) -> 'TileIterator':
+        return self
+
+    async def __anext__(self) -> LazyTileDict:
+        from .asynctiles import runAsync
+
+        tile = await runAsync(self.source, self._nextLoadedTile)
+        if tile is None:
+            raise StopAsyncIteration
+        return tile
+
+    def _nextLoadedTile(self) -> Optional[LazyTileDict]:
+        """
+        Get the next tile and load its image.  This is used for asynchronous
+        iteration, so that the tile image is read on the thread pool rather
+        than when it is accessed in the event loop.
+
+        :returns: the next tile or None if there are no more tiles.
+        """
+        with self._nextLock:
+            tile = next(self, None)
+        if tile is not None:
+            tile['tile']
+        return tile
+
     def __repr__(self) -> str:
         repr = f'TileIterator<{self.source}'
         if self.info:
@@ -182,6 +215,7 @@ class TileIterator:
                     is being delivered.
 
             :frame: the frame value for the base image.
+            :frames: None or a list of frames to stack in each tile.
             :format: a tuple of allowed output formats.
             :encoding: if the output format is TILE_FORMAT_IMAGE, the desired
                 encoding.
@@ -343,6 +377,8 @@ class TileIterator:
                 'height': outHeight,
             },
             'frame': kwargs.get('frame'),
+            'frames': (None if kwargs.get('frames') is None else
+                       [int(frame) for frame in kwargs['frames']]),
             'format': kwargs.get('format', (TILE_FORMAT_NUMPY, )),
             'encoding': kwargs.get('encoding'),
             'requestedScale': requestedScale,
@@ -497,6 +533,7 @@ class TileIterator:
                     'x': x,
                     'y': y,
                     'frame': iterInfo.get('frame'),
+                    'frames': iterInfo.get('frames'),
                     'level': level,
                     'format': format,
                     'encoding': encoding,
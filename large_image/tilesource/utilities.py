@@ -1,3 +1,5 @@
+import collections
+import concurrent.futures
 import io
 import math
 import threading
@@ -14,6 +16,7 @@ import PIL.Image
 import PIL.ImageColor
 import PIL.ImageDraw
 
+from .. import config
 from ..constants import dtypeToGValue
 
 # This was exposed here, once.
@@ -90,46 +93,113 @@ class JSONDict(dict):
         return self
 
 
-def _encodeImageBinary(
+# Used for encoding batches of images
+_encodingPool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_encodingPoolLock = threading.Lock()
+
+# zlib strategies as used by the PIL png encoder's compress_type
+_Z_HUFFMAN_ONLY = 2
+_Z_RLE = 3
+
+
+def _pngEncodingParams(image: PIL.Image.Image) -> Dict[str, Any]:
+    """
+    Pick png compression parameters based on the content of an image.  A
+    sparse sample of pixels is used to classify the image.  Images that are a
+    single value (such as blank background) or have very few distinct values
+    (such as masks and label images) compress best and fastest with run-length
+    encoding.  Images where most sampled pixels are distinct (such as noisy
+    or photographic data) gain little from string matching, so Huffman-only
+    coding is used, which is both faster and usually smaller for such data.
+    Other images use a moderate deflate setting.
+
+    :param image: a PIL image.
+    :returns: a dictionary of parameters for saving a png with PIL.
+    """
+    sample = np.asarray(image.resize(
+        (min(image.width, 32), min(image.height, 32)),
+        getattr(PIL.Image, 'Resampling', PIL.Image).NEAREST))
+    sample = sample.reshape(sample.shape[0] * sample.shape[1], -1)
+    distinct = len(np.unique(sample, axis=0))
+    if distinct <= 16:
+        return {'compress_level': 6, 'compress_type': _Z_RLE}
+    if distinct >= sample.shape[0] // 2:
+        return {'compress_level': 1, 'compress_type': _Z_HUFFMAN_ONLY}
+    return {'compress_level': 2}
+
+
+def _encodeNumpyBinary(image: Union[PIL.Image.Image, np.ndarray]) -> bytes:
+    """
+    Encode an image as a numpy .npy file.  This is lossless, preserves the
+    data type and number of bands, and is very fast, but isn't compressed and
+    isn't viewable in browsers.
+
+    :param image: a PIL image or numpy array.
+    :returns: the binary npy data.
+    """
+    if not isinstance(image, np.ndarray):
+        image = _imageToNumpy(image)[0]
+    output = io.BytesIO()
+    np.save(output, image, allow_pickle=False)
+    return ImageBytes(output.getvalue(), mimetype=TileOutputMimeTypes['NPY'])
+
+
+def _encodeJpegBinary(
+        image: PIL.Image.Image, jpegQuality: Union[str, int],
+        jpegSubsampling: Union[str, int]) -> bytes:
+    """
+    Encode a PIL Image as a jpeg with simplejpeg.
+
+    :param image: a PIL image in L, RGB, or RGBA mode.
+    :param jpegQuality: the quality to use when encoding a JPEG.
+    :param jpegSubsampling: the subsampling level to use when encoding a JPEG.
+    :returns: a binary image.
+    """
+    return ImageBytes(simplejpeg.encode_jpeg(
+        _imageToNumpy(image)[0],
+        quality=jpegQuality,
+        colorspace=image.mode if image.mode in {'RGB', 'RGBA'} else 'GRAY',
+        colorsubsampling={-1: '444', 0: '444', 1: '422', 2: '420'}.get(
+            cast(int, jpegSubsampling), str(jpegSubsampling).strip(':')),
+    ), mimetype='image/jpeg')
+
+
+def _pilEncodingParams(
         image: PIL.Image.Image, encoding: str, jpegQuality: Union[str, int],
-        jpegSubsampling: Union[str, int], tiffCompression: str) -> bytes:
+        jpegSubsampling: Union[str, int], tiffCompression: str) -> Dict[str, Any]:
     """
-    Encode a PIL Image to a binary representation of the image (a jpeg, png, or
-    tif).
+    Get the parameters for saving an image with PIL.
 
     :param image: a PIL image.
-    :param encoding: a valid PIL encoding (typically 'PNG' or 'JPEG').  Must
-        also be in the TileOutputMimeTypes map.
+    :param encoding: a valid PIL encoding.
     :param jpegQuality: the quality to use when encoding a JPEG.
     :param jpegSubsampling: the subsampling level to use when encoding a JPEG.
     :param tiffCompression: the compression format to use when encoding a TIFF.
-    :returns: a binary image or b'' if the image is of zero size.
+    :returns: a dictionary of parameters.
     """
-    encoding = TileOutputPILFormat.get(encoding, encoding)
-    if image.width == 0 or image.height == 0:
-        return b''
-    params: Dict[str, Any] = {}
     if encoding == 'JPEG':
-        if image.mode not in ({'L', 'RGB', 'RGBA'} if simplejpeg else {'L', 'RGB'}):
-            image = image.convert('RGB' if image.mode != 'LA' else 'L')
-        if simplejpeg:
-            return ImageBytes(simplejpeg.encode_jpeg(
-                _imageToNumpy(image)[0],
-                quality=jpegQuality,
-                colorspace=image.mode if image.mode in {'RGB', 'RGBA'} else 'GRAY',
-                colorsubsampling={-1: '444', 0: '444', 1: '422', 2: '420'}.get(
-                    cast(int, jpegSubsampling), str(jpegSubsampling).strip(':')),
-            ), mimetype='image/jpeg')
-        params['quality'] = jpegQuality
-        params['subsampling'] = jpegSubsampling
-    elif encoding in {'TIFF', 'TILED'}:
-        params['compression'] = {
+        return {'quality': jpegQuality, 'subsampling': jpegSubsampling}
+    if encoding in {'TIFF', 'TILED'}:
+        return {'compression': {
             'none': 'raw',
             'lzw': 'tiff_lzw',
             'deflate': 'tiff_adobe_deflate',
-        }.get(tiffCompression, tiffCompression)
-    elif encoding == 'PNG':
-        params['compress_level'] = 2
+        }.get(tiffCompression, tiffCompression)}
+    if encoding == 'PNG':
+        return _pngEncodingParams(image)
+    return {}
+
+
+def _savePILImage(image: PIL.Image.Image, encoding: str, params: Dict[str, Any]) -> bytes:
+    """
+    Save a PIL Image, converting it to a simpler mode if the encoding doesn't
+    support its mode.
+
+    :param image: a PIL image.
+    :param encoding: a valid PIL encoding.
+    :param params: parameters for saving the image.
+    :returns: the binary image data.
+    """
     output = io.BytesIO()
     try:
         image.save(output, encoding, **params)
@@ -144,12 +214,90 @@ def _encodeImageBinary(
                 pass
         if retry:
             image.convert('1').save(output, encoding, **params)
+    return output.getvalue()
+
+
+def _encodeImageBinary(
+        image: Union[PIL.Image.Image, np.ndarray], encoding: str,
+        jpegQuality: Union[str, int], jpegSubsampling: Union[str, int],
+        tiffCompression: str) -> bytes:
+    """
+    Encode a PIL Image to a binary representation of the image (a jpeg, png,
+    tif, or npy).
+
+    :param image: a PIL image.  For the NPY encoding, this may also be a numpy
+        array, in which case the data type is preserved.
+    :param encoding: a valid PIL encoding (typically 'PNG' or 'JPEG') or
+        'NPY'.  Must also be in the TileOutputMimeTypes map.
+    :param jpegQuality: the quality to use when encoding a JPEG.
+    :param jpegSubsampling: the subsampling level to use when encoding a JPEG.
+    :param tiffCompression: the compression format to use when encoding a TIFF.
+    :returns: a binary image or b'' if the image is of zero size.
+    """
+    encoding = TileOutputPILFormat.get(encoding, encoding)
+    if encoding == 'NPY':
+        return _encodeNumpyBinary(image)
+    if isinstance(image, np.ndarray):
+        image = _imageToPIL(image)
+    if image.width == 0 or image.height == 0:
+        return b''
+    if encoding == 'JPEG':
+        if image.mode not in ({'L', 'RGB', 'RGBA'} if simplejpeg else {'L', 'RGB'}):
+            image = image.convert('RGB' if image.mode != 'LA' else 'L')
+        if simplejpeg:
+            return _encodeJpegBinary(image, jpegQuality, jpegSubsampling)
+    params = _pilEncodingParams(
+        image, encoding, jpegQuality, jpegSubsampling, tiffCompression)
     return ImageBytes(
-        output.getvalue(),
+        _savePILImage(image, encoding, params),
         mimetype=f'image/{encoding.lower().replace("tiled", "tiff")}',
     )
 
 
+def _encodeImagesBinary(
+        images: List[Union[PIL.Image.Image, np.ndarray]], encoding: str,
+        jpegQuality: Union[str, int] = 95, jpegSubsampling: Union[str, int] = 0,
+        tiffCompression: str = 'raw', maxQueued: Optional[int] = None) -> List[bytes]:
+    """
+    Encode a list of images in parallel.  The encoders release the GIL, so
+    this uses a shared thread pool.  A new image is queued as soon as the
+    oldest queued image is encoded, so the pool stays busy without holding
+    every encoded image in memory.
+
+    :param images: a list of PIL images or numpy arrays.
+    :param encoding: a valid PIL encoding (typically 'PNG' or 'JPEG') or
+        'NPY'.  Must also be in the TileOutputMimeTypes map.
+    :param jpegQuality: the quality to use when encoding a JPEG.
+    :param jpegSubsampling: the subsampling level to use when encoding a JPEG.
+    :param tiffCompression: the compression format to use when encoding a TIFF.
+    :param maxQueued: if not None, the maximum number of images that are
+        queued for encoding at once.  Otherwise, this is twice the number of
+        logical cpus.
+    :returns: a list of binary images in the same order as the input.
+    """
+    global _encodingPool
+
+    if len(images) <= 1 or maxQueued == 1:
+        return [_encodeImageBinary(
+            image, encoding, jpegQuality, jpegSubsampling, tiffCompression)
+            for image in images]
+    with _encodingPoolLock:
+        if _encodingPool is None:
+            _encodingPool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.cpu_count(), thread_name_prefix='large_image_encode')
+    maxQueued = maxQueued or config.cpu_count() * 2
+    results: List[bytes] = []
+    pending: collections.deque = collections.deque()
+    for image in images:
+        if len(pending) >= maxQueued:
+            results.append(pending.popleft().result())
+        pending.append(_encodingPool.submit(
+            _encodeImageBinary, image, encoding, jpegQuality, jpegSubsampling,
+            tiffCompression))
+    results.extend(future.result() for future in pending)
+    return results
+
+
 def _encodeImage(
     image: Union[ImageBytes, PIL.Image.Image, bytes, np.ndarray],
     encoding: str = 'JPEG', jpegQuality: int = 95, jpegSubsampling: int = 0,
@@ -188,7 +336,10 @@ def _encodeImage(
         if encoding not in TileOutputMimeTypes:
             raise ValueError('Invalid encoding "%s"' % encoding)
         imageFormatOrMimeType = TileOutputMimeTypes[encoding]
-        image = _imageToPIL(image)
+        if encoding == 'NPY':
+            image, _ = _imageToNumpy(image)
+        else:
+            image = _imageToPIL(image)
         imageData = _encodeImageBinary(
             image, encoding, jpegQuality, jpegSubsampling, tiffCompression)
     return imageData, imageFormatOrMimeType
@@ -228,6 +379,8 @@ def _imageToPIL(
         elif image.dtype != np.uint8:
             image = image.astype(np.uint8)
         image = PIL.Image.fromarray(image, mode)
+    elif isinstance(image, bytes) and image[:6] == b'\x93NUMPY':
+        return _imageToPIL(np.load(io.BytesIO(image), allow_pickle=False), setMode)
     elif not isinstance(image, PIL.Image.Image):
         image = PIL.Image.open(io.BytesIO(image))
     if setMode is not None and image.mode != setMode:
@@ -246,6 +399,11 @@ def _imageToNumpy(
     """
     if isinstance(image, np.ndarray) and len(image.shape) == 3 and 1 <= image.shape[2] <= 4:
         return image, modesBySize[image.shape[2] - 1]
+    if isinstance(image, bytes) and image[:6] == b'\x93NUMPY':
+        array: np.ndarray = np.load(io.BytesIO(image), allow_pickle=False)
+        if len(array.shape) == 3 and 1 <= array.shape[2] <= 4:
+            return array, modesBySize[array.shape[2] - 1]
+        image = array
     if (simplejpeg and isinstance(image, bytes) and image[:3] == b'\xff\xd8\xff' and
             b'\xff\xc0' in image[:1024]):
         idx = image.index(b'\xff\xc0')
@@ -939,6 +1097,37 @@ def _calculateWidthHeight(
     return int(cast(float, width)), int(cast(float, height)), scale
 
 
+def _frameBlock(
+        positions: Dict[str, np.ndarray],
+        maxRatio: float = 2) -> Optional[Tuple[Dict[str, slice], Dict[str, np.ndarray]]]:
+    """
+    Given the positions of several frames along each of the axes that frames
+    are stored on, find the smallest block of data that contains all of them.
+    Reading such a block in one call is faster than reading each frame
+    separately unless the block contains many frames that aren't needed.
+
+    :param positions: a dictionary with a key for each axis and an array of
+        the position of each frame along that axis.
+    :param maxRatio: if the block contains more than this multiple of the
+        number of frames, don't use it.
+    :returns: None if the block is too large.  Otherwise, a dictionary of
+        slices for each axis and a dictionary of the position of each frame
+        relative to the start of the block.
+    """
+    slices = {}
+    relative = {}
+    size = count = 1
+    for key, pos in positions.items():
+        low, high = int(pos.min()), int(pos.max()) + 1
+        slices[key] = slice(low, high)
+        relative[key] = pos - low
+        size *= high - low
+        count = len(pos)
+    if size > maxRatio * count:
+        return None
+    return slices, relative
+
+
 def _computeFramesPerTexture(
         opts: Dict[str, Any], numFrames: int, sizeX: int,
         sizeY: int) -> Tuple[int, int, int, int, int]:
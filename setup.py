@@ -39,6 +39,8 @@ extraReqs = {
     'redis': ['redis>=4.5.5'],
     'converter': [f'large-image-converter{limit_version}'],
     'colormaps': ['matplotlib'],
+    'dask': ['dask[array]'],
+    'xarray': ['dask[array]', 'xarray'],
     'tiledoutput': ['pyvips'],
     'performance': [
         'psutil>=4.2.0',
@@ -27,6 +27,10 @@ class DeepzoomFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
     mimeTypes = {
         None: SourcePriority.FALLBACK,
     }
+    signatures = {
+        # Deepzoom files are xml
+        None: SourcePriority.MANUAL,
+    }
 
     def __init__(self, path, **kwargs):
         """
@@ -114,6 +114,10 @@ class DICOMFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         r'DCM_\d+$': SourcePriority.MEDIUM,
         r'\d+(\.\d+){3,20}$': SourcePriority.MEDIUM,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'dicom': SourcePriority.PREFERRED,
+    }
 
     _minTileSize = 64
     _maxTileSize = 4096
@@ -139,6 +139,44 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
         self._getTileLock = threading.Lock()
         self._setDefaultStyle()
 
+    def _openDataset(self):
+        try:
+            return gdal.Open(self._largeImagePath, gdalconst.GA_ReadOnly)
+        except RuntimeError:
+            return None
+
+    def _closeDataset(self, dataset):
+        # GDAL datasets are closed when they are dereferenced
+        pass
+
+    def _warpTransform(self):
+        with self._getDatasetLock:
+            # Sources with nodata, masks, or alpha are warped by GDAL so that
+            # those are handled the same way
+            if not self.dataset.GetProjection() or self.dataset.GetGCPCount() or any(
+                    self.dataset.GetRasterBand(i + 1).GetMaskFlags() != gdal.GMF_ALL_VALID
+                    for i in range(self.dataset.RasterCount)):
+                return None
+        return self._projectionToNativePixels
+
+    def _readWindow(self, x, y, width, height, bufferWidth, bufferHeight):
+        """
+        Read a window of the source with nearest-neighbor sampling.
+
+        :param x: the left edge of the window in source pixels.
+        :param y: the top edge of the window in source pixels.
+        :param width: the width of the window in source pixels.
+        :param height: the height of the window in source pixels.
+        :param bufferWidth: the width of the returned array.
+        :param bufferHeight: the height of the returned array.
+        :returns: a numpy array of (bands, bufferHeight, bufferWidth).
+        """
+        with self._readDataset() as dataset:
+            return dataset.ReadAsArray(
+                xoff=x, yoff=y, xsize=width, ysize=height,
+                buf_xsize=bufferWidth, buf_ysize=bufferHeight,
+                resample_alg=gdal.GRIORA_NearestNeighbour)
+
     def _getDriver(self):
         """
         Get the GDAL driver used to read this dataset.
@@ -315,6 +353,11 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
             pass  # failed to parse version
         return pyproj.Proj(proj)
 
+    def _makeCoordinateTransform(self, srcProj, dstProj=None):
+        inProj = self._proj4Proj(srcProj)
+        outProj = self._proj4Proj(self.getProj4String() if dstProj is None else dstProj)
+        return pyproj.Transformer.from_proj(inProj, outProj, always_xy=True).transform
+
     def toNativePixelCoordinates(self, x, y, proj=None, roundResults=True):
         """
         Convert a coordinate in the native projection (self.getProj4String) to
@@ -326,20 +369,7 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
         :param roundResults: if True, round the results to the nearest pixel.
         :return: (x, y) the pixel coordinate.
         """
-        if proj is None:
-            proj = self.projection
-        # convert to the native projection
-        inProj = self._proj4Proj(proj)
-        outProj = self._proj4Proj(self.getProj4String())
-        px, py = pyproj.Transformer.from_proj(inProj, outProj, always_xy=True).transform(x, y)
-        # convert to native pixel coordinates
-        gt = self._getGeoTransform()
-        d = gt[2] * gt[4] - gt[1] * gt[5]
-        x = (gt[0] * gt[5] - gt[2] * gt[3] - gt[5] * px + gt[2] * py) / d
-        y = (gt[1] * gt[3] - gt[0] * gt[4] + gt[4] * px - gt[1] * py) / d
-        if roundResults:
-            x = int(round(x))
-            y = int(round(y))
+        x, y = self.toNativePixelCoordinatesArray([(x, y)], proj, roundResults)[0].tolist()
         return x, y
 
     def _convertProjectionUnits(self, left, top, right, bottom, width, height,
@@ -379,26 +409,18 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
                    'left and right and at least one of top and bottom is '
                    'specified.')
             raise TileSourceError(msg)
+        corners = [(right if left is None else left, bottom if top is None else top),
+                   (left if right is None else right, top if bottom is None else bottom)]
         if not self.projection:
-            pleft, ptop = self.toNativePixelCoordinates(
-                right if left is None else left,
-                bottom if top is None else top,
-                units)
-            pright, pbottom = self.toNativePixelCoordinates(
-                left if right is None else right,
-                top if bottom is None else bottom,
-                units)
+            (pleft, ptop), (pright, pbottom) = self.toNativePixelCoordinatesArray(
+                corners, units).tolist()
             units = 'base_pixels'
         else:
-            inProj = self._proj4Proj(units)
-            outProj = self._proj4Proj(self.projection)
-            transformer = pyproj.Transformer.from_proj(inProj, outProj, always_xy=True)
-            pleft, ptop = transformer.transform(
-                right if left is None else left,
-                bottom if top is None else top)
-            pright, pbottom = transformer.transform(
-                left if right is None else right,
-                top if bottom is None else bottom)
+            x, y = self._coordinateTransform(units, self.projection)(
+                np.array([corners[0][0], corners[1][0]], dtype=float),
+                np.array([corners[0][1], corners[1][1]], dtype=float))
+            pleft, pright = np.asarray(x).tolist()
+            ptop, pbottom = np.asarray(y).tolist()
             units = 'projection'
         left = pleft if left is not None else None
         top = ptop if top is not None else None
@@ -414,21 +436,7 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
         :param level: the level of the pixel.  None for maximum level.
         :returns: x, y in projection coordinates.
         """
-        if level is None:
-            level = self.levels - 1
-        if not self.projection:
-            x *= 2 ** (self.levels - 1 - level)
-            y *= 2 ** (self.levels - 1 - level)
-            gt = self._getGeoTransform()
-            px = gt[0] + gt[1] * x + gt[2] * y
-            py = gt[3] + gt[4] * x + gt[5] * y
-            return px, py
-        xScale = 2 ** level * self.tileWidth
-        yScale = 2 ** level * self.tileHeight
-        x = x / xScale - 0.5
-        y = 0.5 - y / yScale
-        x = x * self.unitsAcrossLevel0 + self.projectionOrigin[0]
-        y = y * self.unitsAcrossLevel0 + self.projectionOrigin[1]
+        x, y = self.pixelToProjectionArray([(x, y)], level)[0].tolist()
         return x, y
 
     def getBounds(self, srs=None):
@@ -484,15 +492,13 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
                     bounds['ul']['x'] = bounds['ll']['x'] = -180
                     bounds['ur']['x'] = bounds['lr']['x'] = 180
             if srs and srs != nativeSrs:
-                inProj = self._proj4Proj(nativeSrs)
-                outProj = self._proj4Proj(srs)
                 keys = ('ll', 'ul', 'lr', 'ur')
-                pts = pyproj.Transformer.from_proj(inProj, outProj, always_xy=True).itransform([
-                    (bounds[key]['x'], bounds[key]['y']) for key in keys])
-                for idx, pt in enumerate(pts):
-                    key = keys[idx]
-                    bounds[key]['x'] = pt[0]
-                    bounds[key]['y'] = pt[1]
+                xs, ys = self._coordinateTransform(nativeSrs, srs)(
+                    np.array([bounds[key]['x'] for key in keys], dtype=float),
+                    np.array([bounds[key]['y'] for key in keys], dtype=float))
+                for idx, key in enumerate(keys):
+                    bounds[key]['x'] = float(xs[idx])
+                    bounds[key]['y'] = float(ys[idx])
                 bounds['srs'] = srs.decode() if isinstance(srs, bytes) else srs
             bounds['xmin'] = min(bounds['ll']['x'], bounds['ul']['x'],
                                  bounds['lr']['x'], bounds['ur']['x'])
@@ -685,6 +691,44 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
             return None
         return int(band)
 
+    def _warpTileWithVRT(self, xmin, ymin, xmax, ymax, z):
+        """
+        Warp a tile with a GDAL VRT.  This is used when a tile can't be warped
+        with a warp plan.
+
+        :param xmin: the left edge of the tile in projection units.
+        :param ymin: the bottom edge of the tile in projection units.
+        :param xmax: the right edge of the tile in projection units.
+        :param ymax: the top edge of the tile in projection units.
+        :param z: the tile level.
+        :returns: a numpy array of (bands, height, width).
+        """
+        res = (self.unitsAcrossLevel0 / self.tileSize) * (2 ** -z)
+        if not hasattr(self, '_warpSRS'):
+            self._warpSRS = (self.getProj4String(),
+                             self.projection.decode())
+            if self._warpSRS[1].startswith(InitPrefix) and tuple(
+                    int(p) for p in gdal.__version__.split('.')[:2]) >= (3, 1):
+                self._warpSRS = (self._warpSRS[0], self._warpSRS[1][len(InitPrefix):])
+        with self._readDataset() as dataset:
+            ds = gdal.Warp(
+                '', dataset, format='VRT',
+                srcSRS=self._warpSRS[0], dstSRS=self._warpSRS[1],
+                dstAlpha=True,
+                # Valid options are GRA_NearestNeighbour, GRA_Bilinear,
+                # GRA_Cubic, GRA_CubicSpline, GRA_Lanczos, GRA_Med,
+                # GRA_Mode, perhaps others; because we have some indexed
+                # datasets, generically, this should probably either be
+                # GRA_NearestNeighbour or GRA_Mode.
+                resampleAlg=gdal.GRA_NearestNeighbour,
+                multithread=True,
+                # We might get a speed-up with acceptable distortion if we
+                # set the polynomialOrder or ask for an optimal transform
+                # around the outputBounds.
+                polynomialOrder=1,
+                xRes=res, yRes=res, outputBounds=[xmin, ymin, xmax, ymax])
+            return ds.ReadAsArray()
+
     @methodcache()
     def getTile(self, x, y, z, pilImageAllowed=False, numpyAllowed=False, **kwargs):
         if not self.projection:
@@ -696,8 +740,8 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
             y1 = int(min(y0 + factor * self.tileHeight, self.sourceSizeY))
             w = int(max(1, round((x1 - x0) / factor)))
             h = int(max(1, round((y1 - y0) / factor)))
-            with self._getDatasetLock:
-                tile = self.dataset.ReadAsArray(
+            with self._readDataset() as dataset:
+                tile = dataset.ReadAsArray(
                     xoff=x0, yoff=y0, xsize=x1 - x0, ysize=y1 - y0, buf_xsize=w, buf_ysize=h)
         else:
             xmin, ymin, xmax, ymax = self.getTileCorners(z, x, y)
@@ -707,31 +751,17 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
                 pilimg = PIL.Image.new('RGBA', (self.tileWidth, self.tileHeight))
                 return self._outputTile(
                     pilimg, TILE_FORMAT_PIL, x, y, z, applyStyle=False, **kwargs)
-            res = (self.unitsAcrossLevel0 / self.tileSize) * (2 ** -z)
-            if not hasattr(self, '_warpSRS'):
-                self._warpSRS = (self.getProj4String(),
-                                 self.projection.decode())
-                if self._warpSRS[1].startswith(InitPrefix) and tuple(
-                        int(p) for p in gdal.__version__.split('.')[:2]) >= (3, 1):
-                    self._warpSRS = (self._warpSRS[0], self._warpSRS[1][len(InitPrefix):])
-            with self._getDatasetLock:
-                ds = gdal.Warp(
-                    '', self.dataset, format='VRT',
-                    srcSRS=self._warpSRS[0], dstSRS=self._warpSRS[1],
-                    dstAlpha=True,
-                    # Valid options are GRA_NearestNeighbour, GRA_Bilinear,
-                    # GRA_Cubic, GRA_CubicSpline, GRA_Lanczos, GRA_Med,
-                    # GRA_Mode, perhaps others; because we have some indexed
-                    # datasets, generically, this should probably either be
-                    # GRA_NearestNeighbour or GRA_Mode.
-                    resampleAlg=gdal.GRA_NearestNeighbour,
-                    multithread=True,
-                    # We might get a speed-up with acceptable distortion if we
-                    # set the polynomialOrder or ask for an optimal transform
-                    # around the outputBounds.
-                    polynomialOrder=1,
-                    xRes=res, yRes=res, outputBounds=[xmin, ymin, xmax, ymax])
-                tile = ds.ReadAsArray()
+            plan = self._getWarpPlan(z)
+            if plan is not None:
+                with self._getDatasetLock:
+                    bands = self.dataset.RasterCount
+                    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+                        self.dataset.GetRasterBand(1).DataType)
+                tile = plan.warp(
+                    xmin, ymax, self._readWindow, self.sourceSizeX, self.sourceSizeY,
+                    bands, dtype)
+            else:
+                tile = self._warpTileWithVRT(xmin, ymin, xmax, ymax, z)
         if len(tile.shape) == 3:
             tile = np.rollaxis(tile, 0, 3)
         return self._outputTile(tile, TILE_FORMAT_NUMPY, x, y, z,
@@ -767,9 +797,9 @@ class GDALFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass):
                 # convert to native pixel coordinates
                 x, y = self.toNativePixelCoordinates(x, y)
             if 0 <= int(x) < self.sizeX and 0 <= int(y) < self.sizeY:
-                with self._getDatasetLock:
-                    for i in range(self.dataset.RasterCount):
-                        band = self.dataset.GetRasterBand(i + 1)
+                with self._readDataset() as dataset:
+                    for i in range(dataset.RasterCount):
+                        band = dataset.GetRasterBand(i + 1)
                         try:
                             value = band.ReadRaster(int(x), int(y), 1, 1, buf_type=gdal.GDT_Float32)
                             if value:
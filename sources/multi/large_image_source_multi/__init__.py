@@ -381,6 +381,10 @@ class MultiFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'application/json': SourcePriority.PREFERRED,
         'application/yaml': SourcePriority.PREFERRED,
     }
+    signatures = {
+        # Multi source files are json or yaml
+        None: SourcePriority.MANUAL,
+    }
 
     _minTileSize = 64
     _maxTileSize = 4096
@@ -26,6 +26,7 @@ from large_image.cache_util import LruCacheMetaclass, methodcache
 from large_image.constants import TILE_FORMAT_NUMPY, SourcePriority
 from large_image.exceptions import TileSourceError, TileSourceFileNotFoundError
 from large_image.tilesource import FileTileSource
+from large_image.tilesource.utilities import _frameBlock
 
 nd2 = None
 
@@ -110,6 +111,12 @@ class ND2FileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         None: SourcePriority.FALLBACK,
         'image/nd2': SourcePriority.PREFERRED,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'nd2': SourcePriority.PREFERRED,
+        # Older ND2 files are JPEG 2000 based
+        'jp2': SourcePriority.FALLBACK,
+    }
 
     # If frames are smaller than this they are served as single tiles, which
     # can be more efficient than handling multiple tiles.
@@ -323,6 +330,28 @@ class ND2FileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         return self._outputTile(tile, TILE_FORMAT_NUMPY, x, y, z,
                                 pilImageAllowed, numpyAllowed, **kwargs)
 
+    def _getTileStack(self, x, y, z, frames):
+        for frame in frames:
+            self._xyzInRange(x, y, z, frame, self._frameCount)
+        x0, y0, x1, y1, step = self._xyzToCorners(x, y, z)
+        fc = self._frameCount
+        fp = np.array(frames)
+        positions = {}
+        for axis in self._nd2order[:self._nd2order.index('Y')]:
+            fc //= self._nd2sizes[axis]
+            positions[axis] = fp // fc
+            fp = fp % fc
+        block = _frameBlock(positions) if positions else None
+        if block is None:
+            return None
+        slices, relative = block
+        sel = tuple(slices[axis] for axis in positions) + (
+            slice(y0, y1, step), slice(x0, x1, step))
+        with self._tileLock:
+            data = self._nd2array[sel].compute(scheduler='single-threaded')
+        # Selecting each frame from the block makes a copy
+        return data[tuple(relative[axis] for axis in positions)]
+
 
 def open(*args, **kwargs):
     """
@@ -80,6 +80,11 @@ class OMETiffFileTileSource(TiffFileTileSource, metaclass=LruCacheMetaclass):
         'image/tiff': SourcePriority.MEDIUM,
         'image/x-tiff': SourcePriority.MEDIUM,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'tiff': SourcePriority.MEDIUM,
+        'bigtiff': SourcePriority.MEDIUM,
+    }
 
     # The expect number of pixels that would need to be read to read the worst-
     # case tile.
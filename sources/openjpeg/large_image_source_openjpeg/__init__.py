@@ -65,6 +65,11 @@ class OpenjpegFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'image/jp2': SourcePriority.PREFERRED,
         'image/jpx': SourcePriority.PREFERRED,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'jp2': SourcePriority.PREFERRED,
+        'j2k': SourcePriority.PREFERRED,
+    }
 
     _boxToTag = {
         # In the few samples I've seen, both of these appear to be macro images
@@ -64,6 +64,11 @@ class OpenslideFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'image/tiff': SourcePriority.MEDIUM,
         'image/x-tiff': SourcePriority.MEDIUM,
     }
+    signatures = {
+        'tiff': SourcePriority.MEDIUM,
+        'bigtiff': SourcePriority.MEDIUM,
+        'dicom': SourcePriority.LOW,
+    }
 
     def __init__(self, path, **kwargs):  # noqa
         """
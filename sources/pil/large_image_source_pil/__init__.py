@@ -103,6 +103,9 @@ class PILFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         None: SourcePriority.FALLBACK_HIGH,
         'image/jpeg': SourcePriority.LOW,
     }
+    signatures = {
+        'jpeg': SourcePriority.LOW,
+    }
 
     def __init__(self, path, maxSize=None, **kwargs):
         """
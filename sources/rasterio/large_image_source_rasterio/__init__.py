@@ -29,7 +29,7 @@ import PIL.Image
 import rasterio as rio
 from affine import Affine
 from rasterio import warp
-from rasterio.enums import ColorInterp, Resampling
+from rasterio.enums import ColorInterp, MaskFlags, Resampling
 from rasterio.errors import RasterioIOError
 
 import large_image
@@ -42,9 +42,13 @@ from large_image.exceptions import (TileSourceError,
                                     TileSourceInefficientError)
 from large_image.tilesource.geo import (GDALBaseFileTileSource,
                                         ProjUnitsAcrossLevel0,
-                                        ProjUnitsAcrossLevel0_MaxSize)
+                                        ProjUnitsAcrossLevel0_MaxSize,
+                                        has_pyproj)
 from large_image.tilesource.utilities import JSONDict
 
+if has_pyproj:
+    import pyproj
+
 try:
     __version__ = _importlib_version(__name__)
 except PackageNotFoundError:
@@ -155,6 +159,22 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
         self._getTileLock = threading.Lock()
         self._setDefaultStyle()
 
+    def _openDataset(self):
+        try:
+            return rio.open(self._largeImagePath)
+        except RasterioIOError:
+            return None
+
+    def _warpTransform(self):
+        with self._getDatasetLock:
+            dataset = self.dataset
+            # Sources with nodata, masks, or alpha are warped by GDAL so that
+            # those are handled the same way
+            if dataset.crs is None or len(dataset.gcps[0]) or any(
+                    MaskFlags.all_valid not in flags for flags in dataset.mask_flag_enums):
+                return None
+        return self._projectionToNativePixels
+
     def _getPopulatedLevels(self):
         try:
             with self._getDatasetLock:
@@ -329,6 +349,18 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
 
         return affine
 
+    def _getGeoTransform(self):
+        return self._getAffine().to_gdal()
+
+    def _makeCoordinateTransform(self, srcProj, dstProj=None):
+        srcCrs = make_crs(srcProj)
+        dstCrs = make_crs(self.getCrs() if dstProj is None else dstProj)
+        if has_pyproj:
+            # A reused transformer is much faster than rasterio's transform
+            return pyproj.Transformer.from_crs(
+                srcCrs.to_wkt(), dstCrs.to_wkt(), always_xy=True).transform
+        return lambda x, y: warp.transform(srcCrs, dstCrs, x, y)
+
     def getBounds(self, crs=None, **kwargs):
         """Returns bounds of the image.
 
@@ -408,8 +440,11 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
         # reproject the pts in the destination coordinate system if necessary
         needProjection = dstCrs and dstCrs != srcCrs
         if needProjection:
-            for pt in bounds.values():
-                [pt['x']], [pt['y']] = warp.transform(srcCrs, dstCrs, [pt['x']], [pt['y']])
+            xs, ys = self._coordinateTransform(srcCrs, dstCrs)(
+                np.array([pt['x'] for pt in bounds.values()], dtype=float),
+                np.array([pt['y'] for pt in bounds.values()], dtype=float))
+            for idx, pt in enumerate(bounds.values()):
+                pt['x'], pt['y'] = float(xs[idx]), float(ys[idx])
 
         # extract min max coordinates from the corners
         ll = bounds['ll']['x'], bounds['ll']['y']
@@ -555,6 +590,61 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
 
         return result
 
+    def _readWindow(self, x, y, width, height, bufferWidth, bufferHeight):
+        """
+        Read a window of the source with nearest-neighbor sampling.
+
+        :param x: the left edge of the window in source pixels.
+        :param y: the top edge of the window in source pixels.
+        :param width: the width of the window in source pixels.
+        :param height: the height of the window in source pixels.
+        :param bufferWidth: the width of the returned array.
+        :param bufferHeight: the height of the returned array.
+        :returns: a numpy array of (bands, bufferHeight, bufferWidth).
+        """
+        with self._readDataset() as dataset:
+            return dataset.read(
+                window=rio.windows.Window(x, y, width, height),
+                out_shape=(dataset.count, bufferHeight, bufferWidth),
+                resampling=Resampling.nearest,
+            )
+
+    def _warpTileWithVRT(self, xmin, ymin, xmax, ymax):
+        """
+        Warp a tile with a GDAL warped VRT.  This is used when a tile can't be
+        warped with a warp plan.
+
+        :param xmin: the left edge of the tile in projection units.
+        :param ymin: the bottom edge of the tile in projection units.
+        :param xmax: the right edge of the tile in projection units.
+        :param ymax: the top edge of the tile in projection units.
+        :returns: a numpy array of (bands, height, width).
+        """
+        xres = (xmax - xmin) / self.tileWidth
+        yres = (ymax - ymin) / self.tileHeight
+        dst_transform = Affine(xres, 0.0, xmin, 0.0, -yres, ymax)
+
+        # Adding an alpha band when the source has one is trouble.
+        # It will result in surprisingly unmasked data.
+        src_alpha_band = 0
+        for i, interp in enumerate(self.dataset.colorinterp):
+            if interp == ColorInterp.alpha:
+                src_alpha_band = i
+        add_alpha = not src_alpha_band
+
+        # read the image as a warp vrt
+        with self._readDataset() as dataset:
+            with rio.vrt.WarpedVRT(
+                dataset,
+                resampling=Resampling.nearest,
+                crs=self.projection,
+                transform=dst_transform,
+                height=self.tileHeight,
+                width=self.tileWidth,
+                add_alpha=add_alpha,
+            ) as vrt:
+                return vrt.read(resampling=Resampling.nearest)
+
     @methodcache()
     def getTile(self, x, y, z, pilImageAllowed=False, numpyAllowed=False, **kwargs):
         if not self.projection:
@@ -567,10 +657,10 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
             w = int(max(1, round((xmax - xmin) / factor)))
             h = int(max(1, round((ymax - ymin) / factor)))
 
-            with self._getDatasetLock:
+            with self._readDataset() as dataset:
                 window = rio.windows.Window(xmin, ymin, xmax - xmin, ymax - ymin)
-                count = self.dataset.count
-                tile = self.dataset.read(
+                count = dataset.count
+                tile = dataset.read(
                     window=window,
                     out_shape=(count, h, w),
                     resampling=Resampling.nearest,
@@ -592,30 +682,16 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
                     pilimg, TILE_FORMAT_PIL, x, y, z, applyStyle=False, **kwargs,
                 )
 
-            xres = (xmax - xmin) / self.tileWidth
-            yres = (ymax - ymin) / self.tileHeight
-            dst_transform = Affine(xres, 0.0, xmin, 0.0, -yres, ymax)
-
-            # Adding an alpha band when the source has one is trouble.
-            # It will result in surprisingly unmasked data.
-            src_alpha_band = 0
-            for i, interp in enumerate(self.dataset.colorinterp):
-                if interp == ColorInterp.alpha:
-                    src_alpha_band = i
-            add_alpha = not src_alpha_band
-
-            # read the image as a warp vrt
-            with self._getDatasetLock:
-                with rio.vrt.WarpedVRT(
-                    self.dataset,
-                    resampling=Resampling.nearest,
-                    crs=self.projection,
-                    transform=dst_transform,
-                    height=self.tileHeight,
-                    width=self.tileWidth,
-                    add_alpha=add_alpha,
-                ) as vrt:
-                    tile = vrt.read(resampling=Resampling.nearest)
+            plan = self._getWarpPlan(z)
+            if plan is not None:
+                with self._getDatasetLock:
+                    bands = self.dataset.count
+                    dtype = self.dataset.dtypes[0]
+                tile = plan.warp(
+                    xmin, ymax, self._readWindow, self.sourceSizeX, self.sourceSizeY,
+                    bands, dtype)
+            else:
+                tile = self._warpTileWithVRT(xmin, ymin, xmax, ymax)
 
         # necessary for multispectral images:
         # set the coordinates first and the bands at the end
@@ -667,16 +743,16 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
                    'specified.')
             raise TileSourceError(msg)
 
+        corners = [
+            (right if left is None else left, bottom if top is None else top),
+            (left if right is None else right, top if bottom is None else bottom),
+        ]
+
         # compute the pixel coordinates of the corners if no projection is set
         if not self.projection:
-            pleft, ptop = self.toNativePixelCoordinates(
-                right if left is None else left, bottom if top is None else top, units,
-            )
-            pright, pbottom = self.toNativePixelCoordinates(
-                left if right is None else right,
-                top if bottom is None else bottom,
-                units,
-            )
+            (pleft, ptop), (pright, pbottom) = self.toNativePixelCoordinatesArray(
+                corners, make_crs(units),
+            ).tolist()
             units = 'base_pixels'
 
         # compute the coordinates if the projection exist
@@ -686,12 +762,12 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
                 units = units.split(':', 1)[1]
             srcCrs = make_crs(units)
             dstCrs = self.projection  # instance projection -- do not use the CRS native to the file
-            [pleft], [ptop] = warp.transform(srcCrs, dstCrs,
-                                             [right if left is None else left],
-                                             [bottom if top is None else top])
-            [pright], [pbottom] = warp.transform(srcCrs, dstCrs,
-                                                 [left if right is None else right],
-                                                 [top if bottom is None else bottom])
+            x, y = self._coordinateTransform(srcCrs, dstCrs)(
+                np.array([corners[0][0], corners[1][0]], dtype=float),
+                np.array([corners[0][1], corners[1][1]], dtype=float),
+            )
+            pleft, pright = np.asarray(x).tolist()
+            ptop, pbottom = np.asarray(y).tolist()
             units = 'projection'
 
         # set the corner value in pixel coordinates if the coordinate was initially
@@ -801,26 +877,7 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
 
         :returns: px, py in projection coordinates.
         """
-        if level is None:
-            level = self.levels - 1
-
-        # if no projection is set build the pixel values using the geotransform
-        if not self.projection:
-            af = self._getAffine()
-            x *= 2 ** (self.levels - 1 - level)
-            y *= 2 ** (self.levels - 1 - level)
-            x = af[2] + af[0] * x + af[1] * y
-            y = af[5] + af[3] * x + af[4] * y
-
-        # else we used the projection set in __init__
-        else:
-            xScale = 2**level * self.tileWidth
-            yScale = 2**level * self.tileHeight
-            x = x / xScale - 0.5
-            y = 0.5 - y / yScale
-            x = x * self.unitsAcrossLevel0 + self.projectionOrigin[0]
-            y = y * self.unitsAcrossLevel0 + self.projectionOrigin[1]
-
+        x, y = self.pixelToProjectionArray([(x, y)], level)[0].tolist()
         return x, y
 
     def toNativePixelCoordinates(self, x, y, crs=None, roundResults=True):
@@ -834,21 +891,7 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
         :return: (x, y) the pixel coordinate.
         """
         srcCrs = self.projection if crs is None else make_crs(crs)
-
-        # convert to the native projection
-        dstCrs = make_crs(self.getCrs())
-        [px], [py] = warp.transform(srcCrs, dstCrs, [x], [y])
-
-        # convert to native pixel coordinates
-        af = self._getAffine()
-        d = af[1] * af[3] - af[0] * af[4]
-        x = (af[2] * af[4] - af[1] * af[5] - af[4] * px + af[1] * py) / d
-        y = (af[0] * af[5] - af[2] * af[3] + af[3] * px - af[0] * py) / d
-
-        # convert to integer if requested
-        if roundResults:
-            x, y = int(round(x)), int(round(y))
-
+        x, y = self.toNativePixelCoordinatesArray([(x, y)], srcCrs, roundResults)[0].tolist()
         return x, y
 
     def getPixel(self, **kwargs):
@@ -879,11 +922,11 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
                 x, y = self.toNativePixelCoordinates(x, y)
 
             if 0 <= int(x) < self.sizeX and 0 <= int(y) < self.sizeY:
-                with self._getDatasetLock:
-                    for i in self.dataset.indexes:
+                with self._readDataset() as dataset:
+                    for i in dataset.indexes:
                         window = rio.windows.Window(int(x), int(y), 1, 1)
                         try:
-                            value = self.dataset.read(
+                            value = dataset.read(
                                 i, window=window, resampling=Resampling.nearest,
                             )
                             value = value[0][0]  # there should be 1 single pixel
@@ -940,7 +983,7 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
         width = iterInfo['output']['width']
         height = iterInfo['output']['height']
 
-        with self._getDatasetLock, tempfile.NamedTemporaryFile(
+        with self._readDataset() as dataset, tempfile.NamedTemporaryFile(
             suffix='.tiff', prefix='tiledGeoRegion_', delete=False,
         ) as output:
 
@@ -949,7 +992,7 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
             dst_transform = Affine(xres, 0.0, left, 0.0, -yres, top)
 
             with rio.vrt.WarpedVRT(
-                self.dataset,
+                dataset,
                 resampling=Resampling.nearest,
                 crs=self.projection,
                 transform=dst_transform,
@@ -958,7 +1001,7 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
             ) as vrt:
                 data = vrt.read(resampling=Resampling.nearest)
 
-            profile = self.dataset.meta.copy()
+            profile = dataset.meta.copy()
             profile.update(
                 large_image.tilesource.utilities._rasterioParameters(
                     defaultCompression='lzw', **kwargs,
@@ -974,8 +1017,8 @@ class RasterioFileTileSource(GDALBaseFileTileSource, metaclass=LruCacheMetaclass
                 dst.write(data)
                 # Write colormaps if available
                 for i in range(data.shape[0]):
-                    if self.dataset.colorinterp[i].name.lower() == 'palette':
-                        dst.write_colormap(i + 1, self.dataset.colormap(i + 1))
+                    if dataset.colorinterp[i].name.lower() == 'palette':
+                        dst.write_colormap(i + 1, dataset.colormap(i + 1))
 
             return pathlib.Path(output.name), TileOutputMimeTypes['TILED']
 
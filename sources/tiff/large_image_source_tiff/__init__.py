@@ -71,6 +71,11 @@ class TiffFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'image/x-tiff': SourcePriority.HIGH,
         'image/x-ptif': SourcePriority.PREFERRED,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'tiff': SourcePriority.HIGH,
+        'bigtiff': SourcePriority.HIGH,
+    }
 
     _maxAssociatedImageSize = 8192
     _maxUntiledImage = 4096
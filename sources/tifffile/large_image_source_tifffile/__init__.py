@@ -14,6 +14,7 @@ from large_image.cache_util import LruCacheMetaclass, methodcache
 from large_image.constants import TILE_FORMAT_NUMPY, SourcePriority
 from large_image.exceptions import TileSourceError, TileSourceFileNotFoundError
 from large_image.tilesource import FileTileSource
+from large_image.tilesource.utilities import _frameBlock
 
 tifffile = None
 
@@ -87,6 +88,11 @@ class TifffileFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'image/tiff': SourcePriority.LOW,
         'image/x-tiff': SourcePriority.LOW,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'tiff': SourcePriority.LOW,
+        'bigtiff': SourcePriority.LOW,
+    }
 
     # Fallback for non-tiled or oddly tiled sources
     _tileSize = 512
@@ -503,15 +509,19 @@ class TifffileFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
             za, hasgbs = self._zarrcache[sidx]
         return za, hasgbs
 
-    @methodcache()
-    def getTile(self, x, y, z, pilImageAllowed=False, numpyAllowed=False, **kwargs):
-        frame = self._getFrame(**kwargs)
-        self._xyzInRange(x, y, z, frame, self._framecount)
+    def _getSeriesLevel(self, x, y, z, sidx):
+        """
+        Get the array to read a tile from and the region of the tile within
+        that array.
+
+        :param x: the x tile position.
+        :param y: the y tile position.
+        :param z: the z tile position.
+        :param sidx: the index of the series in self._series.
+        :returns: the series, the array, and the x0, y0, x1, y1, and step of
+            the region in the array.
+        """
         x0, y0, x1, y1, step = self._xyzToCorners(x, y, z)
-        if len(self._series) > 1:
-            sidx = frame // self._basis['P'][0]
-        else:
-            sidx = 0
         series = self._tf.series[self._series[sidx]]
         za, hasgbs = self._getZarrArray(series, sidx)
         xidx = series.axes.index('X')
@@ -532,6 +542,17 @@ class TifffileFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
                     break
         else:
             bza = za
+        return series, bza, x0, y0, x1, y1, step
+
+    @methodcache()
+    def getTile(self, x, y, z, pilImageAllowed=False, numpyAllowed=False, **kwargs):
+        frame = self._getFrame(**kwargs)
+        self._xyzInRange(x, y, z, frame, self._framecount)
+        if len(self._series) > 1:
+            sidx = frame // self._basis['P'][0]
+        else:
+            sidx = 0
+        series, bza, x0, y0, x1, y1, step = self._getSeriesLevel(x, y, z, sidx)
         if step > 2 ** self._maxSkippedLevels:
             tile = self._getTileFromEmptyLevel(x, y, z, **kwargs)
             tile = large_image.tilesource.base._imageToNumpy(tile)[0]
@@ -558,6 +579,41 @@ class TifffileFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         return self._outputTile(tile, TILE_FORMAT_NUMPY, x, y, z,
                                 pilImageAllowed, numpyAllowed, **kwargs)
 
+    def _getTileStack(self, x, y, z, frames):
+        for frame in frames:
+            self._xyzInRange(x, y, z, frame, self._framecount)
+        frames = np.array(frames)
+        sidx = 0
+        if len(self._series) > 1:
+            sidxs = frames // self._basis['P'][0]
+            if np.any(sidxs != sidxs[0]):
+                return None
+            sidx = int(sidxs[0])
+        series, bza, x0, y0, x1, y1, step = self._getSeriesLevel(x, y, z, sidx)
+        positions = {axis: (frames // self._basis[axis][0]) % self._basis[axis][2]
+                     for axis in series.axes if axis not in 'YXS'}
+        block = _frameBlock(positions) if positions else None
+        if step > 2 ** self._maxSkippedLevels or block is None:
+            return None
+        slices, relative = block
+        sel = []
+        for aidx, axis in enumerate(series.axes):
+            if axis == 'X':
+                sel.append(slice(x0, x1, step))
+            elif axis == 'Y':
+                sel.append(slice(y0, y1, step))
+            elif axis == 'S':
+                sel.append(slice(series.shape[aidx]))
+            else:
+                sel.append(slices[axis])
+        data = bza[tuple(sel)]
+        # Move the frame axes first, then select each frame from the block
+        order = [axis for axis in series.axes if axis not in 'YXS'] + [
+            axis for axis in 'YXS' if axis in series.axes]
+        data = np.moveaxis(
+            data, [series.axes.index(axis) for axis in order], range(len(order)))
+        return data[tuple(relative[axis] for axis in order if axis not in 'YXS')]
+
     @classmethod
     def addKnownExtensions(cls):
         if not hasattr(cls, '_addedExtensions'):
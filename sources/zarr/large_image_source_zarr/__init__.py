@@ -19,7 +19,7 @@ from large_image.constants import NEW_IMAGE_PATH_FLAG, TILE_FORMAT_NUMPY, Source
 from large_image.exceptions import TileSourceError, TileSourceFileNotFoundError
 from large_image.tilesource import FileTileSource
 from large_image.tilesource.resample import ResampleMethod, downsampleTileHalfRes
-from large_image.tilesource.utilities import _imageToNumpy, nearPowerOfTwo
+from large_image.tilesource.utilities import _frameBlock, _imageToNumpy, nearPowerOfTwo
 
 try:
     __version__ = _importlib_version(__name__)
@@ -53,6 +53,13 @@ class ZarrFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         'application/vnd+zarr': SourcePriority.PREFERRED,
         'application/x-zarr': SourcePriority.PREFERRED,
     }
+    signatures = {
+        None: SourcePriority.MANUAL,
+        'zarr': SourcePriority.PREFERRED,
+        'ome-ngff': SourcePriority.PREFERRED,
+        'sqlite': SourcePriority.MEDIUM,
+        'zip': SourcePriority.LOWER,
+    }
     newPriority = SourcePriority.HIGH
 
     _tileSize = 512
@@ -521,6 +528,49 @@ class ZarrFileTileSource(FileTileSource, metaclass=LruCacheMetaclass):
         return self._outputTile(tile, TILE_FORMAT_NUMPY, x, y, z,
                                 pilImageAllowed, numpyAllowed, **kwargs)
 
+    def _getTileStack(self, x, y, z, frames):
+        if self._levels is None:
+            self._validateZarr()
+        for frame in frames:
+            self._xyzInRange(x, y, z, frame, self._framecount)
+        frames = np.array(frames)
+        sidx = 0
+        if len(self._series) > 1:
+            sidxs = frames // self._strides['xy']
+            if np.any(sidxs != sidxs[0]):
+                return None
+            sidx = int(sidxs[0])
+        x0, y0, x1, y1, step = self._xyzToCorners(x, y, z)
+        targlevel = self.levels - 1 - z
+        while targlevel and self._levels[sidx][targlevel] is None:
+            targlevel -= 1
+        arr = self._levels[sidx][targlevel]
+        scale = int(2 ** targlevel)
+        step //= scale
+        positions = {key: (frames // self._strides[key]) % self._axisCounts[key]
+                     for key in self._axes if key in self._strides}
+        block = _frameBlock(positions) if positions else None
+        if step > 2 ** self._maxSkippedLevels or block is None:
+            return None
+        slices, relative = block
+        idx = [slice(None) for _ in arr.shape]
+        idx[self._axes['x']] = slice(x0 // scale, x1 // scale, step)
+        idx[self._axes['y']] = slice(y0 // scale, y1 // scale, step)
+        for key, value in slices.items():
+            idx[self._axes[key]] = value
+        trans = [idx for idx in range(len(arr.shape))
+                 if idx not in {self._axes['x'], self._axes['y'],
+                                self._axes.get('s', self._axes['x'])}]
+        # Select each frame from the block; other leading axes have one entry
+        axisKeys = {axis: key for key, axis in self._axes.items()}
+        sel = tuple(relative.get(axisKeys.get(axis), 0) for axis in trans)
+        trans += [self._axes['y'], self._axes['x']]
+        if 's' in self._axes:
+            trans.append(self._axes['s'])
+        with self._tileLock:
+            data = arr[tuple(idx)]
+        return np.transpose(data, trans)[sel]
+
     def _validateNewTile(self, tile, mask, placement, axes):
         if not isinstance(tile, np.ndarray) or axes is None:
             axes = 'yxs'
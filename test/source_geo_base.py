@@ -1,3 +1,4 @@
+import concurrent.futures
 import glob
 import io
 import json
@@ -15,6 +16,10 @@ from large_image.tilesource.utilities import ImageBytes
 from . import utilities
 from .datastore import datastore
 
+# Don't write .aux.xml sidecar files next to the test files when statistics
+# are computed.  tox sets this, but running pytest directly doesn't.
+os.environ['GDAL_PAM_ENABLED'] = 'NO'
+
 
 class _BaseGeoTests:
 
@@ -302,6 +307,82 @@ class _BaseGeoTests:
 
 class _GDALBaseSourceTest(_BaseGeoTests):
 
+    def testConcurrentReads(self):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        imagePath = os.path.join(testDir, 'test_files', 'rgb_geotiff.tiff')
+        source = self.basemodule.open(imagePath, projection='EPSG:3857')
+        regions = [{
+            'left': -13132910 + idx * 100, 'top': 4010586 - idx * 50, 'units': 'projection',
+        } for idx in range(32)]
+        expected = [source.getPixel(region=region) for region in regions]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            pixels = list(pool.map(lambda region: source.getPixel(region=region), regions))
+        assert pixels == expected
+        # Reads use their own dataset handles
+        assert len(source._datasetPool) >= 1
+        assert source.dataset not in source._datasetPool
+
+    def testWarpPlan(self):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        imagePath = os.path.join(testDir, 'test_files', 'rgb_geotiff.tiff')
+        source = self.basemodule.open(imagePath, projection='EPSG:3857')
+        plan = source._getWarpPlan(8)
+        assert plan is not None
+        assert source._getWarpPlan(8) is plan
+        assert source._getWarpPlan(9) is not plan
+        xmin, ymin, xmax, ymax = source.getTileCorners(8, 44, 103)
+        sx, sy = plan.sourcePixels(xmin, ymax)
+        ex, ey = plan._transformPoints(xmin, ymax, np.arange(256), np.arange(256))
+        assert np.abs(sx - ex).max() <= plan.maxError
+        assert np.abs(sy - ey).max() <= plan.maxError
+        tile = plan.warp(
+            xmin, ymax, source._readWindow, source.sourceSizeX, source.sourceSizeY, 3, np.uint16)
+        assert tile.shape == (4, 256, 256)
+        valid = tile[3] != 0
+        assert np.all(tile[3][valid] == 65535)
+        assert np.all(tile[:3, ~valid] == 0)
+        ix = np.clip(np.floor(ex[valid]).astype(int), 0, 255)
+        iy = np.clip(np.floor(ey[valid]).astype(int), 0, 255)
+        data = source._readWindow(0, 0, 256, 256, 256, 256)
+        # Only pixels close to a source pixel edge can differ from an exact
+        # transform
+        assert np.count_nonzero(np.any(
+            tile[:3, valid] != data[:, iy, ix], axis=0)) < np.count_nonzero(valid) * 0.05
+        # Tiles outside of the source are empty
+        xmin, ymin, xmax, ymax = source.getTileCorners(8, 0, 0)
+        tile = plan.warp(
+            xmin, ymax, source._readWindow, source.sourceSizeX, source.sourceSizeY, 3, np.uint16)
+        assert not np.any(tile)
+
+    def testCoordinateArrays(self):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        imagePath = os.path.join(testDir, 'test_files', 'rgb_geotiff.tiff')
+        source = self.basemodule.open(imagePath)
+        corners = source.pixelToProjectionArray([(0, 0), (256, 256), (128, 64)])
+        assert corners.shape == (3, 2)
+        assert corners[0].tolist() == pytest.approx([367185, 3788115])
+        assert corners[1].tolist() == pytest.approx([597915, 3552885])
+        assert corners[2].tolist() == pytest.approx(list(source.pixelToProjection(128, 64)))
+        pixels = source.toNativePixelCoordinatesArray(corners, 'epsg:32611')
+        assert pixels.tolist() == [[0, 0], [256, 256], [128, 64]]
+
+        source = self.basemodule.open(imagePath, projection='EPSG:3857')
+        points = [(-13132910 + idx * 5000, 4010586 - idx * 3000) for idx in range(20)]
+        pixels = source.toNativePixelCoordinatesArray(points)
+        assert pixels.dtype.kind == 'i'
+        assert pixels.tolist() == [
+            list(source.toNativePixelCoordinates(x, y)) for x, y in points]
+        exact = source.toNativePixelCoordinatesArray(points, roundResults=False)
+        assert exact.dtype.kind == 'f'
+        assert np.abs(exact - pixels).max() <= 0.5
+        lonlat = source.toNativePixelCoordinatesArray([(-117.5, 33.5)], 'epsg:4326')
+        assert lonlat.tolist() == [list(source.toNativePixelCoordinates(-117.5, 33.5, 'epsg:4326'))]
+        projected = source.pixelToProjectionArray([(0, 0), (1024, 2048)], 3)
+        assert projected.tolist() == [
+            list(source.pixelToProjection(0, 0, 3)), list(source.pixelToProjection(1024, 2048, 3))]
+        # Transforms are reused
+        assert source._coordinateTransform('epsg:4326') is source._coordinateTransform('epsg:4326')
+
     def testPalettizedGeotiff(self):
         imagePath = datastore.fetch('landcover_sample_1000.tif')
         source = self.basemodule.open(imagePath)
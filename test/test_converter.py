@@ -7,6 +7,7 @@ import large_image_converter.__main__ as main
 import large_image_source_tiff
 import pytest
 import tifftools
+from large_image_converter.manifest import ConversionManifest
 
 import large_image
 from large_image import constants
@@ -316,6 +317,113 @@ def testConvertFromTestSourceFrameArray(tmpdir):
     assert len(info['ifds']) == 6
 
 
+def testConvertFromTestSourceFramesNoSubIFDs(tmpdir):
+    outputPath = os.path.join(tmpdir, 'out.tiff')
+    large_image_converter.convert(
+        'large_image://test?maxLevel=3&frames=4', outputPath, subifds=False,
+        _concurrency=2)
+    source = large_image_source_tiff.open(outputPath)
+    metadata = source.getMetadata()
+    assert metadata['levels'] == 4
+    assert len(metadata['frames']) == 4
+    info = tifftools.read_tiff(outputPath)
+    assert len(info['ifds']) == 16
+    assert not [name for name in os.listdir(tmpdir) if name.endswith('.partial')]
+
+
+def testConvertFromTestSourceFramesToAperio(tmpdir):
+    outputPath = os.path.join(tmpdir, 'out.svs')
+    large_image_converter.convert(
+        'large_image://test?maxLevel=3&frames=2', outputPath, format='aperio')
+    info = tifftools.read_tiff(outputPath)
+    assert info['ifds'][0]['tags'][
+        tifftools.Tag.ImageDescription.value]['data'].startswith('Aperio')
+    assert len(info['ifds']) >= 8
+
+
+def testConvertResumable(tmpdir, monkeypatch):
+    outputPath = os.path.join(tmpdir, 'out.tiff')
+    workdir = os.path.join(tmpdir, 'work')
+    origAssociated = large_image_converter._associated_ifds
+
+    def failAssociated(*args, **kwargs):
+        msg = 'Interrupted'
+        raise Exception(msg)
+
+    monkeypatch.setattr(large_image_converter, '_associated_ifds', failAssociated)
+    with pytest.raises(Exception, match='Interrupted'):
+        large_image_converter.convert(
+            'large_image://test?maxLevel=3&frames=4', outputPath, _workdir=workdir)
+    assert not os.path.exists(outputPath)
+    manifest = json.load(open(os.path.join(workdir, 'manifest.json')))
+    assert len(manifest['entries']['frame']) == 4
+    # Damage one frame so that it must be regenerated
+    open(os.path.join(workdir, manifest['entries']['frame']['2']['name']), 'ab').write(b'x')
+
+    monkeypatch.setattr(large_image_converter, '_associated_ifds', origAssociated)
+    converted = []
+    origFrame = large_image_converter._convert_large_image_frame
+
+    def countFrames(idx, frame, *args, **kwargs):
+        converted.append(frame)
+        return origFrame(idx, frame, *args, **kwargs)
+
+    monkeypatch.setattr(large_image_converter, '_convert_large_image_frame', countFrames)
+    large_image_converter.convert(
+        'large_image://test?maxLevel=3&frames=4', outputPath, _workdir=workdir)
+    assert converted == [2]
+    source = large_image_source_tiff.open(outputPath)
+    assert len(source.getMetadata()['frames']) == 4
+    manifest = json.load(open(os.path.join(workdir, 'manifest.json')))
+    assert manifest['output'] == os.path.abspath(outputPath)
+    assert os.listdir(workdir) == ['manifest.json']
+
+
+def testConvertResumableSourceId(tmpdir, monkeypatch):
+    outputPath = os.path.join(tmpdir, 'out.tiff')
+    workdir = os.path.join(tmpdir, 'work')
+
+    def failAssociated(*args, **kwargs):
+        msg = 'Interrupted'
+        raise Exception(msg)
+
+    monkeypatch.setattr(large_image_converter, '_associated_ifds', failAssociated)
+    with pytest.raises(Exception, match='Interrupted'):
+        large_image_converter.convert(
+            'large_image://test?maxLevel=3&frames=2', outputPath, _workdir=workdir,
+            _sourceId={'fileId': 'abc'})
+    manifest = ConversionManifest.read(workdir)
+    assert manifest.source['id'] == {'fileId': 'abc'}
+    assert manifest.summary() == {'frame': 2}
+    assert not manifest.output
+    # The same id at a different path reuses the intermediate files
+    args = manifest.source['arguments']
+    manifest = ConversionManifest(
+        workdir, os.path.join(tmpdir, 'other.tiff'), _sourceId={'fileId': 'abc'}, **args)
+    assert manifest.summary() == {'frame': 2}
+    manifest = ConversionManifest(
+        workdir, os.path.join(tmpdir, 'other.tiff'), _sourceId={'fileId': 'def'}, **args)
+    assert manifest.summary() == {}
+    assert ConversionManifest.read(os.path.join(tmpdir, 'none')) is None
+
+
+def testStreamingTiffWriterPromote(tmpdir):
+    outputPath = os.path.join(tmpdir, 'out.tiff')
+    large_image_converter.convert('large_image://test?maxLevel=3&frames=2', outputPath)
+    info = tifftools.read_tiff(outputPath)
+    destPath = os.path.join(tmpdir, 'dest.tiff')
+    writer = large_image_converter._StreamingTiffWriter(destPath)
+    writer.add(info['ifds'][:1])
+    writer._promote()
+    writer.add(info['ifds'][1:])
+    writer.close(destPath)
+    destInfo = tifftools.read_tiff(destPath)
+    assert destInfo['bigtiff'] is True
+    assert len(destInfo['ifds']) == len(info['ifds'])
+    source = large_image_source_tiff.open(destPath)
+    assert len(source.getMetadata()['frames']) == 2
+
+
 def testConvertImageJ(tmpdir):
     imagePath = datastore.fetch('synthetic_imagej.tiff')
     outputPath = os.path.join(tmpdir, 'out.tiff')
@@ -95,6 +95,25 @@ def testExtraAxis():
     assert len(metadata.get('frames')) == 2
 
 
+def testTileStack():
+    sink = large_image_source_zarr.new()
+    for t in range(2):
+        for c in range(3):
+            sink.addTile(np.random.random((300, 400)), 0, 0, t=t, c=c)
+    level = sink.levels - 1
+    frames = [2, 3, 4]
+    stack = sink._getTileStack(1, 0, level, frames)
+    assert stack is not None
+    tiles = sink.getTileStack(1, 0, level, frames=frames)
+    assert tiles.shape == (3, sink.tileHeight, sink.tileWidth, 1)
+    for idx, frame in enumerate(frames):
+        tile = sink.getTile(1, 0, level, frame=frame, numpyAllowed='always')
+        assert np.array_equal(tiles[idx], tile)
+    # Frames that are far apart are read separately
+    assert sink._getTileStack(1, 0, level, [0, 5]) is None
+    assert sink.getTileStack(1, 0, level, frames=[0, 5]).shape[0] == 2
+
+
 @pytest.mark.parametrize('file_type', FILE_TYPES)
 def testCrop(file_type, tmp_path):
     output_file = tmp_path / f'test.{file_type}'
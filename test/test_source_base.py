@@ -1,9 +1,12 @@
+import asyncio
 import io
 import json
 import os
+import pickle
 import re
 import sys
 from pathlib import Path
+from unittest import mock
 
 import numpy as np
 import PIL.Image
@@ -153,6 +156,144 @@ def testSourcesFileNotFound(source):
         large_image.tilesource.AvailableTileSources[source]('nosuchfile.ext')
 
 
+def testLazySourceLoading(tmp_path):
+    import concurrent.futures
+    import time
+
+    from large_image.tilesource.registry import LazySourceDict, SourceManifestEntry
+
+    large_image.config.setConfig('source_manifest_directory', str(tmp_path))
+    try:
+        eager = {}
+        large_image.tilesource.loadTileSources(sourceDict=eager)
+        first = LazySourceDict()
+        large_image.tilesource.loadTileSources(sourceDict=first)
+        assert set(first) == set(eager)
+        assert all(first.isLoaded(name) for name in first)
+        assert len(list(tmp_path.iterdir())) == 1
+        lazy = LazySourceDict()
+        large_image.tilesource.loadTileSources(sourceDict=lazy)
+        assert set(lazy) == set(eager)
+        assert not any(lazy.isLoaded(name) for name in lazy)
+        for name in ['sample.png', 'sample.tiff', 'sample.nd2', 'sample', 'large_image://test']:
+            assert (sorted(large_image.tilesource.getSortedSourceList(lazy, name)) ==
+                    sorted(large_image.tilesource.getSortedSourceList(eager, name)))
+        assert not any(lazy.isLoaded(name) for name in lazy)
+        assert large_image.tilesource.getSourceNameFromDict(
+            lazy, 'large_image://test') == 'test'
+        assert [name for name in lazy if lazy.isLoaded(name)] == ['test']
+        assert lazy['test'] is eager['test']
+        # Extensions added at runtime aren't recorded in the manifest
+        large_image.tilesource.listSources(eager)
+        large_image.tilesource.loadTileSources(sourceDict=LazySourceDict())
+        lazy = LazySourceDict()
+        large_image.tilesource.loadTileSources(sourceDict=lazy)
+        assert lazy.peek('pil').extensions == {
+            k: v for k, v in eager['pil'].extensions.items()
+            if v != large_image.constants.SourcePriority.IMPLICIT_HIGH}
+
+        # Threads that ask for a source while it is loading get the class
+        class SlowEntryPoint:
+            def load(self):
+                time.sleep(0.1)
+                return eager['test']
+
+        lazy = LazySourceDict()
+        lazy.addLazy('test', SlowEntryPoint(), SourceManifestEntry.describe(eager['test']))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: lazy['test'], range(8)))
+        assert all(result is eager['test'] for result in results)
+    finally:
+        large_image.config.setConfig('source_manifest_directory', None)
+
+
+def testSourceSelectionCache(tmp_path):
+    from large_image.tilesource import selectioncache
+
+    imagePath = str(tmp_path / 'sample.png')
+    PIL.Image.new('RGB', (100, 80)).save(imagePath)
+    large_image.config.setConfig('source_selection_cache_path', str(tmp_path / 'cache.sqlite'))
+    try:
+        large_image.tilesource.loadTileSources()
+        sources = large_image.tilesource.AvailableTileSources
+        key = selectioncache.selectionKey(sources, imagePath)
+        assert selectioncache.lookup(key) is None
+        assert large_image.open(imagePath, noCache=True).name == 'pil'
+        assert selectioncache.lookup(key) == 'pil'
+        assert selectioncache.lookup(selectioncache.selectionKey(
+            sources, imagePath, 'image/png')) is None
+        assert selectioncache.selectionKey(sources, 'large_image://test') is None
+        # Defaults added when a source is imported don't change the key, but
+        # explicit settings do
+        large_image.config.ConfigValues['source_sample_ignored_names'] = r'\.png$'
+        assert selectioncache.selectionKey(sources, imagePath) == key
+        with mock.patch.dict(os.environ, {'LARGE_IMAGE_SOURCE_SAMPLE_IGNORED_NAMES': 'x'}):
+            assert selectioncache.selectionKey(sources, imagePath) != key
+        large_image.config.ConfigValues.pop('source_sample_ignored_names')
+        # A stale entry is discarded when the source fails to open the file
+        selectioncache.store(key, 'test')
+        assert large_image.getTileSource(imagePath, noCache=True).name == 'test'
+        selectioncache.store(key, 'multi')
+        assert large_image.open(imagePath, noCache=True).name == 'pil'
+        assert selectioncache.lookup(key) == 'pil'
+        # Changing the file invalidates the entry
+        PIL.Image.new('RGB', (100, 90)).save(imagePath)
+        assert selectioncache.lookup(selectioncache.selectionKey(sources, imagePath)) is None
+        selectioncache.clear()
+        assert selectioncache.lookup(key) is None
+    finally:
+        large_image.config.setConfig('source_selection_cache_path', None)
+    assert selectioncache.selectionKey(sources, imagePath) is None
+
+
+def testSniffFormats(tmp_path):
+    from large_image.tilesource.sniff import sniffFormats
+
+    testDir = os.path.dirname(os.path.realpath(__file__))
+    assert sniffFormats(os.path.join(testDir, 'test_files', 'grey10kx5k.tif')) == {'tiff'}
+    assert sniffFormats(os.path.join(testDir, 'test_files', 'multi1.yml')) == set()
+    assert sniffFormats('large_image://test') == set()
+    assert sniffFormats(str(tmp_path / 'nosuchfile')) == set()
+    (tmp_path / 'sample.dcm').write_bytes(b'\0' * 128 + b'DICM' + b'\0' * 100)
+    assert sniffFormats(str(tmp_path / 'sample.dcm')) == {'dicom'}
+    (tmp_path / 'sample.zarr').mkdir()
+    (tmp_path / 'sample.zarr' / '.zgroup').write_text('{"zarr_format": 2}')
+    assert sniffFormats(str(tmp_path / 'sample.zarr')) == {'zarr'}
+    (tmp_path / 'sample.zarr' / '.zattrs').write_text('{"multiscales": []}')
+    assert sniffFormats(tmp_path / 'sample.zarr') == {'zarr', 'ome-ngff'}
+    # An unnamed file is only tried with sources that accept its format
+    large_image.tilesource.loadTileSources()
+    sources = large_image.tilesource.AvailableTileSources
+    imagePath = str(tmp_path / 'noextension')
+    PIL.Image.new('RGB', (100, 80)).save(imagePath, format='PNG')
+    sourceList = large_image.tilesource.getSortedSourceList(sources, imagePath)
+    assert 'pil' in [entry[-1] for entry in sourceList]
+    assert 'tiff' not in [entry[-1] for entry in sourceList]
+    assert 'multi' not in [entry[-1] for entry in sourceList]
+    assert large_image.open(imagePath, noCache=True).name == 'pil'
+    # An explicit extension match keeps its priority, but sources that accept
+    # the file's format are also tried
+    imagePath = str(tmp_path / 'misnamed.tif')
+    PIL.Image.new('RGB', (100, 80)).save(imagePath, format='PNG')
+    sourceList = {entry[-1]: entry[1:3] for entry in
+                  large_image.tilesource.getSortedSourceList(sources, imagePath)}
+    assert sourceList['tiff'] == (False, sources['tiff'].extensions['tif'])
+    assert sourceList['pil'][0] is False
+    assert large_image.open(imagePath, noCache=True).name == 'pil'
+    assert large_image.tilesource._applySignatures(
+        {None: large_image.constants.SourcePriority.MANUAL}, {'png'},
+        large_image.constants.SourcePriority.PREFERRED, False) == (
+        large_image.constants.SourcePriority.PREFERRED, False)
+    assert large_image.tilesource._applySignatures(
+        {None: large_image.constants.SourcePriority.MANUAL}, {'png'},
+        large_image.constants.SourcePriority.FALLBACK, True) == (
+        large_image.constants.SourcePriority.MANUAL, True)
+    imagePath = str(tmp_path / 'tiffnoextension')
+    PIL.Image.new('RGB', (100, 80)).save(imagePath, format='TIFF')
+    sourceList = sorted(large_image.tilesource.getSortedSourceList(sources, imagePath))
+    assert sourceList[0][1:] == (False, large_image.constants.SourcePriority.HIGH, 'tiff')
+
+
 def testBaseFileNotFound():
     with pytest.raises(large_image.exceptions.TileSourceFileNotFoundError):
         large_image.open('nosuchfile')
@@ -602,7 +743,7 @@ def testImageBytes():
 
 @pytest.mark.parametrize('format', [
     format for format in large_image.constants.TileOutputMimeTypes
-    if format not in {'TILED'}])
+    if format not in {'TILED', 'NPY'}])
 def testOutputFormats(format):
     imagePath = datastore.fetch('sample_image.ptif')
     testDir = os.path.dirname(os.path.realpath(__file__))
@@ -621,6 +762,50 @@ def testOutputFormats(format):
     assert (img.width, img.height) == (256, 256)
 
 
+def testOutputFormatNPY():
+    ts = large_image.open(
+        'large_image://test', encoding='NPY', bands='red=0-4000,green=0-4000')
+    assert ts.getTileMimeType() == 'application/x-npy'
+    tile = ts.getTile(0, 0, 0)
+    assert tile.mimetype == 'application/x-npy'
+    data = np.load(io.BytesIO(tile))
+    assert data.shape == (256, 256, 2)
+    assert data.dtype == np.uint16
+    assert (large_image.tilesource.utilities._imageToNumpy(tile)[0] == data).all()
+    region, mime = ts.getRegion(
+        region=dict(left=0, top=0, width=300, height=200), encoding='NPY')
+    assert mime == 'application/x-npy'
+    assert np.load(io.BytesIO(region)).shape == (200, 300, 2)
+
+
+@pytest.mark.parametrize(('image', 'params'), [
+    (np.zeros((256, 256, 3), dtype=np.uint8), {'compress_type': 3}),
+    (np.random.randint(0, 255, (256, 256, 3), dtype=np.uint8), {'compress_type': 2}),
+    (np.tile(np.arange(256, dtype=np.uint8)[None, :, None], (256, 1, 3)),
+     {'compress_level': 2}),
+])
+def testPngEncodingParams(image, params):
+    utilities = large_image.tilesource.utilities
+    pilImage = PIL.Image.fromarray(image)
+    result = utilities._pngEncodingParams(pilImage)
+    for key, value in params.items():
+        assert result[key] == value
+    encoded = utilities._encodeImageBinary(pilImage, 'PNG', 95, 0, 'raw')
+    assert (np.asarray(PIL.Image.open(io.BytesIO(encoded))) == image).all()
+
+
+@pytest.mark.parametrize('maxQueued', [None, 1, 3])
+def testEncodeImagesBinary(maxQueued):
+    utilities = large_image.tilesource.utilities
+    ts = large_image.open('large_image://test')
+    images = [ts.getTile(x, y, 2, numpyAllowed='always') for x in range(4) for y in range(4)]
+    for encoding in ('JPEG', 'PNG', 'NPY'):
+        results = utilities._encodeImagesBinary(images, encoding, maxQueued=maxQueued)
+        assert len(results) == len(images)
+        for image, result in zip(images, results):
+            assert result == utilities._encodeImageBinary(image, encoding, 95, 0, 'raw')
+
+
 def testStyleFunctions():
     imagePath = datastore.fetch('extraoverview.tiff')
     source = large_image.open(imagePath)
@@ -819,6 +1004,166 @@ def testStyleRepeatedFrame():
     assert ts6.getTile(0, 0, 0) == tile1
 
 
+def testGetPixels():
+    import large_image_source_test
+
+    ts = large_image_source_test.TestTileSource(
+        sizeX=1000, sizeY=800, frames=3, bands='red,green,blue')
+    points = [[0, 0], [255, 256], [999, 799], [512.7, 100.2], [1000, 0], [-1, 5],
+              [float('nan'), 5]]
+    values = ts.getPixels(points, frame=1)
+    assert values.shape == (len(points), 3)
+    assert not values.mask[:4].any()
+    assert values.mask[4:].all()
+    for idx, (x, y) in enumerate(points[:4]):
+        pixel = ts.getPixel(region={'left': int(x), 'top': int(y)}, frame=1)
+        assert list(values[idx]) == pixel['value']
+    # Parallel and serial sampling agree
+    serial = ts.getPixels(points, frame=1, max_workers=1)
+    assert np.array_equal(serial.filled(0), values.filled(0))
+    # Lower levels sample the pixel that contains each point
+    level = ts.getPixels(points[:4], level=ts.levels - 2)
+    for idx, (x, y) in enumerate(points[:4]):
+        tile = ts.getTile(int(x) // 512, int(y) // 512, ts.levels - 2, numpyAllowed='always')
+        assert list(level[idx]) == list(tile[int(y) // 2 % 256, int(x) // 2 % 256])
+    assert ts.getPixels([]).shape == (0, 3)
+    # Points that are all outside of the image still have a value per band
+    outside = ts.getPixels(points[4:], frame=1)
+    assert outside.shape == (3, 3)
+    assert outside.dtype == values.dtype
+    assert outside.mask.all()
+
+
+def testGetTileStack():
+    import large_image_source_test
+
+    ts = large_image_source_test.TestTileSource(
+        sizeX=1000, sizeY=800, frames=5, bands='red,green,blue')
+    frames = [0, 2, 4]
+    stack = ts.getTileStack(1, 1, ts.levels - 1, frames=frames)
+    assert stack.shape == (3, 256, 256, 3)
+    for idx, frame in enumerate(frames):
+        tile = ts.getTile(1, 1, ts.levels - 1, frame=frame, numpyAllowed='always')
+        assert np.array_equal(stack[idx], tile)
+    assert ts.getTileStack(0, 0, 0).shape == (5, 256, 256, 3)
+    with pytest.raises(ValueError):
+        ts.getTileStack(0, 0, 0, frames=[])
+
+    region = dict(left=100, top=50, width=600, height=500)
+    tiles = list(ts.tileIterator(format='numpy', frames=[1, 3], region=region))
+    assert len(tiles) == 9
+    tile = tiles[0]
+    assert tile['tile'].shape == (2, tile['height'], tile['width'], 3)
+    image, _ = ts.getRegion(region=region, frame=3, format='numpy')
+    assert np.array_equal(tile['tile'][1], image[:tile['height'], :tile['width']])
+    tiles = list(ts.tileIterator(
+        format='numpy', frames=[1, 3], tile_size=dict(width=300, height=300),
+        tile_overlap=dict(x=20, y=20)))
+    tile = tiles[4]
+    assert tile['tile'].shape == (2, 300, 300, 3)
+    image, _ = ts.getRegion(region=dict(
+        left=tile['x'], top=tile['y'], width=tile['width'], height=tile['height']),
+        frame=1, format='numpy')
+    assert np.array_equal(tile['tile'][0], image)
+    with pytest.raises(ValueError):
+        list(ts.tileIterator(format='PIL', frames=[1]))
+    with pytest.raises(ValueError):
+        list(ts.tileIterator(format='numpy', frames=[1], output=dict(maxWidth=300)))
+
+
+def testGetTileStackTifffile(tmp_path):
+    import large_image_source_tifffile
+    import tifffile
+
+    data = np.random.default_rng(0).integers(0, 65535, (3, 4, 600, 700), dtype=np.uint16)
+    imagePath = tmp_path / 'sample.ome.tif'
+    tifffile.imwrite(imagePath, data, tile=(256, 256), metadata={'axes': 'TCYX'}, ome=True)
+    ts = large_image_source_tifffile.open(imagePath)
+    frames = [5, 6, 4]
+    for level in (0, ts.levels - 1):
+        assert ts._getTileStack(0, 0, level, frames) is not None
+        stack = ts.getTileStack(0, 0, level, frames=frames)
+        for idx, frame in enumerate(frames):
+            tile = ts.getTile(0, 0, level, frame=frame, numpyAllowed='always')
+            assert np.array_equal(stack[idx], tile)
+    assert np.array_equal(
+        ts.getTileStack(1, 1, ts.levels - 1, frames=[6, 7])[:, :, :, 0],
+        data[1, 2:4, 256:512, 256:512])
+
+
+def testAsDaskArray():
+    import large_image_source_test
+
+    ts = large_image_source_test.TestTileSource(
+        sizeX=1000, sizeY=800, frames=6, bands='red,green,blue')
+    arr = ts.asDaskArray()
+    assert arr.shape == (6, 800, 1000, 3)
+    assert arr.chunks[1:] == ((256, 256, 256, 32), (256, 256, 256, 232), (3, ))
+    image, _ = ts.getRegion(format='numpy', frame=4)
+    assert np.array_equal(arr[4].compute(), image)
+    assert np.array_equal(
+        arr[4, 100:700:3, 5:900:7, 1].compute(), image[100:700:3, 5:900:7, 1])
+    arr = ts.asDaskArray(level=ts.levels - 2, frames=[1, 2, 5], chunks=(2, 300, 300))
+    assert arr.chunks == ((2, 1), (400, ), (500, ), (3, ))
+    image, _ = ts.getRegion(
+        format='numpy', frame=5, output=dict(maxWidth=500, maxHeight=400))
+    assert np.array_equal(arr[2].compute(), image)
+    # The array can be sent to workers
+    arr = pickle.loads(pickle.dumps(arr))
+    assert np.array_equal(arr[2].compute(), image)
+    ts = large_image_source_test.TestTileSource(sizeX=1000, sizeY=800)
+    assert ts.asDaskArray().shape == (800, 1000, 3)
+    with pytest.raises(ValueError):
+        ts.asDaskArray(level=ts.levels)
+
+
+def testAsXarray():
+    import large_image_source_test
+
+    ts = large_image_source_test.TestTileSource(
+        sizeX=500, sizeY=400, frames='c=2,z=3,t=2', bands='red,green,blue')
+    arr = ts.asXarray()
+    assert arr.dims == ('t', 'z', 'c', 'y', 'x', 's')
+    assert arr.shape == (2, 3, 2, 400, 500, 3)
+    stride = ts.getMetadata()['IndexStride']
+    image, _ = ts.getRegion(
+        format='numpy', frame=stride['IndexT'] + 2 * stride['IndexZ'])
+    assert np.array_equal(arr.isel(t=1, z=2, c=0).values, image)
+    arr = ts.asXarray(level=ts.levels - 2, frames=[1, 3])
+    assert arr.dims == ('frame', 'y', 'x', 's')
+    assert list(arr.coords['frame'].values) == [1, 3]
+    assert arr.coords['x'].values[1] == 2
+
+
+def testAsyncTiles():
+    from large_image_source_test import TestTileSource
+
+    ts = TestTileSource(sizeX=1000, sizeY=800)
+
+    async def readTiles():
+        tiles = await asyncio.gather(*[
+            ts.agetTile(x, y, 2, numpyAllowed='always') for x in range(4) for y in range(4)])
+        region = await ts.agetRegion(output={'maxWidth': 200}, format='numpy')
+        iterated = [tile async for tile in ts.tileIterator(
+            format='numpy', region={'width': 600, 'height': 300})]
+        with pytest.raises(large_image.exceptions.TileSourceXYZRangeError):
+            await ts.agetTile(10, 10, 2)
+        return tiles, region, iterated
+
+    tiles, region, iterated = asyncio.run(readTiles())
+    assert len(tiles) == 16
+    assert np.array_equal(tiles[5], ts.getTile(1, 1, 2, numpyAllowed='always'))
+    assert np.array_equal(region[0], ts.getRegion(output={'maxWidth': 200}, format='numpy')[0])
+    assert len(iterated) == 6
+    for tile, expected in zip(iterated, ts.tileIterator(
+            format='numpy', region={'width': 600, 'height': 300})):
+        assert tile.loaded
+        assert tile['tile_position'] == expected['tile_position']
+        assert np.array_equal(tile['tile'], expected['tile'])
+    # Each event loop gets its own concurrency limit
+    assert asyncio.run(ts.agetTile(0, 0, 0)) == ts.getTile(0, 0, 0)
+
+
 def testKnownExtensionList():
     assert len(large_image.tilesource.listSources()['extensions']) > 100
     assert len(large_image.listExtensions()) > 100
@@ -2,6 +2,7 @@ try:
     import large_image_source_nd2
 except ImportError:
     pass
+import numpy as np
 import pytest
 
 from . import utilities
@@ -30,6 +31,18 @@ def testTilesFromND2():
     utilities.checkTilesZXY(source, tileMetadata)
 
 
+def testTileStack():
+    imagePath = datastore.fetch('ITGA3Hi_export_crop2.nd2')
+    source = large_image_source_nd2.open(imagePath)
+    frames = [200, 201, 202, 203]
+    assert source._getTileStack(0, 0, 0, frames) is not None
+    stack = source.getTileStack(0, 0, 0, frames=frames)
+    assert stack.shape[0] == len(frames)
+    for idx, frame in enumerate(frames):
+        tile = source.getTile(0, 0, 0, frame=frame, numpyAllowed='always')
+        assert np.array_equal(stack[idx], tile)
+
+
 def testInternalMetadata():
     imagePath = datastore.fetch('ITGA3Hi_export_crop2.nd2')
     source = large_image_source_nd2.open(imagePath)
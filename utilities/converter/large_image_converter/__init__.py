@@ -1,4 +1,5 @@
 import concurrent.futures
+import contextlib
 import datetime
 import fractions
 import json
@@ -11,7 +12,7 @@ import threading
 import time
 from importlib.metadata import PackageNotFoundError
 from importlib.metadata import version as _importlib_version
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, mkstemp
 
 import numpy as np
 import tifftools
@@ -22,6 +23,7 @@ from large_image.tilesource.utilities import (_gdalParameters,
                                               _vipsParameters)
 
 from . import format_aperio
+from .manifest import ConversionManifest
 
 pyvips = None
 
@@ -104,10 +106,14 @@ def _data_from_large_image(path, outputPath, **kwargs):
             img, mime = ts.getAssociatedImage(key)
         except Exception:
             continue
-        savePath = outputPath + '-%s-%s.tiff' % (key, time.strftime('%Y%m%d-%H%M%S'))
-        # TODO: allow specifying quality separately from main image quality
-        _pool_add(tasks, (pool.submit(
-            _convert_via_vips, img, savePath, outputPath, mime=mime, forTiled=False), ))
+        savePath, done = _checkpoint_path(
+            'associated', key,
+            outputPath + '-%s-%s.tiff' % (key, time.strftime('%Y%m%d-%H%M%S')), **kwargs)
+        if not done:
+            # TODO: allow specifying quality separately from main image quality
+            _pool_add(tasks, (pool.submit(
+                _convert_via_vips, img, savePath, outputPath, mime=mime, forTiled=False,
+                checkpoint=('associated', key), _manifest=kwargs.get('_manifest')), ))
         results['images'][key] = savePath
     _drain_pool(pool, tasks)
     return results
@@ -197,11 +203,13 @@ def _generate_multiframe_tiff(inputPath, outputPath, tempPath, lidata, **kwargs)
         frame += 1
         if onlyFrame is not None and onlyFrame + 1 != frame:
             continue
-        subOutputPath = tempPath + '-%d-%s.tiff' % (
-            page + 1, time.strftime('%Y%m%d-%H%M%S'))
-        _pool_add(tasks, (pool.submit(
-            _convert_via_vips, subInputPath, subOutputPath, tempPath,
-            status='%d/%d' % (page, pages), **kwargs), ))
+        subOutputPath, done = _checkpoint_path(
+            'page', page, tempPath + '-%d-%s.tiff' % (
+                page + 1, time.strftime('%Y%m%d-%H%M%S')), **kwargs)
+        if not done:
+            _pool_add(tasks, (pool.submit(
+                _convert_via_vips, subInputPath, subOutputPath, tempPath,
+                status='%d/%d' % (page, pages), checkpoint=('page', page), **kwargs), ))
         outputList.append(subOutputPath)
     extraImages = {}
     if not lidata or not len(lidata['images']):
@@ -214,9 +222,14 @@ def _generate_multiframe_tiff(inputPath, outputPath, tempPath, lidata, **kwargs)
                 key = 'image_%d' % page
                 if not _use_associated_image(key, **kwargs):
                     continue
-                savePath = tempPath + '-%s-%s.tiff' % (key, time.strftime('%Y%m%d-%H%M%S'))
-                _pool_add(tasks, (pool.submit(
-                    _convert_via_vips, subInputPath, savePath, tempPath, False), ))
+                savePath, done = _checkpoint_path(
+                    'associated', key,
+                    tempPath + '-%s-%s.tiff' % (key, time.strftime('%Y%m%d-%H%M%S')), **kwargs)
+                if not done:
+                    _pool_add(tasks, (pool.submit(
+                        _convert_via_vips, subInputPath, savePath, tempPath, False,
+                        checkpoint=('associated', key),
+                        _manifest=kwargs.get('_manifest')), ))
                 extraImages[key] = savePath
     _drain_pool(pool, tasks)
     _output_tiff(outputList, outputPath, tempPath, lidata, extraImages, **kwargs)
@@ -243,13 +256,15 @@ def _generate_tiff(inputPath, outputPath, tempPath, lidata, **kwargs):
         deflate.
     """
     _import_pyvips()
-    subOutputPath = tempPath + '-%s.tiff' % (time.strftime('%Y%m%d-%H%M%S'))
-    _convert_via_vips(inputPath, subOutputPath, tempPath, **kwargs)
+    subOutputPath, done = _checkpoint_path(
+        'frame', 0, tempPath + '-%s.tiff' % (time.strftime('%Y%m%d-%H%M%S')), **kwargs)
+    if not done:
+        _convert_via_vips(inputPath, subOutputPath, tempPath, checkpoint=('frame', 0), **kwargs)
     _output_tiff([subOutputPath], outputPath, tempPath, lidata, **kwargs)
 
 
 def _convert_via_vips(inputPathOrBuffer, outputPath, tempPath, forTiled=True,
-                      status=None, **kwargs):
+                      status=None, checkpoint=None, **kwargs):
     """
     Convert a file, buffer, or vips image to a tiff file.  This is equivalent
     to a vips command line of
@@ -263,6 +278,8 @@ def _convert_via_vips(inputPathOrBuffer, outputPath, tempPath, forTiled=True,
         also stores files in TMPDIR
     :param forTiled: True if the output should be tiled, false if not.
     :param status: an optional additional string to add to log messages.
+    :param checkpoint: if not None and kwargs contains a _manifest, a tuple of
+        the kind and key to record in the manifest once the file is written.
     :param kwargs: addition arguments that get passed to _vipsParameters
         and _convert_to_jp2k.
     """
@@ -308,6 +325,28 @@ def _convert_via_vips(inputPathOrBuffer, outputPath, tempPath, forTiled=True,
     image.write_to_file(outputPath, **convertParams)
     if kwargs.get('compression') == 'jp2k':
         _convert_to_jp2k(outputPath, **kwargs)
+    if checkpoint and kwargs.get('_manifest'):
+        kwargs['_manifest'].record(*checkpoint, outputPath)
+
+
+def _checkpoint_path(kind, key, defaultPath, _manifest=None, **kwargs):
+    """
+    Get the path for an intermediate file, reusing a completed file from the
+    conversion manifest if there is one.
+
+    :param kind: the kind of file (e.g., 'frame', 'page', or 'associated').
+    :param key: a key unique within the kind.
+    :param defaultPath: the path to use if there is no manifest.
+    :param _manifest: an optional ConversionManifest.
+    :returns: the path and a boolean that is True if the file is already
+        complete.
+    """
+    if not _manifest:
+        return defaultPath, False
+    path = _manifest.lookup(kind, key)
+    if path:
+        return path, True
+    return _manifest.file_path(kind, key), False
 
 
 def _convert_to_jp2k_tile(lock, fptr, dest, offset, length, shape, dtype, jp2kargs):
@@ -399,6 +438,225 @@ def _drain_pool(pool, tasks):
     pool.shutdown(False)
 
 
+class _ConversionScheduler:
+    """
+    Share a single worker pool and memory budget between all of the jobs of a
+    conversion, where a job (such as a frame) consists of many tasks (such as
+    tiles).  Tasks from every active job run on the same workers, and new jobs
+    are only started when there is memory budget for them.  Finished jobs are
+    committed on the calling thread in the order they were started.
+    """
+
+    def __init__(self, commit, memoryLimit=None, **kwargs):
+        """
+        :param commit: a function that is called on the calling thread with
+            (index, result) for each finished job in the order jobs were
+            started.
+        :param memoryLimit: if not None, limit the number of active jobs to no
+            more than one per memoryLimit bytes of total memory.
+        """
+        concurrency = _concurrency_to_value(**kwargs)
+        jobLimit = concurrency
+        if memoryLimit:
+            jobLimit = min(jobLimit, large_image.config.total_memory() // memoryLimit)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self._commit = commit
+        self._jobSlots = threading.BoundedSemaphore(max(1, jobLimit))
+        # Limit queued tasks so that tiles are not all read before they can
+        # be processed
+        self._taskSlots = threading.BoundedSemaphore(concurrency * 2)
+        self._lock = threading.Lock()
+        self._finished = {}
+        self._started = 0
+        self._committed = 0
+        self.error = None
+
+    def _run(self, func, *args, **kwargs):
+        # Once anything has failed, skip remaining work
+        if self.error is not None:
+            return None
+        try:
+            return func(*args, **kwargs)
+        except BaseException as exc:
+            with self._lock:
+                if self.error is None:
+                    self.error = exc
+            raise
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Submit a task to the shared pool.
+
+        :param func: the function to call.
+        :returns: a future.
+        """
+        return self.pool.submit(self._run, func, *args, **kwargs)
+
+    def submit_bounded(self, func, *args, **kwargs):
+        """
+        Submit a task to the shared pool, first waiting until the number of
+        outstanding bounded tasks is small enough.  This must be called from
+        the thread that created the scheduler.
+
+        :param func: the function to call.
+        :returns: a future.
+        """
+        # Poll with a timeout; this allows better stopping on a SIGTERM
+        while not self._taskSlots.acquire(timeout=0.1):
+            self._poll()
+        try:
+            future = self.submit(func, *args, **kwargs)
+        except BaseException:
+            self._taskSlots.release()
+            raise
+        future.add_done_callback(lambda _: self._taskSlots.release())
+        return future
+
+    def _poll(self):
+        """
+        Raise any error from a task and commit finished jobs in order.  This
+        is called from the thread that created the scheduler.
+        """
+        if self.error is not None:
+            raise self.error
+        while True:
+            with self._lock:
+                if self._committed not in self._finished:
+                    return
+                result = self._finished.pop(self._committed)
+            self._commit(self._committed, result)
+            self._committed += 1
+
+    def start_job(self):
+        """
+        Wait until there is budget for another job, committing finished jobs
+        while waiting.
+
+        :returns: the index of the new job.
+        """
+        # Poll with a timeout; this allows better stopping on a SIGTERM
+        while not self._jobSlots.acquire(timeout=0.1):
+            self._poll()
+        self._poll()
+        self._started += 1
+        return self._started - 1
+
+    def finish_job(self, idx, result):
+        """
+        Mark a job as finished, releasing its budget.  This can be called from
+        any thread.
+
+        :param idx: the index of the job as returned from start_job.
+        :param result: a value passed to the commit function.
+        """
+        with self._lock:
+            self._finished[idx] = result
+        self._jobSlots.release()
+
+    def wait(self, count):
+        """
+        Wait for a number of jobs to be finished and committed.
+
+        :param count: the number of jobs to wait for.
+        """
+        while self._committed < count:
+            self._poll()
+            if self._committed < count:
+                time.sleep(0.1)
+
+    def shutdown(self):
+        if self.error is None and self._committed < self._started:
+            self.error = Exception('Conversion stopped.')
+        self.pool.shutdown(False)
+
+
+class _StreamingTiffWriter:
+    """
+    Write a little-endian tiff file one group of ifds at a time.  The image
+    data referenced by each group is copied as soon as the group is added, so
+    source files can be discarded immediately and no final merge pass is
+    needed.  If the file grows too large for a classic tiff, it is converted
+    to a bigtiff.
+    """
+
+    def __init__(self, outputPath, bigtiff=False):
+        """
+        :param outputPath: the eventual output path.  Data is written to a
+            temporary file in the same directory until close is called.
+        :param bigtiff: True to start with a bigtiff.
+        """
+        fd, self.path = mkstemp(
+            prefix=os.path.basename(outputPath) + '.',
+            suffix='.partial', dir=os.path.dirname(os.path.abspath(outputPath)))
+        os.close(fd)
+        self._start(bigtiff)
+
+    def _start(self, bigtiff):
+        self.bigtiff = bigtiff
+        self.ifdCount = 0
+        self.fptr = open(self.path, 'wb')
+        if bigtiff:
+            header = b'II' + struct.pack('<HHHQ', 0x2B, 8, 0, 0)
+        else:
+            header = b'II' + struct.pack('<HL', 0x2A, 0)
+        self.fptr.write(header)
+        self.ifdPtr = len(header) - (8 if bigtiff else 4)
+
+    def add(self, ifds):
+        """
+        Append ifds to the file, copying their data.
+
+        :param ifds: a list of tifftools ifd records.  These may contain
+            subifds.
+        """
+        length = self.fptr.seek(0, os.SEEK_END)
+        ifdPtr = self.ifdPtr
+        try:
+            for ifd in ifds:
+                ifdPtr = tifftools.tifftools.write_ifd(
+                    self.fptr, self.fptr, '<', self.bigtiff, ifd, ifdPtr)
+        except tifftools.MustBeBigTiffError:
+            # Remove the partially written ifds, then start over as a bigtiff
+            self.fptr.seek(self.ifdPtr)
+            self.fptr.write(b'\x00' * (8 if self.bigtiff else 4))
+            self.fptr.truncate(length)
+            self._promote()
+            self.add(ifds)
+            return
+        self.ifdPtr = ifdPtr
+        self.ifdCount += len(ifds)
+
+    def _promote(self):
+        """
+        Rewrite the ifds written so far as a bigtiff.
+        """
+        logger.info('Switching to bigtiff for %s', self.path)
+        self.fptr.close()
+        smallPath = self.path + '.small'
+        os.replace(self.path, smallPath)
+        ifds = tifftools.read_tiff(smallPath)['ifds'] if self.ifdCount else []
+        self._start(True)
+        self.add(ifds)
+        os.unlink(smallPath)
+
+    def close(self, outputPath):
+        """
+        Finish writing the file and move it to its final location.
+
+        :param outputPath: the final path.
+        """
+        self.fptr.close()
+        os.replace(self.path, outputPath)
+
+    def discard(self):
+        """
+        Stop writing and remove the partial file.
+        """
+        self.fptr.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
 def _convert_to_jp2k(path, **kwargs):
     """
     Given a tiled tiff file without compression, convert it to jp2k compression
@@ -507,40 +765,63 @@ def _convert_large_image_tile(tilelock, strips, tile):
         strips[ty] = strips[ty].insert(vimg, x, 0, expand=True)
 
 
-def _convert_large_image_frame(frame, numFrames, ts, frameOutputPath, tempPath, **kwargs):
+def _convert_large_image_frame(
+        idx, frame, numFrames, ts, frameOutputPath, tempPath, scheduler, **kwargs):
     """
-    Convert a single frame from a large_image source.  This parallelizes tile
-    reads.  Once all tiles are converted to a composited vips image, a tiff
-    file is generated.
+    Convert a single frame from a large_image source.  Tile reads are
+    submitted to the shared scheduler, waiting when too many are outstanding.
+    Once all tiles are converted to a composited vips image, a tiff file is
+    generated and the scheduler is told that the frame is finished.
 
+    :param idx: the 0-based index of this frame in the output.
     :param frame: the 0-based frame number.
     :param numFrames: the total number of frames; used for logging.
     :param ts: the open tile source.
     :param frameOutputPath: the destination name for the tiff file.
     :param tempPath: a temporary file in a temporary directory.
+    :param scheduler: the _ConversionScheduler used for all work.
     """
     # The iterator tile size is a balance between memory use and fewer calls
     # and file handles.
     _iterTileSize = 4096
     logger.info('Processing frame %d/%d', frame + 1, numFrames)
     strips = []
-    pool = _get_thread_pool(**kwargs)
-    tasks = []
     tilelock = threading.Lock()
+    # The tile iteration itself is counted as outstanding work so that the
+    # frame isn't finalized before all tiles have been submitted.
+    outstanding = [1]
+
+    def finalize():
+        img = strips[0]
+        for stripidx in range(1, len(strips)):
+            img = img.insert(strips[stripidx], 0, stripidx * _iterTileSize, expand=True)
+        _convert_via_vips(
+            img, frameOutputPath, tempPath, status='%d/%d' % (frame + 1, numFrames),
+            checkpoint=('frame', frame), **kwargs)
+        scheduler.finish_job(idx, frameOutputPath)
+
+    def tileDone(future=None):
+        with tilelock:
+            outstanding[0] -= 1
+            last = not outstanding[0]
+        if last:
+            scheduler.submit(finalize)
+
     for tile in ts.tileIterator(tile_size=dict(width=_iterTileSize), frame=frame):
-        _pool_add(tasks, (pool.submit(_convert_large_image_tile, tilelock, strips, tile), ))
-    _drain_pool(pool, tasks)
-    img = strips[0]
-    for stripidx in range(1, len(strips)):
-        img = img.insert(strips[stripidx], 0, stripidx * _iterTileSize, expand=True)
-    _convert_via_vips(
-        img, frameOutputPath, tempPath, status='%d/%d' % (frame + 1, numFrames), **kwargs)
+        with tilelock:
+            outstanding[0] += 1
+        scheduler.submit_bounded(
+            _convert_large_image_tile, tilelock, strips, tile).add_done_callback(tileDone)
+    tileDone()
 
 
 def _convert_large_image(inputPath, outputPath, tempPath, lidata, **kwargs):
     """
     Take a large_image source and convert it by resaving each tiles image with
-    vips.
+    vips.  All frames and tiles share a single scheduler, and, unless the
+    output format needs to modify the whole file before it is written, each
+    frame is written to the output file as soon as it and all preceding frames
+    are complete.
 
     :param inputPath: the path to the input file or base file of a set.
     :param outputPath: the path of the output file.
@@ -550,81 +831,106 @@ def _convert_large_image(inputPath, outputPath, tempPath, lidata, **kwargs):
     """
     ts = lidata['tilesource']
     numFrames = len(lidata['metadata'].get('frames', [0]))
-    outputList = []
-    tasks = []
-    pool = _get_thread_pool(memoryLimit=FrameMemoryEstimate, **kwargs)
     startFrame = 0
     endFrame = numFrames
     if kwargs.get('onlyFrame') is not None and str(kwargs.get('onlyFrame')):
         startFrame = int(kwargs.get('onlyFrame'))
         endFrame = startFrame + 1
-    for frame in range(startFrame, endFrame):
-        frameOutputPath = tempPath + '-%d-%s.tiff' % (
-            frame + 1, time.strftime('%Y%m%d-%H%M%S'))
-        _pool_add(tasks, (pool.submit(
-            _convert_large_image_frame, frame, numFrames, ts, frameOutputPath,
-            tempPath, **kwargs), ))
-        outputList.append(frameOutputPath)
-    _drain_pool(pool, tasks)
-    _output_tiff(outputList, outputPath, tempPath, lidata, **kwargs)
+    frames = list(range(startFrame, endFrame))
+    outputList = []
+    writer = None
+    if not _format_has_hook('modify_tiff_before_write', **kwargs):
+        writer = _StreamingTiffWriter(outputPath)
 
+    def commit(idx, frameOutputPath):
+        if writer is None:
+            outputList.append(frameOutputPath)
+            return
+        logger.debug('Adding frame %d/%d to %s', idx + 1, len(frames), outputPath)
+        info = tifftools.read_tiff(frameOutputPath)
+        writer.add(_frame_ifds(
+            info, idx, len(frames), lidata, len(lidata['images']), **kwargs))
+        # Checkpointed frames are kept until the whole conversion is done
+        if not kwargs.get('_manifest'):
+            os.unlink(frameOutputPath)
+
+    scheduler = _ConversionScheduler(commit, memoryLimit=FrameMemoryEstimate, **kwargs)
+    try:
+        for idx, frame in enumerate(frames):
+            frameOutputPath, done = _checkpoint_path(
+                'frame', frame, tempPath + '-%d-%s.tiff' % (
+                    frame + 1, time.strftime('%Y%m%d-%H%M%S')), **kwargs)
+            scheduler.start_job()
+            if done:
+                scheduler.finish_job(idx, frameOutputPath)
+                continue
+            _convert_large_image_frame(
+                idx, frame, numFrames, ts, frameOutputPath, tempPath, scheduler, **kwargs)
+        scheduler.wait(len(frames))
+        if writer is not None:
+            writer.add(_associated_ifds(lidata))
+            writer.close(outputPath)
+            writer = None
+    finally:
+        scheduler.shutdown()
+        if writer is not None:
+            writer.discard()
+    if outputList:
+        _output_tiff(outputList, outputPath, tempPath, lidata, **kwargs)
+
+
+def _frame_ifds(info, idx, numFrames, lidata, numAssociatedImages, **kwargs):
+    """
+    Adjust the ifds of a single frame's pyramidal tiff so that they can be
+    added to a combined output file.
 
-def _output_tiff(inputs, outputPath, tempPath, lidata, extraImages=None, **kwargs):
+    :param info: the tifftools info of the frame's tiff file; modified.
+    :param idx: the 0-based index of the frame in the output.  The first frame
+        gets the large_image description of the whole file.
+    :param numFrames: the number of frames in the output.
+    :param lidata: large_image data including metadata and associated images.
+    :param numAssociatedImages: the number of associated images that will be
+        added to the output.
+    :returns: a list of ifds to add to the output file.
     """
-    Given a list of input tiffs and data as parsed by _data_from_large_image,
-    generate an output tiff file with the associated images, correct scale, and
-    other metadata.
+    ifds = info['ifds']
+    if not idx:
+        imgDesc = ifds[0]['tags'].get(tifftools.Tag.ImageDescription.value)
+        description = _make_li_description(
+            len(ifds), numFrames, lidata, numAssociatedImages,
+            imgDesc['data'] if imgDesc else None, **kwargs)
+        ifds[0]['tags'][tifftools.Tag.ImageDescription.value] = {
+            'data': description,
+            'datatype': tifftools.Datatype.ASCII,
+        }
+    if lidata:
+        _set_resolution(ifds, lidata['metadata'])
+        if idx and len(lidata['metadata'].get('frames', [])) > idx:
+            ifds[0]['tags'][tifftools.Tag.ImageDescription.value] = {
+                'data': json.dumps(
+                    {'frame': lidata['metadata']['frames'][idx]},
+                    separators=(',', ':'), sort_keys=True, default=json_serial),
+                'datatype': tifftools.Datatype.ASCII,
+            }
+    if numFrames > 1 and kwargs.get('subifds') is not False:
+        ifds[0]['tags'][tifftools.Tag.SubIFD.value] = {
+            'ifds': ifds[1:],
+        }
+        return ifds[:1]
+    return ifds
+
+
+def _associated_ifds(lidata, extraImages=None):
+    """
+    Read the associated images that were extracted from a source and label
+    them so they can be added to an output file.
 
-    :param inputs: a list of pyramidal input files.
-    :param outputPath: the final destination.
-    :param tempPath: a temporary file in a temporary directory.
     :param lidata: large_image data including metadata and associated images.
     :param extraImages: an optional dictionary of keys and paths to add as
         extra associated images.
+    :returns: a list of ifds.
     """
-    logger.debug('Reading %s', inputs[0])
-    info = tifftools.read_tiff(inputs[0])
-    ifdIndices = [0]
-    imgDesc = info['ifds'][0]['tags'].get(tifftools.Tag.ImageDescription.value)
-    description = _make_li_description(
-        len(info['ifds']), len(inputs), lidata,
-        (len(extraImages) if extraImages else 0) + (len(lidata['images']) if lidata else 0),
-        imgDesc['data'] if imgDesc else None, **kwargs)
-    info['ifds'][0]['tags'][tifftools.Tag.ImageDescription.value] = {
-        'data': description,
-        'datatype': tifftools.Datatype.ASCII,
-    }
-    if lidata:
-        _set_resolution(info['ifds'], lidata['metadata'])
-    if len(inputs) > 1:
-        if kwargs.get('subifds') is not False:
-            info['ifds'][0]['tags'][tifftools.Tag.SubIFD.value] = {
-                'ifds': info['ifds'][1:],
-            }
-            info['ifds'][1:] = []
-        for idx, inputPath in enumerate(inputs):
-            if not idx:
-                continue
-            logger.debug('Reading %s', inputPath)
-            nextInfo = tifftools.read_tiff(inputPath)
-            if lidata:
-                _set_resolution(nextInfo['ifds'], lidata['metadata'])
-                if len(lidata['metadata'].get('frames', [])) > idx:
-                    nextInfo['ifds'][0]['tags'][tifftools.Tag.ImageDescription.value] = {
-                        'data': json.dumps(
-                            {'frame': lidata['metadata']['frames'][idx]},
-                            separators=(',', ':'), sort_keys=True, default=json_serial),
-                        'datatype': tifftools.Datatype.ASCII,
-                    }
-            ifdIndices.append(len(info['ifds']))
-            if kwargs.get('subifds') is not False:
-                nextInfo['ifds'][0]['tags'][tifftools.Tag.SubIFD.value] = {
-                    'ifds': nextInfo['ifds'][1:],
-                }
-                info['ifds'].append(nextInfo['ifds'][0])
-            else:
-                info['ifds'].extend(nextInfo['ifds'])
-    ifdIndices.append(len(info['ifds']))
+    ifds = []
     assocList = []
     if lidata:
         assocList += list(lidata['images'].items())
@@ -636,7 +942,39 @@ def _output_tiff(inputs, outputPath, tempPath, lidata, extraImages=None, **kwarg
             'data': key,
             'datatype': tifftools.Datatype.ASCII,
         }
-        info['ifds'] += assocInfo['ifds']
+        ifds += assocInfo['ifds']
+    return ifds
+
+
+def _output_tiff(inputs, outputPath, tempPath, lidata, extraImages=None, **kwargs):
+    """
+    Given a list of input tiffs and data as parsed by _data_from_large_image,
+    generate an output tiff file with the associated images, correct scale, and
+    other metadata.
+
+    :param inputs: a list of pyramidal input files.
+    :param outputPath: the final destination.
+    :param tempPath: a temporary file in a temporary directory.
+    :param lidata: large_image data including metadata and associated images.
+    :param extraImages: an optional dictionary of keys and paths to add as
+        extra associated images.
+    """
+    numAssociatedImages = (
+        (len(extraImages) if extraImages else 0) + (len(lidata['images']) if lidata else 0))
+    info = None
+    ifdIndices = []
+    for idx, inputPath in enumerate(inputs):
+        logger.debug('Reading %s', inputPath)
+        nextInfo = tifftools.read_tiff(inputPath)
+        ifds = _frame_ifds(
+            nextInfo, idx, len(inputs), lidata, numAssociatedImages, **kwargs)
+        if info is None:
+            info = nextInfo
+            info['ifds'] = []
+        ifdIndices.append(len(info['ifds']))
+        info['ifds'].extend(ifds)
+    ifdIndices.append(len(info['ifds']))
+    info['ifds'] += _associated_ifds(lidata, extraImages)
     if format_hook('modify_tiff_before_write', info, ifdIndices, tempPath,
                    lidata, **kwargs) is False:
         return
@@ -830,6 +1168,17 @@ def _make_li_description(
     return json.dumps(results, separators=(',', ':'), sort_keys=True, default=json_serial)
 
 
+def _format_has_hook(funcname, **kwargs):
+    """
+    Check if the file format specified in kwargs has a specific function.
+
+    :param funcname: name of the function.
+    :returns: True if the format has the function.
+    """
+    format = str(kwargs.get('format')).lower()
+    return callable(getattr(FormatModules.get(format, {}), funcname, None))
+
+
 def format_hook(funcname, *args, **kwargs):
     """
     Call a function specific to a file format.
@@ -884,6 +1233,15 @@ def convert(inputPath, outputPath=None, **kwargs):  # noqa: C901
         geospatial.  If not specified or None, this will be checked.
     :param _concurrency: the number of cpus to use during conversion.  None to
         use the logical cpu count.
+    :param _workdir: if specified, a directory used for intermediate files.  A
+        manifest of completed intermediate files is kept in this directory so
+        that an interrupted conversion can be resumed by calling convert with
+        the same input, arguments, and work directory.  Geospatial conversions
+        are not resumable.
+    :param _sourceId: if specified with _workdir, a json-serializable value
+        that identifies the input, such as a database id and checksum.  This
+        is used in place of the input path, size, and modification time to
+        decide if intermediate files can be reused.
 
     :returns: outputPath if successful
     """
@@ -922,7 +1280,11 @@ def convert(inputPath, outputPath=None, **kwargs):  # noqa: C901
     if geospatial:
         _generate_geotiff(inputPath, outputPath, eightbit=eightbit or None, **kwargs)
     else:
-        with TemporaryDirectory() as tempDir:
+        workdir = kwargs.get('_workdir')
+        with (contextlib.nullcontext(workdir) if workdir else TemporaryDirectory()) as tempDir:
+            if workdir:
+                kwargs = kwargs.copy()
+                kwargs['_manifest'] = ConversionManifest(workdir, inputPath, **kwargs)
             tempPath = os.path.join(tempDir, os.path.basename(outputPath))
             lidata = _data_from_large_image(str(inputPath), tempPath, **kwargs)
             logger.log(logging.DEBUG - 1, 'large_image information for %s: %r',
@@ -939,6 +1301,8 @@ def convert(inputPath, outputPath=None, **kwargs):  # noqa: C901
                 except Exception:
                     if lidata:
                         _convert_large_image(inputPath, outputPath, tempPath, lidata, **kwargs)
+            if workdir:
+                kwargs['_manifest'].complete(outputPath)
     return outputPath
 
 
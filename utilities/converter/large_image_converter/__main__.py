@@ -106,6 +106,12 @@ depth.
         'multiple processors.  A value <= 0 will use the number of logical '
         'processors less that number.  This is a recommendation and is not '
         'strict.  Default is 0.')
+    parser.add_argument(
+        '--workdir', '--resume', dest='_workdir',
+        help='A directory for intermediate files.  Completed intermediate '
+        'files are recorded in a manifest in this directory; if a conversion '
+        'is interrupted, running it again with the same options and work '
+        'directory will reuse them.  This does not apply to geospatial files.')
     parser.add_argument(
         '--stats', action='store_true', dest='_stats',
         help='Add conversion stats (time and size) to the ImageDescription of '
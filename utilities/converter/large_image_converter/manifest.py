@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import tifftools
+
+logger = logging.getLogger('large-image-converter')
+
+ManifestName = 'manifest.json'
+
+
+class ConversionManifest:
+    """
+    Track the intermediate files of a conversion in a work directory so that
+    an interrupted conversion can be resumed.  Each intermediate file is
+    recorded with its size once it is completely written; on a later run, a
+    recorded file is only reused if it still has that size and can be parsed
+    as a tiff file.
+
+    The manifest is a json file in the work directory.  If the input file or
+    the conversion arguments differ from those recorded in the manifest, or
+    the recorded conversion finished, the recorded files are discarded and the
+    conversion starts over.
+    """
+
+    def __init__(self, workdir, inputPath, **kwargs):
+        """
+        :param workdir: the work directory.  This is created if needed.
+        :param inputPath: the path to the input file.
+        :param kwargs: the conversion arguments.  Arguments starting with an
+            underscore or that only affect where the output is written are not
+            used to determine if the manifest can be reused.  If _sourceId is
+            specified, it identifies the input instead of the input path,
+            size, and modification time; this allows resuming when the input
+            is copied to a different location for each attempt.
+        """
+        os.makedirs(workdir, exist_ok=True)
+        self.workdir = workdir
+        self.path = os.path.join(workdir, ManifestName)
+        self._lock = threading.Lock()
+        self.source = self._source_identity(inputPath, **kwargs)
+        self.entries = {}
+        self.output = None
+        try:
+            with open(self.path) as fptr:
+                manifest = json.load(fptr)
+        except FileNotFoundError:
+            manifest = None
+        except Exception:
+            logger.warning('Cannot read conversion manifest %s; starting over', self.path)
+            manifest = None
+        if manifest and manifest.get('source') == self.source and not manifest.get('output'):
+            self.entries = manifest.get('entries', {})
+            if self.entries:
+                logger.info('Resuming conversion from %s', self.path)
+        elif manifest:
+            logger.info('Conversion manifest %s does not match; starting over', self.path)
+            self._remove_files(manifest.get('entries', {}))
+        self._save()
+
+    @classmethod
+    def read(cls, workdir):
+        """
+        Read the manifest in a work directory without validating or modifying
+        it.
+
+        :param workdir: the work directory.
+        :returns: a ConversionManifest or None if there is no readable
+            manifest.
+        """
+        path = os.path.join(workdir, ManifestName)
+        try:
+            with open(path) as fptr:
+                manifest = json.load(fptr)
+        except Exception:
+            return None
+        self = cls.__new__(cls)
+        self.workdir = workdir
+        self.path = path
+        self._lock = threading.Lock()
+        self.source = manifest.get('source')
+        self.entries = manifest.get('entries', {})
+        self.output = manifest.get('output')
+        return self
+
+    @staticmethod
+    def _source_identity(inputPath, **kwargs):
+        """
+        Get a json-serializable description of the input and arguments.
+
+        :param inputPath: the path to the input file.
+        :returns: a dictionary.
+        """
+        source = {
+            'path': str(inputPath),
+            'arguments': {
+                k: v for k, v in sorted(kwargs.items())
+                if not k.startswith('_') and k not in {'overwrite'} and
+                isinstance(v, (str, int, float, bool, type(None)))},
+        }
+        if kwargs.get('_sourceId') is not None:
+            del source['path']
+            source['id'] = kwargs['_sourceId']
+        elif os.path.exists(str(inputPath)):
+            stat = os.stat(str(inputPath))
+            source['path'] = os.path.abspath(str(inputPath))
+            source['size'] = stat.st_size
+            source['mtime'] = stat.st_mtime
+        return source
+
+    def _save(self):
+        """
+        Atomically write the manifest to the work directory.
+        """
+        with self._lock:
+            manifest = {
+                'source': self.source,
+                'entries': self.entries,
+                'modified': time.time(),
+            }
+            if self.output:
+                manifest['output'] = self.output
+            tempPath = self.path + '.tmp'
+            with open(tempPath, 'w') as fptr:
+                json.dump(manifest, fptr, indent=1, sort_keys=True)
+            os.replace(tempPath, self.path)
+
+    def _remove_files(self, entries):
+        for kind in entries.values():
+            for entry in kind.values():
+                try:
+                    os.unlink(os.path.join(self.workdir, entry['name']))
+                except OSError:
+                    pass
+
+    def file_path(self, kind, key, suffix='.tiff'):
+        """
+        Get the path in the work directory where an intermediate file should
+        be written.
+
+        :param kind: the kind of file (e.g., 'frame', 'page', or
+            'associated').
+        :param key: a key unique within the kind.
+        :param suffix: the file suffix.
+        :returns: a path in the work directory.
+        """
+        return os.path.join(self.workdir, '%s-%s%s' % (kind, key, suffix))
+
+    def lookup(self, kind, key):
+        """
+        Check if an intermediate file was completed and is still valid.
+
+        :param kind: the kind of file.
+        :param key: a key unique within the kind.
+        :returns: the path of the file or None if it must be regenerated.
+        """
+        entry = self.entries.get(kind, {}).get(str(key))
+        if not entry:
+            return None
+        path = os.path.join(self.workdir, entry['name'])
+        try:
+            if os.path.getsize(path) != entry['size']:
+                msg = 'size mismatch'
+                raise ValueError(msg)
+            tifftools.read_tiff(path)
+        except Exception:
+            logger.info('Checkpointed %s %s is not valid; regenerating it', kind, key)
+            with self._lock:
+                self.entries[kind].pop(str(key), None)
+            return None
+        logger.info('Reusing checkpointed %s %s', kind, key)
+        return path
+
+    def record(self, kind, key, path):
+        """
+        Record that an intermediate file has been completely written.
+
+        :param kind: the kind of file.
+        :param key: a key unique within the kind.
+        :param path: the path of the file.  This must be in the work
+            directory.
+        """
+        with self._lock:
+            self.entries.setdefault(kind, {})[str(key)] = {
+                'name': os.path.relpath(path, self.workdir),
+                'size': os.path.getsize(path),
+            }
+        self._save()
+
+    def summary(self):
+        """
+        Get the number of completed intermediate files of each kind.
+
+        :returns: a dictionary of kinds and counts.
+        """
+        return {kind: len(entries) for kind, entries in self.entries.items()}
+
+    def complete(self, outputPath):
+        """
+        Mark the conversion as finished and remove intermediate files.
+
+        :param outputPath: the path of the final output file.
+        """
+        self._remove_files(self.entries)
+        self.entries = {}
+        self.output = os.path.abspath(str(outputPath))
+        self._save()
@@ -1,4 +1,7 @@
+import hashlib
+import json
 import logging
+import math
 import os
 import shutil
 import sys
@@ -88,6 +91,51 @@ class JobLogger(logging.Handler):
         self._job = Job().updateJob(self._job, log=self.format(record).rstrip() + '\n')
 
 
+def _conversion_workdir(fileObj, kwargs):
+    """
+    Get a work directory for a resumable conversion of a Girder file.  The
+    directory depends on the file and the conversion arguments, so running
+    the same conversion again finds the intermediate files of an earlier
+    attempt.
+
+    :param fileObj: the Girder file being converted.
+    :param kwargs: the conversion arguments.
+    :returns: the path of the work directory.
+    """
+    import large_image
+
+    key = hashlib.sha256(json.dumps({
+        k: v for k, v in kwargs.items() if not k.startswith('_')},
+        sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return large_image.config.userCachePath(
+        'conversions', '%s-%s' % (fileObj['_id'], key))
+
+
+def _record_conversion_manifest(job, workdir):
+    """
+    Add information about a resumable conversion's manifest to a job's
+    results.
+
+    :param job: the job to update.
+    :param workdir: the work directory used for the conversion.
+    :returns: the updated job.
+    """
+    from girder_jobs.models.job import Job
+    from large_image_converter.manifest import ConversionManifest
+
+    manifest = ConversionManifest.read(workdir)
+    if manifest is None:
+        return job
+    job = Job().load(job['_id'], force=True)
+    job.setdefault('results', {})
+    job['results']['manifest'] = {
+        'path': manifest.path,
+        'complete': bool(manifest.output),
+        'entries': manifest.summary(),
+    }
+    return Job().save(job)
+
+
 def convert_image_job(job):
     import tempfile
 
@@ -115,10 +163,23 @@ def convert_image_job(job):
         parentType = 'item'
         parent = item
     name = kwargs.pop('name', None)
+    if kwargs.pop('resumable', False) and not kwargs.get('_workdir'):
+        kwargs['_workdir'] = _conversion_workdir(fileObj, kwargs)
+    workdir = kwargs.get('_workdir')
+    if workdir:
+        # The file is identified by its id and contents rather than its local
+        # path, which can differ for each attempt
+        kwargs['_sourceId'] = {
+            'fileId': str(fileObj['_id']),
+            'size': fileObj.get('size'),
+            'sha512': fileObj.get('sha512'),
+        }
 
     job = Job().updateJob(
         job, log='Started large image conversion\n',
         status=JobStatus.RUNNING)
+    if workdir:
+        job = _record_conversion_manifest(job, workdir)
     logger = logging.getLogger('large-image-converter')
     handler = JobLogger(job=job)
     logger.addHandler(handler)
@@ -159,12 +220,18 @@ def convert_image_job(job):
         logger.exception('Failed in large image conversion')
         job = Job().updateJob(
             job, log='Failed in large image conversion (%s)\n' % exc, status=status)
+        if workdir:
+            job = Job().updateJob(
+                job, log='Completed work is recorded in %s and will be reused if the '
+                'conversion is run again\n' % workdir)
     else:
         status = JobStatus.SUCCESS
         job = Job().updateJob(
             job, log='Finished large image conversion\n', status=status)
     finally:
         logger.removeHandler(handler)
+        if workdir:
+            _record_conversion_manifest(job, workdir)
 
 
 def cache_tile_frames_job(job):
@@ -217,3 +284,222 @@ def cache_histograms_job(job):
         logger.exception('Failed caching histograms')
         job = Job().updateJob(
             job, log='Failed caching histograms (%s)\n' % exc, status=JobStatus.ERROR)
+
+
+def _cache_tiles_item_ids(kwargs, user):
+    """
+    Get the ids of the large image items whose tiles should be cached.
+
+    :param kwargs: the job kwargs.  This contains either itemId or folderId
+        and, optionally, recurse.
+    :param user: the user used to list subfolders.
+    :returns: a list of item id strings.
+    """
+    from girder.constants import SortDir
+    from girder.models.folder import Folder
+    from girder.models.item import Item
+
+    if kwargs.get('itemId'):
+        return [str(kwargs['itemId'])]
+    folders = [Folder().load(kwargs['folderId'], force=True)]
+    itemIds = []
+    while folders:
+        folder = folders.pop(0)
+        itemIds.extend(str(item['_id']) for item in Item().find(
+            {'folderId': folder['_id'], 'largeImage.fileId': {'$exists': True}},
+            sort=[('_id', SortDir.ASCENDING)], fields=['_id']))
+        if kwargs.get('recurse'):
+            folders.extend(Folder().childFolders(folder, 'folder', user=user))
+    return itemIds
+
+
+def _cache_tiles_levels(metadata, levels=None, maxTiles=256):
+    """
+    Determine which levels of an image should be cached.
+
+    :param metadata: the tile source metadata.
+    :param levels: a list of levels.  Negative values are relative to the
+        number of levels, so -1 is the maximum resolution level.  If None, all
+        levels with at most maxTiles tiles are used.
+    :param maxTiles: the maximum number of tiles in a level when levels is
+        not specified.
+    :returns: a sorted list of levels.
+    """
+    numLevels = metadata['levels']
+    if levels is not None:
+        return sorted({
+            level + numLevels if level < 0 else level for level in levels
+            if -numLevels <= level < numLevels})
+    result = []
+    for level in range(numLevels):
+        scale = 2 ** (numLevels - 1 - level)
+        if (math.ceil(metadata['sizeX'] / scale / metadata['tileWidth']) *
+                math.ceil(metadata['sizeY'] / scale / metadata['tileHeight']) > maxTiles):
+            break
+        result.append(level)
+    return result
+
+
+def _cache_tiles_iterate(item, kwargs):
+    """
+    Yield the tiles of an item that should be cached.
+
+    :param item: the item.
+    :param kwargs: the job kwargs.  This may contain levels, maxTiles, frames,
+        styles, and tileParams.
+    :yields: a tuple of (tileSource, x, y, z, frame), where frame may be None.
+    """
+    from girder_large_image.models.image_item import ImageItem
+
+    for style in kwargs.get('styles') or [None]:
+        params = dict(kwargs.get('tileParams') or {})
+        if style is not None:
+            params['style'] = style if isinstance(style, str) else json.dumps(style)
+        tileSource = ImageItem()._loadTileSource(item, **params)
+        metadata = tileSource.getMetadata()
+        numFrames = len(metadata.get('frames', [])) or 1
+        levels = _cache_tiles_levels(
+            metadata, kwargs.get('levels'), int(kwargs.get('maxTiles') or 256))
+        for frame in kwargs.get('frames') or [None]:
+            if frame is not None and not 0 <= frame < numFrames:
+                continue
+            for z in levels:
+                scale = 2 ** (metadata['levels'] - 1 - z)
+                for y in range(math.ceil(metadata['sizeY'] / scale / metadata['tileHeight'])):
+                    for x in range(math.ceil(metadata['sizeX'] / scale / metadata['tileWidth'])):
+                        yield tileSource, x, y, z, frame
+
+
+def _cache_tile(tileSource, x, y, z, frame):
+    """
+    Get a tile so that it is stored in the tile cache.  The tile is requested
+    the same way the tile endpoints request it so that they share cache
+    entries.
+
+    :returns: True if the tile was cached, False if it could not be read.
+    """
+    from girder import logger
+    from large_image.exceptions import TileGeneralError
+
+    imageParams = {} if frame is None else {'frame': int(frame)}
+    try:
+        tileSource.getTile(x, y, z, mayRedirect=False, **imageParams)
+    except TileGeneralError:
+        return False
+    except Exception as exc:
+        logger.info('Failed to cache tile %d, %d, %d (frame %s): %r', x, y, z, frame, exc)
+        return False
+    return True
+
+
+def cache_tiles_job(job):  # noqa
+    """
+    Populate the tile cache with tiles from one item or all of the large image
+    items in a folder.
+
+    The job kwargs contain::
+
+      - itemId or folderId: the item or folder to process.
+      - recurse: if true and folderId is specified, also process subfolders.
+      - userId: the user used to list subfolders.
+      - levels: a list of levels to cache.  Negative values are relative to
+        the maximum resolution level.  If not specified, all levels with at
+        most maxTiles tiles are cached.
+      - maxTiles: the maximum number of tiles in a level when levels is not
+        specified.  Defaults to 256.
+      - frames: a list of frames to cache.  If not specified, the default
+        frame is cached.
+      - styles: a list of styles to cache.  If not specified, the unstyled
+        image is cached.
+      - tileParams: a dictionary of encoding parameters, such as encoding and
+        jpegQuality.
+      - concurrent: the number of threads to use.  0 for the number of cpus.
+      - logInterval: the time in seconds between log messages.  This also
+        controls the granularity of cancelling the job.
+
+    :param job: the job object including kwargs.
+    """
+    import concurrent.futures
+
+    from girder_jobs.constants import JobStatus
+    from girder_jobs.models.job import Job
+    from girder_large_image.models.image_item import ImageItem
+
+    import large_image
+    from girder import logger
+    from girder.models.user import User
+
+    kwargs = job['kwargs']
+    job = Job().updateJob(
+        job, log='Started caching tiles\n',
+        status=JobStatus.RUNNING)
+    concurrency = int(kwargs.get('concurrent') or 0)
+    concurrency = large_image.config.cpu_count(
+        logical=True) if concurrency < 1 else concurrency
+    logInterval = float(kwargs.get('logInterval', 10))
+    status = {'cached': 0, 'failed': 0, 'total': 0}
+    tasks = []
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        user = User().load(kwargs['userId'], force=True) if kwargs.get('userId') else None
+        itemIds = _cache_tiles_item_ids(kwargs, user)
+        job = Job().updateJob(job, log='Caching tiles for %d item%s (%d concurrent)\n' % (
+            len(itemIds), 's' if len(itemIds) != 1 else '', concurrency))
+        nextLogTime = time.time() + logInterval
+        itemIdx = 0
+        tiles = iter(())
+        while True:
+            # Keep a bounded number of tiles queued; tiles are enumerated as
+            # they are needed rather than all at once.
+            while len(tasks) < concurrency * 4:
+                try:
+                    entry = next(tiles, None)
+                except Exception as exc:
+                    logger.info(
+                        'Failed to cache tiles for item %s: %r', itemIds[itemIdx - 1], exc)
+                    status['failed'] += 1
+                    entry = None
+                if entry is None:
+                    if itemIdx >= len(itemIds):
+                        break
+                    item = ImageItem().load(itemIds[itemIdx], force=True)
+                    itemIdx += 1
+                    tiles = _cache_tiles_iterate(item, kwargs)
+                    continue
+                status['total'] += 1
+                tasks.append(pool.submit(_cache_tile, *entry))
+            if not tasks:
+                break
+            try:
+                tasks[0].result(0.1)
+            except concurrent.futures.TimeoutError:
+                pass
+            for pos in range(len(tasks) - 1, -1, -1):
+                if tasks[pos].done():
+                    status['cached' if tasks[pos].result() else 'failed'] += 1
+                    tasks[pos:pos + 1] = []
+            if time.time() > nextLogTime:
+                job = Job().updateJob(
+                    job, log='Cached %d tiles, %d failed (item %d of %d)\n' % (
+                        status['cached'], status['failed'], itemIdx, len(itemIds)),
+                    progressTotal=len(itemIds), progressCurrent=max(0, itemIdx - 1))
+                # Check if the job was deleted or canceled; if so, quit
+                job = Job().load(id=job['_id'], force=True)
+                if not job or job['status'] in (JobStatus.CANCELED, JobStatus.ERROR):
+                    logger.info('Cache tiles job %s', 'deleted' if not job else 'canceled')
+                    for task in tasks:
+                        task.cancel()
+                    return
+                nextLogTime = time.time() + logInterval
+    except Exception as exc:
+        logger.exception('Failed caching tiles')
+        job = Job().updateJob(
+            job, log='Failed caching tiles (%s)\n' % exc, status=JobStatus.ERROR)
+        return
+    finally:
+        pool.shutdown(False)
+    job = Job().updateJob(
+        job, log='Finished caching tiles: cached %d tiles, %d failed\n' % (
+            status['cached'], status['failed']),
+        progressTotal=len(itemIds), progressCurrent=len(itemIds),
+        status=JobStatus.SUCCESS)